@@ -258,7 +258,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     user_id = update.message.from_user.id
     lang = get_user_language(user_id)
-    update_user_interaction(user_id)
+    update_user_interaction(user_id, update.message.from_user.username)
 
     help_text = get_message(lang, "help_message")
     await update.message.reply_text(help_text, parse_mode='Markdown')
@@ -271,7 +271,7 @@ async def handle_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user_id = query.from_user.id
     lang = get_user_language(user_id)
-    update_user_interaction(user_id)
+    update_user_interaction(user_id, query.from_user.username)
 
     await query.answer()
 
@@ -304,12 +304,11 @@ async def handle_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def send_startup_reports(application: Application):
     """إرسال تقارير بدء التشغيل إلى قناة السجلات والأدمن"""
     try:
-        from database import get_all_users, is_subscription_enabled, is_welcome_broadcast_enabled
+        from database import get_users_count, is_subscription_enabled, is_welcome_broadcast_enabled
         from datetime import datetime
 
         # جلب البيانات
-        all_users = get_all_users()
-        total_users = len(all_users)
+        total_users = get_users_count()['total']
         sub_enabled = is_subscription_enabled()
         welcome_enabled = is_welcome_broadcast_enabled()
 
@@ -440,6 +439,18 @@ async def post_init(application: Application):
     # إرسال إشعار التشغيل لقناة التحديثات
     await send_startup_notification(application.bot)
 
+async def post_shutdown(application: Application):
+    """يتم تنفيذه عند إيقاف البوت"""
+    from database import shutdown_telemetry, shutdown_db_executor
+    from core.utils.ytdlp_runner import shutdown_ytdlp_pool
+
+    # إنهاء عمال yt-dlp (وضع العمليات)
+    await shutdown_ytdlp_pool()
+
+    # إرسال الإحصائيات المعلقة قبل إغلاق مجمع خيوط قاعدة البيانات
+    shutdown_telemetry()
+    shutdown_db_executor()
+
 def main() -> None:
     """تشغيل البوت الرئيسي"""
     # ===== التحقق من عدم وجود نسخة أخرى من البوت =====
@@ -534,6 +545,7 @@ def main() -> None:
     except Exception as e:
         logger.warning(f"⚠️ خطأ في الاتصال بقاعدة البيانات: {e}")
         logger.info("🧪 تشغيل البوت في وضع الاختبار (بدون قاعدة بيانات).")
+        logger.info("💡 للتشغيل بقاعدة بيانات داخل الذاكرة: STORAGE_BACKEND=memory")
         # لا نوقف البوت في وضع الاختبار
 
     # إنشاء التطبيق
@@ -552,6 +564,7 @@ def main() -> None:
         .token(BOT_TOKEN)
         .request(request)
         .post_init(post_init)
+        .post_shutdown(post_shutdown)
         .concurrent_updates(100)
         .build()
     )
@@ -600,6 +613,14 @@ def main() -> None:
     except Exception as e:
         logger.error(f"❌ فشل تسجيل نظام تتبع الأخطاء: {e}")
 
+    # 3.4.1. Database Index & Slow-Query Stats (للمدير)
+    try:
+        from handlers.admin.db_stats import cmd_dbstats
+        application.add_handler(CommandHandler("dbstats", cmd_dbstats))
+        logger.info("✅ تم تسجيل أمر إحصائيات قاعدة البيانات")
+    except Exception as e:
+        logger.error(f"❌ فشل تسجيل أمر إحصائيات قاعدة البيانات: {e}")
+
     # 3.5. Per-user cancel download + batch YouTube download
     application.add_handler(CommandHandler("cancel", cancel_download))
     application.add_handler(CommandHandler("batch", handle_batch_download))
@@ -865,6 +886,13 @@ def main() -> None:
     except Exception as e:
         logger.error(f"❌ فشل جدولة تقارير الأخطاء اليومية: {e}")
 
+    # تنظيف دوري لمجلدات المهام المؤقتة المتروكة
+    try:
+        from utils import setup_temp_cleanup_job
+        setup_temp_cleanup_job(application)
+    except Exception as e:
+        logger.error(f"❌ فشل جدولة تنظيف مجلدات المهام: {e}")
+
     # تشغيل البوت
     try:
         if WEBHOOK_URL:
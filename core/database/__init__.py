@@ -12,7 +12,9 @@ from .base import (
     users_collection,
     settings_collection,
     init_db,
-    ensure_db_connection
+    ensure_db_connection,
+    get_db,
+    get_collection
 )
 
 # Users - إدارة المستخدمين
@@ -21,6 +23,13 @@ from .users import (
     add_user,
     get_user,
     get_all_users,
+    get_user_by_username,
+    search_users_by_username,
+    normalize_username,
+    get_users_page,
+    iter_user_batches,
+    USERS_BATCH_SIZE,
+    get_recent_users,
     update_user_language,
     get_user_language,
     update_user_interaction,
@@ -46,6 +55,8 @@ from .subscriptions import (
 # Downloads - إدارة التحميلات
 from .downloads import (
     increment_download_count,
+    reserve_daily_download,
+    release_daily_download,
     get_daily_download_count,
     get_total_downloads_count,
     reset_daily_downloads,
@@ -53,6 +64,10 @@ from .downloads import (
     get_user_downloads,
     get_download_stats,
     get_daily_download_stats,
+    get_weekly_download_stats,
+    get_rollup_stats,
+    expand_download,
+    DOWNLOADS_RETENTION_DAYS,
     generate_daily_report,
     track_download_success,
     get_download_success_rate,
@@ -74,7 +89,8 @@ from .logos import (
     get_logo_opacity,
     get_all_logo_settings,
     set_logo_target,
-    get_logo_target
+    get_logo_target,
+    LOGO_TARGET_NAMES
 )
 
 # Libraries - إدارة المكتبات والمنصات
@@ -134,6 +150,92 @@ from .settings import (
     get_daily_download_limit_setting
 )
 
+# Context - سياق المستخدم لكل طلب
+from .context import (
+    UserRequestContext,
+    load_user_context
+)
+
+# Settings Cache - لقطة الإعدادات المخزنة مؤقتاً
+from .settings_cache import (
+    get_settings_snapshot,
+    get_cached_settings,
+    get_settings_version,
+    invalidate_settings_cache
+)
+
+# Migrations - الفهارس وترحيل المخطط
+from .migrations import (
+    SCHEMA_VERSION,
+    run_migrations,
+    apply_retention_policy,
+    get_schema_version,
+    get_index_usage_stats,
+    get_slow_query_stats,
+    set_slow_query_profiling
+)
+
+# Storage Backend - الواجهة الخلفية للتخزين وإحصائيات الأوامر
+from .backends import (
+    get_db_command_stats,
+    reset_db_command_stats
+)
+from .health import get_db_health
+
+# Telemetry - كتابة الإحصائيات المؤجلة والمجمعة
+from .telemetry import (
+    enqueue_write,
+    flush_telemetry,
+    shutdown_telemetry,
+    get_telemetry_stats
+)
+
+# Media Cache - ذاكرة استخراج الوسائط الدائمة
+from .media_cache import (
+    get_cached_extraction,
+    store_cached_extraction,
+    clear_cached_extractions,
+    get_cached_delivery,
+    store_cached_delivery,
+    delete_cached_delivery
+)
+
+# Async - طبقة الوصول غير المتزامنة (لا توقف event loop)
+from .async_api import (
+    run_db,
+    shutdown_db_executor,
+    db_executor,
+    async_add_user,
+    async_get_user,
+    async_update_user_language,
+    async_get_user_language,
+    async_update_user_interaction,
+    async_get_user_by_username,
+    async_search_users_by_username,
+    aiter_user_batches,
+    async_is_admin,
+    async_is_subscribed,
+    async_is_subscription_enabled,
+    async_increment_download_count,
+    async_reserve_daily_download,
+    async_release_daily_download,
+    async_get_daily_download_count,
+    async_track_download,
+    async_is_logo_enabled,
+    async_get_logo_target,
+    async_is_platform_allowed,
+    async_record_download_attempt,
+    async_generate_referral_code,
+    async_use_no_logo_credit,
+    async_get_no_logo_credits,
+    async_is_referral_enabled,
+    async_load_user_context,
+    async_create_error_report,
+    async_is_audio_enabled,
+    async_get_free_time_limit,
+    async_get_daily_download_limit_setting
+)
+
 __all__ = [
     # Base
     'MONGODB_URI',
@@ -144,12 +246,21 @@ __all__ = [
     'settings_collection',
     'init_db',
     'ensure_db_connection',
+    'get_db',
+    'get_collection',
 
     # Users
     'is_admin',
     'add_user',
     'get_user',
     'get_all_users',
+    'get_user_by_username',
+    'search_users_by_username',
+    'normalize_username',
+    'get_users_page',
+    'iter_user_batches',
+    'USERS_BATCH_SIZE',
+    'get_recent_users',
     'update_user_language',
     'get_user_language',
     'update_user_interaction',
@@ -171,6 +282,8 @@ __all__ = [
 
     # Downloads
     'increment_download_count',
+    'reserve_daily_download',
+    'release_daily_download',
     'get_daily_download_count',
     'get_total_downloads_count',
     'reset_daily_downloads',
@@ -178,6 +291,10 @@ __all__ = [
     'get_user_downloads',
     'get_download_stats',
     'get_daily_download_stats',
+    'get_weekly_download_stats',
+    'get_rollup_stats',
+    'expand_download',
+    'DOWNLOADS_RETENTION_DAYS',
     'generate_daily_report',
     'track_download_success',
     'get_download_success_rate',
@@ -198,6 +315,7 @@ __all__ = [
     'get_all_logo_settings',
     'set_logo_target',
     'get_logo_target',
+    'LOGO_TARGET_NAMES',
 
     # Libraries
     'init_library_settings',
@@ -246,5 +364,77 @@ __all__ = [
     'set_free_time_limit',
     'get_free_time_limit',
     'set_daily_download_limit',
-    'get_daily_download_limit_setting'
+    'get_daily_download_limit_setting',
+
+    # Context
+    'UserRequestContext',
+    'load_user_context',
+
+    # Settings Cache
+    'get_settings_snapshot',
+    'get_cached_settings',
+    'get_settings_version',
+    'invalidate_settings_cache',
+
+    # Migrations
+    'SCHEMA_VERSION',
+    'run_migrations',
+    'apply_retention_policy',
+    'get_schema_version',
+    'get_index_usage_stats',
+    'get_slow_query_stats',
+    'set_slow_query_profiling',
+
+    # Storage Backend
+    'get_db_command_stats',
+    'reset_db_command_stats',
+    'get_db_health',
+
+    # Telemetry
+    'enqueue_write',
+    'flush_telemetry',
+    'shutdown_telemetry',
+    'get_telemetry_stats',
+
+    # Media Cache
+    'get_cached_extraction',
+    'store_cached_extraction',
+    'clear_cached_extractions',
+    'get_cached_delivery',
+    'store_cached_delivery',
+    'delete_cached_delivery',
+
+    # Async
+    'run_db',
+    'shutdown_db_executor',
+    'db_executor',
+    'async_add_user',
+    'async_get_user',
+    'async_update_user_language',
+    'async_get_user_language',
+    'async_update_user_interaction',
+    'async_get_user_by_username',
+    'async_search_users_by_username',
+    'aiter_user_batches',
+    'async_is_admin',
+    'async_is_subscribed',
+    'async_is_subscription_enabled',
+    'async_increment_download_count',
+    'async_reserve_daily_download',
+    'async_release_daily_download',
+    'async_get_daily_download_count',
+    'async_track_download',
+    'async_is_logo_enabled',
+    'async_get_logo_target',
+    'async_is_platform_allowed',
+    'async_record_download_attempt',
+    'async_generate_referral_code',
+    'async_use_no_logo_credit',
+    'async_get_no_logo_credits',
+    'async_is_referral_enabled',
+    'async_load_user_context',
+    'async_create_error_report',
+    'async_is_audio_enabled',
+    'async_get_free_time_limit',
+    'async_get_daily_download_limit_setting'
 ]
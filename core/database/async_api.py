@@ -0,0 +1,198 @@
+"""
+Async Data-Access Layer - طبقة الوصول غير المتزامنة لقاعدة البيانات
+
+pymongo متزامن، واستدعاؤه مباشرة من داخل المعالجات (async handlers) يوقف
+حلقة الأحداث (event loop) حتى يعود رد MongoDB. هذه الوحدة تنفذ دوال قاعدة
+البيانات الحالية داخل ThreadPoolExecutor مخصص ومحدود الحجم، وتوفر نسخة
+async_* من كل دالة تُستدعى في المسارات الساخنة (التحميل / البدء / الحساب).
+
+الاستخدام:
+    from database import async_get_user, run_db
+
+    user = await async_get_user(user_id)
+    count = await run_db(get_daily_download_count, user_id)
+"""
+
+import os
+import asyncio
+from functools import partial, wraps
+from concurrent.futures import ThreadPoolExecutor
+
+from config.logger import get_logger
+
+from .users import (
+    is_admin,
+    add_user,
+    get_user,
+    update_user_language,
+    get_user_language,
+    update_user_interaction,
+    get_user_by_username,
+    search_users_by_username,
+    get_users_page,
+    USERS_BATCH_SIZE,
+)
+from .subscriptions import (
+    is_subscribed,
+    is_subscription_enabled,
+)
+from .downloads import (
+    increment_download_count,
+    reserve_daily_download,
+    release_daily_download,
+    get_daily_download_count,
+    track_download,
+)
+from .logos import (
+    is_logo_enabled,
+    get_logo_target,
+)
+from .libraries import (
+    is_platform_allowed,
+    record_download_attempt,
+)
+from .referrals import (
+    generate_referral_code,
+    use_no_logo_credit,
+    get_no_logo_credits,
+    is_referral_enabled,
+)
+from .errors import create_error_report
+from .context import load_user_context
+from .settings import (
+    is_audio_enabled,
+    get_free_time_limit,
+    get_daily_download_limit_setting,
+)
+
+# إنشاء logger instance
+logger = get_logger(__name__)
+
+# حجم مجمع خيوط قاعدة البيانات - أقل من maxPoolSize الخاص بـ MongoClient
+# حتى لا تتنافس الخيوط على الاتصالات
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "16"))
+
+# مجمع خيوط مخصص لقاعدة البيانات فقط (منفصل عن خيوط yt-dlp و FFmpeg)
+db_executor = ThreadPoolExecutor(
+    max_workers=DB_EXECUTOR_WORKERS,
+    thread_name_prefix="db"
+)
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    تنفيذ دالة قاعدة بيانات متزامنة داخل مجمع خيوط قاعدة البيانات
+
+    Args:
+        func: الدالة المتزامنة (من core.database)
+        *args, **kwargs: معاملات الدالة
+
+    Returns:
+        القيمة التي تعيدها الدالة
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, partial(func, *args, **kwargs))
+
+
+def _async_version(func):
+    """إنشاء نسخة async من دالة قاعدة بيانات متزامنة"""
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
+
+    wrapper.__name__ = f"async_{func.__name__}"
+    wrapper.__qualname__ = wrapper.__name__
+    return wrapper
+
+
+def _inline_async(func):
+    """
+    نسخة async تُنفذ مباشرة بدون مجمع الخيوط - للدوال التي تضيف إلى
+    مخزن الإحصائيات المؤجل (telemetry) ولا تنتظر MongoDB
+    """
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        return func(*args, **kwargs)
+
+    wrapper.__name__ = f"async_{func.__name__}"
+    wrapper.__qualname__ = wrapper.__name__
+    return wrapper
+
+
+def shutdown_db_executor(wait: bool = True):
+    """إيقاف مجمع خيوط قاعدة البيانات (عند إيقاف البوت)"""
+    db_executor.shutdown(wait=wait)
+    logger.info("✅ تم إيقاف مجمع خيوط قاعدة البيانات")
+
+
+# ==================== Users ====================
+async_add_user = _async_version(add_user)
+async_get_user = _async_version(get_user)
+async_update_user_language = _async_version(update_user_language)
+async_get_user_language = _async_version(get_user_language)
+async_update_user_interaction = _inline_async(update_user_interaction)
+
+
+async_get_user_by_username = _async_version(get_user_by_username)
+async_search_users_by_username = _async_version(search_users_by_username)
+
+
+async def aiter_user_batches(projection: dict = None, query: dict = None, batch_size: int = USERS_BATCH_SIZE):
+    """
+    نسخة async من iter_user_batches - كل دفعة تُجلب داخل مجمع الخيوط
+
+    مثال:
+        async for batch in aiter_user_batches({'user_id': 1}):
+            for user in batch: ...
+    """
+    after_id = None
+    while True:
+        batch = await run_db(get_users_page, after_id, projection, query, batch_size)
+        if not batch:
+            return
+        yield batch
+        if len(batch) < batch_size:
+            return
+        after_id = batch[-1]['_id']
+
+
+async def async_is_admin(user_id: int) -> bool:
+    """is_admin لا يلمس قاعدة البيانات - لا حاجة لمجمع الخيوط"""
+    return is_admin(user_id)
+
+
+# ==================== Subscriptions ====================
+async_is_subscribed = _async_version(is_subscribed)
+async_is_subscription_enabled = _async_version(is_subscription_enabled)
+
+# ==================== Downloads ====================
+async_increment_download_count = _async_version(increment_download_count)
+async_reserve_daily_download = _async_version(reserve_daily_download)
+async_release_daily_download = _async_version(release_daily_download)
+async_get_daily_download_count = _async_version(get_daily_download_count)
+async_track_download = _async_version(track_download)
+
+# ==================== Logos ====================
+async_is_logo_enabled = _async_version(is_logo_enabled)
+async_get_logo_target = _async_version(get_logo_target)
+
+# ==================== Libraries ====================
+async_is_platform_allowed = _async_version(is_platform_allowed)
+async_record_download_attempt = _inline_async(record_download_attempt)
+
+# ==================== Referrals ====================
+async_generate_referral_code = _async_version(generate_referral_code)
+async_use_no_logo_credit = _async_version(use_no_logo_credit)
+async_get_no_logo_credits = _async_version(get_no_logo_credits)
+async_is_referral_enabled = _async_version(is_referral_enabled)
+
+# ==================== Context ====================
+async_load_user_context = _async_version(load_user_context)
+
+# ==================== Errors ====================
+async_create_error_report = _async_version(create_error_report)
+
+# ==================== Settings ====================
+async_is_audio_enabled = _async_version(is_audio_enabled)
+async_get_free_time_limit = _async_version(get_free_time_limit)
+async_get_daily_download_limit_setting = _async_version(get_daily_download_limit_setting)
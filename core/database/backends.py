@@ -0,0 +1,341 @@
+"""
+Storage Backends - واجهة تخزين قابلة للاستبدال
+
+core.database يعمل على واجهة pymongo (Database / Collection)، والواجهة
+الخلفية تحدد من أين يأتي الـ client:
+
+    STORAGE_BACKEND=mongo   (افتراضي) MongoDB عبر MONGODB_URI
+    STORAGE_BACKEND=memory  قاعدة بيانات داخل العملية (mongomock) - بدون خادم،
+                            لقياس أداء المعالجات على جهاز محلي
+
+الواجهة المحلية تحتاج: pip install -r requirements-dev.txt (mongomock)
+
+CommandStats يسجل عدد ومدة كل أمر MongoDB لكل مجموعة (عبر command monitoring)،
+لقياس تكلفة قاعدة البيانات لكل معالج: reset_db_command_stats() ثم تشغيل
+المعالج ثم get_db_command_stats(). في الواجهة المحلية لا توجد أوامر شبكة،
+فيُسجل كل استدعاء على المجموعة عبر غلاف (_MemoryCollection) بنفس أسماء الأوامر.
+"""
+
+import os
+import threading
+from time import perf_counter
+
+from pymongo import monitoring
+
+from config.logger import get_logger
+from .health import db_health
+
+# إنشاء logger instance
+logger = get_logger(__name__)
+
+DB_NAME = 'telegram_bot'
+
+# Performance optimization: added maxPoolSize for better concurrent operations
+MONGO_MAX_POOL_SIZE = 100  # Increased pool size for better performance
+MONGO_MIN_POOL_SIZE = 10   # Minimum connections to maintain
+
+
+# ==================== إحصائيات الأوامر ====================
+
+class CommandStats(monitoring.CommandListener):
+    """تجميع عدد ومدة أوامر MongoDB حسب (الأمر، المجموعة)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._stats = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else '-'
+        with self._lock:
+            self._pending[event.request_id] = (event.command_name, collection)
+
+    def _finish(self, event, failed: bool):
+        with self._lock:
+            key = self._pending.pop(event.request_id, None)
+        if key is not None:
+            self.record(key[0], key[1], event.duration_micros / 1000, failed)
+
+    def record(self, command: str, collection: str, ms: float, failed: bool = False):
+        """تسجيل أمر منفذ (من المستمع أو من غلاف الواجهة المحلية)"""
+        with self._lock:
+            entry = self._stats.setdefault((command, collection), {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'failed': 0})
+            entry['count'] += 1
+            entry['total_ms'] += ms
+            entry['max_ms'] = max(entry['max_ms'], ms)
+            if failed:
+                entry['failed'] += 1
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def snapshot(self) -> list:
+        """[{'command', 'collection', 'count', 'total_ms', 'avg_ms', 'max_ms', 'failed'}] - الأعلى تكلفة أولاً"""
+        with self._lock:
+            rows = [
+                {
+                    'command': command,
+                    'collection': collection,
+                    **entry,
+                    'avg_ms': entry['total_ms'] / entry['count'] if entry['count'] else 0.0
+                }
+                for (command, collection), entry in self._stats.items()
+            ]
+        return sorted(rows, key=lambda r: r['total_ms'], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+command_stats = CommandStats()
+
+
+def get_db_command_stats(limit: int = None) -> list:
+    """إحصائيات أوامر قاعدة البيانات منذ التشغيل أو آخر reset"""
+    rows = command_stats.snapshot()
+    return rows[:limit] if limit else rows
+
+
+def reset_db_command_stats():
+    """تصفير إحصائيات الأوامر"""
+    command_stats.reset()
+
+
+# ==================== الواجهات الخلفية ====================
+
+class StorageBackend:
+    """الواجهة المشتركة: create_client() يعيد client متوافق مع pymongo"""
+
+    name = None
+    # هل تحتاج الواجهة مراقبة صحة الاتصال (health.py)
+    monitored = False
+    pool_max = None
+
+    def create_client(self):
+        """إنشاء الـ client بدون انتظار الخادم - يرفع استثناء عند خطأ الإعداد"""
+        raise NotImplementedError
+
+    def connect(self):
+        """إنشاء الاتصال والتحقق منه - يرفع استثناء عند الفشل"""
+        return self.create_client()
+
+    def get_database(self, client):
+        return client[DB_NAME]
+
+
+class MongoBackend(StorageBackend):
+    """MongoDB حقيقي عبر MONGODB_URI"""
+
+    name = 'mongo'
+    monitored = True
+    pool_max = MONGO_MAX_POOL_SIZE
+
+    def __init__(self, uri: str):
+        self.uri = uri
+
+    def create_client(self):
+        if not self.uri:
+            raise ValueError("متغير البيئة MONGODB_URI غير موجود.")
+
+        from pymongo import MongoClient
+        return MongoClient(
+            self.uri,
+            serverSelectionTimeoutMS=5000,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            event_listeners=[command_stats, db_health.pool]
+        )
+
+    def connect(self):
+        client = self.create_client()
+        client.server_info()
+        return client
+
+
+# ==================== أغلفة الواجهة المحلية ====================
+
+# اسم أمر MongoDB المقابل لكل دالة (نفس أسماء CommandStats في الوضع الحقيقي)
+_MEMORY_COMMANDS = {
+    'find': 'find', 'find_one': 'find',
+    'insert_one': 'insert', 'insert_many': 'insert',
+    'update_one': 'update', 'update_many': 'update', 'replace_one': 'update',
+    'delete_one': 'delete', 'delete_many': 'delete',
+    'find_one_and_update': 'findAndModify', 'find_one_and_replace': 'findAndModify',
+    'find_one_and_delete': 'findAndModify',
+    'count_documents': 'aggregate', 'aggregate': 'aggregate',
+    'estimated_document_count': 'count', 'distinct': 'distinct',
+    'create_index': 'createIndexes', 'drop_index': 'dropIndexes',
+    'index_information': 'listIndexes',
+}
+
+
+def _timed(command: str, collection: str, func, *args, **kwargs):
+    started = perf_counter()
+    failed = False
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        failed = True
+        raise
+    finally:
+        command_stats.record(command, collection, (perf_counter() - started) * 1000, failed)
+
+
+class _MemoryCollection:
+    """
+    غلاف مجموعة mongomock: تسجيل الاستدعاءات في CommandStats، وسد ما لا
+    يدعمه mongomock ويستخدمه مسار التشغيل:
+
+        - bulk_write: mongomock لا يقبل عمليات pymongo 4.11+ (وسيط sort) -
+          تُنفذ العمليات واحدة تلو الأخرى
+        - aggregate مع $merge في النهاية: يُنفذ الباقي ثم تُكتب النتائج بـ replace_one
+        - create_index مع partialFilterExpression: mongomock يتجاهله فيفشل الفهرس
+          الفريد على المستندات التي لا تحتوي الحقل - يُستبدل بـ sparse (نفس
+          النتيجة لفلاتر $type / $exists المستخدمة في الترحيلات)
+    """
+
+    def __init__(self, database: '_MemoryDatabase', collection):
+        self._database = database
+        self._collection = collection
+
+    def __getattr__(self, attr):
+        value = getattr(self._collection, attr)
+        command = _MEMORY_COMMANDS.get(attr)
+        if command is None:
+            return value
+
+        def call(*args, **kwargs):
+            return _timed(command, self._collection.name, value, *args, **kwargs)
+        return call
+
+    def __getitem__(self, key):
+        return self._database[f"{self._collection.name}.{key}"]
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        from pymongo import InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany
+        from pymongo.results import BulkWriteResult
+
+        counts = {'nInserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'nUpserted': 0, 'upserted': []}
+        for op in requests:
+            if isinstance(op, InsertOne):
+                self.insert_one(op._doc)
+                counts['nInserted'] += 1
+                continue
+            if isinstance(op, (UpdateOne, UpdateMany, ReplaceOne)):
+                if isinstance(op, ReplaceOne):
+                    result = self.replace_one(op._filter, op._doc, upsert=op._upsert)
+                elif isinstance(op, UpdateOne):
+                    result = self.update_one(op._filter, op._doc, upsert=op._upsert)
+                else:
+                    result = self.update_many(op._filter, op._doc, upsert=op._upsert)
+                counts['nMatched'] += result.matched_count
+                counts['nModified'] += result.modified_count
+                if result.upserted_id is not None:
+                    counts['nUpserted'] += 1
+                    counts['upserted'].append({'index': 0, '_id': result.upserted_id})
+                continue
+            if isinstance(op, (DeleteOne, DeleteMany)):
+                delete = self.delete_one if isinstance(op, DeleteOne) else self.delete_many
+                counts['nRemoved'] += delete(op._filter).deleted_count
+                continue
+            raise TypeError(f"عملية bulk غير مدعومة في الواجهة المحلية: {type(op).__name__}")
+        return BulkWriteResult(counts, True)
+
+    def create_index(self, keys, **kwargs):
+        if kwargs.pop('partialFilterExpression', None) is not None:
+            kwargs['sparse'] = True
+        return _timed('createIndexes', self._collection.name, self._collection.create_index, keys, **kwargs)
+
+    def aggregate(self, pipeline, *args, **kwargs):
+        pipeline = list(pipeline)
+        merge = pipeline[-1].get('$merge') if pipeline else None
+        if merge is None:
+            return _timed('aggregate', self._collection.name, self._collection.aggregate, pipeline, *args, **kwargs)
+
+        target = self._database[merge['into'] if isinstance(merge['into'], str) else merge['into']['coll']]
+        for doc in _timed('aggregate', self._collection.name, self._collection.aggregate, pipeline[:-1], *args, **kwargs):
+            target.replace_one({'_id': doc['_id']}, doc, upsert=True)
+        return iter(())
+
+
+class _MemoryDatabase:
+    """غلاف قاعدة بيانات mongomock: المجموعات تُعاد مغلفة، و command يقبل صيغة pymongo"""
+
+    def __init__(self, database, collection_type):
+        self._database = database
+        self._collection_type = collection_type
+
+    def __getattr__(self, attr):
+        value = getattr(self._database, attr)
+        if isinstance(value, self._collection_type):
+            return _MemoryCollection(self, value)
+        return value
+
+    def __getitem__(self, name):
+        return _MemoryCollection(self, self._database[name])
+
+    def get_collection(self, name, *args, **kwargs):
+        return _MemoryCollection(self, self._database.get_collection(name, *args, **kwargs))
+
+    def command(self, command, value=1, **kwargs):
+        """db.command('name', value, **kwargs) كما في pymongo (mongomock يقبل dict فقط)"""
+        if isinstance(command, str):
+            command = {command: value, **kwargs}
+        name = next(iter(command))
+
+        if name == 'collMod' and 'index' in command:
+            # تعديل مدة TTL: إعادة إنشاء الفهرس بالمدة الجديدة
+            collection = self._database[command['collMod']]
+            spec = command['index']
+            key = collection.index_information()[spec['name']]['key']
+            collection.drop_index(spec['name'])
+            return _timed('collMod', collection.name, collection.create_index, key,
+                          name=spec['name'], expireAfterSeconds=spec['expireAfterSeconds'])
+
+        return _timed(name, '-', self._database.command, command)
+
+
+class MemoryBackend(StorageBackend):
+    """
+    قاعدة بيانات داخل العملية (mongomock)
+
+    client واحد مشترك طوال عمر العملية، فإعادة الاتصال لا تفقد البيانات.
+    قاعدة البيانات تُعاد مغلفة (_MemoryDatabase) لتسجيل إحصائيات الأوامر.
+    المعاملات (sessions) غير مدعومة في mongomock - المستدعي يرجع لمساره البديل.
+    """
+
+    name = 'memory'
+    _client = None
+    _lock = threading.Lock()
+
+    def create_client(self):
+        with self._lock:
+            if MemoryBackend._client is None:
+                try:
+                    import mongomock
+                except ImportError:
+                    raise RuntimeError("STORAGE_BACKEND=memory يحتاج mongomock: pip install -r requirements-dev.txt")
+                MemoryBackend._client = mongomock.MongoClient()
+                logger.warning("🧪 استخدام قاعدة بيانات داخل الذاكرة (mongomock) - البيانات لا تُحفظ")
+        return MemoryBackend._client
+
+    def get_database(self, client):
+        from mongomock.collection import Collection
+        return _MemoryDatabase(client[DB_NAME], Collection)
+
+
+def get_storage_backend() -> StorageBackend:
+    """اختيار الواجهة الخلفية حسب STORAGE_BACKEND"""
+    name = os.getenv("STORAGE_BACKEND", "mongo").strip().lower()
+
+    if name == 'memory':
+        return MemoryBackend()
+    if name != 'mongo':
+        logger.warning(f"⚠️ STORAGE_BACKEND غير معروف: {name} - استخدام mongo")
+
+    return MongoBackend(os.getenv("MONGODB_URI"))
@@ -1,7 +1,9 @@
 import os
-from pymongo import MongoClient
+import threading
 from datetime import datetime
 from config.logger import get_logger
+from .backends import get_storage_backend
+from .health import db_health
 
 # إنشاء logger
 logger = get_logger(__name__)
@@ -33,86 +35,152 @@ except (ValueError, AttributeError) as e:
     logger.error(f"❌ Failed to parse ADMIN_ID/ADMIN_IDS from .env: {e}")
     ADMIN_IDS = []
 
-# تهيئة المتغيرات العامة
-client = None
-db = None
-users_collection = None
-settings_collection = None
+# الـ client وقاعدة البيانات الحاليان (يُعاد ربطهما إذا أنشأ المراقب الـ client لاحقاً)
+_client = None
+_db = None
 
-try:
-    if not MONGODB_URI:
-        raise ValueError("متغير البيئة MONGODB_URI غير موجود.")
-
-    # Performance optimization: added maxPoolSize for better concurrent operations
-    client = MongoClient(
-        MONGODB_URI,
-        serverSelectionTimeoutMS=5000,
-        maxPoolSize=100,  # Increased pool size for better performance
-        minPoolSize=10    # Minimum connections to maintain
-    )
-    client.server_info()
+# هل طُبقت الترحيلات في هذه العملية (عند التشغيل أو أول عودة للاتصال)
+_migrations_applied = False
+_migrations_lock = threading.Lock()
 
-    db = client.telegram_bot
-    users_collection = db.users
-    settings_collection = db.settings
+# الواجهة الخلفية للتخزين (mongo / memory) - انظر backends.py
+storage_backend = get_storage_backend()
+
+
+class DatabaseHandle:
+    """
+    مرجع ثابت يُحل عند كل وصول إلى الكائن الحالي (client / قاعدة البيانات / مجموعة)
+
+    الوحدات الأخرى تستورد users_collection و db بالقيمة عند الاستيراد؛ لو كانت
+    هذه كائنات pymongo مباشرة لبقيت None إذا فشل إنشاء الـ client عند التشغيل ثم
+    أنشأه المراقب لاحقاً. المرجع يبقى نفسه ويُحل دائماً إلى الـ client الحالي.
+    """
+
+    __slots__ = ('_resolve', '_name')
+
+    def __init__(self, resolve, name: str):
+        self._resolve = resolve
+        self._name = name
+
+    def get(self):
+        """الكائن الفعلي - يرفع ConnectionError إذا لم يُنشأ الـ client بعد"""
+        target = self._resolve()
+        if target is None:
+            raise ConnectionError(f"قاعدة البيانات غير متصلة ({self._name})")
+        return target
+
+    def __getattr__(self, attr):
+        return getattr(self.get(), attr)
+
+    def __getitem__(self, key):
+        return self.get()[key]
+
+    def __repr__(self):
+        return f"<DatabaseHandle {self._name}>"
+
+
+def get_collection(name: str) -> DatabaseHandle:
+    """مرجع ثابت لمجموعة يُحل عند كل وصول"""
+    return DatabaseHandle(lambda: _db[name] if _db is not None else None, name)
+
+
+client = DatabaseHandle(lambda: _client, 'client')
+db = DatabaseHandle(lambda: _db, 'db')
+users_collection = get_collection('users')
+settings_collection = get_collection('settings')
+
+
+def get_db():
+    """قاعدة البيانات الحالية (كائن pymongo) أو None إذا لم يُنشأ الـ client بعد"""
+    return _db
+
+
+def is_db_initialized() -> bool:
+    """هل أُنشئ الـ client (بغض النظر عن حالة القاطع)"""
+    return _db is not None
 
-    logger.info("✅ تم الاتصال بقاعدة البيانات بنجاح.")
-except Exception as e:
-    logger.error(f"!!! خطأ في الاتصال بقاعدة البيانات: {e}")
-    client = None
-    db = None
-    users_collection = None
-    settings_collection = None
+
+def _bind_client(new_client):
+    """ربط الـ client (عند التشغيل أو عند إنشائه من المراقب)"""
+    global _client, _db
+    _client = new_client
+    _db = storage_backend.get_database(new_client)
+
+
+def _apply_migrations():
+    """
+    إنشاء الفهارس وتطبيق ترحيلات المخطط المعلقة (idempotent) مرة واحدة لكل عملية
+
+    تُستدعى من init_db، ومن المراقب عند أول عودة للاتصال إذا كانت قاعدة
+    البيانات غير متاحة عند التشغيل (وإلا يعمل البوت بدون فهارس و TTL حتى إعادة التشغيل)
+    """
+    global _migrations_applied
+    # init_db وخيط المراقبة قد يستدعيانها معاً
+    with _migrations_lock:
+        if _migrations_applied or _db is None:
+            return
+        try:
+            from .migrations import run_migrations, apply_retention_policy
+            if run_migrations(_db):
+                _migrations_applied = True
+                apply_retention_policy(_db)
+        except Exception as e:
+            logger.error(f"❌ فشل تطبيق ترحيلات قاعدة البيانات: {e}")
+
+
+def _report_connection_failure(error):
+    logger.error(f"!!! خطأ في الاتصال بقاعدة البيانات: {error}")
 
     # إرسال تقرير خطأ جسيم
     try:
         from utils import send_critical_log
-        send_critical_log(f"فشل الاتصال بقاعدة البيانات MongoDB: {str(e)}", module="database.py")
+        send_critical_log(f"فشل الاتصال بقاعدة البيانات MongoDB: {str(error)}", module="database.py")
     except Exception as log_error:
         logger.error(f"فشل إرسال سجل الخطأ: {log_error}")
 
+
+try:
+    # إنشاء الـ client لا ينتظر الخادم - الفحص الفعلي عبر db_health
+    _bind_client(storage_backend.create_client())
+except Exception as e:
+    _report_connection_failure(e)
+
+if storage_backend.monitored and MONGODB_URI:
+    db_health.start(
+        storage_backend.create_client,
+        client=_client,
+        on_connected=_bind_client,
+        on_recovered=_apply_migrations,
+        pool_max=storage_backend.pool_max
+    )
+    if _client is not None:
+        # فحص أول متزامن عند التشغيل (نفس مهلة server_info السابقة)
+        if db_health.check_now():
+            logger.info(f"✅ تم الاتصال بقاعدة البيانات بنجاح ({storage_backend.name}).")
+        else:
+            db_health.trip(db_health.last_error)
+            _report_connection_failure(db_health.last_error)
+elif _client is not None:
+    # الواجهة المحلية لا تحتاج مراقبة
+    db_health.client = _client
+    logger.info(f"✅ تم الاتصال بقاعدة البيانات بنجاح ({storage_backend.name}).")
+
 def init_db():
     """التحقق من الاتصال بقاعدة البيانات"""
-    if db is None or users_collection is None:
+    if _db is None or not db_health.is_available():
         logger.error("!!! قاعدة البيانات غير متصلة.")
         return False
+
+    # إنشاء الفهارس وتطبيق ترحيلات المخطط المعلقة
+    _apply_migrations()
+
     return True
 
 def ensure_db_connection():
-    """التحقق من الاتصال بقاعدة البيانات مع إعادة المحاولة التلقائية"""
-    global client, db, users_collection, settings_collection
+    """
+    هل قاعدة البيانات متاحة الآن - بدون أي عملية شبكة
 
-    # إذا كانت المتغيرات غير مهيأة، محاولة إعادة الاتصال
-    if db is None or users_collection is None or settings_collection is None:
-        logger.warning("⚠️ Database connection lost, attempting reconnection...")
-        try:
-            # محاولة إعادة الاتصال
-            if not MONGODB_URI:
-                logger.error("❌ MONGODB_URI not configured")
-                return False
-
-            # Performance optimization: added maxPoolSize for better concurrent operations
-            client = MongoClient(
-                MONGODB_URI,
-                serverSelectionTimeoutMS=5000,
-                maxPoolSize=100,  # Increased pool size for better performance
-                minPoolSize=10    # Minimum connections to maintain
-            )
-            client.server_info()  # Test connection
-
-            db = client.telegram_bot
-            users_collection = db.users
-            settings_collection = db.settings
-
-            logger.info("✅ Database reconnection successful")
-            return True
-        except Exception as e:
-            logger.error(f"❌ Database reconnection failed: {e}")
-            try:
-                from utils import send_critical_log
-                send_critical_log(f"Database reconnection failed: {str(e)}", module="database.py")
-            except:
-                pass
-            return False
-
-    return True
+    الفحص وإعادة الاتصال يتولاهما خيط db_health الخلفي، فأثناء الانقطاع تعود
+    هذه الدالة بـ False فوراً بدلاً من انتظار server_info() في كل طلب.
+    """
+    return _db is not None and db_health.is_available()
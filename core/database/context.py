@@ -0,0 +1,158 @@
+"""
+User Request Context - سياق المستخدم لكل طلب تحميل
+
+طلب التحميل الواحد كان يستدعي get_user_language, get_user, is_subscribed,
+get_daily_download_count, get_no_logo_credits وعدة دوال إعدادات، كل منها
+find_one منفصل ويتكرر بين handle_download و handle_quality_selection و
+perform_download.
+
+UserRequestContext يُبنى مرة واحدة لكل update من:
+    1. استعلام واحد على users مع projection للحقول المطلوبة فقط
+    2. لقطة الإعدادات المخزنة مؤقتاً (settings_cache) - بدون استعلام غالباً
+ثم يُمرر عبر مسار التحميل بالكامل.
+"""
+
+from datetime import datetime
+
+from .base import ensure_db_connection, ADMIN_IDS
+from .logos import LOGO_TARGET_NAMES
+from .downloads import daily_count_from_usage
+from .settings_cache import get_settings_snapshot
+from config.logger import get_logger
+
+# إنشاء logger instance
+logger = get_logger(__name__)
+
+# الحقول التي يحتاجها مسار التحميل من مستند المستخدم
+USER_CONTEXT_PROJECTION = {
+    '_id': 0,
+    'user_id': 1,
+    'username': 1,
+    'full_name': 1,
+    'language': 1,
+    'subscription_end': 1,
+    'daily_usage': 1,
+    'no_logo_credits': 1,
+}
+
+
+class UserRequestContext:
+    """
+    بيانات المستخدم والإعدادات اللازمة لطلب تحميل واحد
+
+    القيم الافتراضية مطابقة لدوال get_* الأصلية حتى يبقى السلوك كما هو
+    عندما يكون مستند الإعدادات غير موجود.
+    """
+
+    __slots__ = ('user_id', 'user', 'settings', 'daily_count')
+
+    def __init__(self, user_id: int, user: dict = None, settings=None):
+        self.user_id = user_id
+        self.user = user or {}
+        self.settings = settings or {}
+        self.daily_count = daily_count_from_usage(self.user.get('daily_usage'))
+
+    def _settings_doc(self, doc_id: str):
+        return self.settings.get(doc_id) or {}
+
+    # ==================== المستخدم ====================
+
+    @property
+    def exists(self) -> bool:
+        return bool(self.user)
+
+    @property
+    def lang(self) -> str:
+        return self.user.get('language', 'ar')
+
+    @property
+    def is_admin(self) -> bool:
+        return self.user_id in ADMIN_IDS
+
+    @property
+    def is_subscribed(self) -> bool:
+        end = self.user.get('subscription_end')
+        return isinstance(end, datetime) and end > datetime.now()
+
+    @property
+    def is_privileged(self) -> bool:
+        """أدمن أو مشترك VIP - لا تنطبق عليه قيود المستخدم المجاني"""
+        return self.is_admin or self.is_subscribed
+
+    @property
+    def no_logo_credits(self) -> int:
+        return self.user.get('no_logo_credits', 0)
+
+    # ==================== الإعدادات ====================
+
+    @property
+    def subscription_enabled(self) -> bool:
+        return self._settings_doc('global_settings').get('subscription_enabled', False)
+
+    @property
+    def daily_limit(self) -> int:
+        return self._settings_doc('general_limits').get('daily_download_limit', 3)
+
+    @property
+    def free_time_limit(self) -> int:
+        return self._settings_doc('general_limits').get('free_time_limit', 5)
+
+    @property
+    def audio_enabled(self) -> bool:
+        return self._settings_doc('audio_settings').get('audio_enabled', True)
+
+    @property
+    def logo_enabled(self) -> bool:
+        return self._settings_doc('logo_settings').get('enabled', True)
+
+    @property
+    def logo_settings(self) -> dict:
+        """مستند logo_settings كاملاً (الحركة، الموضع، الحجم، الشفافية...)"""
+        return self._settings_doc('logo_settings')
+
+    @property
+    def logo_target(self) -> str:
+        target = self._settings_doc('logo_settings').get('target', 'free_all')
+        return target if target in LOGO_TARGET_NAMES else 'free_all'
+
+    def is_platform_allowed(self, platform: str) -> bool:
+        return self._settings_doc('library_settings').get('allowed_platforms', {}).get(platform, True)
+
+    # ==================== الحد اليومي ====================
+
+    @property
+    def reached_daily_limit(self) -> bool:
+        return self.daily_count >= self.daily_limit
+
+    @property
+    def remaining_downloads(self) -> int:
+        return self.daily_limit - self.daily_count
+
+    def consume_download(self):
+        """تحديث العداد المحلي بعد increment/reserve بدون إعادة القراءة"""
+        self.daily_count += 1
+
+    def consume_no_logo_credit(self):
+        """تحديث الرصيد المحلي بعد use_no_logo_credit"""
+        self.user['no_logo_credits'] = max(0, self.no_logo_credits - 1)
+
+
+def load_user_context(user_id: int) -> UserRequestContext:
+    """
+    بناء سياق الطلب: استعلام users واحد + لقطة الإعدادات
+
+    Returns:
+        UserRequestContext (exists=False إذا لم يكن المستخدم مسجلاً)
+    """
+    if not ensure_db_connection():
+        return UserRequestContext(user_id)
+
+    from .base import users_collection as uc
+
+    try:
+        user = uc.find_one({'user_id': user_id}, USER_CONTEXT_PROJECTION)
+    except Exception as e:
+        logger.error(f"❌ فشل جلب سياق المستخدم {user_id}: {e}")
+        user = None
+
+    return UserRequestContext(user_id, user, get_settings_snapshot())
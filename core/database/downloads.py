@@ -1,35 +1,88 @@
+import os
 from datetime import datetime, timedelta
-from .base import users_collection, db
+from pymongo import InsertOne, UpdateOne
+from .base import users_collection, db, get_collection, is_db_initialized, ensure_db_connection
+from .telemetry import enqueue_write
 from config.logger import get_logger
 
 # إنشاء logger instance
 logger = get_logger(__name__)
 
-# إنشاء مجموعة التحميلات
-try:
-    downloads_collection = db.downloads if db is not None else None
-except Exception as e:
-    logger.error(f"❌ فشل إنشاء مجموعة التحميلات: {e}")
-    downloads_collection = None
+# مجموعة التحميلات (مرجع ثابت يُحل عند كل وصول - انظر base.DatabaseHandle)
+downloads_collection = get_collection('downloads')
+
+
+# ═══════════════════════════════════════════════════════════════
+#  Daily Usage Counter
+#  عداد يومي واحد لكل مستخدم: daily_usage = {'day': 'YYYY-MM-DD', 'count': N}
+#  يُصفّر تلقائياً عند أول تحميل في يوم جديد - لا حاجة لتنظيف ليلي
+# ═══════════════════════════════════════════════════════════════
+
+def _today_key() -> str:
+    """مفتاح اليوم الحالي للعداد اليومي"""
+    return datetime.now().strftime('%Y-%m-%d')
+
+
+def daily_count_from_usage(daily_usage) -> int:
+    """استخراج عدد تحميلات اليوم من حقل daily_usage (0 إذا كان من يوم سابق)"""
+    if not isinstance(daily_usage, dict) or daily_usage.get('day') != _today_key():
+        return 0
+    return daily_usage.get('count', 0)
+
+
+def _bump_daily_usage(user_id: int, limit: int = None) -> bool:
+    """
+    زيادة العداد اليومي ذرياً (atomic)
+
+    Args:
+        user_id: معرف المستخدم
+        limit: إذا حُدد، لا تتم الزيادة إلا إذا كان العدد الحالي أقل منه
+
+    Returns:
+        bool: True إذا تمت الزيادة
+    """
+    today = _today_key()
+
+    # الحالة الشائعة: العداد لليوم الحالي موجود -> $inc مشروط
+    same_day_filter = {'user_id': user_id, 'daily_usage.day': today}
+    if limit is not None:
+        same_day_filter['daily_usage.count'] = {'$lt': limit}
+
+    result = users_collection.update_one(
+        same_day_filter,
+        {'$inc': {'daily_usage.count': 1, 'download_count': 1}}
+    )
+    if result.matched_count:
+        return True
+
+    if limit is not None and limit <= 0:
+        return False
+
+    # أول تحميل اليوم: تصفير العداد وبدء يوم جديد
+    result = users_collection.update_one(
+        {'user_id': user_id, 'daily_usage.day': {'$ne': today}},
+        {
+            '$set': {'daily_usage': {'day': today, 'count': 1}},
+            '$inc': {'download_count': 1}
+        }
+    )
+    if result.matched_count:
+        return True
+
+    # طلب آخر بدأ اليوم الجديد في نفس اللحظة -> إعادة المحاولة بالـ $inc المشروط
+    result = users_collection.update_one(
+        same_day_filter,
+        {'$inc': {'daily_usage.count': 1, 'download_count': 1}}
+    )
+    return result.matched_count > 0
 
 
 def increment_download_count(user_id: int):
     """زيادة عداد التحميلات"""
+    if not ensure_db_connection():
+        return False
     try:
-        today = datetime.now().date()
-
-        users_collection.update_one(
-            {'user_id': user_id},
-            {
-                '$inc': {'download_count': 1},
-                '$push': {
-                    'daily_downloads': {
-                        'date': datetime.combine(today, datetime.min.time()),
-                        'count': 1
-                    }
-                }
-            }
-        )
+        _bump_daily_usage(user_id)
         logger.info(f"✅ تم زيادة عداد التحميلات للمستخدم {user_id}")
         return True
     except Exception as e:
@@ -37,22 +90,52 @@ def increment_download_count(user_id: int):
         return False
 
 
+def reserve_daily_download(user_id: int, limit: int) -> bool:
+    """
+    حجز تحميل من الحد اليومي بعملية شرطية واحدة
+
+    الفحص والزيادة يتمان في نفس التحديث، فلا يمكن لطلبين متزامنين
+    تجاوز الحد. يجب استدعاء release_daily_download إذا فشل التحميل.
+
+    Returns:
+        bool: True إذا تم الحجز، False إذا وصل المستخدم للحد
+    """
+    if not ensure_db_connection():
+        # عند انقطاع قاعدة البيانات لا نمنع المستخدم من التحميل
+        return True
+    try:
+        return _bump_daily_usage(user_id, limit=limit)
+    except Exception as e:
+        logger.error(f"❌ فشل حجز تحميل من الحد اليومي: {e}")
+        # عند فشل قاعدة البيانات لا نمنع المستخدم من التحميل
+        return True
+
+
+def release_daily_download(user_id: int) -> bool:
+    """إرجاع تحميل محجوز (عند فشل التحميل)"""
+    if not ensure_db_connection():
+        return False
+    try:
+        result = users_collection.update_one(
+            {'user_id': user_id, 'daily_usage.day': _today_key(), 'daily_usage.count': {'$gt': 0}},
+            {'$inc': {'daily_usage.count': -1, 'download_count': -1}}
+        )
+        return result.modified_count > 0
+    except Exception as e:
+        logger.error(f"❌ فشل إرجاع التحميل المحجوز: {e}")
+        return False
+
+
 def get_daily_download_count(user_id: int) -> int:
     """جلب عدد التحميلات اليومية"""
+    if not ensure_db_connection():
+        return 0
     try:
-        user = users_collection.find_one({'user_id': user_id})
+        user = users_collection.find_one({'user_id': user_id}, {'_id': 0, 'daily_usage': 1})
         if not user:
             return 0
 
-        today = datetime.now().date()
-        daily_downloads = user.get('daily_downloads', [])
-
-        today_count = sum(
-            1 for download in daily_downloads
-            if isinstance(download.get('date'), datetime) and download['date'].date() == today
-        )
-
-        return today_count
+        return daily_count_from_usage(user.get('daily_usage'))
     except Exception as e:
         logger.error(f"❌ فشل جلب العداد اليومي: {e}")
         return 0
@@ -74,30 +157,75 @@ def get_total_downloads_count() -> int:
 
 
 def reset_daily_downloads():
-    """إعادة تعيين التحميلات اليومية (يتم تشغيله تلقائياً)"""
-    try:
-        yesterday = datetime.now() - timedelta(days=1)
-        users_collection.update_many(
-            {},
-            {
-                '$pull': {
-                    'daily_downloads': {
-                        'date': {'$lt': yesterday}
-                    }
-                }
-            }
-        )
-        logger.info("✅ تم تنظيف السجلات القديمة")
-        return True
-    except Exception as e:
-        logger.error(f"❌ فشل تنظيف السجلات: {e}")
-        return False
+    """
+    للتوافق فقط - العداد اليومي يُصفّر تلقائياً عند أول تحميل في يوم جديد
+    (daily_usage.day)، فلا حاجة لتحديث جميع المستخدمين ليلاً
+    """
+    return True
 
 
 # ═══════════════════════════════════════════════════════════════
 #  Mission 10: Download Tracking & Admin Logs
+#  سجل التحميل الخام بأسماء حقول مختصرة وقيم مرمّزة، وينتهي تلقائياً
+#  بعد DOWNLOADS_RETENTION_DAYS (فهرس TTL على ts). الإحصائيات الدائمة
+#  محفوظة في التجميع اليومي (downloads_daily) الذي يُحدّث مع كل حدث،
+#  فانتهاء السجل الخام لا يفقد أي رقم من التقارير.
+#
+#  u: user_id | p: platform | m: mode | q: quality | f: format
+#  s: status | r: url | sz: file_size | e: error_msg | ts: timestamp
 # ═══════════════════════════════════════════════════════════════
 
+# مدة الاحتفاظ بالسجل الخام بالأيام (0 = بدون انتهاء)
+DOWNLOADS_RETENTION_DAYS = int(os.getenv("DOWNLOADS_RETENTION_DAYS", "30"))
+
+DOWNLOAD_MODE_CODES = {'video': 'v', 'audio': 'a'}
+DOWNLOAD_STATUS_CODES = {'completed': 0, 'canceled': 1, 'failed': 2}
+
+_MODE_NAMES = {code: name for name, code in DOWNLOAD_MODE_CODES.items()}
+_STATUS_NAMES = {code: name for name, code in DOWNLOAD_STATUS_CODES.items()}
+
+# أقصى طول لرسالة الخطأ المحفوظة
+DOWNLOAD_ERROR_MAX_LEN = 300
+
+
+def _compact_download(user_id, platform, mode, quality, format, status, url, file_size, error_msg, ts) -> dict:
+    """بناء مستند السجل المختصر (الحقول الفارغة لا تُحفظ)"""
+    doc = {
+        'u': user_id,
+        'p': platform,
+        'm': DOWNLOAD_MODE_CODES.get(mode, mode),
+        's': DOWNLOAD_STATUS_CODES.get(status, status),
+        'ts': ts
+    }
+    if quality is not None:
+        doc['q'] = quality
+    if format is not None:
+        doc['f'] = format
+    if url:
+        doc['r'] = url
+    if file_size:
+        doc['sz'] = file_size
+    if error_msg:
+        doc['e'] = str(error_msg)[:DOWNLOAD_ERROR_MAX_LEN]
+    return doc
+
+
+def expand_download(doc: dict) -> dict:
+    """تحويل مستند السجل المختصر إلى الأسماء الكاملة (للعرض)"""
+    return {
+        'user_id': doc.get('u'),
+        'platform': doc.get('p'),
+        'mode': _MODE_NAMES.get(doc.get('m'), doc.get('m')),
+        'quality': doc.get('q'),
+        'format': doc.get('f'),
+        'status': _STATUS_NAMES.get(doc.get('s'), doc.get('s')),
+        'url': doc.get('r'),
+        'file_size': doc.get('sz', 0),
+        'error_msg': doc.get('e'),
+        'timestamp': doc.get('ts')
+    }
+
+
 def track_download(
     user_id: int,
     platform: str,
@@ -112,6 +240,10 @@ def track_download(
     """
     تتبع تحميل مفصل
 
+    كل الحالات تُسجل في downloads والتجميع اليومي، لكن عداد المستخدم
+    (daily_usage / download_count) يزيد مع status='completed' فقط - الملغاة
+    والفاشلة لا تُحسب من الحد اليومي (كما في مسار الملف الواحد الذي يُرجع الحجز عند الفشل)
+
     Args:
         user_id: معرف المستخدم
         platform: المنصة (youtube/instagram/facebook)
@@ -124,28 +256,26 @@ def track_download(
         error_msg: رسالة الخطأ إن وجدت
     """
     try:
-        if downloads_collection is None:
+        if not is_db_initialized():
             logger.warning("⚠️ مجموعة التحميلات غير متاحة")
             return False
 
-        download_data = {
-            'user_id': user_id,
-            'platform': platform,
-            'mode': mode,
-            'quality': quality,
-            'format': format,
-            'status': status,
-            'url': url,
-            'file_size': file_size,
-            'error_msg': error_msg,
-            'timestamp': datetime.now(),
-            'date': datetime.now().date()
-        }
+        now = datetime.now()
+        today = now.strftime('%Y-%m-%d')
 
-        downloads_collection.insert_one(download_data)
+        # كتابة مؤجلة - لا ننتظر MongoDB على مسار التحميل
+        enqueue_write('downloads', InsertOne(_compact_download(
+            user_id, platform, mode, quality, format, status, url, file_size, error_msg, now
+        )))
 
-        # تحديث عداد التحميلات للمستخدم
-        increment_download_count(user_id)
+        # تحديث التجميع اليومي الذي تقرأ منه التقارير
+        _enqueue_rollup(today, user_id, platform, mode, status, file_size)
+
+        # عداد التحميلات للتحميلات المكتملة فقط (الملغاة/الفاشلة لا تُحسب)
+        # كتابة مباشرة وليست مؤجلة: هذا العداد يطبق الحد اليومي، والمخزن المؤجل
+        # قد يُسقط العمليات عند الامتلاء أو بعد الإيقاف
+        if status == 'completed':
+            _bump_daily_usage(user_id)
 
         logger.info(f"✅ تم تتبع التحميل: {user_id} - {platform} - {mode} - {status}")
         return True
@@ -158,14 +288,14 @@ def track_download(
 def get_user_downloads(user_id: int, limit: int = 50):
     """جلب سجل تحميلات المستخدم"""
     try:
-        if downloads_collection is None:
+        if not is_db_initialized():
             return []
 
-        downloads = list(downloads_collection.find(
-            {'user_id': user_id}
-        ).sort('timestamp', -1).limit(limit))
+        downloads = downloads_collection.find(
+            {'u': user_id}
+        ).sort('ts', -1).limit(limit)
 
-        return downloads
+        return [expand_download(d) for d in downloads]
     except Exception as e:
         logger.error(f"❌ فشل جلب تحميلات المستخدم: {e}")
         return []
@@ -183,45 +313,58 @@ def get_download_stats(start_date=None, end_date=None):
         dict: إحصائيات التحميلات
     """
     try:
-        if downloads_collection is None:
+        if not is_db_initialized():
             return {}
 
         # تحديد نطاق التاريخ
         query = {}
         if start_date or end_date:
-            query['timestamp'] = {}
+            query['ts'] = {}
             if start_date:
-                query['timestamp']['$gte'] = start_date
+                query['ts']['$gte'] = start_date
             if end_date:
-                query['timestamp']['$lte'] = end_date
+                query['ts']['$lte'] = end_date
+
+        # تجميع على الخادم: مرور واحد على التحميلات في النطاق بدلاً من نقلها إلى Python
+        def count_by(field):
+            return [{'$group': {'_id': f'${field}', 'count': {'$sum': 1}}}]
+
+        pipeline = [
+            {'$match': query},
+            {'$facet': {
+                'status': count_by('s'),
+                'mode': count_by('m'),
+                'platform': count_by('p'),
+                'top_users': [
+                    {'$match': {'u': {'$ne': None}}},
+                    {'$group': {'_id': '$u', 'count': {'$sum': 1}}},
+                    {'$sort': {'count': -1}},
+                    {'$limit': 10}
+                ]
+            }}
+        ]
+        facets = next(downloads_collection.aggregate(pipeline), {})
 
-        # جلب جميع التحميلات في النطاق
-        downloads = list(downloads_collection.find(query))
+        by_status = {_STATUS_NAMES.get(f['_id'], f['_id']): f['count'] for f in facets.get('status', [])}
+        by_mode = {_MODE_NAMES.get(f['_id'], f['_id']): f['count'] for f in facets.get('mode', [])}
 
-        # حساب الإحصائيات
-        total_downloads = len(downloads)
-        completed = len([d for d in downloads if d.get('status') == 'completed'])
-        canceled = len([d for d in downloads if d.get('status') == 'canceled'])
-        failed = len([d for d in downloads if d.get('status') == 'failed'])
+        total_downloads = sum(by_status.values())
+        completed = by_status.get('completed', 0)
+        canceled = by_status.get('canceled', 0)
+        failed = by_status.get('failed', 0)
 
         # إحصائيات حسب الوضع
-        video_downloads = len([d for d in downloads if d.get('mode') == 'video'])
-        audio_downloads = len([d for d in downloads if d.get('mode') == 'audio'])
+        video_downloads = by_mode.get('video', 0)
+        audio_downloads = by_mode.get('audio', 0)
 
         # إحصائيات حسب المنصة
-        platforms = {}
-        for download in downloads:
-            platform = download.get('platform', 'unknown')
-            platforms[platform] = platforms.get(platform, 0) + 1
+        platforms = {
+            (f['_id'] or 'unknown'): f['count']
+            for f in facets.get('platform', [])
+        }
 
         # أعلى المستخدمين تحميلاً
-        user_downloads = {}
-        for download in downloads:
-            user_id = download.get('user_id')
-            if user_id:
-                user_downloads[user_id] = user_downloads.get(user_id, 0) + 1
-
-        top_users = sorted(user_downloads.items(), key=lambda x: x[1], reverse=True)[:10]
+        top_users = [(f['_id'], f['count']) for f in facets.get('top_users', [])]
 
         stats = {
             'total_downloads': total_downloads,
@@ -243,17 +386,26 @@ def get_download_stats(start_date=None, end_date=None):
 
 
 def get_daily_download_stats():
-    """جلب إحصائيات التحميلات اليومية"""
+    """جلب إحصائيات التحميلات اليومية (من التجميع اليومي)"""
     try:
-        today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        today_end = datetime.now()
-
-        return get_download_stats(start_date=today_start, end_date=today_end)
+        today = _today_key()
+        return get_rollup_stats(today, today)
     except Exception as e:
         logger.error(f"❌ فشل جلب إحصائيات اليوم: {e}")
         return {}
 
 
+def get_weekly_download_stats():
+    """جلب إحصائيات آخر 7 أيام (من التجميع اليومي)"""
+    try:
+        today = datetime.now()
+        start = (today - timedelta(days=6)).strftime('%Y-%m-%d')
+        return get_rollup_stats(start, today.strftime('%Y-%m-%d'))
+    except Exception as e:
+        logger.error(f"❌ فشل جلب إحصائيات الأسبوع: {e}")
+        return {}
+
+
 def generate_daily_report():
     """
     توليد تقرير يومي شامل
@@ -310,6 +462,101 @@ def generate_daily_report():
         return "❌ فشل توليد التقرير / Failed to generate report"
 
 
+# ═══════════════════════════════════════════════════════════════
+#  Daily Rollup
+#  downloads_daily: مستند لكل (يوم × منصة × وضع × حالة) فيه count و bytes
+#  downloads_daily_users: مستند لكل (يوم × مستخدم) لحساب أعلى المستخدمين
+#  يُحدّثان بـ $inc مع كل track_download، فتقرأ التقارير بضعة مستندات صغيرة
+#  بدلاً من إعادة فحص سجل التحميلات الخام
+# ═══════════════════════════════════════════════════════════════
+
+def _enqueue_rollup(day: str, user_id: int, platform: str, mode: str, status: str, file_size: int = 0):
+    """إضافة تحديثات التجميع اليومي لتحميل واحد إلى مخزن الكتابة المؤجلة"""
+    platform = platform or 'unknown'
+    mode = mode or 'unknown'
+    status = status or 'unknown'
+
+    enqueue_write('downloads_daily', UpdateOne(
+        {'_id': f"{day}|{platform}|{mode}|{status}"},
+        {
+            '$inc': {'count': 1, 'bytes': file_size or 0},
+            '$setOnInsert': {'day': day, 'platform': platform, 'mode': mode, 'status': status}
+        },
+        upsert=True
+    ))
+
+    if user_id:
+        enqueue_write('downloads_daily_users', UpdateOne(
+            {'_id': f"{day}|{user_id}"},
+            {
+                '$inc': {'count': 1},
+                '$setOnInsert': {'day': day, 'user_id': user_id}
+            },
+            upsert=True
+        ))
+
+
+def get_rollup_stats(start_day: str, end_day: str, top_users: int = 10) -> dict:
+    """
+    إحصائيات التحميلات لنطاق أيام من التجميع اليومي
+
+    Args:
+        start_day: أول يوم 'YYYY-MM-DD'
+        end_day: آخر يوم 'YYYY-MM-DD' (ضمن النطاق)
+        top_users: عدد أعلى المستخدمين
+
+    Returns:
+        dict: نفس شكل get_download_stats + total_bytes
+    """
+    try:
+        if not is_db_initialized():
+            return {}
+
+        day_range = {'day': {'$gte': start_day, '$lte': end_day}}
+
+        by_status, by_mode, platforms = {}, {}, {}
+        total_bytes = 0
+        for doc in db.downloads_daily.find(day_range, {'_id': 0}):
+            count = doc.get('count', 0)
+            by_status[doc['status']] = by_status.get(doc['status'], 0) + count
+            by_mode[doc['mode']] = by_mode.get(doc['mode'], 0) + count
+            platforms[doc['platform']] = platforms.get(doc['platform'], 0) + count
+            total_bytes += doc.get('bytes', 0)
+
+        if start_day == end_day:
+            # يوم واحد: الفهرس (day, count) يعطي الترتيب مباشرة
+            cursor = db.downloads_daily_users.find(day_range, {'_id': 0, 'user_id': 1, 'count': 1}) \
+                .sort('count', -1).limit(top_users)
+        else:
+            cursor = db.downloads_daily_users.aggregate([
+                {'$match': day_range},
+                {'$group': {'_id': '$user_id', 'count': {'$sum': '$count'}}},
+                {'$sort': {'count': -1}},
+                {'$limit': top_users},
+                {'$project': {'_id': 0, 'user_id': '$_id', 'count': 1}}
+            ])
+        top = [(u['user_id'], u['count']) for u in cursor]
+
+        total_downloads = sum(by_status.values())
+        completed = by_status.get('completed', 0)
+
+        return {
+            'total_downloads': total_downloads,
+            'completed': completed,
+            'canceled': by_status.get('canceled', 0),
+            'failed': by_status.get('failed', 0),
+            'video_downloads': by_mode.get('video', 0),
+            'audio_downloads': by_mode.get('audio', 0),
+            'platforms': platforms,
+            'top_users': top,
+            'total_bytes': total_bytes,
+            'success_rate': (completed / total_downloads * 100) if total_downloads > 0 else 0
+        }
+    except Exception as e:
+        logger.error(f"❌ فشل جلب التجميع اليومي: {e}")
+        return {}
+
+
 # ═══════════════════════════════════════════════════════════════
 #  Download Success Rate Tracking
 # ═══════════════════════════════════════════════════════════════
@@ -317,23 +564,14 @@ def generate_daily_report():
 def track_download_success(user_id: int, success: bool):
     """تتبع نجاح/فشل التحميلات"""
     try:
-        if users_collection is None:
+        if not is_db_initialized():
             return False
 
-        users_collection.update_one(
+        # $inc ينشئ الحقل إذا لم يكن موجوداً - لا حاجة لـ $setOnInsert
+        return enqueue_write('users', UpdateOne(
             {'user_id': user_id},
-            {
-                '$inc': {
-                    'download_success_count' if success else 'download_fail_count': 1
-                },
-                '$setOnInsert': {
-                    'download_success_count': 0,
-                    'download_fail_count': 0
-                }
-            },
-            upsert=True
-        )
-        return True
+            {'$inc': {'download_success_count' if success else 'download_fail_count': 1}}
+        ))
     except Exception as e:
         logger.error(f"❌ فشل تتبع حالة التحميل: {e}")
         return False
@@ -342,7 +580,7 @@ def track_download_success(user_id: int, success: bool):
 def get_download_success_rate() -> float:
     """حساب معدل نجاح التحميلات"""
     try:
-        if users_collection is None:
+        if not is_db_initialized():
             return 0.0
 
         pipeline = [
@@ -373,7 +611,7 @@ def get_download_success_rate() -> float:
 def get_user_download_stats(user_id: int) -> dict:
     """جلب إحصائيات التحميل للمستخدم"""
     try:
-        if users_collection is None:
+        if not is_db_initialized():
             return {'success': 0, 'fail': 0, 'rate': 0.0}
 
         user = users_collection.find_one({'user_id': user_id})
@@ -1,16 +1,12 @@
 from datetime import datetime
-from .base import db
+from .base import get_collection, is_db_initialized
 from config.logger import get_logger
 
 # إنشاء logger instance
 logger = get_logger(__name__)
 
-# إنشاء مجموعة البلاغات
-try:
-    error_reports_collection = db.error_reports if db is not None else None
-except Exception as e:
-    logger.error(f"❌ فشل إنشاء مجموعة البلاغات: {e}")
-    error_reports_collection = None
+# مجموعة البلاغات (مرجع ثابت يُحل عند كل وصول - انظر base.DatabaseHandle)
+error_reports_collection = get_collection('error_reports')
 
 
 # ═══════════════════════════════════════════════════════════════
@@ -29,7 +25,7 @@ def create_error_report(user_id: int, username: str, url: str, error_type: str,
         error_message: رسالة الخطأ التفصيلية
     """
     try:
-        if error_reports_collection is None:
+        if not is_db_initialized():
             logger.warning("⚠️ مجموعة البلاغات غير متاحة")
             return None
 
@@ -57,7 +53,7 @@ def create_error_report(user_id: int, username: str, url: str, error_type: str,
 def get_pending_error_reports(limit: int = 50):
     """جلب البلاغات المعلقة (غير المحلولة)"""
     try:
-        if error_reports_collection is None:
+        if not is_db_initialized():
             return []
 
         reports = list(error_reports_collection.find(
@@ -73,7 +69,7 @@ def get_pending_error_reports(limit: int = 50):
 def get_all_error_reports(limit: int = 100):
     """جلب جميع البلاغات (معلقة ومحلولة)"""
     try:
-        if error_reports_collection is None:
+        if not is_db_initialized():
             return []
 
         reports = list(error_reports_collection.find().sort('created_at', -1).limit(limit))
@@ -93,7 +89,7 @@ def resolve_error_report(report_id: str, admin_note: str = None):
         admin_note: ملاحظة اختيارية من المدير
     """
     try:
-        if error_reports_collection is None:
+        if not is_db_initialized():
             return False
 
         from bson.objectid import ObjectId
@@ -125,7 +121,7 @@ def resolve_error_report(report_id: str, admin_note: str = None):
 def get_error_report_by_id(report_id: str):
     """جلب بلاغ محدد بواسطة المعرف"""
     try:
-        if error_reports_collection is None:
+        if not is_db_initialized():
             return None
 
         from bson.objectid import ObjectId
@@ -141,7 +137,7 @@ def get_error_report_by_id(report_id: str):
 def delete_error_report(report_id: str):
     """حذف بلاغ"""
     try:
-        if error_reports_collection is None:
+        if not is_db_initialized():
             return False
 
         from bson.objectid import ObjectId
@@ -162,7 +158,7 @@ def delete_error_report(report_id: str):
 def get_error_stats():
     """جلب إحصائيات الأخطاء"""
     try:
-        if error_reports_collection is None:
+        if not is_db_initialized():
             return {}
 
         total = error_reports_collection.count_documents({})
@@ -0,0 +1,253 @@
+"""
+DB Health Monitor - مراقبة الاتصال وقاطع الدائرة (Circuit Breaker)
+
+ensure_db_connection() كان يبني MongoClient جديداً وينفذ server_info() لمدة
+5 ثوانٍ داخل كل طلب أثناء انقطاع قاعدة البيانات، فيتحول الانقطاع إلى عاصفة
+إعادة اتصال ويتوقف كل معالج 5 ثوانٍ.
+
+الآن خيط خلفي واحد يملك الـ client:
+    - يرسل ping كل DB_HEALTH_INTERVAL ثانية ويقيس زمن الاستجابة
+    - بعد DB_BREAKER_FAILURES فشل متتالٍ (أو عند pool_cleared من pymongo)
+      يفتح القاطع، فتعيد ensure_db_connection() القيمة False فوراً
+    - يستمر بالـ ping أثناء الانقطاع ويغلق القاطع عند أول نجاح
+    - ينشئ الـ client بنفسه إذا فشل إنشاؤه عند التشغيل
+
+MongoClient يعيد الاتصال تلقائياً، فلا حاجة لاستبداله عند الانقطاع المؤقت.
+"""
+
+import os
+import threading
+from time import monotonic
+from datetime import datetime
+
+from pymongo import monitoring
+
+from config.logger import get_logger
+
+# إنشاء logger instance
+logger = get_logger(__name__)
+
+# الفاصل بين كل فحص (بالثواني)
+DB_HEALTH_INTERVAL = float(os.getenv("DB_HEALTH_INTERVAL", "5"))
+
+# عدد مرات الفشل المتتالية لفتح القاطع
+DB_BREAKER_FAILURES = int(os.getenv("DB_BREAKER_FAILURES", "2"))
+
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+
+
+class PoolUsageListener(monitoring.ConnectionPoolListener):
+    """عدّ اتصالات المجمع المفتوحة والمستخدمة حالياً"""
+
+    def __init__(self, on_cleared=None):
+        self._lock = threading.Lock()
+        self.open_connections = 0
+        self.checked_out = 0
+        self.on_cleared = on_cleared
+
+    def _add(self, field: str, delta: int):
+        with self._lock:
+            setattr(self, field, max(0, getattr(self, field) + delta))
+
+    def connection_created(self, event):
+        self._add('open_connections', 1)
+
+    def connection_closed(self, event):
+        self._add('open_connections', -1)
+
+    def connection_checked_out(self, event):
+        self._add('checked_out', 1)
+
+    def connection_checked_in(self, event):
+        self._add('checked_out', -1)
+
+    def pool_cleared(self, event):
+        # pymongo يمسح المجمع عند خطأ شبكة - مؤشر مبكر على الانقطاع
+        if self.on_cleared:
+            self.on_cleared()
+
+    # أحداث لا نحتاجها
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+    def connection_check_out_failed(self, event): pass
+
+
+class DBHealthMonitor:
+    """خيط مراقبة واحد + قاطع دائرة لقاعدة البيانات"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self.client = None
+        self._connect = None
+        self._on_connected = None
+        self._on_recovered = None
+
+        self.state = CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.last_check = None
+        self.opened_at = None
+        self.outages = 0
+        self.latency_ms = None
+        self.avg_latency_ms = None
+
+        self.pool = PoolUsageListener(on_cleared=self.request_check)
+        self.pool_max = None
+
+    # ==================== القاطع ====================
+
+    def is_available(self) -> bool:
+        """هل يُسمح بالوصول لقاعدة البيانات الآن (بدون أي عملية شبكة)"""
+        return self.client is not None and self.state == CIRCUIT_CLOSED
+
+    def _record_success(self, latency_ms: float) -> bool:
+        """تسجيل فحص ناجح - True إذا أغلق القاطع (عودة بعد انقطاع)"""
+        with self._lock:
+            self.latency_ms = latency_ms
+            self.avg_latency_ms = latency_ms if self.avg_latency_ms is None \
+                else self.avg_latency_ms * 0.8 + latency_ms * 0.2
+            self.consecutive_failures = 0
+            self.last_error = None
+            if self.state == CIRCUIT_OPEN:
+                down_for = (monotonic() - self.opened_at) if self.opened_at else 0
+                self.state = CIRCUIT_CLOSED
+                self.opened_at = None
+                logger.info(f"✅ [db-health] عادت قاعدة البيانات بعد {down_for:.0f} ثانية - القاطع مغلق")
+                return True
+        return False
+
+    def _record_failure(self, error):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = str(error)[:200]
+            if self.state == CIRCUIT_CLOSED and self.consecutive_failures >= DB_BREAKER_FAILURES:
+                self.state = CIRCUIT_OPEN
+                self.opened_at = monotonic()
+                self.outages += 1
+                logger.error(f"🔌 [db-health] قاعدة البيانات غير متاحة - القاطع مفتوح: {self.last_error}")
+                return True
+        return False
+
+    def request_check(self):
+        """إشارة خارجية بوجود مشكلة (مثل pool_cleared) - فحص فوري بدلاً من انتظار الدورة"""
+        self._wakeup.set()
+
+    # ==================== الفحص ====================
+
+    def check_now(self) -> bool:
+        """فحص واحد متزامن (ping أو إنشاء الـ client إذا لم يكن موجوداً)"""
+        self.last_check = datetime.now()
+
+        if self.client is None:
+            try:
+                self.client = self._connect()
+                if self._on_connected:
+                    self._on_connected(self.client)
+            except Exception as e:
+                self.trip(e)
+                return False
+
+        started = monotonic()
+        try:
+            self.client.admin.command('ping')
+        except Exception as e:
+            if self._record_failure(e):
+                self._notify_outage(e)
+            return False
+
+        if self._record_success((monotonic() - started) * 1000) and self._on_recovered:
+            try:
+                self._on_recovered()
+            except Exception as e:
+                logger.error(f"❌ [db-health] فشل تنفيذ مهام العودة: {e}")
+        return True
+
+    def trip(self, error):
+        """فتح القاطع مباشرة (فشل إنشاء الـ client أو فشل الفحص الأول عند التشغيل)"""
+        with self._lock:
+            self.consecutive_failures = max(self.consecutive_failures + 1, DB_BREAKER_FAILURES)
+            self.last_error = str(error)[:200]
+            if self.state == CIRCUIT_CLOSED:
+                self.state = CIRCUIT_OPEN
+                self.opened_at = monotonic()
+                self.outages += 1
+                logger.error(f"🔌 [db-health] قاعدة البيانات غير متاحة - القاطع مفتوح: {self.last_error}")
+
+    def _notify_outage(self, error):
+        try:
+            from utils import send_critical_log
+            send_critical_log(f"Database unavailable (circuit open): {str(error)[:200]}", module="database.py")
+        except Exception:
+            pass
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(DB_HEALTH_INTERVAL)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                return
+            try:
+                self.check_now()
+            except Exception as e:
+                logger.error(f"❌ [db-health] خطأ غير متوقع في المراقبة: {e}")
+
+    def start(self, connect, client=None, on_connected=None, on_recovered=None, pool_max: int = None):
+        """
+        تشغيل المراقبة
+
+        Args:
+            connect: دالة تنشئ client جديد (عند فشل الإنشاء الأول)
+            client: الـ client الحالي إن وُجد
+            on_connected: تُستدعى بالـ client الجديد عند إنشائه من المراقب
+            on_recovered: تُستدعى عند إغلاق القاطع بعد انقطاع (من خيط المراقبة)
+            pool_max: maxPoolSize للعرض في المقاييس
+        """
+        self._connect = connect
+        self.client = client
+        self._on_connected = on_connected
+        self._on_recovered = on_recovered
+        self.pool_max = pool_max
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="db-health", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    # ==================== المقاييس ====================
+
+    def stats(self) -> dict:
+        """حالة القاطع، زمن الاستجابة، واستخدام مجمع الاتصالات"""
+        with self._lock:
+            return {
+                'state': self.state,
+                'available': self.is_available(),
+                'consecutive_failures': self.consecutive_failures,
+                'outages': self.outages,
+                'last_error': self.last_error,
+                'last_check': self.last_check,
+                'open_for_s': (monotonic() - self.opened_at) if self.opened_at else 0,
+                'latency_ms': self.latency_ms,
+                'avg_latency_ms': self.avg_latency_ms,
+                'pool_in_use': self.pool.checked_out,
+                'pool_open': self.pool.open_connections,
+                'pool_max': self.pool_max,
+            }
+
+
+db_health = DBHealthMonitor()
+
+
+def get_db_health() -> dict:
+    """مقاييس صحة قاعدة البيانات (للوحة الأدمن)"""
+    return db_health.stats()
@@ -1,5 +1,10 @@
+import os
+import random
 from datetime import datetime
+from pymongo import UpdateOne
 from .base import db
+from .telemetry import enqueue_write, flush_telemetry
+from .settings_cache import get_cached_settings, invalidate_settings_cache
 from config.logger import get_logger
 
 # إنشاء logger
@@ -51,11 +56,8 @@ def init_library_settings():
                 'approved_platforms': [],
                 'denied_platforms': []
             },
+            # العدادات نفسها في مجموعة metrics_shards (انظر record_download_attempt)
             'performance_metrics': {
-                'total_downloads': 0,
-                'successful_downloads': 0,
-                'failed_downloads': 0,
-                'avg_download_speed': 0,
                 'last_reset': datetime.now()
             }
         }
@@ -65,6 +67,7 @@ def init_library_settings():
             {'$setOnInsert': default_settings},
             upsert=True
         )
+        invalidate_settings_cache()
         logger.info("✅ تم تهيئة إعدادات المكتبات الافتراضية")
         return True
     except Exception as e:
@@ -75,10 +78,10 @@ def init_library_settings():
 def get_library_settings():
     """جلب إعدادات المكتبات الحالية"""
     try:
-        settings = db.settings.find_one({'_id': 'library_settings'})
+        settings = get_cached_settings('library_settings')
         if not settings:
             init_library_settings()
-            settings = db.settings.find_one({'_id': 'library_settings'})
+            settings = get_cached_settings('library_settings')
         return settings
     except Exception as e:
         logger.error(f"❌ فشل جلب إعدادات المكتبات: {e}")
@@ -92,6 +95,7 @@ def update_library_setting(key: str, value):
             {'_id': 'library_settings'},
             {'$set': {key: value}}
         )
+        invalidate_settings_cache()
         logger.info(f"✅ تم تحديث {key}: {value}")
         return True
     except Exception as e:
@@ -117,6 +121,7 @@ def toggle_platform(platform: str, enabled: bool):
             {'_id': 'library_settings'},
             {'$set': {f'allowed_platforms.{platform}': enabled}}
         )
+        invalidate_settings_cache()
         logger.info(f"✅ تم {'تفعيل' if enabled else 'إلغاء تفعيل'} منصة {platform}")
         return True
     except Exception as e:
@@ -178,6 +183,7 @@ def add_admin_approval_request(platform: str, requested_by: int, request_data: d
             {'_id': 'library_settings'},
             {'$push': {'admin_approvals.pending_requests': approval_request}}
         )
+        invalidate_settings_cache()
         logger.info(f"✅ تم إضافة طلب موافقة للمنصة {platform}")
         return approval_request['id']
     except Exception as e:
@@ -222,6 +228,7 @@ def approve_platform_request(request_id: str, approved_by: int):
                 '$push': {'admin_approvals.approved_platforms': request}
             }
         )
+        invalidate_settings_cache()
 
         # تفعيل المنصة
         toggle_platform(platform, True)
@@ -262,6 +269,7 @@ def deny_platform_request(request_id: str, denied_by: int, reason: str = ""):
                 '$push': {'admin_approvals.denied_platforms': request}
             }
         )
+        invalidate_settings_cache()
 
         logger.info(f"❌ تم رفض منصة {platform} بواسطة المدير {denied_by}")
         return True
@@ -277,6 +285,7 @@ def update_library_status(library_name: str, status_data: dict):
             {'_id': 'library_settings'},
             {'$set': {f'library_status.{library_name}': status_data}}
         )
+        invalidate_settings_cache()
         logger.info(f"✅ تم تحديث حالة مكتبة {library_name}")
         return True
     except Exception as e:
@@ -300,51 +309,91 @@ def get_library_status(library_name: str = None):
         return {}
 
 
-def record_download_attempt(success: bool, speed: float = 0):
-    """تسجيل محاولة تحميل لتتبع الإحصائيات"""
-    try:
-        db.settings.update_one(
-            {'_id': 'library_settings'},
-            {
-                '$inc': {
-                    'performance_metrics.total_downloads': 1,
-                    'performance_metrics.successful_downloads': 1 if success else 0,
-                    'performance_metrics.failed_downloads': 0 if success else 1
-                },
-                '$set': {
-                    'performance_metrics.last_download': datetime.now()
-                }
-            }
-        )
+# ========== عدادات الأداء الموزعة (Sharded Counters) ==========
+# كل تحميل كان يعدّل مستند library_settings نفسه، فيصبح نقطة تنافس على
+# الكتابة مع التحميلات المتزامنة. العدادات الآن موزعة على PERFORMANCE_SHARDS
+# مستند في مجموعة metrics_shards، كل كتابة تختار مستنداً عشوائياً، والقراءة
+# تجمعها بـ $group. متوسط السرعة = مجموع السرعات / عدد القياسات.
 
-        # تحديث متوسط السرعة (إذا تم توفير سرعة)
-        if speed > 0:
-            settings = get_library_settings()
-            current_avg = settings.get('performance_metrics', {}).get('avg_download_speed', 0)
-            total_downloads = settings.get('performance_metrics', {}).get('total_downloads', 1)
+PERFORMANCE_COUNTER = 'library_performance'
+PERFORMANCE_SHARDS = int(os.getenv("PERFORMANCE_SHARDS", "8"))
 
-            # حساب المتوسط الجديد
-            new_avg = (current_avg * (total_downloads - 1) + speed) / total_downloads
 
-            db.settings.update_one(
-                {'_id': 'library_settings'},
-                {'$set': {'performance_metrics.avg_download_speed': new_avg}}
-            )
+def _performance_shard_id(shard: int) -> str:
+    """معرف مستند العداد الجزئي"""
+    return f"{PERFORMANCE_COUNTER}:{shard}"
 
-        return True
+
+def record_download_attempt(success: bool, speed: float = 0):
+    """تسجيل محاولة تحميل لتتبع الإحصائيات (كتابة مؤجلة على عداد جزئي عشوائي)"""
+    try:
+        shard = random.randrange(PERFORMANCE_SHARDS)
+        inc = {
+            'total_downloads': 1,
+            'successful_downloads': 1 if success else 0,
+            'failed_downloads': 0 if success else 1
+        }
+        if speed > 0:
+            inc['speed_sum'] = speed
+            inc['speed_samples'] = 1
+
+        return enqueue_write('metrics_shards', UpdateOne(
+            {'_id': _performance_shard_id(shard)},
+            {
+                '$inc': inc,
+                '$max': {'last_download': datetime.now()},
+                '$setOnInsert': {'counter': PERFORMANCE_COUNTER, 'shard': shard}
+            },
+            upsert=True
+        ))
     except Exception as e:
         logger.error(f"❌ فشل تسجيل محاولة التحميل: {e}")
         return False
 
 
 def get_performance_metrics():
-    """جلب إحصائيات الأداء"""
+    """جلب إحصائيات الأداء (مجموع العدادات الجزئية)"""
     try:
-        settings = get_library_settings()
-        if not settings:
-            return {}
+        metrics = {
+            'total_downloads': 0,
+            'successful_downloads': 0,
+            'failed_downloads': 0,
+            'avg_download_speed': 0
+        }
+
+        totals = list(db.metrics_shards.aggregate([
+            {'$match': {'counter': PERFORMANCE_COUNTER}},
+            {'$group': {
+                '_id': None,
+                'total_downloads': {'$sum': '$total_downloads'},
+                'successful_downloads': {'$sum': '$successful_downloads'},
+                'failed_downloads': {'$sum': '$failed_downloads'},
+                'speed_sum': {'$sum': '$speed_sum'},
+                'speed_samples': {'$sum': '$speed_samples'},
+                'last_download': {'$max': '$last_download'}
+            }}
+        ]))
+
+        if totals:
+            t = totals[0]
+            metrics['total_downloads'] = t['total_downloads']
+            metrics['successful_downloads'] = t['successful_downloads']
+            metrics['failed_downloads'] = t['failed_downloads']
+            if t['speed_samples']:
+                metrics['avg_download_speed'] = t['speed_sum'] / t['speed_samples']
+            if t.get('last_download'):
+                metrics['last_download'] = t['last_download']
+
+        # تاريخ آخر إعادة تعيين يبقى في مستند library_settings
+        settings = db.settings.find_one(
+            {'_id': 'library_settings'},
+            {'performance_metrics.last_reset': 1}
+        ) or {}
+        last_reset = settings.get('performance_metrics', {}).get('last_reset')
+        if last_reset:
+            metrics['last_reset'] = last_reset
 
-        return settings.get('performance_metrics', {})
+        return metrics
     except Exception as e:
         logger.error(f"❌ فشل جلب إحصائيات الأداء: {e}")
         return {}
@@ -353,18 +402,15 @@ def get_performance_metrics():
 def reset_performance_metrics():
     """إعادة تعيين إحصائيات الأداء"""
     try:
+        # إرسال الكتابات المعلقة أولاً حتى لا تظهر بعد التصفير
+        flush_telemetry()
+
+        db.metrics_shards.delete_many({'counter': PERFORMANCE_COUNTER})
         db.settings.update_one(
             {'_id': 'library_settings'},
-            {
-                '$set': {
-                    'performance_metrics.total_downloads': 0,
-                    'performance_metrics.successful_downloads': 0,
-                    'performance_metrics.failed_downloads': 0,
-                    'performance_metrics.avg_download_speed': 0,
-                    'performance_metrics.last_reset': datetime.now()
-                }
-            }
+            {'$set': {'performance_metrics': {'last_reset': datetime.now()}}}
         )
+        invalidate_settings_cache()
         logger.info("✅ تم إعادة تعيين إحصائيات الأداء")
         return True
     except Exception as e:
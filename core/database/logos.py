@@ -1,5 +1,6 @@
 from datetime import datetime
 from .base import db
+from .settings_cache import get_cached_settings, invalidate_settings_cache
 from config.logger import get_logger
 
 # إنشاء logger instance
@@ -15,6 +16,7 @@ def set_logo_status(enabled: bool):
             {'$set': {'enabled': enabled, 'updated_at': datetime.now()}},
             upsert=True
         )
+        invalidate_settings_cache()
         logger.info(f"✅ تم {'تفعيل' if enabled else 'إيقاف'} اللوجو")
         return True
     except Exception as e:
@@ -25,7 +27,7 @@ def set_logo_status(enabled: bool):
 def is_logo_enabled() -> bool:
     """التحقق من حالة اللوجو"""
     try:
-        settings = db.settings.find_one({'_id': 'logo_settings'})
+        settings = get_cached_settings('logo_settings')
         if settings:
             return settings.get('enabled', True)
         return True  # افتراضياً مفعّل
@@ -54,6 +56,7 @@ def set_logo_animation(animation_type: str):
             },
             upsert=True
         )
+        invalidate_settings_cache()
 
         logger.info(f"✅ تم تعيين حركة اللوجو إلى: {animation_type}")
         return True
@@ -65,7 +68,7 @@ def set_logo_animation(animation_type: str):
 def get_logo_animation() -> str:
     """جلب نوع حركة اللوجو الحالية"""
     try:
-        settings = db.settings.find_one({'_id': 'logo_settings'})
+        settings = get_cached_settings('logo_settings')
         if settings and 'animation_type' in settings:
             return settings['animation_type']
         return 'static'  # افتراضي
@@ -104,6 +107,7 @@ def set_logo_position(position: str):
             },
             upsert=True
         )
+        invalidate_settings_cache()
 
         logger.info(f"✅ تم تعيين موضع اللوجو إلى: {position}")
         return True
@@ -115,7 +119,7 @@ def set_logo_position(position: str):
 def get_logo_position() -> str:
     """جلب موضع اللوجو الحالي"""
     try:
-        settings = db.settings.find_one({'_id': 'logo_settings'})
+        settings = get_cached_settings('logo_settings')
         if settings and 'position' in settings:
             return settings['position']
         return 'top_right'  # افتراضي
@@ -147,6 +151,7 @@ def set_logo_size(size: str):
             },
             upsert=True
         )
+        invalidate_settings_cache()
 
         logger.info(f"✅ تم تعيين حجم اللوجو إلى: {size} ({valid_sizes[size]}px)")
         return True
@@ -158,7 +163,7 @@ def set_logo_size(size: str):
 def get_logo_size() -> tuple:
     """جلب حجم اللوجو الحالي (اسم، بكسل)"""
     try:
-        settings = db.settings.find_one({'_id': 'logo_settings'})
+        settings = get_cached_settings('logo_settings')
         if settings and 'size' in settings:
             return settings['size'], settings.get('size_pixels', 150)
         return 'medium', 150  # افتراضي
@@ -187,6 +192,7 @@ def set_logo_opacity(opacity: int):
             },
             upsert=True
         )
+        invalidate_settings_cache()
 
         logger.info(f"✅ تم تعيين شفافية اللوجو إلى: {opacity}%")
         return True
@@ -198,7 +204,7 @@ def set_logo_opacity(opacity: int):
 def get_logo_opacity() -> tuple:
     """جلب شفافية اللوجو الحالية (نسبة، عشري)"""
     try:
-        settings = db.settings.find_one({'_id': 'logo_settings'})
+        settings = get_cached_settings('logo_settings')
         if settings and 'opacity' in settings:
             return settings['opacity'], settings.get('opacity_decimal', 0.7)
         return 70, 0.7  # افتراضي
@@ -244,6 +250,22 @@ def get_all_logo_settings() -> dict:
 # إعدادات الفئة المستهدفة للوجو
 # ====================================
 
+# أسماء الفئات المستهدفة (المفتاح = القيمة المحفوظة في logo_settings.target)
+LOGO_TARGET_NAMES = {
+    'free_with_points': 'العاديون - يظهر للجميع (لا يهم النقاط)',
+    'free_no_points': 'العاديون - فقط من ليس لديهم نقاط',
+    'free_all': 'جميع العاديون',
+    'vip_with_points': 'VIP - يظهر للجميع (لا يهم النقاط)',
+    'vip_no_points': 'VIP - فقط من ليس لديهم نقاط',
+    'vip_all': 'جميع VIP',
+    'everyone_with_points': 'الجميع - يظهر للجميع (لا يهم النقاط)',
+    'everyone_no_points': 'الجميع - فقط من ليس لديهم نقاط',
+    'everyone_all': 'الجميع',
+    'no_credits_only': 'المستخدمون بدون نقاط فقط',
+    'everyone_except_no_credits': 'الجميع عدا من لديهم نقاط'
+}
+
+
 def set_logo_target(target: str):
     """
     تعيين الفئة المستهدفة لتطبيق اللوجو
@@ -276,21 +298,9 @@ def set_logo_target(target: str):
             {'$set': {'target': target}},
             upsert=True
         )
+        invalidate_settings_cache()
 
-        target_names = {
-            'free_with_points': 'العاديون - يظهر للجميع (لا يهم النقاط)',
-            'free_no_points': 'العاديون - فقط من ليس لديهم نقاط',
-            'free_all': 'جميع العاديون',
-            'vip_with_points': 'VIP - يظهر للجميع (لا يهم النقاط)',
-            'vip_no_points': 'VIP - فقط من ليس لديهم نقاط',
-            'vip_all': 'جميع VIP',
-            'everyone_with_points': 'الجميع - يظهر للجميع (لا يهم النقاط)',
-            'everyone_no_points': 'الجميع - فقط من ليس لديهم نقاط',
-            'everyone_all': 'الجميع',
-            'no_credits_only': 'المستخدمون بدون نقاط فقط',
-            'everyone_except_no_credits': 'الجميع عدا من لديهم نقاط'
-        }
-        logger.info(f"✅ تم تعيين الفئة المستهدفة للوجو إلى: {target_names[target]}")
+        logger.info(f"✅ تم تعيين الفئة المستهدفة للوجو إلى: {LOGO_TARGET_NAMES[target]}")
     except Exception as e:
         logger.error(f"❌ فشل تعيين الفئة المستهدفة: {e}")
 
@@ -303,35 +313,14 @@ def get_logo_target() -> tuple:
         tuple: (target_id, target_name_ar)
     """
     try:
-        settings = db.settings.find_one({'_id': 'logo_settings'})
+        settings = get_cached_settings('logo_settings')
         target = settings.get('target', 'free_all') if settings else 'free_all'
 
         # التحقق من صحة الخيار، إذا لم يكن صحيحاً استخدم القيمة الافتراضية
-        valid_targets = [
-            'free_with_points', 'free_no_points', 'free_all',
-            'vip_with_points', 'vip_no_points', 'vip_all',
-            'everyone_with_points', 'everyone_no_points', 'everyone_all',
-            'no_credits_only', 'everyone_except_no_credits'
-        ]
-
-        if target not in valid_targets:
+        if target not in LOGO_TARGET_NAMES:
             target = 'free_all'
 
-        target_names = {
-            'free_with_points': 'العاديون - يظهر للجميع (لا يهم النقاط)',
-            'free_no_points': 'العاديون - فقط من ليس لديهم نقاط',
-            'free_all': 'جميع العاديون',
-            'vip_with_points': 'VIP - يظهر للجميع (لا يهم النقاط)',
-            'vip_no_points': 'VIP - فقط من ليس لديهم نقاط',
-            'vip_all': 'جميع VIP',
-            'everyone_with_points': 'الجميع - يظهر للجميع (لا يهم النقاط)',
-            'everyone_no_points': 'الجميع - فقط من ليس لديهم نقاط',
-            'everyone_all': 'الجميع',
-            'no_credits_only': 'المستخدمون بدون نقاط فقط',
-            'everyone_except_no_credits': 'الجميع عدا من لديهم نقاط'
-        }
-
-        return target, target_names.get(target, 'جميع العاديون')
+        return target, LOGO_TARGET_NAMES.get(target, 'جميع العاديون')
     except Exception as e:
         logger.error(f"❌ فشل جلب الفئة المستهدفة: {e}")
         return 'free_only', 'المستخدمون العاديون فقط'
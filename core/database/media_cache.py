@@ -0,0 +1,136 @@
+"""
+Media Cache - الطبقة الدائمة لذاكرة الاستخراج وذاكرة التسليم
+
+نتائج extract_info (بعد تقليصها) تُحفظ في مجموعة extraction_cache بمفتاح
+(الرابط الموحد + الخيارات المؤثرة) حتى تستفيد منها جميع العمليات وتبقى بعد
+إعادة التشغيل. expires_at يحدده المستدعي (مدة المنصة أو انتهاء الروابط
+الموقعة)، وفهرس TTL يحذف المستندات المنتهية.
+
+ذاكرة التسليم (delivery_cache) تحفظ file_id للملفات المرسلة حتى يُجاب الطلب
+المتكرر بإعادة إرسال نفس الملف بدون تحميل.
+
+الكتابة تمر عبر telemetry (write-behind) حتى لا ينتظر المستخدم MongoDB.
+"""
+
+from datetime import datetime
+
+from pymongo import UpdateOne, DeleteOne
+
+from .base import ensure_db_connection
+from .telemetry import enqueue_write
+from config.logger import get_logger
+
+# إنشاء logger instance
+logger = get_logger(__name__)
+
+EXTRACTION_CACHE_COLLECTION = 'extraction_cache'
+
+
+# ═══════════════════════════════════════════════════════════════
+#  Extraction Cache (persistent tier)
+# ═══════════════════════════════════════════════════════════════
+
+def get_cached_extraction(key: str):
+    """
+    جلب نتيجة استخراج محفوظة
+
+    Returns:
+        tuple: (info, expires_at) أو None إذا لم تكن موجودة أو انتهت
+    """
+    if not ensure_db_connection():
+        return None
+
+    from .base import db
+
+    try:
+        doc = db[EXTRACTION_CACHE_COLLECTION].find_one(
+            # فهرس TTL يحذف كل دقيقة تقريباً - الشرط يمنع قراءة مستند منتهٍ لم يُحذف بعد
+            {'_id': key, 'expires_at': {'$gt': datetime.now()}},
+            {'_id': 0, 'info': 1, 'expires_at': 1}
+        )
+    except Exception as e:
+        logger.error(f"❌ فشل قراءة ذاكرة الاستخراج: {e}")
+        return None
+
+    if not doc:
+        return None
+    return doc['info'], doc['expires_at']
+
+
+def store_cached_extraction(key: str, info: dict, platform: str, expires_at: datetime) -> bool:
+    """حفظ نتيجة استخراج (مؤجل عبر telemetry)"""
+    return enqueue_write(EXTRACTION_CACHE_COLLECTION, UpdateOne(
+        {'_id': key},
+        {'$set': {
+            'info': info,
+            'platform': platform,
+            'created_at': datetime.now(),
+            'expires_at': expires_at
+        }},
+        upsert=True
+    ), key=key)
+
+
+def clear_cached_extractions(platform: str = None) -> int:
+    """
+    حذف النتائج المحفوظة (كلها أو لمنصة واحدة) - مثلاً بعد تحديث الكوكيز
+
+    Returns:
+        int: عدد المستندات المحذوفة
+    """
+    if not ensure_db_connection():
+        return 0
+
+    from .base import db
+
+    try:
+        query = {'platform': platform} if platform else {}
+        return db[EXTRACTION_CACHE_COLLECTION].delete_many(query).deleted_count
+    except Exception as e:
+        logger.error(f"❌ فشل حذف ذاكرة الاستخراج: {e}")
+        return 0
+
+
+# ═══════════════════════════════════════════════════════════════
+#  Delivery Cache (Telegram file_id)
+#  مستند لكل (وسائط × جودة × صوت/فيديو × نسخة اللوجو): file_id للملف المرسل
+#  معرّفات file_id دائمة للبوت نفسه، فلا تحتاج مدة صلاحية
+# ═══════════════════════════════════════════════════════════════
+
+DELIVERY_CACHE_COLLECTION = 'delivery_cache'
+
+
+def get_cached_delivery(key: str):
+    """
+    جلب الملف المرسل سابقاً
+
+    Returns:
+        dict: {'file_id', 'type', 'file_size'} أو None
+    """
+    if not ensure_db_connection():
+        return None
+
+    from .base import db
+
+    try:
+        return db[DELIVERY_CACHE_COLLECTION].find_one(
+            {'_id': key},
+            {'_id': 0, 'file_id': 1, 'type': 1, 'file_size': 1}
+        )
+    except Exception as e:
+        logger.error(f"❌ فشل قراءة ذاكرة التسليم: {e}")
+        return None
+
+
+def store_cached_delivery(key: str, entry: dict) -> bool:
+    """حفظ file_id للملف المرسل (مؤجل عبر telemetry)"""
+    return enqueue_write(DELIVERY_CACHE_COLLECTION, UpdateOne(
+        {'_id': key},
+        {'$set': {**entry, 'updated_at': datetime.now()}},
+        upsert=True
+    ), key=key)
+
+
+def delete_cached_delivery(key: str) -> bool:
+    """حذف مدخل لم يعد file_id الخاص به صالحاً"""
+    return enqueue_write(DELIVERY_CACHE_COLLECTION, DeleteOne({'_id': key}), key=key)
@@ -0,0 +1,473 @@
+"""
+Schema Migrations - إنشاء الفهارس وترحيل مخطط قاعدة البيانات
+
+كل ترحيل له رقم إصدار ثابت ويُنفذ مرة واحدة فقط. الإصدار المطبق يُحفظ في
+مستند {'_id': 'schema_version'} داخل مجموعة settings، وكل خطوة مكتوبة بحيث
+يمكن إعادة تشغيلها بأمان (create_index لا يفعل شيئاً إذا كان الفهرس موجوداً).
+
+لإضافة ترحيل جديد: أضف دالة _migrate_vN ثم أضفها إلى MIGRATIONS بالترتيب.
+"""
+
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+
+from .base import get_db
+from config.logger import get_logger
+
+# إنشاء logger instance
+logger = get_logger(__name__)
+
+SCHEMA_VERSION_ID = 'schema_version'
+
+
+# ==================== الترحيلات ====================
+
+def _dedupe_users(users) -> int:
+    """
+    حذف مستندات المستخدم المكررة (نفس user_id) مع إبقاء الأقدم
+
+    add_user القديم كان upsert بدون فهرس، فضغطات /start المتزامنة قد تنشئ
+    مستندين لنفس المستخدم، وعندها يفشل إنشاء الفهرس الفريد في كل تشغيل
+
+    Returns:
+        int: عدد المستندات المحذوفة
+    """
+    duplicates = users.aggregate([
+        {'$sort': {'_id': ASCENDING}},
+        {'$group': {'_id': '$user_id', 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}}
+    ], allowDiskUse=True)
+
+    removed = 0
+    for group in duplicates:
+        # ObjectId مرتب حسب وقت الإنشاء - الأول هو الأقدم
+        result = users.delete_many({'_id': {'$in': group['ids'][1:]}})
+        removed += result.deleted_count
+        logger.warning(f"⚠️ تم حذف {result.deleted_count} مستند مكرر للمستخدم {group['_id']}")
+
+    return removed
+
+
+def _migrate_v1(database):
+    """الفهارس الأساسية لمجموعتي users و downloads"""
+    users = database.users
+    downloads = database.downloads
+
+    # إزالة المكررات قبل الفهرس الفريد
+    removed = _dedupe_users(users)
+    if removed:
+        logger.info(f"🧹 تم حذف {removed} مستند مستخدم مكرر قبل إنشاء فهرس user_id")
+
+    # البحث عن المستخدم بالمعرف - أكثر استعلام في البوت
+    users.create_index([('user_id', ASCENDING)], unique=True, name='user_id_unique')
+
+    # البحث بكود الإحالة (فقط للمستخدمين الذين لديهم كود)
+    users.create_index(
+        [('referral_code', ASCENDING)],
+        unique=True,
+        partialFilterExpression={'referral_code': {'$type': 'string'}},
+        name='referral_code_unique'
+    )
+
+    # البحث باسم المستخدم من لوحة الأدمن
+    users.create_index([('username', ASCENDING)], name='username')
+
+    # عدّ المشتركين النشطين (subscription_end > now)
+    users.create_index([('subscription_end', ASCENDING)], name='subscription_end')
+
+    # سجل تحميلات المستخدم مرتباً بالأحدث
+    downloads.create_index(
+        [('user_id', ASCENDING), ('timestamp', DESCENDING)],
+        name='user_id_timestamp'
+    )
+
+    # إحصائيات التحميلات حسب نطاق التاريخ
+    downloads.create_index([('timestamp', DESCENDING)], name='timestamp')
+
+
+def _migrate_v2(database):
+    """تحويل مصفوفة daily_downloads إلى العداد اليومي daily_usage = {day, count}"""
+    if not database.users.count_documents({'daily_downloads': {'$exists': True}}, limit=1):
+        return
+
+    today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    today_key = today_start.strftime('%Y-%m-%d')
+
+    # تحديث بـ pipeline (MongoDB 4.2+): عدّ عناصر اليوم فقط ثم حذف المصفوفة
+    database.users.update_many(
+        {'daily_downloads': {'$exists': True}},
+        [
+            {'$set': {'daily_usage': {
+                'day': today_key,
+                'count': {'$size': {'$filter': {
+                    'input': {'$ifNull': ['$daily_downloads', []]},
+                    'cond': {'$gte': ['$$this.date', today_start]}
+                }}}
+            }}},
+            {'$unset': 'daily_downloads'}
+        ]
+    )
+
+
+def _migrate_v3(database):
+    """نقل عدادات performance_metrics من library_settings إلى العداد الجزئي 0"""
+    settings = database.settings.find_one({'_id': 'library_settings'}, {'performance_metrics': 1})
+    metrics = (settings or {}).get('performance_metrics', {})
+    total = metrics.get('total_downloads', 0)
+
+    if total:
+        # المتوسط القديم محسوب على كل التحميلات - نعتبره قياساً لكل تحميل
+        avg = metrics.get('avg_download_speed', 0)
+        database.metrics_shards.update_one(
+            {'_id': 'library_performance:0'},
+            {
+                '$inc': {
+                    'total_downloads': total,
+                    'successful_downloads': metrics.get('successful_downloads', 0),
+                    'failed_downloads': metrics.get('failed_downloads', 0),
+                    'speed_sum': avg * total if avg else 0,
+                    'speed_samples': total if avg else 0
+                },
+                '$setOnInsert': {'counter': 'library_performance', 'shard': 0}
+            },
+            upsert=True
+        )
+
+    database.settings.update_one(
+        {'_id': 'library_settings'},
+        {'$unset': {
+            'performance_metrics.total_downloads': '',
+            'performance_metrics.successful_downloads': '',
+            'performance_metrics.failed_downloads': '',
+            'performance_metrics.avg_download_speed': '',
+            'performance_metrics.last_download': ''
+        }}
+    )
+
+
+def _migrate_v4(database):
+    """حقل username_lower وفهرسه للبحث باسم المستخدم بدون حساسية لحالة الأحرف"""
+    legacy = {'username': {'$type': 'string'}, 'username_lower': {'$exists': False}}
+    if database.users.count_documents(legacy, limit=1):
+        database.users.update_many(
+            legacy,
+            [{'$set': {'username_lower': {'$toLower': {'$ltrim': {'input': '$username', 'chars': '@'}}}}}]
+        )
+
+    database.users.create_index(
+        [('username_lower', ASCENDING)],
+        partialFilterExpression={'username_lower': {'$type': 'string'}},
+        name='username_lower'
+    )
+
+
+def _migrate_v5(database):
+    """مجموعتا التجميع اليومي downloads_daily و downloads_daily_users + ملؤهما من السجل"""
+    database.downloads_daily.create_index([('day', ASCENDING)], name='day')
+    database.downloads_daily_users.create_index(
+        [('day', ASCENDING), ('count', DESCENDING)],
+        name='day_count'
+    )
+
+    if not database.downloads.count_documents({'timestamp': {'$exists': True}}, limit=1):
+        return
+
+    day = {'$dateToString': {'format': '%Y-%m-%d', 'date': '$timestamp'}}
+
+    database.downloads.aggregate([
+        {'$group': {
+            '_id': {
+                'day': day,
+                'platform': {'$ifNull': ['$platform', 'unknown']},
+                'mode': {'$ifNull': ['$mode', 'unknown']},
+                'status': {'$ifNull': ['$status', 'unknown']}
+            },
+            'count': {'$sum': 1},
+            'bytes': {'$sum': {'$ifNull': ['$file_size', 0]}}
+        }},
+        {'$project': {
+            '_id': {'$concat': ['$_id.day', '|', '$_id.platform', '|', '$_id.mode', '|', '$_id.status']},
+            'day': '$_id.day',
+            'platform': '$_id.platform',
+            'mode': '$_id.mode',
+            'status': '$_id.status',
+            'count': 1,
+            'bytes': 1
+        }},
+        {'$merge': {'into': 'downloads_daily', 'whenMatched': 'replace'}}
+    ])
+
+    database.downloads.aggregate([
+        {'$match': {'user_id': {'$ne': None}}},
+        {'$group': {'_id': {'day': day, 'user_id': '$user_id'}, 'count': {'$sum': 1}}},
+        {'$project': {
+            '_id': {'$concat': ['$_id.day', '|', {'$toString': '$_id.user_id'}]},
+            'day': '$_id.day',
+            'user_id': '$_id.user_id',
+            'count': 1
+        }},
+        {'$merge': {'into': 'downloads_daily_users', 'whenMatched': 'replace'}}
+    ])
+
+
+def _migrate_v6(database):
+    """تحويل سجل downloads إلى المخطط المختصر (u, p, m, s, ts ...) وفهارسه"""
+    def optional(field):
+        return {'$ifNull': [field, '$$REMOVE']}
+
+    legacy = {'timestamp': {'$exists': True}}
+    if database.downloads.count_documents(legacy, limit=1):
+        database.downloads.update_many(
+            legacy,
+            [
+                {'$set': {
+                    'u': '$user_id',
+                    'p': '$platform',
+                    'm': {'$switch': {
+                        'branches': [
+                            {'case': {'$eq': ['$mode', 'video']}, 'then': 'v'},
+                            {'case': {'$eq': ['$mode', 'audio']}, 'then': 'a'}
+                        ],
+                        'default': '$mode'
+                    }},
+                    's': {'$switch': {
+                        'branches': [
+                            {'case': {'$eq': ['$status', 'completed']}, 'then': 0},
+                            {'case': {'$eq': ['$status', 'canceled']}, 'then': 1},
+                            {'case': {'$eq': ['$status', 'failed']}, 'then': 2}
+                        ],
+                        'default': '$status'
+                    }},
+                    'q': optional('$quality'),
+                    'f': optional('$format'),
+                    'r': optional('$url'),
+                    'sz': {'$cond': [{'$gt': ['$file_size', 0]}, '$file_size', '$$REMOVE']},
+                    'e': {'$cond': [
+                        {'$eq': [{'$type': '$error_msg'}, 'string']},
+                        {'$substrCP': ['$error_msg', 0, 300]},
+                        '$$REMOVE'
+                    ]},
+                    'ts': '$timestamp'
+                }},
+                {'$unset': [
+                    'user_id', 'platform', 'mode', 'quality', 'format', 'status',
+                    'url', 'file_size', 'error_msg', 'timestamp', 'date'
+                ]}
+            ]
+        )
+
+    for name in ('user_id_timestamp', 'timestamp'):
+        if name in database.downloads.index_information():
+            database.downloads.drop_index(name)
+
+    database.downloads.create_index([('u', ASCENDING), ('ts', DESCENDING)], name='u_ts')
+
+
+def _migrate_v7(database):
+    """ذاكرة الاستخراج الدائمة: فهرس TTL على expires_at"""
+    database.extraction_cache.create_index(
+        [('expires_at', ASCENDING)],
+        expireAfterSeconds=0,
+        name='expires_at_ttl'
+    )
+    database.extraction_cache.create_index([('platform', ASCENDING)], name='platform')
+
+
+# (version, description, function)
+MIGRATIONS = [
+    (1, 'initial indexes: users + downloads', _migrate_v1),
+    (2, 'users.daily_downloads array -> daily_usage counter', _migrate_v2),
+    (3, 'library_settings.performance_metrics -> metrics_shards', _migrate_v3),
+    (4, 'users.username_lower + index', _migrate_v4),
+    (5, 'downloads_daily rollup collections', _migrate_v5),
+    (6, 'downloads compact schema', _migrate_v6),
+    (7, 'extraction_cache TTL index', _migrate_v7),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+# ==================== تشغيل الترحيلات ====================
+
+def get_schema_version(database=None) -> int:
+    """جلب إصدار المخطط المطبق حالياً (0 إذا لم يُطبق أي ترحيل)"""
+    database = database if database is not None else get_db()
+    if database is None:
+        return 0
+    try:
+        doc = database.settings.find_one({'_id': SCHEMA_VERSION_ID}, {'version': 1})
+        return doc.get('version', 0) if doc else 0
+    except Exception as e:
+        logger.error(f"❌ فشل جلب إصدار المخطط: {e}")
+        return 0
+
+
+def run_migrations(database=None) -> bool:
+    """
+    تطبيق جميع الترحيلات المعلقة بالترتيب
+
+    Returns:
+        bool: True إذا أصبح المخطط محدثاً، False إذا فشل ترحيل ما
+              (لا يُسجل إصدار الترحيل الفاشل، فيُعاد تشغيله عند التشغيل التالي)
+    """
+    database = database if database is not None else get_db()
+    if database is None:
+        logger.error("❌ [migrations] قاعدة البيانات غير متصلة")
+        return False
+
+    current = get_schema_version(database)
+    pending = [m for m in MIGRATIONS if m[0] > current]
+
+    if not pending:
+        logger.info(f"✅ [migrations] المخطط محدث (الإصدار {current})")
+        return True
+
+    for version, description, migrate in pending:
+        try:
+            logger.info(f"🔄 [migrations] تطبيق الترحيل v{version}: {description}")
+            migrate(database)
+        except PyMongoError as e:
+            logger.error(f"❌ [migrations] فشل الترحيل v{version}: {e}")
+            return False
+
+        database.settings.update_one(
+            {'_id': SCHEMA_VERSION_ID},
+            {
+                '$set': {'version': version, 'updated_at': datetime.now()},
+                '$push': {'history': {
+                    'version': version,
+                    'description': description,
+                    'applied_at': datetime.now()
+                }}
+            },
+            upsert=True
+        )
+        logger.info(f"✅ [migrations] تم تطبيق الترحيل v{version}")
+
+    return True
+
+
+# ==================== سياسة الاحتفاظ بالسجل الخام ====================
+
+def apply_retention_policy(database=None) -> bool:
+    """
+    مطابقة فهرس TTL على downloads.ts مع DOWNLOADS_RETENTION_DAYS
+
+    يُستدعى عند كل تشغيل (وليس كترحيل) حتى يُطبق تغيير المدة بدون ترحيل جديد.
+    """
+    from .downloads import DOWNLOADS_RETENTION_DAYS
+
+    database = database if database is not None else get_db()
+    if database is None:
+        return False
+
+    try:
+        indexes = database.downloads.index_information()
+        current = indexes.get('ts_ttl', {}).get('expireAfterSeconds')
+
+        if DOWNLOADS_RETENTION_DAYS <= 0:
+            if 'ts_ttl' in indexes:
+                database.downloads.drop_index('ts_ttl')
+                logger.info("✅ [retention] تم إيقاف انتهاء سجل التحميلات")
+            return True
+
+        seconds = DOWNLOADS_RETENTION_DAYS * 86400
+        if current is None:
+            database.downloads.create_index([('ts', ASCENDING)], expireAfterSeconds=seconds, name='ts_ttl')
+        elif current != seconds:
+            database.command('collMod', 'downloads', index={'name': 'ts_ttl', 'expireAfterSeconds': seconds})
+        else:
+            return True
+
+        logger.info(f"✅ [retention] سجل التحميلات ينتهي بعد {DOWNLOADS_RETENTION_DAYS} يوم")
+        return True
+    except PyMongoError as e:
+        logger.error(f"❌ [retention] فشل تطبيق سياسة الاحتفاظ: {e}")
+        return False
+
+
+# ==================== إحصائيات الفهارس والاستعلامات البطيئة ====================
+
+def get_index_usage_stats(collections=('users', 'downloads', 'settings', 'error_reports')) -> dict:
+    """
+    إحصائيات استخدام الفهارس عبر $indexStats
+
+    Returns:
+        dict: {collection: [{'name', 'key', 'ops', 'since'}, ...]}
+    """
+    stats = {}
+    db = get_db()
+    if db is None:
+        return stats
+
+    for name in collections:
+        try:
+            stats[name] = [
+                {
+                    'name': s['name'],
+                    'key': dict(s.get('key', {})),
+                    'ops': s.get('accesses', {}).get('ops', 0),
+                    'since': s.get('accesses', {}).get('since')
+                }
+                for s in db[name].aggregate([{'$indexStats': {}}])
+            ]
+        except Exception as e:
+            logger.error(f"❌ فشل جلب إحصائيات فهارس {name}: {e}")
+            stats[name] = []
+
+    return stats
+
+
+def set_slow_query_profiling(enabled: bool, slow_ms: int = 100) -> bool:
+    """تفعيل/إيقاف profiler الخاص بـ MongoDB للاستعلامات الأبطأ من slow_ms"""
+    db = get_db()
+    if db is None:
+        return False
+    try:
+        db.command('profile', 1 if enabled else 0, slowms=slow_ms)
+        logger.info(f"✅ profiler {'مفعل' if enabled else 'معطل'} (slowms={slow_ms})")
+        return True
+    except Exception as e:
+        # بعض الخدمات المستضافة (مثل Atlas M0) لا تسمح بتغيير مستوى profiler
+        logger.error(f"❌ فشل تغيير إعدادات profiler: {e}")
+        return False
+
+
+def get_slow_query_stats(limit: int = 5) -> dict:
+    """
+    أبطأ الاستعلامات المسجلة في system.profile
+
+    Returns:
+        dict: {'level', 'slow_ms', 'queries': [{'ns', 'op', 'millis', 'plan', 'ts'}]}
+    """
+    result = {'level': None, 'slow_ms': None, 'queries': []}
+    db = get_db()
+    if db is None:
+        return result
+
+    try:
+        status = db.command('profile', -1)
+        result['level'] = status.get('was')
+        result['slow_ms'] = status.get('slowms')
+
+        if result['level']:
+            cursor = db.system.profile.find(
+                {},
+                {'ns': 1, 'op': 1, 'millis': 1, 'planSummary': 1, 'ts': 1}
+            ).sort('millis', DESCENDING).limit(limit)
+
+            result['queries'] = [
+                {
+                    'ns': q.get('ns'),
+                    'op': q.get('op'),
+                    'millis': q.get('millis', 0),
+                    'plan': q.get('planSummary', ''),
+                    'ts': q.get('ts')
+                }
+                for q in cursor
+            ]
+    except Exception as e:
+        logger.error(f"❌ فشل جلب الاستعلامات البطيئة: {e}")
+
+    return result
@@ -1,7 +1,12 @@
-import random
+import re
 import traceback
 from datetime import datetime
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, ConfigurationError, OperationFailure
+
 from .base import users_collection, settings_collection
+from .settings_cache import get_cached_settings, invalidate_settings_cache
 from config.logger import get_logger
 
 # إنشاء logger instance
@@ -10,9 +15,35 @@ logger = get_logger(__name__)
 
 # ==================== نظام الإحالة ====================
 
+def referral_code_for(user_id: int) -> str:
+    """
+    كود الإحالة المشتق من معرف المستخدم (REF_<user_id>)
+
+    معرف تليجرام فريد، فالكود فريد بدون البحث عن تكرار. الفهرس الفريد
+    referral_code_unique يبقى الضامن النهائي، والأكواد القديمة بصيغة
+    REF_<user_id>_<رقم> تبقى صالحة.
+    """
+    return f"REF_{user_id}"
+
+
+# REF_<user_id> أو الصيغة القديمة REF_<user_id>_<رقم>
+_REFERRAL_CODE_RE = re.compile(r'^REF_(\d+)(?:_\d+)?$')
+
+
+def parse_referral_code(code: str):
+    """
+    استخراج معرف المحيل من كود الإحالة بدون استعلام
+
+    Returns:
+        int: معرف المحيل أو None إذا كانت صيغة الكود غير صالحة
+    """
+    match = _REFERRAL_CODE_RE.match(code or '')
+    return int(match.group(1)) if match else None
+
+
 def generate_referral_code(user_id: int) -> str:
     """
-    توليد كود إحالة فريد للمستخدم
+    جلب أو إنشاء كود إحالة المستخدم (عملية واحدة على قاعدة البيانات)
 
     Args:
         user_id: معرف المستخدم في تليجرام
@@ -21,10 +52,10 @@ def generate_referral_code(user_id: int) -> str:
         str: كود الإحالة أو None في حالة الخطأ
     """
     function_name = "generate_referral_code"
-    logger.info(f"🔵 [{function_name}] بدء التنفيذ للمستخدم: {user_id}")
+    logger.debug(f"🔵 [{function_name}] بدء التنفيذ للمستخدم: {user_id}")
 
     try:
-        # ⭐ التحقق من الاتصال بقاعدة البيانات وإعادة الاتصال إن لزم الأمر
+        # ⭐ التحقق من الاتصال بقاعدة البيانات
         from .base import ensure_db_connection, users_collection as uc
         if not ensure_db_connection():
             logger.error(f"❌ [{function_name}] فشل الاتصال بقاعدة البيانات للمستخدم {user_id}")
@@ -35,177 +66,235 @@ def generate_referral_code(user_id: int) -> str:
             logger.error(f"❌ [{function_name}] خطأ: user_id غير صالح: {user_id}")
             return None
 
-        logger.debug(f"🔍 [{function_name}] البحث عن المستخدم {user_id} في قاعدة البيانات...")
-
-        # التحقق إذا كان المستخدم لديه كود بالفعل
-        user = uc.find_one({'user_id': user_id})
-
-        if user and user.get('referral_code'):
-            existing_code = user['referral_code']
-            logger.info(f"✅ [{function_name}] المستخدم {user_id} لديه كود موجود: {existing_code}")
-            return existing_code
-
-        logger.debug(f"🔄 [{function_name}] توليد كود جديد للمستخدم {user_id}...")
-
-        # توليد كود جديد بصيغة REF_XXXXX
-        max_attempts = 10
-        attempt = 0
-        code = None
-
-        while attempt < max_attempts:
-            attempt += 1
-            code = f"REF_{user_id}_{random.randint(1000, 9999)}"
-
-            logger.debug(f"🎲 [{function_name}] محاولة {attempt}/{max_attempts}: توليد الكود {code}")
-
-            # التأكد من عدم تكرار الكود
-            existing = uc.find_one({'referral_code': code})
-            if not existing:
-                logger.debug(f"✅ [{function_name}] الكود {code} فريد، متابعة الحفظ...")
-                break
-            else:
-                logger.warning(f"⚠️ [{function_name}] الكود {code} مكرر، إعادة المحاولة...")
-                code = None
-
-        if not code:
-            logger.error(f"❌ [{function_name}] فشل توليد كود فريد بعد {max_attempts} محاولة للمستخدم {user_id}")
-            return None
-
-        logger.debug(f"💾 [{function_name}] حفظ الكود {code} في قاعدة البيانات للمستخدم {user_id}...")
-
-        # حفظ الكود في قاعدة البيانات
-        result = uc.update_one(
+        # pipeline update: الكود والعدادات الموجودة تبقى كما هي ($ifNull)،
+        # والكود يُنشأ فقط إذا لم يكن موجوداً - بدون find_one مسبق
+        user = uc.find_one_and_update(
             {'user_id': user_id},
-            {
+            [{
                 '$set': {
-                    'referral_code': code,
-                    'referral_count': 0,
-                    'no_logo_credits': 0
+                    'referral_code': {'$ifNull': ['$referral_code', referral_code_for(user_id)]},
+                    'referral_count': {'$ifNull': ['$referral_count', 0]},
+                    'no_logo_credits': {'$ifNull': ['$no_logo_credits', 0]}
                 }
-            },
-            upsert=True
+            }],
+            projection={'_id': 0, 'referral_code': 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
         )
 
-        if result.acknowledged:
-            logger.info(f"✅ [{function_name}] نجح! تم توليد وحفظ كود إحالة للمستخدم {user_id}: {code}")
-            return code
-        else:
+        code = user.get('referral_code') if user else None
+        if not code:
             logger.error(f"❌ [{function_name}] فشل حفظ الكود في قاعدة البيانات للمستخدم {user_id}")
             return None
 
+        logger.debug(f"✅ [{function_name}] كود إحالة المستخدم {user_id}: {code}")
+        return code
+
+    except DuplicateKeyError as e:
+        # الكود مستخدم من مستند آخر - الفهرس الفريد منع التكرار
+        logger.error(f"❌ [{function_name}] الكود {referral_code_for(user_id)} مكرر للمستخدم {user_id}: {e}")
+        return None
+
     except Exception as e:
         logger.error(f"❌ [{function_name}] خطأ حرج للمستخدم {user_id}: {type(e).__name__}: {str(e)}")
         logger.error(f"📍 [{function_name}] Stack trace:\n{traceback.format_exc()}")
         return None
 
 
-async def track_referral(referrer_code: str, new_user_id: int, bot=None) -> bool:
-    """
-    تسجيل إحالة جديدة مع إرسال إشعارات
+# None = لم يُفحص بعد؛ False = الخادم لا يدعم المعاملات (standalone أو mongomock)
+_transactions_supported = None
 
-    Args:
-        referrer_code: كود الإحالة الخاص بالمحيل
-        new_user_id: معرف المستخدم الجديد
-        bot: كائن البوت لإرسال الإشعارات (اختياري)
 
-    Returns:
-        bool: True في حالة النجاح، False في حالة الفشل
+def _mark_referred(uc, new_user_id: int, referrer_id: int, session=None):
+    """تسجيل المحيل للمستخدم الجديد فقط إذا لم يُحَل مسبقاً (عند الضغط المتزامن تنجح عملية واحدة)"""
+    return uc.find_one_and_update(
+        {'user_id': new_user_id, 'referred_by': None},
+        {
+            '$set': {
+                'referred_by': referrer_id,
+                'referral_date': datetime.now()
+            }
+        },
+        projection={'_id': 0, 'full_name': 1},
+        session=session
+    )
+
+
+def _credit_referrer(uc, referrer_id: int, referrer_code: str, session=None):
+    """مكافأة المحيل - الشرط على الكود يتحقق من صحته في نفس العملية"""
+    return uc.find_one_and_update(
+        {'user_id': referrer_id, 'referral_code': referrer_code},
+        {
+            '$inc': {
+                'referral_count': 1,
+                'no_logo_credits': 10  # مكافأة 10 فيديوهات بدون لوجو
+            }
+        },
+        projection={'_id': 0, 'full_name': 1, 'no_logo_credits': 1, 'referral_count': 1},
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+
+
+def _unmark_referred(uc, new_user_id: int, referrer_id: int):
+    """إلغاء تسجيل الخطوة 1 حتى يمكن استخدام رابط صحيح لاحقاً"""
+    uc.update_one(
+        {'user_id': new_user_id, 'referred_by': referrer_id},
+        {'$unset': {'referred_by': '', 'referral_date': ''}}
+    )
+
+
+def _record_in_transaction(referrer_code: str, referrer_id: int, new_user_id: int):
     """
-    function_name = "track_referral"
-    logger.info(f"🔵 [{function_name}] بدء تتبع إحالة - الكود: {referrer_code}, المستخدم الجديد: {new_user_id}")
+    الخطوتان في معاملة واحدة: إما تُطبقان معاً أو لا شيء
+
+    Raises:
+        NotImplementedError / ConfigurationError / OperationFailure(20)
+        إذا لم يدعم الخادم المعاملات (قبل تطبيق أي شيء)
+    """
+    from .base import client, users_collection as uc
+
+    def callback(session):
+        new_user = _mark_referred(uc, new_user_id, referrer_id, session)
+        if new_user is None:
+            return 'already_referred', None
+        referrer = _credit_referrer(uc, referrer_id, referrer_code, session)
+        if referrer is None:
+            session.abort_transaction()
+            return 'unknown_code', None
+        return None, (new_user, referrer)
+
+    with client.start_session() as session:
+        return session.with_transaction(callback)
+
+
+def _record_with_undo(referrer_code: str, referrer_id: int, new_user_id: int):
+    """بدون معاملات: الخطوتان بالتتابع، والخطوة 1 تُلغى إذا فشلت الخطوة 2 أو رفعت استثناء"""
+    from .base import users_collection as uc
+
+    new_user = _mark_referred(uc, new_user_id, referrer_id)
+    if new_user is None:
+        return 'already_referred', None
 
     try:
-        # ⭐ التحقق من الاتصال بقاعدة البيانات وإعادة الاتصال إن لزم الأمر
-        from .base import ensure_db_connection, users_collection as uc
-        if not ensure_db_connection():
-            logger.error(f"❌ [{function_name}] فشل الاتصال بقاعدة البيانات")
-            return False
+        referrer = _credit_referrer(uc, referrer_id, referrer_code)
+    except Exception:
+        _unmark_referred(uc, new_user_id, referrer_id)
+        raise
 
-        # التحقق من صحة المدخلات
-        if not referrer_code or not isinstance(referrer_code, str):
-            logger.error(f"❌ [{function_name}] خطأ: referrer_code غير صالح: {referrer_code}")
-            return False
+    if referrer is None:
+        _unmark_referred(uc, new_user_id, referrer_id)
+        return 'unknown_code', None
+    return None, (new_user, referrer)
 
-        if not new_user_id or not isinstance(new_user_id, int):
-            logger.error(f"❌ [{function_name}] خطأ: new_user_id غير صالح: {new_user_id}")
-            return False
 
-        logger.debug(f"🔍 [{function_name}] البحث عن المستخدم المحيل بالكود: {referrer_code}...")
+def record_referral(referrer_code: str, new_user_id: int):
+    """
+    تسجيل الإحالة ومنح المكافأة
 
-        # البحث عن المستخدم المحيل بالكود
-        referrer = uc.find_one({'referral_code': referrer_code})
+    1. find_one_and_update على المستخدم الجديد بشرط عدم وجود referred_by -
+       عند الضغط المتزامن على الرابط تنجح عملية واحدة فقط
+    2. find_one_and_update على المحيل بشرط تطابق الكود: $inc للعداد والرصيد
+       مع إرجاع القيم الجديدة للإشعار
 
-        if not referrer:
-            logger.warning(f"⚠️ [{function_name}] كود إحالة غير موجود في قاعدة البيانات: {referrer_code}")
-            return False
+    الخطوتان في معاملة (replica set / Atlas). إذا لم يدعم الخادم المعاملات
+    تُنفذان بالتتابع وتُلغى الخطوة 1 عند فشل الخطوة 2 أو عدم تطابق الكود.
 
-        referrer_id = referrer.get('user_id')
-        referrer_name = referrer.get('full_name', 'مستخدم')
+    Returns:
+        dict: {'referrer_id', 'referrer_name', 'new_user_name', 'balance', 'referral_count'}
+              أو None إذا لم تُسجل الإحالة
+    """
+    global _transactions_supported
+    function_name = "record_referral"
 
-        if not referrer_id:
-            logger.error(f"❌ [{function_name}] خطأ: المحيل لا يملك user_id صالح في قاعدة البيانات")
-            return False
+    from .base import ensure_db_connection
+    if not ensure_db_connection():
+        logger.error(f"❌ [{function_name}] فشل الاتصال بقاعدة البيانات")
+        return None
 
-        logger.info(f"✅ [{function_name}] تم العثور على المحيل - ID: {referrer_id}, الاسم: {referrer_name}")
+    # التحقق من صحة المدخلات
+    if not referrer_code or not isinstance(referrer_code, str):
+        logger.error(f"❌ [{function_name}] خطأ: referrer_code غير صالح: {referrer_code}")
+        return None
 
-        # التحقق من عدم إحالة نفسه
-        if referrer_id == new_user_id:
-            logger.warning(f"⚠️ [{function_name}] محاولة إحالة ذاتية! المستخدم {new_user_id} حاول إحالة نفسه")
-            return False
+    if not new_user_id or not isinstance(new_user_id, int):
+        logger.error(f"❌ [{function_name}] خطأ: new_user_id غير صالح: {new_user_id}")
+        return None
 
-        logger.debug(f"🔍 [{function_name}] التحقق من حالة المستخدم الجديد {new_user_id}...")
+    referrer_id = parse_referral_code(referrer_code)
+    if referrer_id is None:
+        logger.warning(f"⚠️ [{function_name}] صيغة كود إحالة غير صالحة: {referrer_code}")
+        return None
 
-        # التحقق من عدم تسجيل الإحالة مسبقاً
-        existing_user = uc.find_one({'user_id': new_user_id})
-        if existing_user and existing_user.get('referred_by'):
-            previous_referrer = existing_user.get('referred_by')
-            logger.warning(f"⚠️ [{function_name}] المستخدم {new_user_id} تم إحالته بالفعل من قبل المستخدم {previous_referrer}")
-            return False
+    # التحقق من عدم إحالة نفسه
+    if referrer_id == new_user_id:
+        logger.warning(f"⚠️ [{function_name}] محاولة إحالة ذاتية! المستخدم {new_user_id} حاول إحالة نفسه")
+        return None
 
-        # جلب بيانات المستخدم الجديد
-        new_user = uc.find_one({'user_id': new_user_id})
-        new_user_name = new_user.get('full_name', 'مستخدم جديد') if new_user else 'مستخدم جديد'
+    outcome = None
+    if _transactions_supported is not False:
+        try:
+            outcome = _record_in_transaction(referrer_code, referrer_id, new_user_id)
+            _transactions_supported = True
+        except (NotImplementedError, ConfigurationError) as e:
+            _transactions_supported = False
+            logger.warning(f"⚠️ [{function_name}] المعاملات غير مدعومة - استخدام الإلغاء اليدوي: {e}")
+        except OperationFailure as e:
+            # 20 = IllegalOperation: خادم standalone بدون replica set
+            if e.code != 20:
+                raise
+            _transactions_supported = False
+            logger.warning(f"⚠️ [{function_name}] المعاملات غير مدعومة - استخدام الإلغاء اليدوي: {e}")
+
+    if outcome is None:
+        outcome = _record_with_undo(referrer_code, referrer_id, new_user_id)
+
+    reason, records = outcome
+    if reason == 'already_referred':
+        logger.warning(f"⚠️ [{function_name}] المستخدم {new_user_id} تم إحالته بالفعل أو غير مسجل")
+        return None
+    if reason == 'unknown_code':
+        logger.warning(f"⚠️ [{function_name}] كود إحالة غير موجود في قاعدة البيانات: {referrer_code}")
+        return None
 
-        logger.info(f"👤 [{function_name}] بيانات المستخدم الجديد - ID: {new_user_id}, الاسم: {new_user_name}")
-        logger.debug(f"💾 [{function_name}] تسجيل الإحالة في قاعدة البيانات...")
+    new_user, referrer = records
+    return {
+        'referrer_id': referrer_id,
+        'referrer_name': referrer.get('full_name', 'مستخدم'),
+        'new_user_name': new_user.get('full_name', 'مستخدم جديد'),
+        'balance': referrer.get('no_logo_credits', 10),
+        'referral_count': referrer.get('referral_count', 1),
+    }
 
-        # تسجيل الإحالة للمستخدم الجديد
-        result_referred = uc.update_one(
-            {'user_id': new_user_id},
-            {
-                '$set': {
-                    'referred_by': referrer_id,
-                    'referral_date': datetime.now()
-                }
-            },
-            upsert=True
-        )
 
-        if not result_referred.acknowledged:
-            logger.error(f"❌ [{function_name}] فشل تسجيل الإحالة للمستخدم الجديد {new_user_id}")
-            return False
+async def track_referral(referrer_code: str, new_user_id: int, bot=None) -> bool:
+    """
+    تسجيل إحالة جديدة مع إرسال إشعارات
 
-        logger.debug(f"💰 [{function_name}] تحديث رصيد المحيل {referrer_id}...")
+    Args:
+        referrer_code: كود الإحالة الخاص بالمحيل
+        new_user_id: معرف المستخدم الجديد
+        bot: كائن البوت لإرسال الإشعارات (اختياري)
 
-        # زيادة عداد الإحالات للمحيل
-        result_referrer = uc.update_one(
-            {'user_id': referrer_id},
-            {
-                '$inc': {
-                    'referral_count': 1,
-                    'no_logo_credits': 10  # مكافأة 10 فيديوهات بدون لوجو
-                }
-            }
-        )
+    Returns:
+        bool: True في حالة النجاح، False في حالة الفشل
+    """
+    function_name = "track_referral"
+    logger.info(f"🔵 [{function_name}] بدء تتبع إحالة - الكود: {referrer_code}, المستخدم الجديد: {new_user_id}")
 
-        if not result_referrer.acknowledged:
-            logger.error(f"❌ [{function_name}] فشل تحديث رصيد المحيل {referrer_id}")
-            # لا نرجع False لأن الإحالة تم تسجيلها
+    try:
+        # عمليات قاعدة البيانات عبر db_executor حتى لا تحجب حلقة الأحداث
+        from .async_api import run_db
+        referral = await run_db(record_referral, referrer_code, new_user_id)
+
+        if not referral:
+            return False
 
-        # حساب الرصيد الجديد
-        updated_referrer = uc.find_one({'user_id': referrer_id})
-        new_balance = updated_referrer.get('no_logo_credits', 10) if updated_referrer else 10
-        new_referral_count = updated_referrer.get('referral_count', 1) if updated_referrer else 1
+        referrer_id = referral['referrer_id']
+        referrer_name = referral['referrer_name']
+        new_user_name = referral['new_user_name']
+        new_balance = referral['balance']
+        new_referral_count = referral['referral_count']
 
         logger.info(f"💰 [{function_name}] رصيد المحيل {referrer_id} الجديد: {new_balance} فيديو، عدد الإحالات: {new_referral_count}")
 
@@ -303,21 +392,18 @@ def add_referral_points(user_id: int, points: int = 5) -> bool:
 
         logger.debug(f"💾 [{function_name}] تحديث رصيد المستخدم {user_id}...")
 
-        result = uc.update_one(
+        # الإضافة وجلب الرصيد الجديد في عملية واحدة
+        user = uc.find_one_and_update(
             {'user_id': user_id},
             {'$inc': {'no_logo_credits': points}},
-            upsert=True
+            projection={'_id': 0, 'no_logo_credits': 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
         )
 
-        if result.acknowledged:
-            # جلب الرصيد الجديد
-            user = uc.find_one({'user_id': user_id})
-            new_balance = user.get('no_logo_credits', points) if user else points
-            logger.info(f"✅ [{function_name}] نجح! تمت إضافة {points} نقطة للمستخدم {user_id}، الرصيد الجديد: {new_balance}")
-            return True
-        else:
-            logger.error(f"❌ [{function_name}] فشل تحديث قاعدة البيانات للمستخدم {user_id}")
-            return False
+        new_balance = user.get('no_logo_credits', points) if user else points
+        logger.info(f"✅ [{function_name}] نجح! تمت إضافة {points} نقطة للمستخدم {user_id}، الرصيد الجديد: {new_balance}")
+        return True
 
     except Exception as e:
         logger.error(f"❌ [{function_name}] خطأ حرج للمستخدم {user_id}: {type(e).__name__}: {str(e)}")
@@ -499,7 +585,7 @@ def get_global_settings():
             logger.error("❌ [get_global_settings] فشل الاتصال بقاعدة البيانات")
             return None
 
-        settings = sc.find_one({'_id': 'global_settings'})
+        settings = get_cached_settings('global_settings')
 
         # إنشاء الإعدادات الافتراضية إذا لم تكن موجودة
         if not settings:
@@ -513,8 +599,9 @@ def get_global_settings():
                 {'$setOnInsert': default_settings},
                 upsert=True
             )
+            invalidate_settings_cache()
             logger.info("✅ تم إنشاء إعدادات نظام الإحالة الافتراضية")
-            return sc.find_one({'_id': 'global_settings'})
+            return get_cached_settings('global_settings')
 
         return settings
     except Exception as e:
@@ -542,6 +629,7 @@ def set_referral_enabled(enabled: bool):
             },
             upsert=True
         )
+        invalidate_settings_cache()
 
         status = "مفعل" if enabled else "معطل"
         logger.info(f"✅ نظام الإحالة تم {status}")
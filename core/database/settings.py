@@ -1,5 +1,6 @@
 from datetime import datetime
-from .base import settings_collection
+from .base import settings_collection, is_db_initialized
+from .settings_cache import get_cached_settings, invalidate_settings_cache
 from config.logger import get_logger
 
 # إنشاء logger instance
@@ -13,10 +14,10 @@ logger = get_logger(__name__)
 def get_audio_settings():
     """جلب إعدادات الصوت الحالية"""
     try:
-        if settings_collection is None:
+        if not is_db_initialized():
             return None
 
-        settings = settings_collection.find_one({'_id': 'audio_settings'})
+        settings = get_cached_settings('audio_settings')
 
         # إنشاء الإعدادات الافتراضية إذا لم تكن موجودة
         if not settings:
@@ -27,6 +28,7 @@ def get_audio_settings():
                 'last_updated': datetime.now()
             }
             settings_collection.insert_one(default_settings)
+            invalidate_settings_cache()
             logger.info("✅ تم إنشاء إعدادات الصوت الافتراضية")
             return default_settings
 
@@ -39,7 +41,7 @@ def get_audio_settings():
 def set_audio_enabled(enabled: bool):
     """تفعيل أو إيقاف تحميل الصوتيات"""
     try:
-        if settings_collection is None:
+        if not is_db_initialized():
             return False
 
         settings_collection.update_one(
@@ -52,6 +54,7 @@ def set_audio_enabled(enabled: bool):
             },
             upsert=True
         )
+        invalidate_settings_cache()
 
         status = "مفعّل" if enabled else "معطّل"
         logger.info(f"✅ تحميل الصوتيات تم {status}")
@@ -67,7 +70,7 @@ def set_audio_limit_minutes(minutes: float):
     استخدم -1 للتحميل غير المحدود
     """
     try:
-        if settings_collection is None:
+        if not is_db_initialized():
             return False
 
         # -1 يعني غير محدود
@@ -87,6 +90,7 @@ def set_audio_limit_minutes(minutes: float):
             },
             upsert=True
         )
+        invalidate_settings_cache()
 
         if minutes == -1:
             logger.info(f"✅ تم تعيين حد الصوتيات إلى: غير محدود")
@@ -129,10 +133,10 @@ def get_audio_limit_minutes():
 def get_general_limits():
     """جلب الإعدادات العامة للقيود"""
     try:
-        if settings_collection is None:
+        if not is_db_initialized():
             return None
 
-        settings = settings_collection.find_one({'_id': 'general_limits'})
+        settings = get_cached_settings('general_limits')
 
         if not settings:
             default_settings = {
@@ -142,6 +146,7 @@ def get_general_limits():
                 'last_updated': datetime.now()
             }
             settings_collection.insert_one(default_settings)
+            invalidate_settings_cache()
             logger.info("✅ تم إنشاء إعدادات القيود العامة الافتراضية")
             return default_settings
 
@@ -154,7 +159,7 @@ def get_general_limits():
 def set_free_time_limit(minutes: int):
     """تعيين الحد الزمني للفيديوهات للمستخدمين غير المشتركين (بالدقائق)"""
     try:
-        if settings_collection is None:
+        if not is_db_initialized():
             return False
 
         if minutes < 0:
@@ -171,6 +176,7 @@ def set_free_time_limit(minutes: int):
             },
             upsert=True
         )
+        invalidate_settings_cache()
 
         logger.info(f"✅ تم تعيين الحد الزمني لغير المشتركين إلى: {minutes} دقيقة")
         return True
@@ -194,7 +200,7 @@ def get_free_time_limit():
 def set_daily_download_limit(count: int):
     """تعيين عدد التحميلات اليومية المسموح بها للمستخدمين غير المشتركين"""
     try:
-        if settings_collection is None:
+        if not is_db_initialized():
             return False
 
         if count < 0:
@@ -211,6 +217,7 @@ def set_daily_download_limit(count: int):
             },
             upsert=True
         )
+        invalidate_settings_cache()
 
         logger.info(f"✅ تم تعيين الحد اليومي لغير المشتركين إلى: {count} تحميل")
         return True
@@ -238,10 +245,10 @@ def get_daily_download_limit_setting():
 def get_referral_settings():
     """جلب إعدادات نظام الإحالة الحالية"""
     try:
-        if settings_collection is None:
+        if not is_db_initialized():
             return None
 
-        settings = settings_collection.find_one({'_id': 'referral_settings'})
+        settings = get_cached_settings('referral_settings')
 
         # إنشاء الإعدادات الافتراضية إذا لم تكن موجودة
         if not settings:
@@ -251,6 +258,7 @@ def get_referral_settings():
                 'last_updated': datetime.now()
             }
             settings_collection.insert_one(default_settings)
+            invalidate_settings_cache()
             logger.info("✅ تم إنشاء إعدادات نظام الإحالة الافتراضية")
             return default_settings
 
@@ -263,7 +271,7 @@ def get_referral_settings():
 def set_referral_enabled(enabled: bool):
     """تفعيل أو إيقاف نظام الإحالة"""
     try:
-        if settings_collection is None:
+        if not is_db_initialized():
             return False
 
         settings_collection.update_one(
@@ -276,6 +284,7 @@ def set_referral_enabled(enabled: bool):
             },
             upsert=True
         )
+        invalidate_settings_cache()
 
         status = "مفعّل" if enabled else "معطّل"
         logger.info(f"✅ نظام الإحالة تم {status}")
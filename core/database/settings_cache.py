@@ -0,0 +1,121 @@
+"""
+Settings Snapshot Cache - ذاكرة مؤقتة لمستندات الإعدادات
+
+جميع مستندات الإعدادات (global_settings, audio_settings, general_limits,
+library_settings, logo_settings, referral_settings) تُقرأ باستعلام واحد وتُحفظ
+كلقطة (snapshot) غير قابلة للتعديل داخل العملية.
+
+اللقطة تُعاد قراءتها عندما:
+    1. يتغير رقم الإصدار - كل دالة set_* تستدعي invalidate_settings_cache()
+    2. تنتهي مدة SETTINGS_CACHE_TTL - لتصل تغييرات العمليات الأخرى خلال ثوانٍ
+"""
+
+import os
+import threading
+from time import monotonic
+from types import MappingProxyType
+
+from config.logger import get_logger
+
+# إنشاء logger instance
+logger = get_logger(__name__)
+
+# مستندات الإعدادات داخل مجموعة settings
+SETTINGS_DOC_IDS = (
+    'global_settings',
+    'audio_settings',
+    'general_limits',
+    'library_settings',
+    'logo_settings',
+    'referral_settings',
+)
+
+# مدة صلاحية اللقطة بالثواني (للتشغيل بأكثر من عملية)
+SETTINGS_CACHE_TTL = float(os.getenv("SETTINGS_CACHE_TTL", "5"))
+
+_cache_lock = threading.Lock()
+_version = 0
+_snapshot = None
+_snapshot_version = -1
+_snapshot_time = 0.0
+
+
+def _freeze(value):
+    """تحويل المستند إلى نسخة للقراءة فقط (dict -> MappingProxyType, list -> tuple)"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _load_snapshot():
+    """قراءة جميع مستندات الإعدادات باستعلام واحد"""
+    from .base import settings_collection as sc
+
+    docs = {}
+    for doc in sc.find({'_id': {'$in': list(SETTINGS_DOC_IDS)}}):
+        docs[doc['_id']] = _freeze(doc)
+    return MappingProxyType(docs)
+
+
+def invalidate_settings_cache():
+    """زيادة رقم الإصدار - القراءة التالية ستجلب لقطة جديدة"""
+    global _version
+    with _cache_lock:
+        _version += 1
+
+
+def get_settings_version() -> int:
+    """رقم إصدار الإعدادات الحالي"""
+    return _version
+
+
+def get_settings_snapshot():
+    """
+    جلب لقطة جميع مستندات الإعدادات
+
+    Returns:
+        Mapping: {doc_id: document} - للقراءة فقط، المستندات غير الموجودة غائبة
+    """
+    global _snapshot, _snapshot_version, _snapshot_time
+
+    with _cache_lock:
+        if (
+            _snapshot is not None
+            and _snapshot_version == _version
+            and monotonic() - _snapshot_time < SETTINGS_CACHE_TTL
+        ):
+            return _snapshot
+        version = _version
+
+    from .health import db_health
+    if not db_health.is_available():
+        # قاعدة البيانات غير متاحة - آخر لقطة معروفة بدون انتظار مهلة الاتصال
+        return _snapshot if _snapshot is not None else MappingProxyType({})
+
+    try:
+        snapshot = _load_snapshot()
+    except Exception as e:
+        logger.error(f"❌ فشل جلب لقطة الإعدادات: {e}")
+        # إرجاع آخر لقطة معروفة بدلاً من لا شيء
+        return _snapshot if _snapshot is not None else MappingProxyType({})
+
+    with _cache_lock:
+        # لا نحفظ اللقطة إذا تم تعديل الإعدادات أثناء قراءتها
+        if version == _version:
+            _snapshot = snapshot
+            _snapshot_version = version
+            _snapshot_time = monotonic()
+
+    return snapshot
+
+
+def get_cached_settings(doc_id: str):
+    """
+    جلب مستند إعدادات واحد من اللقطة
+
+    Returns:
+        Mapping أو None إذا لم يكن المستند موجوداً
+    """
+    return get_settings_snapshot().get(doc_id)
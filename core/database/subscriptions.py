@@ -1,5 +1,6 @@
 from datetime import datetime
-from .base import users_collection, settings_collection
+from .base import users_collection, settings_collection, is_db_initialized
+from .settings_cache import get_cached_settings, invalidate_settings_cache
 from config.logger import get_logger
 
 # إنشاء logger instance
@@ -40,10 +41,10 @@ def add_subscription(user_id: int, subscription_end: datetime):
 def get_global_settings():
     """جلب الإعدادات العامة للبوت"""
     try:
-        if settings_collection is None:
+        if not is_db_initialized():
             return None
 
-        settings = settings_collection.find_one({'_id': 'global_settings'})
+        settings = get_cached_settings('global_settings')
 
         # إنشاء الإعدادات الافتراضية إذا لم تكن موجودة
         if not settings:
@@ -54,6 +55,7 @@ def get_global_settings():
                 'last_updated': datetime.now()
             }
             settings_collection.insert_one(default_settings)
+            invalidate_settings_cache()
             logger.info("✅ تم إنشاء الإعدادات العامة الافتراضية")
             return default_settings
 
@@ -66,7 +68,7 @@ def get_global_settings():
 def set_subscription_enabled(enabled: bool):
     """تفعيل أو إيقاف نظام الاشتراك"""
     try:
-        if settings_collection is None:
+        if not is_db_initialized():
             return False
 
         settings_collection.update_one(
@@ -79,6 +81,7 @@ def set_subscription_enabled(enabled: bool):
             },
             upsert=True
         )
+        invalidate_settings_cache()
 
         status = "enabled" if enabled else "disabled"
         logger.info(f"✅ نظام الاشتراك تم {status}")
@@ -91,7 +94,7 @@ def set_subscription_enabled(enabled: bool):
 def set_welcome_broadcast_enabled(enabled: bool):
     """تفعيل أو إيقاف رسالة الترحيب عند تفعيل الاشتراك"""
     try:
-        if settings_collection is None:
+        if not is_db_initialized():
             return False
 
         settings_collection.update_one(
@@ -104,6 +107,7 @@ def set_welcome_broadcast_enabled(enabled: bool):
             },
             upsert=True
         )
+        invalidate_settings_cache()
 
         status = "enabled" if enabled else "disabled"
         logger.info(f"✅ رسالة الترحيب تم {status}")
@@ -140,7 +144,7 @@ def is_welcome_broadcast_enabled():
 def set_subscription_price(price: float):
     """تعيين سعر الاشتراك"""
     try:
-        if settings_collection is None:
+        if not is_db_initialized():
             return False
 
         settings_collection.update_one(
@@ -153,6 +157,7 @@ def set_subscription_price(price: float):
             },
             upsert=True
         )
+        invalidate_settings_cache()
 
         logger.info(f"✅ تم تعيين سعر الاشتراك إلى: ${price}")
         return True
@@ -0,0 +1,196 @@
+"""
+Telemetry Write-Behind Buffer - كتابة مؤجلة ومجمعة لبيانات الإحصائيات
+
+track_download, record_download_attempt, track_download_success و
+update_user_interaction تكتب بيانات إحصائية فقط، ولا يجب أن ينتظر تحميل
+المستخدم ردّ MongoDB عليها. هذه الوحدة تجمع عمليات الكتابة في الذاكرة،
+وخيط خلفي يرسلها بـ bulk_write(ordered=False) لكل مجموعة:
+    1. كل TELEMETRY_FLUSH_INTERVAL ثانية
+    2. أو فوراً عند وصول عدد العمليات المعلقة إلى TELEMETRY_BATCH_SIZE
+
+عند إيقاف البوت تُرسل العمليات المتبقية عبر shutdown_telemetry().
+"""
+
+import os
+import atexit
+import threading
+
+from pymongo.errors import BulkWriteError
+
+from config.logger import get_logger
+
+# إنشاء logger instance
+logger = get_logger(__name__)
+
+# الفاصل الزمني بين كل إرسال (بالثواني)
+TELEMETRY_FLUSH_INTERVAL = float(os.getenv("TELEMETRY_FLUSH_INTERVAL", "2"))
+
+# عدد العمليات الذي يُطلق الإرسال فوراً
+TELEMETRY_BATCH_SIZE = int(os.getenv("TELEMETRY_BATCH_SIZE", "500"))
+
+# الحد الأقصى للعمليات المعلقة - ما يزيد عنه يُهمل بدلاً من استهلاك الذاكرة
+TELEMETRY_MAX_PENDING = int(os.getenv("TELEMETRY_MAX_PENDING", "50000"))
+
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_stopped = threading.Event()
+_flush_lock = threading.Lock()
+_worker = None
+
+# {collection: [op, ...]}
+_pending = {}
+# {(collection, key): op} - عمليات تُستبدل بأحدث نسخة (مثل last_interaction)
+_coalesced = {}
+_pending_count = 0
+_dropped = 0
+
+
+def _ensure_worker():
+    """تشغيل خيط الإرسال عند أول عملية (يُستدعى تحت _lock)"""
+    global _worker
+    if _worker is None and not _stopped.is_set():
+        _worker = threading.Thread(target=_run, name="telemetry-writer", daemon=True)
+        _worker.start()
+
+
+def enqueue_write(collection: str, op, key=None) -> bool:
+    """
+    إضافة عملية كتابة (InsertOne / UpdateOne) إلى المخزن المؤقت
+
+    Args:
+        collection: اسم المجموعة (downloads / users / settings)
+        op: عملية pymongo جاهزة لـ bulk_write
+        key: إذا حُدد، تستبدل العملية أي عملية معلقة بنفس المفتاح
+
+    Returns:
+        bool: False إذا كان المخزن ممتلئاً أو متوقفاً وأُهملت العملية
+    """
+    global _pending_count, _dropped
+
+    with _lock:
+        if _stopped.is_set():
+            _dropped += 1
+            return False
+
+        if key is not None and (collection, key) in _coalesced:
+            _coalesced[(collection, key)] = op
+            return True
+
+        if _pending_count >= TELEMETRY_MAX_PENDING:
+            _dropped += 1
+            return False
+
+        if key is not None:
+            _coalesced[(collection, key)] = op
+        else:
+            _pending.setdefault(collection, []).append(op)
+        _pending_count += 1
+
+        _ensure_worker()
+        if _pending_count >= TELEMETRY_BATCH_SIZE:
+            _wakeup.set()
+
+    return True
+
+
+def _take_pending():
+    """سحب جميع العمليات المعلقة وتصفير المخزن"""
+    global _pending, _coalesced, _pending_count, _dropped
+
+    with _lock:
+        batches = _pending
+        coalesced = _coalesced
+        dropped = _dropped
+        _pending = {}
+        _coalesced = {}
+        _pending_count = 0
+        _dropped = 0
+
+    for (collection, _key), op in coalesced.items():
+        batches.setdefault(collection, []).append(op)
+
+    return batches, dropped
+
+
+def flush_telemetry() -> int:
+    """
+    إرسال جميع العمليات المعلقة الآن
+
+    Returns:
+        int: عدد العمليات المرسلة بنجاح
+    """
+    from .base import get_db
+    from .health import db_health
+
+    db = get_db()
+
+    with _flush_lock:
+        if db is not None and not db_health.is_available() and not _stopped.is_set():
+            # القاطع مفتوح - نحتفظ بالعمليات حتى تعود قاعدة البيانات
+            return 0
+
+        batches, dropped = _take_pending()
+
+        if dropped:
+            logger.warning(f"⚠️ [telemetry] تم إهمال {dropped} عملية (المخزن ممتلئ أو متوقف)")
+
+        if not batches:
+            return 0
+
+        if db is None:
+            logger.error(f"❌ [telemetry] قاعدة البيانات غير متصلة - فُقدت {sum(map(len, batches.values()))} عملية")
+            return 0
+
+        written = 0
+        for collection, ops in batches.items():
+            try:
+                db[collection].bulk_write(ops, ordered=False)
+                written += len(ops)
+            except BulkWriteError as e:
+                errors = e.details.get('writeErrors', [])
+                written += len(ops) - len(errors)
+                logger.error(f"❌ [telemetry] {len(errors)} عملية فاشلة في {collection}: {errors[:1]}")
+            except Exception as e:
+                # خطأ في مجموعة واحدة لا يمنع إرسال باقي المجموعات
+                logger.error(f"❌ [telemetry] فشل إرسال {len(ops)} عملية إلى {collection}: {e}")
+
+        return written
+
+
+def _run():
+    """حلقة خيط الإرسال"""
+    while not _stopped.is_set():
+        _wakeup.wait(TELEMETRY_FLUSH_INTERVAL)
+        _wakeup.clear()
+        try:
+            flush_telemetry()
+        except Exception as e:
+            logger.error(f"❌ [telemetry] خطأ غير متوقع في خيط الإرسال: {e}")
+
+
+def get_telemetry_stats() -> dict:
+    """عدد العمليات المعلقة حالياً"""
+    with _lock:
+        return {
+            'pending': _pending_count,
+            'dropped': _dropped,
+            'running': _worker is not None and _worker.is_alive(),
+        }
+
+
+def shutdown_telemetry(timeout: float = 10):
+    """إيقاف خيط الإرسال وإرسال العمليات المتبقية (عند إيقاف البوت)"""
+    if _stopped.is_set():
+        return
+
+    _stopped.set()
+    _wakeup.set()
+    if _worker is not None:
+        _worker.join(timeout)
+
+    written = flush_telemetry()
+    logger.info(f"✅ تم إيقاف كاتب الإحصائيات (آخر دفعة: {written} عملية)")
+
+
+# شبكة أمان إذا انتهت العملية بدون استدعاء shutdown_telemetry
+atexit.register(shutdown_telemetry)
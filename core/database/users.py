@@ -1,5 +1,8 @@
+import re
 from datetime import datetime
+from pymongo import UpdateOne
 from .base import users_collection, ensure_db_connection, ADMIN_IDS
+from .telemetry import enqueue_write
 from config.logger import get_logger
 
 # إنشاء logger instance
@@ -11,6 +14,19 @@ def is_admin(user_id: int) -> bool:
     return user_id in ADMIN_IDS
 
 
+def normalize_username(username: str):
+    """توحيد اسم المستخدم للبحث: بدون @ وبأحرف صغيرة (None إذا كان فارغاً)"""
+    if not username:
+        return None
+    username = username.strip().lstrip('@').lower()
+    return username or None
+
+
+def _username_fields(username: str) -> dict:
+    """حقول اسم المستخدم التي تُحدّث مع كل تسجيل/تفاعل"""
+    return {'username': username, 'username_lower': normalize_username(username)}
+
+
 def add_user(user_id: int, username: str = None, full_name: str = None, language: str = 'ar'):
     """
     إضافة مستخدم جديد
@@ -25,19 +41,25 @@ def add_user(user_id: int, username: str = None, full_name: str = None, language
     try:
         user_data = {
             'user_id': user_id,
-            'username': username,
             'full_name': full_name,
             'language': language,
             'join_date': datetime.now(),
             'last_interaction': datetime.now(),
             'download_count': 0,
-            'daily_downloads': [],
+            'daily_usage': {'day': None, 'count': 0},
             'subscription_end': None
         }
 
+        # اسم المستخدم يتغير في تيليجرام - يُحدّث دائماً وليس عند الإنشاء فقط
+        update = {'$setOnInsert': user_data}
+        if username:
+            update['$set'] = _username_fields(username)
+        else:
+            user_data.update(_username_fields(None))
+
         result = users_collection.update_one(
             {'user_id': user_id},
-            {'$setOnInsert': user_data},
+            update,
             upsert=True
         )
 
@@ -67,8 +89,154 @@ def get_user(user_id: int):
         return None
 
 
+def get_recent_users(limit: int = 20):
+    """
+    جلب آخر المستخدمين تسجيلاً (بالحقول المعروضة فقط)
+
+    Returns:
+        list: من الأقدم إلى الأحدث
+    """
+    if not ensure_db_connection():
+        return []
+    try:
+        users = list(users_collection.find(
+            {},
+            {'_id': 0, 'user_id': 1, 'username': 1, 'full_name': 1, 'subscription_end': 1}
+        ).sort('_id', -1).limit(limit))
+        users.reverse()
+        return users
+    except Exception as e:
+        logger.error(f"❌ فشل جلب آخر المستخدمين: {e}")
+        return []
+
+
+def get_user_by_username(username: str):
+    """
+    جلب مستخدم باسم المستخدم - بدون حساسية لحالة الأحرف ومع أو بدون @
+
+    استعلام واحد على فهرس username_lower
+    """
+    key = normalize_username(username)
+    if not key or not ensure_db_connection():
+        return None
+    try:
+        return users_collection.find_one({'username_lower': key})
+    except Exception as e:
+        logger.error(f"❌ فشل البحث باسم المستخدم: {e}")
+        return None
+
+
+USER_SEARCH_PROJECTION = {
+    '_id': 0,
+    'user_id': 1,
+    'username': 1,
+    'username_lower': 1,
+    'full_name': 1,
+    'subscription_end': 1,
+}
+
+
+def search_users_by_username(prefix: str, after: str = None, limit: int = 10):
+    """
+    البحث بأول أحرف اسم المستخدم (للوحة الأدمن)
+
+    Args:
+        prefix: بداية اسم المستخدم (بدون حساسية لحالة الأحرف)
+        after: username_lower لآخر نتيجة في الصفحة السابقة (للصفحة التالية)
+        limit: عدد النتائج في الصفحة
+
+    Returns:
+        tuple: (users, next_after) - next_after هو None إذا لم تتبق نتائج
+    """
+    key = normalize_username(prefix)
+    if not key or not ensure_db_connection():
+        return [], None
+
+    # regex مثبت بالبداية على حقل بأحرف صغيرة = نطاق على الفهرس
+    query = {'username_lower': {'$regex': f'^{re.escape(key)}'}}
+    if after:
+        query['username_lower']['$gt'] = after
+
+    try:
+        users = list(users_collection.find(query, USER_SEARCH_PROJECTION)
+                     .sort('username_lower', 1)
+                     .limit(limit + 1))
+    except Exception as e:
+        logger.error(f"❌ فشل البحث عن المستخدمين: {e}")
+        return [], None
+
+    if len(users) > limit:
+        users = users[:limit]
+        return users, users[-1]['username_lower']
+    return users, None
+
+
+# ═══════════════════════════════════════════════════════════════
+#  Streaming User Iteration
+#  المرور على جميع المستخدمين على دفعات بدلاً من تحميلهم كلهم في الذاكرة
+#  الترقيم بـ _id (keyset) - كل دفعة استعلام مستقل، فلا ينتهي المؤشر
+#  (cursor timeout) أثناء بث طويل
+# ═══════════════════════════════════════════════════════════════
+
+USERS_BATCH_SIZE = 500
+
+
+def get_users_page(after_id=None, projection: dict = None, query: dict = None, limit: int = USERS_BATCH_SIZE):
+    """
+    جلب دفعة من المستخدمين مرتبة بـ _id
+
+    Args:
+        after_id: آخر _id من الدفعة السابقة (None للبداية)
+        projection: الحقول المطلوبة فقط، مثل {'user_id': 1, 'language': 1}
+        query: فلتر إضافي
+        limit: حجم الدفعة
+
+    Returns:
+        list: الدفعة (فارغة عند النهاية). _id موجود دائماً في كل مستند
+    """
+    if not ensure_db_connection():
+        return []
+
+    page_query = dict(query or {})
+    if after_id is not None:
+        page_query['_id'] = {'$gt': after_id}
+
+    if projection is not None:
+        projection = {**projection, '_id': 1}
+
+    try:
+        return list(users_collection.find(page_query, projection).sort('_id', 1).limit(limit))
+    except Exception as e:
+        logger.error(f"❌ فشل جلب دفعة المستخدمين: {e}")
+        return []
+
+
+def iter_user_batches(projection: dict = None, query: dict = None, batch_size: int = USERS_BATCH_SIZE):
+    """
+    المرور على المستخدمين على دفعات (generator)
+
+    مثال:
+        for batch in iter_user_batches({'user_id': 1, 'language': 1}):
+            for user in batch: ...
+    """
+    after_id = None
+    while True:
+        batch = get_users_page(after_id, projection, query, batch_size)
+        if not batch:
+            return
+        yield batch
+        if len(batch) < batch_size:
+            return
+        after_id = batch[-1]['_id']
+
+
 def get_all_users():
-    """جلب جميع المستخدمين"""
+    """
+    جلب جميع المستخدمين
+
+    ⚠️ يحمّل المجموعة كاملة في الذاكرة - استخدم iter_user_batches /
+    aiter_user_batches للمرور على جميع المستخدمين
+    """
     if not ensure_db_connection():
         return []
     try:
@@ -113,18 +281,28 @@ def get_user_language(user_id: int) -> str:
         return 'ar'
 
 
-def update_user_interaction(user_id: int):
-    """تحديث آخر تفاعل للمستخدم"""
+def update_user_interaction(user_id: int, username: str = None):
+    """
+    تحديث آخر تفاعل للمستخدم
+
+    Args:
+        username: اسم المستخدم الحالي من تيليجرام - إذا حُدد يُحدّث فهرس البحث
+    """
     if not ensure_db_connection():
         logger.error("❌ [update_user_interaction] فشل الاتصال بقاعدة البيانات")
         return False
 
     try:
-        users_collection.update_one(
-            {'user_id': user_id},
-            {'$set': {'last_interaction': datetime.now()}}
+        fields = {'last_interaction': datetime.now()}
+        if username:
+            fields.update(_username_fields(username))
+
+        # كتابة مؤجلة - تفاعلات نفس المستخدم داخل الدفعة تُدمج في عملية واحدة
+        return enqueue_write(
+            'users',
+            UpdateOne({'user_id': user_id}, {'$set': fields}),
+            key=('last_interaction', user_id)
         )
-        return True
     except Exception as e:
         logger.error(f"❌ فشل تحديث التفاعل: {e}")
         return False
@@ -155,7 +333,7 @@ def get_user_stats(user_id: int):
 
     try:
         from .subscriptions import is_subscribed
-        from .downloads import get_daily_download_count
+        from .downloads import daily_count_from_usage
 
         user = users_collection.find_one({'user_id': user_id})
         if not user:
@@ -163,7 +341,7 @@ def get_user_stats(user_id: int):
 
         stats = {
             'total_downloads': user.get('download_count', 0),
-            'daily_downloads': get_daily_download_count(user_id),
+            'daily_downloads': daily_count_from_usage(user.get('daily_usage')),
             'is_vip': is_subscribed(user_id),
             'join_date': user.get('join_date'),
             'subscription_end': user.get('subscription_end')
@@ -176,9 +354,15 @@ def get_user_stats(user_id: int):
 
 
 def get_users_count() -> dict:
-    """جلب عدد المستخدمين"""
+    """
+    جلب عدد المستخدمين
+
+    vip = الاشتراكات النشطة فقط (subscription_end > الآن)، والمنتهية تُحسب في free
+    """
     try:
-        total = users_collection.count_documents({})
+        # العدد الإجمالي من بيانات المجموعة مباشرة (بدون فحص المستندات)
+        total = users_collection.estimated_document_count()
+        # يستخدم فهرس subscription_end
         vip = users_collection.count_documents({
             'subscription_end': {'$gt': datetime.now()}
         })
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+اختيار الصيغة حسب الحجم المتوقع
+Size-aware format pre-selection
+
+المسار القديم يطلب bestvideo[height<=1080]+bestaudio دائماً، ولا يُعرف أن الملف
+تجاوز حد Telegram إلا بعد التحميل، فيُضغط (حتى 3 مرات ترميز) أو يُرسل كمستند.
+
+نتيجة التحليل تحتوي مسبقاً على filesize / filesize_approx / tbr لكل صيغة، فيُقدّر
+هنا حجم كل خيار (صيغة مدمجة، أو فيديو + صوت) ويُختار أعلى خيار متوقع أن يقع تحت
+حد المستخدم، مع تفضيل الصيغ المدمجة (لا تحتاج دمج، وتقبل وضع التدفق).
+
+الخطة صيغة صريحة بالمعرّفات ("18" أو "137+140") تحل محل format المنصة؛
+إذا لم تتوفر أحجام، أو لم يقترب أي خيار من الحد بما يكفي لضغطه، تُرجع None
+ويبقى الاختيار القديم كما هو.
+"""
+
+import os
+
+# تفعيل اختيار الصيغة حسب الحجم
+FORMAT_PLANNER = os.getenv("FORMAT_PLANNER", "1") == "1"
+
+# الحجم المستهدف (MB) - أقل من حد sendDocument في send_file_with_retry حتى يُرسل كفيديو
+PLAN_LIMIT_MB = int(os.getenv("PLAN_LIMIT_MB", "45"))
+
+# حد المشتركين والأدمن (أعلى فقط مع خادم Bot API محلي يقبل ملفات حتى 2000MB)
+PLAN_LIMIT_MB_PRIVILEGED = int(os.getenv("PLAN_LIMIT_MB_PRIVILEGED", str(PLAN_LIMIT_MB)))
+
+# إذا لم يتسع شيء: أقصى نسبة (الحجم / الحد) يُقبل معها خيار ليُضغط بعد التحميل
+# compress_video_smart يخفض الـ bitrate فقط بنفس الدقة، وما بعد هذه النسبة
+# تكون الصورة أسوأ من صيغة المنصة (مثلاً 144p لفيديو طويل)
+PLAN_COMPRESS_RATIO = float(os.getenv("PLAN_COMPRESS_RATIO", "4"))
+
+# أقل ارتفاع يُقبل للضغط بعد التحميل (الأقل منه لا يستحق التحميل ثم الضغط)
+PLAN_COMPRESS_MIN_HEIGHT = int(os.getenv("PLAN_COMPRESS_MIN_HEIGHT", "360"))
+
+# أقصى ارتفاع لكل جودة (مطابق لـ quality_formats في get_ydl_opts_for_platform)
+PLAN_MAX_HEIGHT = {
+    'best': 1080,
+    'medium': 720,
+}
+
+# صيغ ليست فيديو قابلاً للإرسال (storyboards، صور)
+_SKIP_EXTS = ('mhtml', 'jpg', 'jpeg', 'png', 'webp')
+
+
+def plan_limit_mb(is_privileged: bool) -> int:
+    """الحد المستهدف حسب فئة المستخدم"""
+    return PLAN_LIMIT_MB_PRIVILEGED if is_privileged else PLAN_LIMIT_MB
+
+
+def estimate_size(fmt: dict, duration) -> int:
+    """
+    الحجم المتوقع للصيغة بالبايت
+
+    Returns:
+        int: filesize ثم filesize_approx ثم tbr × المدة، أو None إذا لم يُعرف
+    """
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return int(size)
+    if fmt.get('tbr') and duration:
+        # tbr بالـ kbit/s
+        return int(fmt['tbr'] * 1000 / 8 * duration)
+    return None
+
+
+def _allows_merge(format_spec: str) -> bool:
+    """هل الاختيار الأول لصيغة المنصة دمج فيديو + صوت (بعض المنصات تطلب 'best' فقط)"""
+    return '+' in format_spec.split('/')[0]
+
+
+def _candidates(formats: list, duration, max_height: int, allow_merge: bool):
+    """الخيارات الممكنة: (format_spec, الحجم، الارتفاع، مدمجة)"""
+    videos = []
+    audios = []
+    for fmt in formats:
+        if not fmt.get('format_id') or fmt.get('ext') in _SKIP_EXTS:
+            continue
+        size = estimate_size(fmt, duration)
+        if size is None:
+            continue
+        if fmt.get('vcodec') == 'none':
+            if fmt.get('acodec') != 'none':
+                audios.append((fmt.get('abr') or fmt.get('tbr') or 0, size, fmt['format_id']))
+            continue
+        height = fmt.get('height') or 0
+        if height > max_height:
+            continue
+        videos.append((fmt, size, height))
+
+    audios.sort(reverse=True)
+
+    for fmt, size, height in videos:
+        if fmt.get('acodec') != 'none':
+            yield fmt['format_id'], size, height, True
+        elif allow_merge and audios:
+            # أفضل صوت، وأصغر صوت كبديل إذا لم يتسع الأفضل
+            for _, audio_size, audio_id in dict.fromkeys((audios[0], audios[-1])):
+                yield f"{fmt['format_id']}+{audio_id}", size + audio_size, height, False
+
+
+def plan_format(info_dict: dict, quality: str, format_spec: str, limit_mb: int):
+    """
+    أفضل صيغة متوقع أن تقع تحت الحد
+
+    Args:
+        quality: best / medium (الصوت يُحوّل لـ MP3 فلا يُخطط له)
+        format_spec: صيغة المنصة من get_ydl_opts_for_platform (None = اختيار تلقائي)
+
+    Returns:
+        dict: {'format', 'size', 'height', 'muxed', 'fits'} أو None للإبقاء على صيغة المنصة
+    """
+    max_height = PLAN_MAX_HEIGHT.get(quality)
+    if not FORMAT_PLANNER or max_height is None or not format_spec:
+        return None
+
+    candidates = list(_candidates(
+        info_dict.get('formats') or [],
+        info_dict.get('duration'),
+        max_height,
+        _allows_merge(format_spec)
+    ))
+    if not candidates:
+        return None
+
+    limit = limit_mb * 1024 * 1024
+    fitting = [c for c in candidates if c[1] <= limit]
+    if not fitting:
+        # لا شيء يتسع - أعلى خيار يمكن ضغطه للحد بجودة مقبولة، وليس الأصغر مطلقاً
+        compressible = [
+            c for c in candidates
+            if c[1] <= limit * PLAN_COMPRESS_RATIO and c[2] >= PLAN_COMPRESS_MIN_HEIGHT
+        ]
+        if not compressible:
+            return None
+        candidates = compressible
+    else:
+        candidates = fitting
+
+    # الأعلى ارتفاعاً، ثم المدمجة، ثم الأعلى bitrate
+    spec, size, height, muxed = max(candidates, key=lambda c: (c[2], c[3], c[1]))
+
+    return {
+        'format': spec,
+        'size': size,
+        'height': height,
+        'muxed': muxed,
+        'fits': bool(fitting),
+    }
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+تحميل متدفق مباشرة إلى ffmpeg
+Streaming download-to-encode pipeline for watermarked videos
+
+المسار العادي للفيديو مع لوجو: تحميل الملف كاملاً ← ffmpeg يقرأه ويكتب نسخة
+باللوجو ← ضغط اختياري ينسخه مرة ثالثة. للصيغ المفردة التقدمية (ملف واحد عبر
+http/https بدون دمج صوت وفيديو) تُمرر البايتات المحملة إلى stdin لـ ffmpeg
+مباشرة، فيُكتب ملف واحد فقط (الناتج باللوجو) ويبدأ الترميز مع أول ميجابايت.
+
+إذا لم تكن الصيغة مناسبة (دمج، HLS/DASH، MP4 بـ moov في النهاية) أو فشل أي
+شيء، تُرجع الدالة None ويكمل المستدعي بالمسار العادي.
+
+يعمل دائماً في خيط من العملية الرئيسية (حتى مع YTDLP_PROCESS_POOL) لأن العمل
+هنا قراءة شبكة وكتابة pipe.
+"""
+
+import os
+import time
+import tempfile
+import subprocess
+
+import yt_dlp
+from yt_dlp.networking import Request
+from yt_dlp.utils import DownloadCancelled
+
+from config.logger import get_logger
+from core.media.watermark import (
+    CANCEL_POLL_INTERVAL,
+    build_simple_watermark_cmd,
+    get_watermark_settings,
+    shrink_to_upload_limit,
+)
+
+logger = get_logger(__name__)
+
+# تفعيل وضع التدفق للفيديوهات التي تحتاج لوجو
+STREAM_WATERMARK = os.getenv("STREAM_WATERMARK", "1") == "1"
+
+# حجم القطعة المقروءة من الشبكة والمكتوبة إلى ffmpeg
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# مهلة التحميل والترميز معاً (بالثواني)
+STREAM_TIMEOUT = int(os.getenv("STREAM_TIMEOUT", "900"))
+
+_STREAM_PROTOCOLS = ('http', 'https')
+
+# حاويات يقرأها ffmpeg من pipe بدون الرجوع للخلف
+_SEQUENTIAL_EXTS = ('webm', 'mkv', 'flv', 'ts')
+
+# MP4 قابل للتدفق فقط إذا جاء moov قبل mdat (faststart)
+_MP4_EXTS = ('mp4', 'm4v', 'mov')
+
+
+def select_stream_format(ydl, info_dict: dict, format_spec: str):
+    """
+    الصيغة التي سيختارها yt-dlp من نتيجة التحليل (بدون طلبات شبكة)
+
+    Returns:
+        str: format_id إذا كانت صيغة مفردة عبر http/https، أو None
+    """
+    formats = info_dict.get('formats') or []
+    if not formats:
+        return None
+
+    ctx = {
+        'formats': formats,
+        'has_merged_format': any('none' not in (f.get('acodec'), f.get('vcodec')) for f in formats),
+        'incomplete_formats': (
+            all(f.get('vcodec') == 'none' for f in formats)
+            or all(f.get('acodec') == 'none' for f in formats)
+        ),
+    }
+    selected = next(iter(ydl.build_format_selector(format_spec or 'best')(ctx)), None)
+
+    if not selected or selected.get('requested_formats'):
+        return None
+    if selected.get('protocol') not in _STREAM_PROTOCOLS:
+        return None
+    if 'none' in (selected.get('vcodec'), selected.get('acodec')):
+        return None
+    return selected.get('format_id')
+
+
+def _is_sequential(ext: str, head: bytes) -> bool:
+    """هل يمكن لـ ffmpeg قراءة الملف من pipe (من أول قطعة)"""
+    if ext in _SEQUENTIAL_EXTS:
+        return True
+    if ext not in _MP4_EXTS:
+        return False
+
+    # صناديق MP4 العليا: حجم (4 بايت) + نوع (4 بايت)
+    offset = 0
+    while offset + 8 <= len(head):
+        size = int.from_bytes(head[offset:offset + 4], 'big')
+        box = head[offset + 4:offset + 8]
+        if box == b'moov':
+            return True
+        if box == b'mdat':
+            return False
+        if size == 1 and offset + 16 <= len(head):
+            size = int.from_bytes(head[offset + 8:offset + 16], 'big')
+        if size < 8:
+            return False
+        offset += size
+    return False
+
+
+def _stop(process):
+    if process.poll() is None:
+        process.kill()
+    process.wait()
+    try:
+        process.stdin.close()
+    except OSError:
+        pass
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def stream_watermark(url: str, info_dict: dict, ydl_opts: dict, output_path: str, logo_path: str, cancel_token=None):
+    """
+    تحميل الفيديو وتمريره إلى ffmpeg مع اللوجو في خطوة واحدة
+
+    Args:
+        info_dict: نتيجة التحليل (formats) لاختيار الصيغة مسبقاً
+        ydl_opts: خيارات التحميل (format, cookies, headers...)
+        output_path: ملف الناتج الوحيد المكتوب على القرص
+
+    Returns:
+        str: مسار الناتج (بعد الضغط إذا تجاوز الحد)، أو None للرجوع للمسار العادي
+
+    Raises:
+        DownloadCancelled
+    """
+    opts = {k: v for k, v in ydl_opts.items() if k != 'progress_hooks'}
+
+    try:
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            format_id = select_stream_format(ydl, info_dict, opts.get('format'))
+        if format_id is None:
+            return None
+
+        # روابط الوسائط الموقعة لا تُحفظ في ذاكرة التحليل - تحليل جديد للصيغة المختارة
+        with yt_dlp.YoutubeDL({**opts, 'format': format_id}) as ydl:
+            info = ydl.extract_info(url, download=False)
+            selected = next(
+                (f for f in info.get('formats') or () if f.get('format_id') == format_id),
+                None
+            )
+            if not selected or not selected.get('url') or selected.get('protocol') not in _STREAM_PROTOCOLS:
+                return None
+
+            if cancel_token is not None:
+                cancel_token.check()
+
+            response = ydl.urlopen(Request(selected['url'], headers=selected.get('http_headers') or {}))
+            with response:
+                head = response.read(STREAM_CHUNK_SIZE)
+                if not _is_sequential(selected.get('ext'), head):
+                    logger.info(f"🌊 [stream] الصيغة {format_id} ({selected.get('ext')}) غير قابلة للتدفق - المسار العادي")
+                    return None
+
+                expected = int(response.headers.get('Content-Length') or 0)
+                return _encode(response, head, expected, output_path, logo_path, cancel_token)
+
+    except DownloadCancelled:
+        raise
+    except Exception as e:
+        logger.warning(f"⚠️ [stream] فشل التدفق، الرجوع للمسار العادي: {e}")
+        _remove(output_path)
+        return None
+
+
+def _encode(response, head: bytes, expected: int, output_path: str, logo_path: str, cancel_token):
+    """ضخ الاستجابة إلى ffmpeg حتى النهاية (مع فحص الإلغاء والمهلة)"""
+    animation_type, position, size_px, opacity = get_watermark_settings()
+    cmd = build_simple_watermark_cmd('pipe:0', output_path, logo_path, animation_type, size_px, position, opacity)
+
+    deadline = time.monotonic() + STREAM_TIMEOUT
+    written = 0
+    stopped = False
+
+    # stderr في ملف مؤقت حتى لا يمتلئ pipe ويتوقف ffmpeg أثناء الكتابة إليه
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr)
+        try:
+            import psutil
+            psutil.Process(process.pid).nice(3)
+        except Exception:
+            pass
+
+        try:
+            chunk = head
+            while chunk:
+                if (cancel_token is not None and cancel_token.cancelled) or time.monotonic() > deadline:
+                    stopped = True
+                    break
+                process.stdin.write(chunk)
+                written += len(chunk)
+                chunk = response.read(STREAM_CHUNK_SIZE)
+            process.stdin.close()
+        except BrokenPipeError:
+            # ffmpeg خرج مبكراً - السبب في stderr
+            pass
+        except BaseException:
+            _stop(process)
+            raise
+
+        while not stopped and process.poll() is None:
+            if (cancel_token is not None and cancel_token.cancelled) or time.monotonic() > deadline:
+                stopped = True
+                break
+            time.sleep(CANCEL_POLL_INTERVAL)
+        _stop(process)
+
+        if cancel_token is not None and cancel_token.cancelled:
+            logger.info("⛔ تم إيقاف التدفق بعد الإلغاء")
+            _remove(output_path)
+            cancel_token.check()
+
+        if stopped:
+            logger.error(f"❌ [stream] انتهت المهلة ({STREAM_TIMEOUT}s)")
+            _remove(output_path)
+            return None
+
+        if expected and written < expected:
+            logger.error(f"❌ [stream] تحميل ناقص ({written}/{expected} بايت)")
+            _remove(output_path)
+            return None
+
+        if process.returncode != 0 or not os.path.exists(output_path) or os.path.getsize(output_path) < 1000:
+            stderr.seek(0)
+            logger.error(f"❌ [stream] FFmpeg فشل ({process.returncode}): {stderr.read()[-500:].decode(errors='replace')}")
+            _remove(output_path)
+            return None
+
+    logger.info(f"🌊 [stream] تحميل + لوجو في خطوة واحدة: {written / 1024 / 1024:.2f}MB ← {os.path.getsize(output_path) / 1024 / 1024:.2f}MB")
+    return shrink_to_upload_limit(output_path, cancel_token)
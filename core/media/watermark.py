@@ -5,12 +5,76 @@ Watermark and logo overlay utilities using FFmpeg
 """
 
 import os
+import time
 import subprocess
 
+from yt_dlp.utils import DownloadCancelled
+
 from config.logger import get_logger
 
 logger = get_logger(__name__)
 
+# الفاصل (بالثواني) بين فحوصات الإلغاء أثناء تشغيل ffmpeg
+CANCEL_POLL_INTERVAL = 0.2
+
+
+def run_ffmpeg(cmd, timeout, cancel_token=None, niceness=0):
+    """
+    تشغيل ffmpeg مع إمكانية قتله فوراً عند الإلغاء
+
+    Args:
+        cmd: الأمر - آخر عنصر هو ملف الناتج (يُحذف إذا أُلغيت العملية)
+        timeout: المهلة بالثواني
+        cancel_token: CancelToken اختياري يُفحص كل CANCEL_POLL_INTERVAL
+        niceness: تقليل أولوية العملية (يتطلب psutil)
+
+    Returns:
+        subprocess.CompletedProcess
+
+    Raises:
+        subprocess.TimeoutExpired: بعد قتل العملية
+        DownloadCancelled: بعد قتل العملية وحذف الناتج الجزئي
+    """
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        cwd=os.getcwd()
+    )
+
+    if niceness:
+        try:
+            import psutil
+            psutil.Process(process.pid).nice(niceness)
+        except Exception:
+            pass
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            stdout, stderr = process.communicate(timeout=CANCEL_POLL_INTERVAL)
+            return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+        except subprocess.TimeoutExpired:
+            cancelled = cancel_token is not None and cancel_token.cancelled
+            if not cancelled and time.monotonic() < deadline:
+                continue
+
+            # wait() بدلاً من communicate() حتى لا ننتظر إغلاق الأنابيب
+            process.kill()
+            process.wait()
+            process.stdout.close()
+            process.stderr.close()
+            if not cancelled:
+                raise subprocess.TimeoutExpired(cmd, timeout)
+
+            logger.info("⛔ تم إيقاف FFmpeg بعد الإلغاء")
+            try:
+                os.remove(cmd[-1])
+            except OSError:
+                pass
+            cancel_token.check()
+
 
 def get_logo_overlay_position(position):
     """
@@ -100,7 +164,149 @@ def prepare_logo_for_processing(logo_path, max_size=500):
         return logo_path
 
 
-def apply_simple_watermark(input_path, output_path, logo_path, animation_type='corner_rotation', size=150, position='top_right', opacity=0.7):
+def build_simple_watermark_cmd(input_path, output_path, logo_path, animation_type, size, position, opacity):
+    """
+    بناء أمر ffmpeg للوجو (الحركة، الموضع، الشفافية، NVENC إن توفر)
+
+    input_path يمكن أن يكون pipe:0 لقراءة الفيديو من stdin (core/media/streaming.py)
+    """
+    # تحضير اللوجو (تصغيره إذا كان كبيراً جداً)
+    prepared_logo_path = prepare_logo_for_processing(logo_path, max_size=500)
+    logger.info(f"  - prepared_logo_path: {prepared_logo_path}")
+
+    # الحصول على إحداثيات الموضع المختار
+    pos_x, pos_y = get_logo_overlay_position(position)
+
+    # تحويل إلى string
+    if isinstance(pos_x, str):
+        overlay_x = pos_x
+    else:
+        overlay_x = str(pos_x)
+
+    if isinstance(pos_y, str):
+        overlay_y = pos_y
+    else:
+        overlay_y = str(pos_y)
+
+    # الشفافية
+    if opacity < 1.0:
+        opacity_filter = f"[1:v]scale={size}:-1,format=rgba,colorchannelmixer=aa={opacity}[logo]"
+    else:
+        opacity_filter = f"[1:v]scale={size}:-1,format=rgba[logo]"
+
+    # اختيار الحركة حسب النوع
+    if animation_type == 'static':
+        # 🔒 ثابت تماماً في الموضع المختار (لا يتحرك مطلقاً)
+        filter_complex = f"{opacity_filter};[0:v][logo]overlay={overlay_x}:{overlay_y}"
+        logger.info(f"🔒 تطبيق لوجو ثابت في الموضع: {position}")
+
+    elif animation_type == 'corner_rotation':
+        # 🔄 يتحرك بين 4 زوايا حول الموضع المختار
+        # إذا اختار "وسط" → يدور حول الوسط في مربع صغير
+        # إذا اختار "تحت" → يدور في الأسفل
+        filter_complex = (
+            f"{opacity_filter};"
+            "[0:v][logo]overlay="
+            f"x='{overlay_x}+if(lt(mod(n,240),60),-30,if(lt(mod(n,240),120),30,if(lt(mod(n,240),180),30,-30)))':"
+            f"y='{overlay_y}+if(lt(mod(n,240),60),-30,if(lt(mod(n,240),120),-30,if(lt(mod(n,240),180),30,30)))'"
+        )
+        logger.info(f"🔄 تطبيق حركة الزوايا في الموضع: {position}")
+
+    elif animation_type == 'bounce':
+        # ⬆️ يرتد حول الموضع المختار (دائرة صغيرة)
+        filter_complex = (
+            f"{opacity_filter};"
+            "[0:v][logo]overlay="
+            f"x='{overlay_x}+30*sin(n/20)':"
+            f"y='{overlay_y}+30*cos(n/20)'"
+        )
+        logger.info(f"⬆️ تطبيق حركة الارتداد في الموضع: {position}")
+
+    elif animation_type == 'slide':
+        # ➡️ ينزلق يميناً ويساراً حول الموضع المختار
+        filter_complex = (
+            f"{opacity_filter};"
+            "[0:v][logo]overlay="
+            f"x='{overlay_x}+50*sin(n/40)':"
+            f"y='{overlay_y}'"
+        )
+        logger.info(f"➡️ تطبيق حركة الانزلاق في الموضع: {position}")
+
+    elif animation_type == 'fade':
+        # 💫 ثابت في الموضع المختار مع تأثير التلاشي
+        filter_complex = f"{opacity_filter};[0:v][logo]overlay={overlay_x}:{overlay_y}"
+        logger.info(f"💫 تطبيق حركة التلاشي في الموضع: {position}")
+
+    elif animation_type == 'zoom':
+        # 🔍 ثابت في الموضع المختار مع تأثير التكبير
+        filter_complex = f"{opacity_filter};[0:v][logo]overlay={overlay_x}:{overlay_y}"
+        logger.info(f"🔍 تطبيق حركة التكبير في الموضع: {position}")
+
+    else:
+        # افتراضي - ثابت في الموضع المحدد
+        filter_complex = f"{opacity_filter};[0:v][logo]overlay={overlay_x}:{overlay_y}"
+        logger.info(f"⚪ تطبيق حركة افتراضية في الموضع: {position}")
+
+    # الأمر مع تحسينات الأداء والحجم
+    # ❌ تم إزالة -movflags +faststart لأنه يسبب حذف الملف المدخل
+    # المشكلة: عند فشل إعادة فتح الملف المخرج، FFmpeg يحذف الملف المدخل!
+
+    # محاولة استخدام hardware acceleration إن أمكن
+    hw_accel_cmd = []
+    try:
+        # التحقق الفعلي من NVENC (اختبار حقيقي وليس فقط الوجود في القائمة)
+        test_cmd = [
+            'ffmpeg', '-hide_banner', '-f', 'lavfi', '-i', 'color=black:s=64x64:d=0.1',
+            '-c:v', 'h264_nvenc', '-f', 'null', '-'
+        ]
+        nvenc_test = subprocess.run(
+            test_cmd,
+            capture_output=True, text=True, timeout=5
+        )
+
+        if nvenc_test.returncode == 0:
+            logger.info("🚀 [apply_simple_watermark] NVENC متاح ويعمل - استخدام hardware acceleration")
+            hw_accel_cmd = ['-c:v', 'h264_nvenc', '-preset', 'p4']  # p4 = medium quality/speed
+        else:
+            logger.debug("ℹ️ [apply_simple_watermark] NVENC غير متاح أو لا يعمل - استخدام CPU")
+            logger.debug(f"  - NVENC test stderr: {nvenc_test.stderr[:200]}")
+    except Exception as e:
+        logger.debug(f"ℹ️ [apply_simple_watermark] فشل فحص NVENC: {e}")
+        pass  # Silently fall back to CPU encoding
+
+    # بناء الأمر
+    cmd = [
+        'ffmpeg', '-y',
+        '-i', input_path,
+        '-i', prepared_logo_path,  # استخدام اللوجو المُحضَّر (المصغر إذا لزم الأمر)
+        '-filter_complex', filter_complex,
+        '-c:a', 'copy',  # نسخ الصوت بدون إعادة ترميز
+    ]
+
+    # إضافة إعدادات الفيديو (hardware أو software)
+    if hw_accel_cmd:
+        cmd.extend(hw_accel_cmd)
+        cmd.extend(['-b:v', '3M', '-maxrate', '4M', '-bufsize', '6M'])  # تحديد bitrate للحجم
+    else:
+        # Software encoding مع توازن أفضل
+        cmd.extend([
+            '-c:v', 'libx264',
+            '-preset', 'veryfast',  # توازن بين السرعة والحجم (أفضل من ultrafast)
+            '-crf', '24',  # جودة جيدة مع حجم معقول (23-28 نطاق جيد)
+            '-tune', 'film',  # تحسين للمحتوى العام
+            '-threads', '4',  # زيادة الخيوط قليلاً للسرعة
+        ])
+
+    cmd.extend([
+        # '-movflags', '+faststart',  # ❌ يسبب: Unable to re-open output file
+        '-shortest',
+        output_path
+    ])
+
+    return cmd
+
+
+def apply_simple_watermark(input_path, output_path, logo_path, animation_type='corner_rotation', size=150, position='top_right', opacity=0.7, cancel_token=None):
     """
     دالة موحدة ومبسطة لإضافة اللوجو - محسّنة للأداء
     جميع الحركات تحترم الموضع المختار من المستخدم
@@ -125,176 +331,12 @@ def apply_simple_watermark(input_path, output_path, logo_path, animation_type='c
         logger.info(f"  - logo_path: {logo_path}")
         logger.info(f"  - logo exists: {os.path.exists(logo_path)}")
 
-        # تحضير اللوجو (تصغيره إذا كان كبيراً جداً)
-        prepared_logo_path = prepare_logo_for_processing(logo_path, max_size=500)
-        logger.info(f"  - prepared_logo_path: {prepared_logo_path}")
-
-        # الحصول على إحداثيات الموضع المختار
-        pos_x, pos_y = get_logo_overlay_position(position)
-
-        # تحويل إلى string
-        if isinstance(pos_x, str):
-            overlay_x = pos_x
-        else:
-            overlay_x = str(pos_x)
-
-        if isinstance(pos_y, str):
-            overlay_y = pos_y
-        else:
-            overlay_y = str(pos_y)
-
-        # الشفافية
-        if opacity < 1.0:
-            opacity_filter = f"[1:v]scale={size}:-1,format=rgba,colorchannelmixer=aa={opacity}[logo]"
-        else:
-            opacity_filter = f"[1:v]scale={size}:-1,format=rgba[logo]"
-
-        # اختيار الحركة حسب النوع
-        if animation_type == 'static':
-            # 🔒 ثابت تماماً في الموضع المختار (لا يتحرك مطلقاً)
-            filter_complex = f"{opacity_filter};[0:v][logo]overlay={overlay_x}:{overlay_y}"
-            logger.info(f"🔒 تطبيق لوجو ثابت في الموضع: {position}")
-
-        elif animation_type == 'corner_rotation':
-            # 🔄 يتحرك بين 4 زوايا حول الموضع المختار
-            # إذا اختار "وسط" → يدور حول الوسط في مربع صغير
-            # إذا اختار "تحت" → يدور في الأسفل
-            filter_complex = (
-                f"{opacity_filter};"
-                "[0:v][logo]overlay="
-                f"x='{overlay_x}+if(lt(mod(n,240),60),-30,if(lt(mod(n,240),120),30,if(lt(mod(n,240),180),30,-30)))':"
-                f"y='{overlay_y}+if(lt(mod(n,240),60),-30,if(lt(mod(n,240),120),-30,if(lt(mod(n,240),180),30,30)))'"
-            )
-            logger.info(f"🔄 تطبيق حركة الزوايا في الموضع: {position}")
-
-        elif animation_type == 'bounce':
-            # ⬆️ يرتد حول الموضع المختار (دائرة صغيرة)
-            filter_complex = (
-                f"{opacity_filter};"
-                "[0:v][logo]overlay="
-                f"x='{overlay_x}+30*sin(n/20)':"
-                f"y='{overlay_y}+30*cos(n/20)'"
-            )
-            logger.info(f"⬆️ تطبيق حركة الارتداد في الموضع: {position}")
-
-        elif animation_type == 'slide':
-            # ➡️ ينزلق يميناً ويساراً حول الموضع المختار
-            filter_complex = (
-                f"{opacity_filter};"
-                "[0:v][logo]overlay="
-                f"x='{overlay_x}+50*sin(n/40)':"
-                f"y='{overlay_y}'"
-            )
-            logger.info(f"➡️ تطبيق حركة الانزلاق في الموضع: {position}")
-
-        elif animation_type == 'fade':
-            # 💫 ثابت في الموضع المختار مع تأثير التلاشي
-            filter_complex = f"{opacity_filter};[0:v][logo]overlay={overlay_x}:{overlay_y}"
-            logger.info(f"💫 تطبيق حركة التلاشي في الموضع: {position}")
-
-        elif animation_type == 'zoom':
-            # 🔍 ثابت في الموضع المختار مع تأثير التكبير
-            filter_complex = f"{opacity_filter};[0:v][logo]overlay={overlay_x}:{overlay_y}"
-            logger.info(f"🔍 تطبيق حركة التكبير في الموضع: {position}")
-
-        else:
-            # افتراضي - ثابت في الموضع المحدد
-            filter_complex = f"{opacity_filter};[0:v][logo]overlay={overlay_x}:{overlay_y}"
-            logger.info(f"⚪ تطبيق حركة افتراضية في الموضع: {position}")
-
-        # الأمر مع تحسينات الأداء والحجم
-        # ❌ تم إزالة -movflags +faststart لأنه يسبب حذف الملف المدخل
-        # المشكلة: عند فشل إعادة فتح الملف المخرج، FFmpeg يحذف الملف المدخل!
-
-        # محاولة استخدام hardware acceleration إن أمكن
-        hw_accel_cmd = []
-        try:
-            # التحقق الفعلي من NVENC (اختبار حقيقي وليس فقط الوجود في القائمة)
-            test_cmd = [
-                'ffmpeg', '-hide_banner', '-f', 'lavfi', '-i', 'color=black:s=64x64:d=0.1',
-                '-c:v', 'h264_nvenc', '-f', 'null', '-'
-            ]
-            nvenc_test = subprocess.run(
-                test_cmd,
-                capture_output=True, text=True, timeout=5
-            )
-
-            if nvenc_test.returncode == 0:
-                logger.info("🚀 [apply_simple_watermark] NVENC متاح ويعمل - استخدام hardware acceleration")
-                hw_accel_cmd = ['-c:v', 'h264_nvenc', '-preset', 'p4']  # p4 = medium quality/speed
-            else:
-                logger.debug("ℹ️ [apply_simple_watermark] NVENC غير متاح أو لا يعمل - استخدام CPU")
-                logger.debug(f"  - NVENC test stderr: {nvenc_test.stderr[:200]}")
-        except Exception as e:
-            logger.debug(f"ℹ️ [apply_simple_watermark] فشل فحص NVENC: {e}")
-            pass  # Silently fall back to CPU encoding
-
-        # بناء الأمر
-        cmd = [
-            'ffmpeg', '-y',
-            '-i', input_path,
-            '-i', prepared_logo_path,  # استخدام اللوجو المُحضَّر (المصغر إذا لزم الأمر)
-            '-filter_complex', filter_complex,
-            '-c:a', 'copy',  # نسخ الصوت بدون إعادة ترميز
-        ]
-
-        # إضافة إعدادات الفيديو (hardware أو software)
-        if hw_accel_cmd:
-            cmd.extend(hw_accel_cmd)
-            cmd.extend(['-b:v', '3M', '-maxrate', '4M', '-bufsize', '6M'])  # تحديد bitrate للحجم
-        else:
-            # Software encoding مع توازن أفضل
-            cmd.extend([
-                '-c:v', 'libx264',
-                '-preset', 'veryfast',  # توازن بين السرعة والحجم (أفضل من ultrafast)
-                '-crf', '24',  # جودة جيدة مع حجم معقول (23-28 نطاق جيد)
-                '-tune', 'film',  # تحسين للمحتوى العام
-                '-threads', '4',  # زيادة الخيوط قليلاً للسرعة
-            ])
-
-        cmd.extend([
-            # '-movflags', '+faststart',  # ❌ يسبب: Unable to re-open output file
-            '-shortest',
-            output_path
-        ])
+        cmd = build_simple_watermark_cmd(input_path, output_path, logo_path, animation_type, size, position, opacity)
 
         logger.info(f"🔄 تنفيذ FFmpeg ({animation_type} في الموضع {position})")
 
-        # تشغيل FFmpeg مع أولوية منخفضة لتقليل استهلاك CPU
-        try:
-            import psutil
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                cwd=os.getcwd()
-            )
-
-            # تقليل أولوية العملية
-            try:
-                p = psutil.Process(process.pid)
-                p.nice(3)  # أولوية منخفضة معتدلة (0-19، 19 الأدنى)
-            except Exception:
-                pass
-
-            # الانتظار حتى الانتهاء
-            stdout, stderr = process.communicate(timeout=300)
-            result = type('obj', (object,), {
-                'returncode': process.returncode,
-                'stdout': stdout,
-                'stderr': stderr
-            })()
-
-        except ImportError:
-            # إذا لم يكن psutil متاحاً، استخدم subprocess العادي
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=300,
-                cwd=os.getcwd()
-            )
+        # تشغيل FFmpeg مع أولوية منخفضة معتدلة (0-19، 19 الأدنى) لتقليل استهلاك CPU
+        result = run_ffmpeg(cmd, 300, cancel_token, niceness=3)
 
         if result.returncode != 0:
             logger.error(f"❌ FFmpeg فشل ({animation_type})")
@@ -317,6 +359,8 @@ def apply_simple_watermark(input_path, output_path, logo_path, animation_type='c
         logger.info(f"✨ نجح اللوجو ({animation_type} في {position})! {file_size/1024/1024:.2f}MB")
         return output_path
 
+    except DownloadCancelled:
+        raise
     except subprocess.TimeoutExpired:
         logger.error("❌ FFmpeg انتهت مهلته")
         return input_path
@@ -325,9 +369,87 @@ def apply_simple_watermark(input_path, output_path, logo_path, animation_type='c
         return input_path
 
 
-def apply_animated_watermark(input_path, output_path, logo_path, size=None):
+def get_watermark_settings(size=None):
+    """
+    إعدادات اللوجو من قاعدة البيانات (أو الافتراضية عند الفشل)
+
+    Returns:
+        tuple: (animation_type, position, size_px, opacity)
+    """
+    try:
+        from database import get_all_logo_settings
+        settings = get_all_logo_settings()
+
+        animation_type = settings.get('animation', 'corner_rotation')
+        position = settings.get('position', 'top_right')
+        size_px = settings.get('size_pixels', 150) if size is None else size
+        opacity = settings.get('opacity_decimal', 0.7)
+
+        logger.info(f"⚙️ إعدادات اللوجو: {animation_type}, {position}, {size_px}px, {int(opacity*100)}%")
+
+    except Exception as db_error:
+        logger.warning(f"⚠️ فشل قراءة إعدادات قاعدة البيانات: {db_error}")
+        # استخدام إعدادات افتراضية
+        animation_type = 'corner_rotation'
+        position = 'top_right'
+        size_px = 150 if size is None else size
+        opacity = 0.7
+        logger.info(f"⚙️ استخدام إعدادات افتراضية: {animation_type}, {position}, {size_px}px, {int(opacity*100)}%")
+
+    return animation_type, position, size_px, opacity
+
+
+def shrink_to_upload_limit(result_path, cancel_token=None, limit_mb=48):
+    """
+    ضغط الفيديو الناتج في مكانه إذا تجاوز limit_mb
+
+    Returns:
+        str: مسار الملف النهائي (نفس result_path عادةً)
+    """
+    # التحقق من حجم الملف الناتج
+    if os.path.exists(result_path):
+        file_size_mb = os.path.getsize(result_path) / 1024 / 1024
+        logger.info(f"📊 [shrink_to_upload_limit] حجم الفيديو بعد اللوجو: {file_size_mb:.2f}MB")
+
+        # إذا تجاوز 48MB، نضغطه تلقائياً
+        if file_size_mb > limit_mb:
+            logger.warning(f"⚠️ [shrink_to_upload_limit] الملف كبير جداً ({file_size_mb:.2f}MB) - بدء الضغط...")
+
+            # إنشاء مسار مؤقت للملف المضغوط
+            compressed_path = result_path.replace('.mp4', '_compressed.mp4')
+
+            # ضغط الفيديو
+            compressed_result = compress_video_smart(result_path, compressed_path, target_size_mb=limit_mb, max_attempts=3, cancel_token=cancel_token)
+
+            if compressed_result != result_path and os.path.exists(compressed_result):
+                # نجح الضغط - حذف الملف الكبير واستخدام المضغوط
+                compressed_size_mb = os.path.getsize(compressed_result) / 1024 / 1024
+                logger.info(f"✅ [shrink_to_upload_limit] تم الضغط بنجاح: {file_size_mb:.2f}MB → {compressed_size_mb:.2f}MB")
+
+                try:
+                    os.remove(result_path)
+                    logger.info(f"🗑️ [shrink_to_upload_limit] تم حذف الملف الكبير: {result_path}")
+                except Exception as e:
+                    logger.warning(f"⚠️ [shrink_to_upload_limit] فشل حذف الملف الكبير: {e}")
+
+                # نقل الملف المضغوط إلى المسار الأصلي
+                try:
+                    os.rename(compressed_result, result_path)
+                    logger.info(f"✅ [shrink_to_upload_limit] تم نقل الملف المضغوط إلى: {result_path}")
+                except Exception as e:
+                    logger.error(f"❌ [shrink_to_upload_limit] فشل نقل الملف: {e}")
+                    result_path = compressed_result
+            else:
+                logger.warning(f"⚠️ [shrink_to_upload_limit] فشل الضغط - استخدام الملف الأصلي")
+
+    return result_path
+
+
+def apply_animated_watermark(input_path, output_path, logo_path, size=None, cancel_token=None):
     """
     دالة رئيسية محدثة لإضافة اللوجو المتحرك - إصلاح FFmpeg
+
+    cancel_token (اختياري): يقتل ffmpeg ويرفع DownloadCancelled عند الإلغاء
     """
     logger.info(f"🎨 بدء معالجة اللوجو...")
     logger.info(f"  - input_path: {input_path}")
@@ -346,81 +468,31 @@ def apply_animated_watermark(input_path, output_path, logo_path, size=None):
     try:
         logger.info(f"✨ بدء إضافة اللوجو المتحرك: {input_path}")
 
-        # جلب جميع الإعدادات من قاعدة البيانات
-        try:
-            from database import get_all_logo_settings
-            settings = get_all_logo_settings()
-
-            animation_type = settings.get('animation', 'corner_rotation')
-            position = settings.get('position', 'top_right')
-            size_px = settings.get('size_pixels', 150) if size is None else size
-            opacity = settings.get('opacity_decimal', 0.7)
-
-            logger.info(f"⚙️ إعدادات اللوجو: {animation_type}, {position}, {size_px}px, {int(opacity*100)}%")
-
-        except Exception as db_error:
-            logger.warning(f"⚠️ فشل قراءة إعدادات قاعدة البيانات: {db_error}")
-            # استخدام إعدادات افتراضية
-            animation_type = 'corner_rotation'
-            position = 'top_right'
-            size_px = 150 if size is None else size
-            opacity = 0.7
-            logger.info(f"⚙️ استخدام إعدادات افتراضية: {animation_type}, {position}, {size_px}px, {int(opacity*100)}%")
+        animation_type, position, size_px, opacity = get_watermark_settings(size)
 
         # استخدام الدالة المبسطة الجديدة مع الإصلاح
-        result_path = apply_simple_watermark(input_path, output_path, logo_path, animation_type, size_px, position, opacity)
+        result_path = apply_simple_watermark(input_path, output_path, logo_path, animation_type, size_px, position, opacity, cancel_token)
 
         if result_path != input_path:
             logger.info(f"✨ تم تطبيق اللوجو بنجاح!")
 
-            # التحقق من حجم الملف الناتج
-            if os.path.exists(result_path):
-                file_size_mb = os.path.getsize(result_path) / 1024 / 1024
-                logger.info(f"📊 [apply_animated_watermark] حجم الفيديو بعد اللوجو: {file_size_mb:.2f}MB")
-
-                # إذا تجاوز 48MB، نضغطه تلقائياً
-                if file_size_mb > 48:
-                    logger.warning(f"⚠️ [apply_animated_watermark] الملف كبير جداً ({file_size_mb:.2f}MB) - بدء الضغط...")
-
-                    # إنشاء مسار مؤقت للملف المضغوط
-                    compressed_path = result_path.replace('.mp4', '_compressed.mp4')
-
-                    # ضغط الفيديو
-                    compressed_result = compress_video_smart(result_path, compressed_path, target_size_mb=48, max_attempts=3)
-
-                    if compressed_result != result_path and os.path.exists(compressed_result):
-                        # نجح الضغط - حذف الملف الكبير واستخدام المضغوط
-                        compressed_size_mb = os.path.getsize(compressed_result) / 1024 / 1024
-                        logger.info(f"✅ [apply_animated_watermark] تم الضغط بنجاح: {file_size_mb:.2f}MB → {compressed_size_mb:.2f}MB")
-
-                        try:
-                            os.remove(result_path)
-                            logger.info(f"🗑️ [apply_animated_watermark] تم حذف الملف الكبير: {result_path}")
-                        except Exception as e:
-                            logger.warning(f"⚠️ [apply_animated_watermark] فشل حذف الملف الكبير: {e}")
-
-                        # نقل الملف المضغوط إلى المسار الأصلي
-                        try:
-                            os.rename(compressed_result, result_path)
-                            logger.info(f"✅ [apply_animated_watermark] تم نقل الملف المضغوط إلى: {result_path}")
-                        except Exception as e:
-                            logger.error(f"❌ [apply_animated_watermark] فشل نقل الملف: {e}")
-                            result_path = compressed_result
-                    else:
-                        logger.warning(f"⚠️ [apply_animated_watermark] فشل الضغط - استخدام الملف الأصلي")
+            # إذا تجاوز 48MB، نضغطه تلقائياً
+            result_path = shrink_to_upload_limit(result_path, cancel_token)
 
             return result_path
         else:
             logger.warning(f"⚠️ فشل اللوجو المتحرك، محاولة اللوجو الثابت...")
-            return apply_watermark(input_path, output_path, logo_path, position, size)
+            return apply_watermark(input_path, output_path, logo_path, position, size, cancel_token)
 
+    except DownloadCancelled:
+        raise
     except Exception as e:
         logger.error(f"❌ خطأ عام في اللوجو المتحرك: {str(e)}")
         logger.error(f"تفاصيل الخطأ: {str(e)}")
-        return apply_watermark(input_path, output_path, logo_path, position, size)
+        return apply_watermark(input_path, output_path, logo_path, position, size, cancel_token)
 
 
-def compress_video_smart(input_path, output_path, target_size_mb=48, max_attempts=3):
+def compress_video_smart(input_path, output_path, target_size_mb=48, max_attempts=3, cancel_token=None):
     """
     ضغط ذكي للفيديو للوصول إلى حجم مستهدف
 
@@ -429,6 +501,7 @@ def compress_video_smart(input_path, output_path, target_size_mb=48, max_attempt
         output_path: مسار الفيديو المخرج
         target_size_mb: الحجم المستهدف بالميجابايت (افتراضي 48MB)
         max_attempts: عدد محاولات الضغط (افتراضي 3)
+        cancel_token: CancelToken اختياري لإيقاف الضغط عند الإلغاء
 
     Returns:
         str: مسار الملف المضغوط في حالة النجاح، أو input_path في حالة الفشل
@@ -502,7 +575,7 @@ def compress_video_smart(input_path, output_path, target_size_mb=48, max_attempt
             logger.info(f"🔄 [compress_video_smart] تشغيل FFmpeg...")
 
             start_time = time.time()
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
+            result = run_ffmpeg(cmd, 600, cancel_token)
             elapsed_time = time.time() - start_time
 
             logger.info(f"⏱️ [compress_video_smart] وقت المعالجة: {elapsed_time:.1f}s")
@@ -539,6 +612,8 @@ def compress_video_smart(input_path, output_path, target_size_mb=48, max_attempt
 
         return input_path
 
+    except DownloadCancelled:
+        raise
     except Exception as e:
         import traceback
         logger.error(f"❌ [compress_video_smart] خطأ حرج: {type(e).__name__}: {str(e)}")
@@ -546,7 +621,7 @@ def compress_video_smart(input_path, output_path, target_size_mb=48, max_attempt
         return input_path
 
 
-def apply_watermark(input_path, output_path, logo_path, position='center', size=150):
+def apply_watermark(input_path, output_path, logo_path, position='center', size=150, cancel_token=None):
     """
     يطبق لوجو ثابت على الفيديو (احتياطي محسّن)
     """
@@ -639,7 +714,7 @@ def apply_watermark(input_path, output_path, logo_path, position='center', size=
         ]
 
         logger.info(f"🔄 [apply_watermark] بدء المعالجة (timeout: {processing_timeout}s)")
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=processing_timeout)
+        result = run_ffmpeg(cmd, processing_timeout, cancel_token)
 
         if result.returncode == 0 and os.path.exists(output_path):
             file_size = os.path.getsize(output_path)
@@ -652,6 +727,8 @@ def apply_watermark(input_path, output_path, logo_path, position='center', size=
             logger.error(f"تفاصيل الخطأ: {result.stderr[:500]}")
         return input_path
 
+    except DownloadCancelled:
+        raise
     except Exception as e:
         logger.error(f"❌ خطأ: {e}")
         return input_path
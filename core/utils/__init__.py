@@ -67,6 +67,8 @@ from .helpers import (
     # Cleanup
     cleanup_temp_files,
     cleanup_old_files,
+    cleanup_job_dirs,
+    setup_temp_cleanup_job,
 )
 
 __all__ = [
@@ -127,4 +129,6 @@ __all__ = [
     # Cleanup
     'cleanup_temp_files',
     'cleanup_old_files',
+    'cleanup_job_dirs',
+    'setup_temp_cleanup_job',
 ]
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+الإلغاء التعاوني للتحميلات
+Cooperative download cancellation
+
+task.cancel() وحده يوقف الـ coroutine فقط، بينما يستمر yt-dlp في خيطه و ffmpeg
+في عمليته حتى النهاية. CancelToken يُمرر عبر مسار التحميل:
+
+    - progress_hook: يُضاف لـ yt-dlp ويرفع DownloadCancelled عند أول تحديث تقدم
+    - postprocessor_hook: نفس الفحص عند بدء/انتهاء كل معالج لاحق (دمج، استخراج صوت)
+    - check(): تفحصه حلقات ffmpeg (core/media/watermark.py) وتقتل العملية
+    - run(): يسابق أي awaitable (رفع، انتظار الطابور) ويلغيه فور الإلغاء
+    - run_in_executor(): ينتظر الخيط قليلاً بعد الإلغاء حتى تُحذف الملفات بأمان
+    - cleanup_partial_files(): يحذف الملفات الجزئية التي سجلها progress_hook
+
+الرموز النشطة لكل مستخدم مسجلة هنا حتى يلغيها /cancel.
+
+حدود وضع الخيوط (الافتراضي، YTDLP_PROCESS_POOL=0): لا يمكن قتل خيط Python، فالإلغاء
+يُلاحظ فقط عند استدعاء الـ hooks. أثناء FFmpegMerger / FFmpegExtractAudio تعمل
+ffmpeg من داخل yt-dlp دون hooks حتى تنتهي، والمقبس المتوقف لا يُطلق progress hook
+حتى socket_timeout. في الحالتين يعود التحكم للمستخدم بعد CANCEL_GRACE ويستمر
+الخيط في الخلفية حتى نقطة الفحص التالية (ثم تُحذف ملفاته مع مجلد المهمة).
+للإلغاء الفوري في كل المراحل يُستخدم وضع العمليات (YTDLP_PROCESS_POOL=1) الذي
+يقتل العامل مع ffmpeg التابعة له.
+"""
+
+import os
+import glob
+import asyncio
+import threading
+from collections import defaultdict
+from contextlib import suppress
+
+from yt_dlp.utils import DownloadCancelled
+
+from config.logger import get_logger
+
+logger = get_logger(__name__)
+
+# المدة التي يُنتظر فيها الخيط ليلاحظ الإلغاء قبل حذف ملفاته
+CANCEL_GRACE = 1.0
+
+# لواحق ملفات yt-dlp المؤقتة
+_PARTIAL_SUFFIXES = ('', '.part', '.ytdl')
+
+
+class CancelToken:
+    """رمز إلغاء آمن بين الخيوط"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._waiters = []
+        self.files = set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        """طلب الإلغاء (من event loop)"""
+        if self._event.is_set():
+            return
+        self._event.set()
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def check(self):
+        """رفع DownloadCancelled إذا طُلب الإلغاء (من أي خيط)"""
+        if self._event.is_set():
+            raise DownloadCancelled('تم الإلغاء بطلب المستخدم')
+
+    def progress_hook(self, d: dict):
+        """progress hook لـ yt-dlp: تسجيل الملفات الجزئية ثم فحص الإلغاء"""
+        for key in ('filename', 'tmpfilename'):
+            if d.get(key):
+                self.files.add(d[key])
+        self.check()
+
+    def postprocessor_hook(self, d: dict):
+        """postprocessor hook لـ yt-dlp: فحص الإلغاء قبل/بعد كل معالج لاحق"""
+        self.check()
+
+    async def run(self, awaitable):
+        """
+        انتظار awaitable مع إلغائه فور طلب الإلغاء
+
+        Raises:
+            DownloadCancelled
+        """
+        self.check()
+        task = asyncio.ensure_future(awaitable)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait({task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            self._waiters.remove(waiter)
+
+        if task.done():
+            return task.result()
+
+        task.cancel()
+        with suppress(asyncio.CancelledError, Exception):
+            await task
+        raise DownloadCancelled('تم الإلغاء بطلب المستخدم')
+
+    async def run_in_executor(self, executor, func, *args):
+        """
+        تشغيل دالة متزامنة تفحص هذا الرمز في خيط، مع انتظار توقفها بعد الإلغاء
+        (حتى CANCEL_GRACE ثانية) قبل إرجاع التحكم للمستدعي
+        """
+        future = asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        try:
+            return await self.run(asyncio.shield(future))
+        except (DownloadCancelled, asyncio.CancelledError):
+            self.cancel()
+            await asyncio.wait({future}, timeout=CANCEL_GRACE)
+            # نتيجة الخيط لم تعد مطلوبة (غالباً DownloadCancelled)
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            raise
+
+    def cleanup_partial_files(self) -> int:
+        """حذف الملفات الجزئية والأجزاء (Frag) التي كتبها yt-dlp"""
+        removed = 0
+        for path in self.files:
+            candidates = [path + suffix for suffix in _PARTIAL_SUFFIXES]
+            candidates += glob.glob(glob.escape(path) + '-Frag*')
+            for candidate in candidates:
+                if os.path.isfile(candidate):
+                    try:
+                        os.remove(candidate)
+                        removed += 1
+                    except OSError as e:
+                        logger.warning(f"⚠️ فشل حذف ملف جزئي {candidate}: {e}")
+        if removed:
+            logger.info(f"🗑️ تم حذف {removed} ملف جزئي بعد الإلغاء")
+        return removed
+
+
+# ==================== سجل الرموز النشطة ====================
+
+_active_tokens = defaultdict(set)  # user_id -> {CancelToken}
+
+
+def register_cancel_token(user_id: int, token: CancelToken):
+    _active_tokens[user_id].add(token)
+
+
+def unregister_cancel_token(user_id: int, token: CancelToken):
+    tokens = _active_tokens.get(user_id)
+    if tokens is None:
+        return
+    tokens.discard(token)
+    if not tokens:
+        del _active_tokens[user_id]
+
+
+def cancel_user_downloads(user_id: int) -> int:
+    """
+    إلغاء جميع تحميلات المستخدم الجارية
+
+    Returns:
+        int: عدد التحميلات الملغاة
+    """
+    tokens = _active_tokens.pop(user_id, set())
+    for token in tokens:
+        token.cancel()
+    return len(tokens)
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+ذاكرة تسليم الملفات عبر Telegram file_id
+Telegram file_id delivery cache
+
+كل طلب لملف أُرسل سابقاً كان يكرر التحميل → اللوجو → الضغط → الرفع بالكامل.
+بعد أول إرسال ناجح يُحفظ file_id الرسالة بمفتاح:
+    (معرف الوسائط الموحد، الجودة، صوت/فيديو، نسخة اللوجو)
+نسخة اللوجو بصمة لإعدادات العرض (الحركة، الموضع، الحجم، الشفافية) ولملف
+اللوجو، فتغيير أي منها من لوحة الأدمن يُنشئ مفاتيح جديدة ولا تُرسل النسخ القديمة.
+والطلب المتكرر يُجاب فوراً بـ send_video / send_audio / send_document بالـ file_id.
+
+الطبقات: LRU داخل الذاكرة + مجموعة delivery_cache في MongoDB (تبقى بعد إعادة
+التشغيل). إذا فُقدت المجموعة يمكن إعادة بنائها من قناة الفيديوهات: رسالة
+التفاصيل في القناة تحمل وسم التسليم (المفتاح + file_id)، و
+rebuild_delivery_cache() يقرأ رسائل القناة ويعيد تسجيلها.
+
+الطلبات المتزامنة لنفس المفتاح قبل اكتمال أول إرسال تنتظر التحميل الجاري
+(download_flights) بدلاً من تحميل ثانٍ، ثم تُجاب بالـ file_id الناتج.
+"""
+
+import os
+import re
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from config.logger import get_logger
+from core.utils.extraction_cache import canonical_url
+from core.utils.single_flight import SingleFlight
+
+logger = get_logger(__name__)
+
+# عدد المدخلات في طبقة الذاكرة
+DELIVERY_CACHE_SIZE = int(os.getenv("DELIVERY_CACHE_SIZE", "2048"))
+
+# وسم التسليم داخل رسالة التفاصيل في قناة الفيديوهات
+DELIVERY_TAG = '#delivery'
+_DELIVERY_TAG_RE = re.compile(re.escape(DELIVERY_TAG) + r'\s+(\S+)\s+(\S+)\s+(\w+)')
+
+
+# ==================== المفتاح ====================
+
+def media_id(info_dict: dict, url: str) -> str:
+    """معرف الوسائط الموحد: extractor:id، أو الرابط الموحد إذا لم يتوفر"""
+    extractor = (info_dict.get('extractor_key') or info_dict.get('extractor') or '').lower()
+    video_id = info_dict.get('id')
+    if extractor and video_id:
+        return f"{extractor}:{video_id}"
+    return canonical_url(url)
+
+
+# حقول logo_settings التي تغير شكل الفيديو الناتج (enabled و target لا تغيره)
+_LOGO_RENDER_FIELDS = ('animation_type', 'position', 'size', 'size_pixels', 'opacity', 'opacity_decimal')
+
+
+def logo_variant(logo_settings: dict, logo_path: str) -> str:
+    """
+    نسخة اللوجو في مفتاح التسليم: logo-<بصمة إعدادات العرض + حجم وتاريخ ملف اللوجو>
+    """
+    render = tuple((field, (logo_settings or {}).get(field)) for field in _LOGO_RENDER_FIELDS)
+    try:
+        stat = os.stat(logo_path)
+        logo_file = (stat.st_size, stat.st_mtime_ns)
+    except (OSError, TypeError):
+        logo_file = None
+    digest = hashlib.sha1(repr((render, logo_file)).encode()).hexdigest()[:10]
+    return f"logo-{digest}"
+
+
+def delivery_cache_key(info_dict: dict, url: str, quality: str, is_audio: bool, variant: str = None) -> str:
+    """
+    مفتاح التسليم: نوع|معرف الوسائط|الجودة|نسخة اللوجو (بدون مسافات)
+
+    Args:
+        variant: نتيجة logo_variant() للنسخة مع لوجو، أو None للنسخة بدونه
+    """
+    kind = 'a' if is_audio else 'v'
+    return f"{kind}|{media_id(info_dict, url)}|{quality or 'auto'}|{variant or 'clean'}".replace(' ', '_')
+
+
+# ==================== طبقة الذاكرة ====================
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # key -> {'file_id', 'type', 'file_size'}
+_stats = {'memory_hits': 0, 'persistent_hits': 0, 'misses': 0, 'stores': 0, 'invalid': 0}
+
+# التحميلات الجارية حسب مفتاح التسليم - outcome المنفذ: (entry, None) أو (None, error)
+download_flights = SingleFlight('download')
+
+
+def _count(name: str):
+    with _lock:
+        _stats[name] += 1
+
+
+def _memory_put(key: str, entry: dict):
+    with _lock:
+        _entries[key] = entry
+        _entries.move_to_end(key)
+        while len(_entries) > DELIVERY_CACHE_SIZE:
+            _entries.popitem(last=False)
+
+
+async def get_delivery(key: str):
+    """
+    البحث عن ملف مرسل سابقاً
+
+    Returns:
+        dict: {'file_id', 'type', 'file_size'} أو None
+    """
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            _entries.move_to_end(key)
+            _stats['memory_hits'] += 1
+            return entry
+
+    from database import run_db, get_cached_delivery
+    entry = await run_db(get_cached_delivery, key)
+    if entry and entry.get('file_id'):
+        _memory_put(key, entry)
+        _count('persistent_hits')
+        return entry
+
+    _count('misses')
+    return None
+
+
+def media_entry(message) -> dict:
+    """استخراج file_id ونوع الملف من رسالة مرسلة (None إذا لم تحتوِ ملفاً)"""
+    if message is None:
+        return None
+    for media_type in ('video', 'audio', 'document'):
+        media = getattr(message, media_type, None)
+        if media is not None:
+            return {'file_id': media.file_id, 'type': media_type, 'file_size': media.file_size or 0}
+    return None
+
+
+def remember_delivery(key: str, message) -> dict:
+    """حفظ file_id الرسالة المرسلة في الطبقتين"""
+    entry = media_entry(message)
+    if entry is None:
+        return None
+
+    _memory_put(key, entry)
+    _count('stores')
+
+    from database import store_cached_delivery
+    store_cached_delivery(key, entry)
+    return entry
+
+
+def forget_delivery(key: str):
+    """حذف مدخل رفضه Telegram (file_id غير صالح)"""
+    with _lock:
+        _entries.pop(key, None)
+        _stats['invalid'] += 1
+
+    from database import delete_cached_delivery
+    delete_cached_delivery(key)
+
+
+# ==================== الإرسال ====================
+
+async def send_cached_media(bot, chat_id: int, key: str, entry: dict, caption: str, reply_to_message_id: int = None):
+    """
+    إرسال الملف بالـ file_id بدون رفع
+
+    Returns:
+        Message أو None إذا رفض Telegram المعرّف (يُحذف المدخل) أو فشل الاتصال
+        (يبقى المدخل) - في الحالتين يُكمل المستدعي بالتحميل العادي
+    """
+    send = {
+        'video': lambda: bot.send_video(
+            chat_id=chat_id, video=entry['file_id'], caption=caption[:1024],
+            reply_to_message_id=reply_to_message_id, supports_streaming=True
+        ),
+        'audio': lambda: bot.send_audio(
+            chat_id=chat_id, audio=entry['file_id'], caption=caption[:1024],
+            reply_to_message_id=reply_to_message_id
+        ),
+        'document': lambda: bot.send_document(
+            chat_id=chat_id, document=entry['file_id'], caption=caption[:1024],
+            reply_to_message_id=reply_to_message_id
+        ),
+    }.get(entry.get('type'))
+
+    if send is None:
+        forget_delivery(key)
+        return None
+
+    try:
+        return await send()
+    except BadRequest as e:
+        logger.warning(f"⚠️ file_id مرفوض من Telegram ({key}): {e}")
+        forget_delivery(key)
+        return None
+    except NetworkError as e:
+        # TimedOut وأخطاء الشبكة: المعرّف صالح، فقط هذا الإرسال فشل
+        logger.warning(f"⚠️ فشل الإرسال من الذاكرة ({key}): {e} - الرجوع للتحميل العادي")
+        return None
+
+
+# ==================== إعادة البناء من قناة الفيديوهات ====================
+
+def delivery_tag(key: str, message) -> str:
+    """سطر الوسم الذي يُضاف لرسالة التفاصيل في القناة (فارغ إذا لم تحتوِ الرسالة ملفاً)"""
+    entry = media_entry(message)
+    if not key or entry is None:
+        return ''
+    return f"{DELIVERY_TAG} {key} {entry['file_id']} {entry['type']}"
+
+
+def parse_delivery_tag(text: str):
+    """
+    قراءة وسم التسليم من نص رسالة
+
+    Returns:
+        tuple: (key, entry) أو None
+    """
+    match = _DELIVERY_TAG_RE.search(text or '')
+    if not match:
+        return None
+    key, file_id, media_type = match.groups()
+    return key, {'file_id': file_id, 'type': media_type, 'file_size': 0}
+
+
+async def rebuild_delivery_cache(bot, channel_id: int, scratch_chat_id: int, last_message_id: int, count: int = 200) -> int:
+    """
+    إعادة بناء الذاكرة من آخر count رسالة في قناة الفيديوهات
+
+    Bot API لا يتيح قراءة سجل القناة، لذلك تُحوّل كل رسالة إلى scratch_chat_id
+    (محادثة المدير) لقراءة نصها ثم تُحذف النسخة فوراً.
+
+    Args:
+        bot: كائن البوت
+        channel_id: VIDEOS_CHANNEL_ID
+        scratch_chat_id: محادثة مؤقتة لقراءة الرسائل
+        last_message_id: معرف آخر رسالة في القناة
+        count: عدد الرسائل المفحوصة
+
+    Returns:
+        int: عدد المدخلات المستعادة
+    """
+    restored = 0
+    seen = set()
+    first = max(1, last_message_id - count + 1)
+
+    for message_id in range(last_message_id, first - 1, -1):
+        try:
+            copy = await bot.forward_message(
+                chat_id=scratch_chat_id,
+                from_chat_id=channel_id,
+                message_id=message_id,
+                disable_notification=True
+            )
+        except RetryAfter as e:
+            # تجاوز حد Telegram - الانتظار ثم إعادة المحاولة مرة واحدة
+            await asyncio.sleep(e.retry_after)
+            try:
+                copy = await bot.forward_message(
+                    chat_id=scratch_chat_id,
+                    from_chat_id=channel_id,
+                    message_id=message_id,
+                    disable_notification=True
+                )
+            except Exception:
+                continue
+        except BadRequest:
+            # رسالة محذوفة أو غير قابلة للتحويل
+            continue
+        except Exception as e:
+            logger.warning(f"⚠️ [delivery-rebuild] توقف عند الرسالة {message_id}: {e}")
+            break
+
+        parsed = parse_delivery_tag(copy.text)
+        try:
+            await bot.delete_message(chat_id=scratch_chat_id, message_id=copy.message_id)
+        except Exception:
+            pass
+
+        # الفحص من الأحدث للأقدم - أول وسم لكل مفتاح هو الأحدث
+        if parsed and parsed[0] not in seen:
+            key, entry = parsed
+            seen.add(key)
+            _memory_put(key, entry)
+            from database import store_cached_delivery
+            store_cached_delivery(key, entry)
+            restored += 1
+
+        # حد Telegram للرسائل في نفس المحادثة
+        await asyncio.sleep(0.5)
+
+    logger.info(f"✅ [delivery-rebuild] تمت استعادة {restored} مدخل من {last_message_id - first + 1} رسالة")
+    return restored
+
+
+def get_delivery_cache_stats() -> dict:
+    """عدادات الإصابة والإخفاق وحجم طبقة الذاكرة"""
+    with _lock:
+        stats = dict(_stats)
+        stats['size'] = len(_entries)
+
+    hits = stats['memory_hits'] + stats['persistent_hits']
+    lookups = hits + stats['misses']
+    stats['hit_rate'] = hits / lookups if lookups else 0.0
+    stats['in_flight'] = download_flights.stats()['in_flight']
+    stats['coalesced'] = download_flights.followers
+    return stats
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+ذاكرة مؤقتة لنتائج استخراج الروابط (extract_info)
+URL-keyed extraction metadata cache
+
+كل تحليل رابط كان يستدعي ydl.extract_info(url, download=False) من الصفر، فرابط
+منتشر يرسله مئات المستخدمين يعني مئات الطلبات للمنصة وانتظار ثوانٍ لكل مستخدم.
+
+المفتاح: الرابط الموحد (بدون معاملات التتبع) + بصمة الخيارات المؤثرة في الاستخراج.
+الطبقات:
+    1. LRU داخل الذاكرة (EXTRACTION_CACHE_SIZE مدخل)
+    2. MongoDB اختيارياً (EXTRACTION_CACHE_PERSIST=1) - مشتركة بين العمليات
+
+مدة الصلاحية حسب المنصة (EXTRACTION_CACHE_TTLS)، ولا تتجاوز انتهاء الروابط
+الموقعة داخل النتيجة (expire / x-expires / oe ...).
+النتيجة المحفوظة نسخة مختصرة: الحقول التي يستخدمها مسار التحميل فقط، بدون
+روابط الوسائط والـ headers.
+"""
+
+import os
+import copy
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from config.logger import get_logger
+from core.utils.ytdlp_runner import ytdlp_extract
+from core.utils.single_flight import SingleFlight
+
+logger = get_logger(__name__)
+
+# عدد المدخلات في طبقة الذاكرة
+EXTRACTION_CACHE_SIZE = int(os.getenv("EXTRACTION_CACHE_SIZE", "512"))
+
+# طبقة MongoDB الاختيارية
+EXTRACTION_CACHE_PERSIST = os.getenv("EXTRACTION_CACHE_PERSIST", "0") == "1"
+
+# مدة الصلاحية الافتراضية (بالثواني) للمنصات غير المذكورة أدناه
+EXTRACTION_CACHE_DEFAULT_TTL = int(os.getenv("EXTRACTION_CACHE_TTL", "1800"))
+
+# مدة الصلاحية لكل منصة (بالثواني)
+EXTRACTION_CACHE_TTLS = {
+    'youtube': 3 * 3600,
+    'tiktok': 1800,
+    'instagram': 1800,
+    'facebook': 1800,
+    'twitter': 3600,
+    'pinterest': 6 * 3600,
+    'reddit': 3600,
+    'vimeo': 3600,
+    'dailymotion': 3600,
+    'twitch': 600,
+}
+
+# هامش قبل انتهاء الروابط الموقعة، وأقل مدة تستحق الحفظ
+SIGNED_URL_MARGIN = 300
+MIN_CACHE_TTL = 60
+
+# ==================== الرابط الموحد ====================
+
+_PLATFORM_HOSTS = (
+    ('youtube', ('youtube.com', 'youtu.be')),
+    ('tiktok', ('tiktok.com',)),
+    ('instagram', ('instagram.com',)),
+    ('facebook', ('facebook.com', 'fb.watch', 'fb.com')),
+    ('twitter', ('twitter.com', 'x.com')),
+    ('pinterest', ('pinterest.com', 'pin.it')),
+    ('reddit', ('reddit.com',)),
+    ('vimeo', ('vimeo.com',)),
+    ('dailymotion', ('dailymotion.com',)),
+    ('twitch', ('twitch.tv',)),
+)
+
+# معاملات تتبع ومشاركة لا تغير المحتوى
+_TRACKING_PARAMS = {
+    'si', 'feature', 'igshid', 'igsh', 'fbclid', 'gclid', 'mibextid', 'rdid',
+    'share_app_id', 'sender_device', 'is_from_webapp', 'ref_src', 'ref_url',
+}
+_PLATFORM_TRACKING_PARAMS = {
+    'youtube': {'t', 'pp', 'ab_channel'},
+    'twitter': {'t', 's'},
+    'tiktok': {'_r', '_t', 'lang'},
+}
+
+# خيارات yt-dlp التي تغير نتيجة الاستخراج
+_KEY_OPTIONS = ('extract_flat', 'format', 'cookiefile', 'noplaylist', 'playlist_items', 'extractor_args', 'ignoreerrors')
+
+
+def platform_from_host(host: str) -> str:
+    """اسم المنصة من اسم النطاق ('unknown' إذا لم تكن معروفة)"""
+    for platform, domains in _PLATFORM_HOSTS:
+        if any(host == d or host.endswith('.' + d) for d in domains):
+            return platform
+    return 'unknown'
+
+
+def canonical_url(url: str) -> str:
+    """
+    توحيد الرابط: نطاق بأحرف صغيرة بدون www/m، بدون معاملات التتبع والـ fragment،
+    وروابط youtu.be و shorts تتحول إلى watch?v=
+    """
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or '').lower()
+    for prefix in ('www.', 'm.', 'mobile.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+
+    platform = platform_from_host(host)
+    path = parts.path.rstrip('/') or '/'
+    dropped = _TRACKING_PARAMS | _PLATFORM_TRACKING_PARAMS.get(platform, set())
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k not in dropped and not k.startswith('utm_')
+    ]
+
+    if platform == 'youtube':
+        video_id = None
+        if host == 'youtu.be':
+            video_id = path.strip('/')
+        elif path.startswith('/shorts/'):
+            video_id = path[len('/shorts/'):]
+        if video_id:
+            host, path = 'youtube.com', '/watch'
+            query = [('v', video_id)] + [(k, v) for k, v in query if k != 'v']
+    elif host == 'x.com':
+        host = 'twitter.com'
+
+    return urlunsplit(('https', host, path, urlencode(sorted(query)), ''))
+
+
+def extraction_cache_key(url: str, ydl_opts: dict) -> str:
+    """مفتاح الذاكرة: الرابط الموحد + بصمة الخيارات المؤثرة"""
+    relevant = {name: ydl_opts.get(name) for name in _KEY_OPTIONS if ydl_opts.get(name) is not None}
+    fingerprint = hashlib.sha1(json.dumps(relevant, sort_keys=True, default=str).encode()).hexdigest()[:12]
+    return f"{canonical_url(url)}|{fingerprint}"
+
+
+# ==================== تقليص النتيجة ====================
+
+# الحقول التي يستخدمها مسار التحميل (العنوان، المدة، اسم الملف، التقارير، كشف منشورات الصور)
+_INFO_FIELDS = (
+    'id', 'title', 'duration', 'ext', 'extractor', 'extractor_key', 'ie_key', '_type',
+    'webpage_url', 'original_url', 'thumbnail', 'uploader', 'uploader_id', 'channel',
+    'view_count', 'like_count', 'width', 'height', 'filesize', 'filesize_approx',
+    'format_id', 'vcodec', 'acodec',
+)
+_FORMAT_FIELDS = (
+    'format_id', 'format_note', 'ext', 'protocol', 'vcodec', 'acodec', 'width', 'height',
+    'fps', 'tbr', 'vbr', 'abr', 'filesize', 'filesize_approx',
+)
+
+
+def trim_info(info: dict) -> dict:
+    """نسخة مختصرة من نتيجة extract_info بدون روابط الوسائط الموقعة"""
+    trimmed = {k: info[k] for k in _INFO_FIELDS if info.get(k) is not None}
+
+    # في entries المسطحة (extract_flat) حقل url هو رابط صفحة الفيديو وليس رابط وسائط
+    if info.get('_type') in ('url', 'url_transparent') and info.get('url'):
+        trimmed['url'] = info['url']
+
+    if info.get('formats'):
+        trimmed['formats'] = [
+            {k: f[k] for k in _FORMAT_FIELDS if f.get(k) is not None}
+            for f in info['formats'] if f
+        ]
+
+    if info.get('entries') is not None:
+        trimmed['entries'] = [trim_info(e) if e else None for e in info['entries']]
+
+    return trimmed
+
+
+_EXPIRY_PARAMS = ('expire', 'expires', 'x-expires')
+
+
+def _iter_media_urls(info: dict):
+    if info.get('url'):
+        yield info['url']
+    for key in ('formats', 'requested_formats'):
+        for f in info.get(key) or ():
+            if f and f.get('url'):
+                yield f['url']
+    for entry in info.get('entries') or ():
+        if isinstance(entry, dict):
+            yield from _iter_media_urls(entry)
+
+
+def signed_url_expiry(info: dict):
+    """
+    أقرب وقت انتهاء للروابط الموقعة داخل النتيجة
+
+    Returns:
+        datetime أو None إذا لم تحتوِ الروابط على وقت انتهاء
+    """
+    earliest = None
+    for media_url in _iter_media_urls(info):
+        try:
+            params = {k.lower(): v for k, v in parse_qsl(urlsplit(media_url).query)}
+        except ValueError:
+            continue
+
+        stamp = None
+        for name in _EXPIRY_PARAMS:
+            if params.get(name, '').isdigit():
+                stamp = int(params[name])
+                break
+        else:
+            # روابط CDN فيسبوك/إنستغرام: oe بالنظام الست عشري
+            try:
+                stamp = int(params['oe'], 16) if 'oe' in params else None
+            except ValueError:
+                stamp = None
+
+        if stamp and (earliest is None or stamp < earliest):
+            earliest = stamp
+
+    return datetime.fromtimestamp(earliest) if earliest else None
+
+
+def _expires_at(url: str, info: dict):
+    """وقت انتهاء الصلاحية، أو None إذا كانت المدة المتبقية أقصر من أن تُحفظ"""
+    now = datetime.now()
+    platform = platform_from_host((urlsplit(canonical_url(url)).hostname or ''))
+    expires_at = now + timedelta(seconds=EXTRACTION_CACHE_TTLS.get(platform, EXTRACTION_CACHE_DEFAULT_TTL))
+
+    signed = signed_url_expiry(info)
+    if signed:
+        expires_at = min(expires_at, signed - timedelta(seconds=SIGNED_URL_MARGIN))
+
+    if (expires_at - now).total_seconds() < MIN_CACHE_TTL:
+        return None
+    return expires_at
+
+
+# ==================== طبقة الذاكرة ====================
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # key -> (info, expires_at)
+# الطلبات المتزامنة لنفس المفتاح تنتظر استخراجاً واحداً
+_flights = SingleFlight('extraction')
+
+_stats = {
+    'memory_hits': 0,
+    'persistent_hits': 0,
+    'misses': 0,
+    'stores': 0,
+    'uncacheable': 0,
+    'evictions': 0,
+}
+
+
+def _count(name: str):
+    with _lock:
+        _stats[name] += 1
+
+
+def _memory_get(key: str):
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return None
+        info, expires_at = entry
+        if expires_at <= datetime.now():
+            del _entries[key]
+            return None
+        _entries.move_to_end(key)
+        return info
+
+
+def _memory_put(key: str, info: dict, expires_at: datetime):
+    with _lock:
+        _entries[key] = (info, expires_at)
+        _entries.move_to_end(key)
+        while len(_entries) > EXTRACTION_CACHE_SIZE:
+            _entries.popitem(last=False)
+            _stats['evictions'] += 1
+
+
+# ==================== الواجهة ====================
+
+async def extract_info_cached(url: str, ydl_opts: dict) -> dict:
+    """
+    بديل ydl.extract_info(url, download=False) مع ذاكرة مؤقتة
+
+    Args:
+        url: رابط الفيديو أو القائمة
+        ydl_opts: خيارات yt-dlp المستخدمة للاستخراج
+
+    Returns:
+        dict: نسخة مختصرة من النتيجة (trim_info) - الأخطاء لا تُحفظ وتُرفع كما هي
+    """
+    key = extraction_cache_key(url, ydl_opts)
+
+    info = _memory_get(key)
+    if info is not None:
+        _count('memory_hits')
+        return copy.deepcopy(info)
+
+    info = await _flights.run(key, lambda: _lookup_or_extract(key, url, ydl_opts))
+    return copy.deepcopy(info)
+
+
+async def _lookup_or_extract(key: str, url: str, ydl_opts: dict) -> dict:
+    """الطبقة الدائمة ثم yt-dlp (تُنفذ مرة واحدة لكل مجموعة طلبات متزامنة)"""
+    info = _memory_get(key)
+    if info is not None:
+        _count('memory_hits')
+        return info
+
+    if EXTRACTION_CACHE_PERSIST:
+        from database import run_db, get_cached_extraction
+        cached = await run_db(get_cached_extraction, key)
+        if cached:
+            info, expires_at = cached
+            _memory_put(key, info, expires_at)
+            _count('persistent_hits')
+            return info
+
+    _count('misses')
+    raw = await ytdlp_extract(url, ydl_opts)
+
+    info = trim_info(raw)
+    expires_at = _expires_at(url, raw)
+    if expires_at is None:
+        _count('uncacheable')
+        return info
+
+    _memory_put(key, info, expires_at)
+    _count('stores')
+    if EXTRACTION_CACHE_PERSIST:
+        from database import store_cached_extraction
+        store_cached_extraction(key, info, platform_from_host(urlsplit(key).hostname or ''), expires_at)
+
+    return info
+
+
+def clear_extraction_cache(platform: str = None) -> int:
+    """
+    حذف النتائج المحفوظة (يستدعيها CookieManager بعد رفع أو حذف كوكيز منصة)
+
+    Returns:
+        int: عدد المدخلات المحذوفة من طبقة الذاكرة
+    """
+    with _lock:
+        keys = [
+            k for k in _entries
+            if platform is None or platform_from_host(urlsplit(k).hostname or '') == platform
+        ]
+        for k in keys:
+            del _entries[k]
+
+    if EXTRACTION_CACHE_PERSIST:
+        from database import clear_cached_extractions
+        clear_cached_extractions(platform)
+
+    return len(keys)
+
+
+def get_extraction_cache_stats() -> dict:
+    """عدادات الإصابة والإخفاق وحجم طبقة الذاكرة"""
+    with _lock:
+        stats = dict(_stats)
+        stats['size'] = len(_entries)
+
+    hits = stats['memory_hits'] + stats['persistent_hits']
+    lookups = hits + stats['misses']
+    stats['hit_rate'] = hits / lookups if lookups else 0.0
+    stats['persistent'] = EXTRACTION_CACHE_PERSIST
+    stats['coalesced'] = _flights.followers
+    return stats
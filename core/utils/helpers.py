@@ -992,12 +992,71 @@ def setup_error_tracking_job(application):
 #  Temporary Files Cleanup System
 # ═══════════════════════════════════════════════════════════════
 
+# مجلدات التحميل المؤقتة لكل مهمة (videos/job_* و downloads/multi_* و downloads/story_*)
+# تُحذف في finally، وتبقى فقط إذا توقف البوت أثناء المهمة
+JOB_DIR_PATTERNS = ("videos/job_*", "downloads/multi_*", "downloads/story_*")
+
+# عمر مجلد المهمة (بالساعات) الذي يُعتبر بعده متروكاً - لا توجد مهمة تعمل كل هذا الوقت
+JOB_DIR_MAX_AGE_HOURS = float(os.getenv("JOB_DIR_MAX_AGE_HOURS", "6"))
+
+# فترة تشغيل التنظيف الدوري (بالدقائق)
+TEMP_CLEANUP_INTERVAL_MINUTES = int(os.getenv("TEMP_CLEANUP_INTERVAL_MINUTES", "60"))
+
+
+def _last_activity(path: str) -> float:
+    """
+    آخر تعديل داخل المجلد (المجلد نفسه أو أي ملف فيه)
+
+    ملف .part الذي يكبر لا يغيّر mtime المجلد، لذا يُفحص كل ما بداخله
+    """
+    latest = os.path.getmtime(path)
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                latest = max(latest, os.path.getmtime(os.path.join(root, name)))
+            except OSError:
+                continue
+    return latest
+
+
+def cleanup_job_dirs(max_age_seconds: float = None) -> int:
+    """
+    حذف مجلدات المهام المتروكة
+
+    Args:
+        max_age_seconds: يُحذف المجلد إذا لم يتغير شيء فيه منذ هذه المدة
+                         (None = حذف الكل، عند إيقاف البوت حيث لا توجد مهام تعمل)
+
+    Returns:
+        int: عدد المجلدات المحذوفة
+    """
+    import glob
+    import shutil
+
+    current_time = time()
+    cleaned_count = 0
+
+    for pattern in JOB_DIR_PATTERNS:
+        for job_dir in glob.glob(pattern):
+            try:
+                if not os.path.isdir(job_dir):
+                    continue
+                if max_age_seconds is not None and current_time - _last_activity(job_dir) <= max_age_seconds:
+                    continue
+                shutil.rmtree(job_dir)
+                cleaned_count += 1
+            except Exception as e:
+                logger.debug(f"تعذر حذف {job_dir}: {e}")
+
+    return cleaned_count
+
+
 def cleanup_temp_files():
     """تنظيف الملفات المؤقتة عند إيقاف البوت"""
     import glob
 
     try:
-        cleaned_count = 0
+        cleaned_count = cleanup_job_dirs()
 
         # تنظيف ملفات الفيديو المؤقتة
         for temp_file in glob.glob("videos/*"):
@@ -1028,6 +1087,7 @@ def cleanup_temp_files():
 def cleanup_old_files(max_age_hours: int = 24):
     """
     تنظيف الملفات القديمة (أكبر من max_age_hours ساعة)
+    ومجلدات المهام المتروكة (أقدم من JOB_DIR_MAX_AGE_HOURS)
 
     Args:
         max_age_hours: العمر الأقصى للملفات بالساعات (افتراضي: 24 ساعة)
@@ -1037,7 +1097,7 @@ def cleanup_old_files(max_age_hours: int = 24):
     try:
         current_time = time()
         max_age_seconds = max_age_hours * 3600
-        cleaned_count = 0
+        cleaned_count = cleanup_job_dirs(JOB_DIR_MAX_AGE_HOURS * 3600)
 
         # تنظيف ملفات الفيديو القديمة
         for temp_file in glob.glob("videos/*"):
@@ -1071,6 +1131,40 @@ def cleanup_old_files(max_age_hours: int = 24):
         return 0
 
 
+async def cleanup_temp_files_job(context):
+    """
+    مهمة دورية: حذف مجلدات المهام المتروكة (مثلاً بعد توقف مفاجئ)
+
+    لا تستدعي cleanup_old_files لأنها تحذف ملفات الكوكيز التي يضعها الأدمن
+    """
+    import asyncio
+    cleaned_count = await asyncio.to_thread(cleanup_job_dirs, JOB_DIR_MAX_AGE_HOURS * 3600)
+    if cleaned_count > 0:
+        logger.info(f"🗑️ تم حذف {cleaned_count} مجلد مهمة متروك")
+
+
+def setup_temp_cleanup_job(application):
+    """
+    إعداد مهمة التنظيف الدوري لمجلدات المهام المتروكة
+
+    Args:
+        application: كائن Application من python-telegram-bot
+    """
+    job_queue = application.job_queue
+
+    if job_queue:
+        # أول تشغيل بعد دقيقة من البدء ينظف ما تركه التشغيل السابق
+        job_queue.run_repeating(
+            cleanup_temp_files_job,
+            interval=TEMP_CLEANUP_INTERVAL_MINUTES * 60,
+            first=60,
+            name='temp_files_cleanup'
+        )
+        logger.info(f"✅ تم جدولة تنظيف مجلدات المهام المتروكة (كل {TEMP_CLEANUP_INTERVAL_MINUTES} دقيقة)")
+    else:
+        logger.warning("⚠️ job_queue غير متاح، لن يتم جدولة تنظيف مجلدات المهام المتروكة")
+
+
 # تسجيل دالة التنظيف عند إغلاق البوت
 import atexit
 atexit.register(cleanup_temp_files)
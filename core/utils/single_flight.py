@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+تجميع الطلبات المتزامنة المتطابقة (single-flight)
+Single-flight coalescing
+
+عندما يرسل عدة مستخدمين نفس الرابط في نفس الوقت، الطلب الأول فقط ينفذ العمل
+(الاستخراج أو التحميل) وباقي الطلبات تنتظر نتيجته بدلاً من تكراره.
+
+النتيجة (outcome) لكل رحلة:
+    (result, None)  نجاح
+    (None, error)   فشل - يُرفع عند المنتظرين مغلفاً في SharedFlightError
+    None            أُلغي المنفذ - أول منتظر يعيد المحاولة بنفسه
+
+يعمل داخل event loop واحد، فلا يحتاج قفلاً.
+"""
+
+import asyncio
+
+
+class SharedFlightError(Exception):
+    """
+    فشل المنفذ كما يصل للمنتظرين
+
+    النص نفس نص الخطأ الأصلي (رسائل المستخدم تُختار حسبه)، والخطأ الأصلي في
+    error. المنفذ وحده يسجل الخطأ ويبلغ عنه، والمنتظرون يتخطون البلاغات عند
+    هذا النوع حتى لا يتكرر البلاغ لكل طلب متزامن.
+    """
+
+    def __init__(self, error: Exception):
+        super().__init__(str(error))
+        self.error = error
+
+
+class SingleFlight:
+    """سجل الرحلات الجارية حسب المفتاح"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def get(self, key):
+        """الرحلة الجارية لهذا المفتاح أو None"""
+        return self._flights.get(key)
+
+    def begin(self, key) -> asyncio.Future:
+        """تسجيل المستدعي كمنفذ للمفتاح (يجب استدعاء end في finally)"""
+        flight = asyncio.get_running_loop().create_future()
+        self._flights[key] = flight
+        self.leaders += 1
+        return flight
+
+    def end(self, key, flight: asyncio.Future, outcome=None):
+        """إنهاء الرحلة وإيقاظ المنتظرين (استدعاء ثانٍ لنفس الرحلة لا يفعل شيئاً)"""
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.done():
+            flight.set_result(outcome)
+
+    async def wait(self, flight: asyncio.Future):
+        """
+        انتظار رحلة جارية
+
+        إلغاء المنتظر لا يلغي المنفذ (shield).
+
+        Returns:
+            outcome الرحلة (انظر أعلى الملف)
+        """
+        self.followers += 1
+        return await asyncio.shield(flight)
+
+    async def run(self, key, func):
+        """
+        تنفيذ func() مرة واحدة لكل مجموعة طلبات متزامنة بنفس المفتاح
+
+        Args:
+            key: مفتاح الرحلة
+            func: دالة بدون معاملات تعيد coroutine
+
+        Returns:
+            نتيجة func (نفس الكائن لجميع المنتظرين)
+
+        Raises:
+            خطأ func عند المنفذ، و SharedFlightError عند المنتظرين
+        """
+        while True:
+            flight = self.get(key)
+            if flight is None:
+                break
+            outcome = await self.wait(flight)
+            if outcome is not None:
+                result, error = outcome
+                if error is not None:
+                    raise SharedFlightError(error) from error
+                return result
+
+        flight = self.begin(key)
+        outcome = None
+        try:
+            result = await func()
+            outcome = (result, None)
+            return result
+        except Exception as e:
+            outcome = (None, e)
+            raise
+        finally:
+            self.end(key, flight, outcome)
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': len(self._flights),
+            'leaders': self.leaders,
+            'followers': self.followers,
+        }
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+تشغيل yt-dlp خارج event loop
+yt-dlp execution backends
+
+الوضع الافتراضي: مجمع الخيوط الافتراضي (loop.run_in_executor) كما كان سابقاً.
+
+وضع العمليات (YTDLP_PROCESS_POOL=1): كل استخراج/تحميل يُنفذ في عملية عامل
+منفصلة (ytdlp_worker.py) والنتيجة تعود عبر pipe:
+    - تحليل JS والـ JSON الضخم لا ينافس event loop على الـ GIL
+    - ذاكرة الـ extractors لا تتراكم في عملية البوت
+    - العامل يُستبدل بعد YTDLP_WORKER_MAX_JOBS مهمة أو إذا تجاوزت ذاكرته
+      YTDLP_WORKER_MAX_RSS_MB
+    - العامل العالق (تجاوز المهلة) أو المهمة الملغاة تُقتل مع عملياتها الفرعية
+      (ffmpeg)، لذلك إلغاء CancelToken في هذا الوضع يقتل العامل مباشرة
+
+progress_hooks تبقى في العملية الرئيسية وتستقبل إطارات التقدم من العامل.
+"""
+
+import os
+import sys
+import pickle
+import signal
+import asyncio
+
+from yt_dlp.utils import DownloadError
+
+from config.logger import get_logger
+from core.utils.ytdlp_worker import extract_job, download_job
+
+logger = get_logger(__name__)
+
+# تفعيل وضع العمليات
+YTDLP_PROCESS_POOL = os.getenv("YTDLP_PROCESS_POOL", "0") == "1"
+
+# عدد العمال، وحدود استبدال العامل
+YTDLP_POOL_SIZE = int(os.getenv("YTDLP_POOL_SIZE", "4"))
+YTDLP_WORKER_MAX_JOBS = int(os.getenv("YTDLP_WORKER_MAX_JOBS", "50"))
+YTDLP_WORKER_MAX_RSS_MB = int(os.getenv("YTDLP_WORKER_MAX_RSS_MB", "400"))
+
+# مهلة المهمة في وضع العمليات (بالثواني) - بعدها يُقتل العامل
+YTDLP_EXTRACT_TIMEOUT = int(os.getenv("YTDLP_EXTRACT_TIMEOUT", "120"))
+YTDLP_DOWNLOAD_TIMEOUT = int(os.getenv("YTDLP_DOWNLOAD_TIMEOUT", "1800"))
+
+_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ytdlp_worker.py')
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(_WORKER_SCRIPT)))
+
+# خيارات تعيش في العملية الرئيسية فقط (دوال لا تُنقل عبر pickle)
+_LOCAL_OPTIONS = ('progress_hooks', 'postprocessor_hooks', 'logger', 'match_filter')
+
+
+# ==================== العامل ====================
+
+class _Worker:
+    """عملية عامل واحدة مع قناة الطلبات/الردود"""
+
+    def __init__(self, process):
+        self.process = process
+        self.jobs = 0
+
+    async def request(self, body: bytes, on_progress=None):
+        """إرسال طلب وانتظار الرد النهائي (إطارات التقدم تُمرر لـ on_progress)"""
+        self.process.stdin.write(len(body).to_bytes(4, 'big') + body)
+        await self.process.stdin.drain()
+
+        while True:
+            header = await self.process.stdout.readexactly(4)
+            frame = pickle.loads(await self.process.stdout.readexactly(int.from_bytes(header, 'big')))
+            if frame[0] != 'progress':
+                return frame
+            if on_progress is not None:
+                try:
+                    on_progress(frame[1])
+                except Exception as e:
+                    logger.debug(f"progress hook: {e}")
+
+    def kill(self):
+        """قتل العامل مع عملياته الفرعية (ffmpeg الخارجي)"""
+        if self.process.returncode is not None:
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError, AttributeError):
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass
+
+    async def close(self):
+        """إنهاء هادئ: إغلاق stdin ثم القتل إذا لم يخرج"""
+        try:
+            self.process.stdin.close()
+            await asyncio.wait_for(self.process.wait(), 5)
+        except Exception:
+            self.kill()
+            await self.process.wait()
+
+
+class YtdlpProcessPool:
+    """مجمع عمال yt-dlp مع استبدال حسب عدد المهام والذاكرة"""
+
+    def __init__(self, size: int, max_jobs: int, max_rss: int):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss
+        self._slots = asyncio.Semaphore(size)
+        self._idle = []
+        self._busy = set()
+        self._stats = {'jobs': 0, 'spawned': 0, 'recycled_jobs': 0, 'recycled_memory': 0, 'killed': 0}
+
+    async def _spawn(self) -> _Worker:
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(p for p in (_PROJECT_ROOT, env.get('PYTHONPATH')) if p)
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, _WORKER_SCRIPT,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            cwd=_PROJECT_ROOT,
+            env=env,
+            # مجموعة عمليات خاصة حتى يُقتل ffmpeg الخارجي مع العامل
+            start_new_session=True,
+        )
+        self._stats['spawned'] += 1
+        return _Worker(process)
+
+    def _retire(self, worker: _Worker, reason: str):
+        self._stats[reason] += 1
+        asyncio.create_task(worker.close())
+
+    async def run(self, request: dict, on_progress=None, timeout: float = None):
+        """
+        تنفيذ طلب في عامل متاح
+
+        Returns:
+            payload الرد
+
+        Raises:
+            DownloadError / RuntimeError بنفس رسالة الخطأ في العامل
+            asyncio.TimeoutError إذا تجاوز المهلة (يُقتل العامل)
+        """
+        body = pickle.dumps(request, protocol=pickle.HIGHEST_PROTOCOL)
+
+        async with self._slots:
+            worker = self._idle.pop() if self._idle else await self._spawn()
+            self._busy.add(worker)
+            try:
+                frame = await asyncio.wait_for(worker.request(body, on_progress), timeout)
+            except BaseException:
+                # مهلة أو إلغاء أو عامل مات - حالته غير معروفة، فيُقتل
+                self._stats['killed'] += 1
+                worker.kill()
+                asyncio.create_task(worker.process.wait())
+                raise
+            finally:
+                self._busy.discard(worker)
+
+            self._stats['jobs'] += 1
+            worker.jobs += 1
+            rss = frame[-1]
+            if rss > self.max_rss:
+                logger.info(f"♻️ استبدال عامل yt-dlp (ذاكرة {rss / 1024 / 1024:.0f}MB)")
+                self._retire(worker, 'recycled_memory')
+            elif worker.jobs >= self.max_jobs:
+                self._retire(worker, 'recycled_jobs')
+            else:
+                self._idle.append(worker)
+
+        if frame[0] == 'error':
+            _, error_type, message, _ = frame
+            if error_type == 'DownloadError':
+                raise DownloadError(message)
+            raise RuntimeError(f"{error_type}: {message}")
+        return frame[1]
+
+    async def shutdown(self):
+        """إنهاء جميع العمال"""
+        idle, self._idle = self._idle, []
+        for worker in self._busy:
+            worker.kill()
+        await asyncio.gather(*(w.close() for w in idle), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            'size': self.size,
+            'idle': len(self._idle),
+            'busy': len(self._busy),
+        }
+
+
+_pool = None
+
+
+def _get_pool() -> YtdlpProcessPool:
+    global _pool
+    if _pool is None:
+        _pool = YtdlpProcessPool(YTDLP_POOL_SIZE, YTDLP_WORKER_MAX_JOBS, YTDLP_WORKER_MAX_RSS_MB * 1024 * 1024)
+    return _pool
+
+
+def _remote_options(ydl_opts: dict):
+    """
+    فصل الخيارات القابلة للإرسال عن الدوال المحلية
+
+    Returns:
+        tuple: (opts للعامل, progress_hooks المحلية) أو None إذا احتوت الخيارات
+        على قيم لا تُنقل عبر pickle (تُنفذ المهمة عندها بالخيوط)
+    """
+    opts = {k: v for k, v in ydl_opts.items() if k not in _LOCAL_OPTIONS}
+    try:
+        pickle.dumps(opts)
+    except Exception:
+        return None
+    return opts, list(ydl_opts.get('progress_hooks') or ())
+
+
+def _relay(hooks):
+    if not hooks:
+        return None
+
+    def on_progress(d):
+        for hook in hooks:
+            hook(d)
+    return on_progress
+
+
+# ==================== الواجهة ====================
+
+async def ytdlp_extract(url: str, ydl_opts: dict) -> dict:
+    """ydl.extract_info(url, download=False) عبر الوضع المفعل"""
+    remote = _remote_options(ydl_opts) if YTDLP_PROCESS_POOL else None
+    if remote is None:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, extract_job, url, ydl_opts)
+
+    opts, _ = remote
+    return await _get_pool().run(
+        {'op': 'extract', 'url': url, 'opts': opts, 'progress': False},
+        timeout=YTDLP_EXTRACT_TIMEOUT
+    )
+
+
+async def ytdlp_download(url: str, ydl_opts: dict, cancel_token=None, summary: bool = False):
+    """
+    تحميل الرابط عبر الوضع المفعل
+
+    Args:
+        cancel_token: CancelToken اختياري - في وضع الخيوط يُفحص من progress و
+            postprocessor hooks فقط (ffmpeg الدمج لا يُقاطع، انظر cancellation.py)،
+            وفي وضع العمليات يُقتل العامل فور الإلغاء
+        summary: إرجاع ملخص info_dict (id, title, duration, uploader) مع المسارات
+
+    Returns:
+        list: مسارات الملفات النهائية (requested_downloads ثم الصور المصغرة المكتوبة)،
+        أو (list, dict) مع summary
+
+    Raises:
+        DownloadCancelled إذا أُلغي التحميل
+    """
+    if cancel_token is not None:
+        ydl_opts = {
+            **ydl_opts,
+            'progress_hooks': [*(ydl_opts.get('progress_hooks') or ()), cancel_token.progress_hook],
+            'postprocessor_hooks': [*(ydl_opts.get('postprocessor_hooks') or ()), cancel_token.postprocessor_hook],
+        }
+
+    remote = _remote_options(ydl_opts) if YTDLP_PROCESS_POOL else None
+    if remote is None:
+        if cancel_token is not None:
+            return await cancel_token.run_in_executor(None, download_job, url, ydl_opts, summary)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, download_job, url, ydl_opts, summary)
+
+    opts, hooks = remote
+    job = _get_pool().run(
+        {'op': 'download', 'url': url, 'opts': opts, 'progress': bool(hooks), 'summary': summary},
+        on_progress=_relay(hooks),
+        timeout=YTDLP_DOWNLOAD_TIMEOUT
+    )
+    if cancel_token is not None:
+        return await cancel_token.run(job)
+    return await job
+
+
+def get_ytdlp_pool_stats() -> dict:
+    """عدادات مجمع العمليات (None إذا كان وضع الخيوط مفعلاً)"""
+    if not YTDLP_PROCESS_POOL:
+        return None
+    return _get_pool().stats()
+
+
+async def shutdown_ytdlp_pool():
+    """إنهاء عمال yt-dlp عند إيقاف البوت"""
+    if _pool is not None:
+        await _pool.shutdown()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+عملية عامل yt-dlp منفصلة
+yt-dlp worker process
+
+تُشغَّل كسكربت مستقل (python core/utils/ytdlp_worker.py) من ytdlp_runner حتى لا
+تستورد البوت ولا قاعدة البيانات - فقط yt-dlp.
+
+البروتوكول عبر stdin/stdout: إطارات pickle مسبوقة بطولها (4 بايت big-endian).
+    الطلب:   {'op': 'extract' | 'download', 'url': str, 'opts': dict, 'progress': bool, 'summary': bool}
+    الردود:  ('progress', dict) ...
+             ('result', payload, rss)
+             ('error', type_name, message, rss)
+
+مخرجات yt-dlp العادية (stdout) تُحوَّل إلى stderr حتى لا تختلط بالإطارات.
+إغلاق stdin ينهي العامل.
+"""
+
+import os
+import sys
+import pickle
+import struct
+
+import yt_dlp
+
+_HEADER = struct.Struct('>I')
+
+# حقول إطار التقدم المرسلة للعملية الرئيسية (القيم البسيطة فقط)
+_PROGRESS_SCALARS = (str, int, float, bool, type(None))
+
+# حقول info_dict المعادة مع مسارات التحميل عند طلب summary
+_SUMMARY_FIELDS = ('id', 'title', 'duration', 'uploader')
+
+
+# ==================== وظائف yt-dlp (مشتركة مع وضع الخيوط) ====================
+
+def extract_job(url: str, opts: dict) -> dict:
+    """extract_info بدون تحميل"""
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        return ydl.extract_info(url, download=False)
+
+
+def download_job(url: str, opts: dict, summary: bool = False):
+    """
+    تحميل الرابط
+
+    Args:
+        summary: إرجاع ملخص info_dict (_SUMMARY_FIELDS) مع المسارات
+
+    Returns:
+        list: مسارات الملفات النهائية (بعد الدمج والمعالجة) من requested_downloads،
+        ثم الصور المصغرة المكتوبة (writethumbnail) - أو (list, dict) مع summary
+    """
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(url, download=True) or {}
+        paths = []
+        for item in [info, *(info.get('entries') or ())]:
+            paths += _output_paths(item or {})
+        if not paths and info:
+            paths.append(ydl.prepare_filename(info))
+
+    if summary:
+        return paths, {k: info.get(k) for k in _SUMMARY_FIELDS}
+    return paths
+
+
+def _output_paths(info: dict) -> list:
+    """الملفات التي كتبها yt-dlp لعنصر واحد (بدون فحص المجلد)"""
+    paths = [d['filepath'] for d in info.get('requested_downloads') or () if d.get('filepath')]
+    # الصور المصغرة قد تُحذف بعد تضمينها (EmbedThumbnail)
+    paths += [
+        t['filepath'] for t in info.get('thumbnails') or ()
+        if t.get('filepath') and os.path.exists(t['filepath'])
+    ]
+    return paths
+
+
+def progress_snapshot(d: dict) -> dict:
+    """نسخة قابلة للإرسال من قاموس التقدم (بدون info_dict)"""
+    return {k: v for k, v in d.items() if k != 'info_dict' and isinstance(v, _PROGRESS_SCALARS)}
+
+
+def rss_bytes() -> int:
+    """الذاكرة المستخدمة حالياً من هذه العملية"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        try:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        except ImportError:
+            return 0
+
+
+# ==================== حلقة العامل ====================
+
+def _read_frame(stream):
+    header = stream.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    (length,) = _HEADER.unpack(header)
+    return pickle.loads(stream.read(length))
+
+
+def _write_frame(stream, frame):
+    body = pickle.dumps(frame, protocol=pickle.HIGHEST_PROTOCOL)
+    stream.write(_HEADER.pack(len(body)) + body)
+    stream.flush()
+
+
+def main():
+    # stdout الأصلي للإطارات فقط، وكل ما يطبعه yt-dlp يذهب إلى stderr
+    channel = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    requests = sys.stdin.buffer
+
+    while True:
+        request = _read_frame(requests)
+        if request is None:
+            return
+
+        opts = dict(request['opts'])
+        if request.get('progress'):
+            opts['progress_hooks'] = [lambda d: _write_frame(channel, ('progress', progress_snapshot(d)))]
+
+        try:
+            if request['op'] == 'extract':
+                payload = yt_dlp.YoutubeDL.sanitize_info(extract_job(request['url'], opts))
+            else:
+                payload = download_job(request['url'], opts, request.get('summary', False))
+            frame = ('result', payload, rss_bytes())
+        except Exception as e:
+            frame = ('error', type(e).__name__, str(e), rss_bytes())
+
+        _write_frame(channel, frame)
+
+
+if __name__ == '__main__':
+    main()
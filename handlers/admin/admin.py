@@ -13,7 +13,8 @@ from telegram.ext import (
 from datetime import datetime, timedelta
 
 from database import (
-    get_all_users,
+    get_recent_users,
+    get_users_count,
     get_user,
     add_subscription,
     is_admin,
@@ -25,7 +26,10 @@ from database import (
     is_subscription_enabled,
     is_welcome_broadcast_enabled,
     get_daily_download_stats,
-    generate_daily_report
+    generate_daily_report,
+    async_get_user_by_username,
+    async_search_users_by_username,
+    aiter_user_batches
 )
 from utils import get_message, escape_markdown, admin_only, validate_user_id, validate_days, log_warning
 from handlers.cookie_manager import confirm_delete_all_cookies_callback, cancel_delete_cookies_callback
@@ -318,19 +322,17 @@ async def show_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    all_users = get_all_users()
-    total_users = len(all_users)
-    
-    vip_users = [u for u in all_users if u.get('subscription_end')]
-    total_vip = len(vip_users)
+    users_count = get_users_count()
+    total_users = users_count['total']
+    total_vip = users_count['vip']
     
     total_downloads = get_total_downloads_count()
     
     stats_text = (
         "📊 **إحصائيات البوت**\n\n"
         f"👥 إجمالي المستخدمين: `{total_users}`\n"
-        f"⭐ مشتركين VIP: `{total_vip}`\n"
-        f"🆓 مستخدمين مجانيين: `{total_users - total_vip}`\n"
+        f"⭐ مشتركين VIP نشطين: `{total_vip}`\n"
+        f"🆓 بدون اشتراك نشط: `{total_users - total_vip}`\n"
         f"📥 إجمالي التحميلات: `{total_downloads}`\n\n"
         f"📅 التاريخ: {datetime.now().strftime('%Y-%m-%d %H:%M')}"
     )
@@ -419,6 +421,17 @@ async def admin_add_subscription_start(update: Update, context: ContextTypes.DEF
 
     return AWAITING_USER_ID
 
+async def _username_suggestions(prefix: str, limit: int = 5) -> str:
+    """أسماء مستخدمين تبدأ بنفس الأحرف (عند عدم وجود تطابق تام)"""
+    users, _next = await async_search_users_by_username(prefix, limit=limit)
+    if not users:
+        return ""
+
+    lines = "\n".join(
+        f"• @{u.get('username')} - {u.get('user_id')}" for u in users
+    )
+    return f"🔎 هل تقصد:\n{lines}\n\n"
+
 async def receive_user_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """استقبال معرف المستخدم أو اليوزر نيم"""
     # التحقق من الوضع: إلغاء اشتراك أم إضافة اشتراك
@@ -433,17 +446,15 @@ async def receive_user_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if user_input.startswith('@') or not user_input.isdigit():
         username = user_input.replace('@', '')  # إزالة @ إذا وجدت
 
-        # البحث عن المستخدم بالـ username
-        all_users = get_all_users()
-        for user in all_users:
-            if user.get('username') == username:
-                user_id = user.get('user_id')
-                user_data = user
-                break
+        # البحث عن المستخدم بالـ username (استعلام واحد على الفهرس)
+        user_data = await async_get_user_by_username(username)
+        if user_data:
+            user_id = user_data.get('user_id')
 
         if not user_id:
             await update.message.reply_text(
                 f"❌ لم أجد مستخدم بالـ username: {username}\n\n"
+                f"{await _username_suggestions(username)}"
                 f"💡 تأكد من:\n"
                 f"• اليوزر نيم صحيح\n"
                 f"• المستخدم أرسل /start للبوت"
@@ -610,17 +621,15 @@ async def receive_user_id_for_cancel(update: Update, context: ContextTypes.DEFAU
     if user_input.startswith('@') or not user_input.isdigit():
         username = user_input.replace('@', '')
 
-        # البحث عن المستخدم بالـ username
-        all_users = get_all_users()
-        for user in all_users:
-            if user.get('username') == username:
-                user_id = user.get('user_id')
-                user_data = user
-                break
+        # البحث عن المستخدم بالـ username (استعلام واحد على الفهرس)
+        user_data = await async_get_user_by_username(username)
+        if user_data:
+            user_id = user_data.get('user_id')
 
         if not user_id:
             await update.message.reply_text(
                 f"❌ لم أجد مستخدم بالـ username: {username}\n\n"
+                f"{await _username_suggestions(username)}"
                 f"💡 تأكد من:\n"
                 f"• اليوزر نيم صحيح\n"
                 f"• المستخدم أرسل /start للبوت"
@@ -751,15 +760,15 @@ async def list_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    all_users = get_all_users()
+    recent_users = get_recent_users(20)
     
-    if not all_users:
+    if not recent_users:
         await query.edit_message_text("📭 لا يوجد مستخدمين حالياً")
         return MAIN_MENU
     
     users_text = "👥 قائمة المستخدمين (آخر 20)\n\n"
     
-    for idx, user in enumerate(all_users[-20:], 1):
+    for idx, user in enumerate(recent_users, 1):
         user_id = user.get('user_id')
         name = user.get('full_name', 'غير معروف')[:20]
         username = user.get('username', 'لا يوجد')
@@ -1487,6 +1496,7 @@ async def receive_platform_cookie_file(update: Update, context: ContextTypes.DEF
         # التحقق من صحة الكوكيز
         from handlers.cookie_manager import cookie_manager
         validation = cookie_manager.validate_cookie_file(file_path, platform)
+        cookie_manager.invalidate_extractions(platform)
 
         if validation.get('valid', False):
             message_text = (
@@ -1907,9 +1917,6 @@ async def handle_sub_enable_notify_yes(update: Update, context: ContextTypes.DEF
         await query.answer("✅ تم تفعيل نظام الاشتراك بنجاح!", show_alert=True)
 
         # إرسال إشعار لجميع المستخدمين
-        from database import get_all_users
-        all_users = get_all_users()
-
         welcome_text = (
             "💎 **نظام الاشتراك VIP تم تفعيله!**\n\n"
             "✨ ستحصل قريباً على مزايا إضافية مثل:\n"
@@ -1920,17 +1927,18 @@ async def handle_sub_enable_notify_yes(update: Update, context: ContextTypes.DEF
         success_count = 0
         fail_count = 0
 
-        for user in all_users:
-            try:
-                await context.bot.send_message(
-                    chat_id=user['user_id'],
-                    text=welcome_text,
-                    parse_mode='Markdown'
-                )
-                success_count += 1
-            except:
-                fail_count += 1
-                pass
+        async for batch in aiter_user_batches({'user_id': 1}):
+            for user in batch:
+                try:
+                    await context.bot.send_message(
+                        chat_id=user['user_id'],
+                        text=welcome_text,
+                        parse_mode='Markdown'
+                    )
+                    success_count += 1
+                except:
+                    fail_count += 1
+                    pass
 
         # إشعار بعدد الرسائل المرسلة
         await context.bot.send_message(
@@ -3484,32 +3492,34 @@ async def send_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if broadcast_type == 'all':
         # إرسال لجميع المستخدمين
-        all_users = get_all_users()
-        logger.info(f"📊 عدد المستخدمين: {len(all_users)}")
+        total_users = get_users_count()['total']
+        logger.info(f"📊 عدد المستخدمين: {total_users}")
 
         await update.message.reply_text(
-            f"📤 جاري الإرسال إلى {len(all_users)} مستخدم..."
+            f"📤 جاري الإرسال إلى {total_users} مستخدم..."
         )
 
         success_count = 0
         failed_count = 0
 
-        for user in all_users:
-            try:
-                await context.bot.send_message(
-                    chat_id=user['user_id'],
-                    text=message_text
-                )
-                success_count += 1
-            except Exception as e:
-                log_warning(f"فشل إرسال لـ {user['user_id']}: {e}", module="handlers/admin.py")
-                failed_count += 1
+        # المرور على دفعات بالحقل user_id فقط - الذاكرة ثابتة مهما كان عدد المستخدمين
+        async for batch in aiter_user_batches({'user_id': 1}):
+            for user in batch:
+                try:
+                    await context.bot.send_message(
+                        chat_id=user['user_id'],
+                        text=message_text
+                    )
+                    success_count += 1
+                except Exception as e:
+                    log_warning(f"فشل إرسال لـ {user['user_id']}: {e}", module="handlers/admin.py")
+                    failed_count += 1
 
         result_text = (
             f"✅ **تم الإرسال!**\n\n"
             f"✔️ نجح: {success_count}\n"
             f"❌ فشل: {failed_count}\n"
-            f"📊 الإجمالي: {len(all_users)}"
+            f"📊 الإجمالي: {success_count + failed_count}"
         )
 
     else:
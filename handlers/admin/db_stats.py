@@ -0,0 +1,195 @@
+"""
+إحصائيات قاعدة البيانات للمدير
+Admin Database Stats
+
+يعرض حالة الاتصال، إصدار المخطط، تكلفة أوامر قاعدة البيانات، ذاكرة الاستخراج والتسليم، مجدول التحميل وعمال yt-dlp، استخدام الفهارس، وأبطأ الاستعلامات المسجلة
+"""
+
+import os
+import logging
+from telegram import Update
+from telegram.ext import ContextTypes
+from database import (
+    is_admin,
+    run_db,
+    SCHEMA_VERSION,
+    get_schema_version,
+    get_index_usage_stats,
+    get_slow_query_stats,
+    set_slow_query_profiling,
+    get_db_command_stats,
+    reset_db_command_stats,
+    get_db_health
+)
+from core.utils.extraction_cache import get_extraction_cache_stats
+from core.utils.delivery_cache import get_delivery_cache_stats, rebuild_delivery_cache
+from handlers.download.scheduler import download_scheduler
+from core.utils.ytdlp_runner import get_ytdlp_pool_stats
+
+logger = logging.getLogger(__name__)
+
+
+async def cmd_dbstats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    أمر /dbstats - تقرير الفهارس والاستعلامات البطيئة (للمدير فقط)
+
+    /dbstats            عرض التقرير
+    /dbstats on [ms]    تفعيل تسجيل الاستعلامات الأبطأ من ms (افتراضي 100)
+    /dbstats off        إيقاف التسجيل
+    /dbstats reset      تصفير إحصائيات الأوامر
+    /dbstats rebuild <آخر_رسالة> [عدد]   إعادة بناء ذاكرة التسليم من قناة الفيديوهات
+    """
+    user_id = update.effective_user.id
+
+    # التحقق من صلاحيات المدير
+    if not is_admin(user_id):
+        await update.message.reply_text("⛔ هذا الأمر للمدراء فقط!")
+        return
+
+    args = context.args or []
+    if args and args[0].lower() == 'reset':
+        reset_db_command_stats()
+        await update.message.reply_text("✅ تم تصفير إحصائيات أوامر قاعدة البيانات")
+        return
+
+    if args and args[0].lower() == 'rebuild':
+        channel_id = os.getenv("VIDEOS_CHANNEL_ID")
+        if not channel_id or len(args) < 2 or not args[1].isdigit():
+            await update.message.reply_text(
+                "⚠️ الاستخدام: `/dbstats rebuild <معرف آخر رسالة في القناة> [عدد]`\n"
+                "يتطلب VIDEOS_CHANNEL_ID",
+                parse_mode='Markdown'
+            )
+            return
+        count = int(args[2]) if len(args) > 2 and args[2].isdigit() else 200
+        await update.message.reply_text(f"🔄 جاري فحص آخر {count} رسالة في قناة الفيديوهات...")
+        restored = await rebuild_delivery_cache(
+            context.bot, int(channel_id), update.effective_chat.id, int(args[1]), count
+        )
+        await update.message.reply_text(f"✅ تمت استعادة {restored} ملف إلى ذاكرة التسليم")
+        return
+
+    if args and args[0].lower() in ('on', 'off'):
+        enabled = args[0].lower() == 'on'
+        slow_ms = int(args[1]) if len(args) > 1 and args[1].isdigit() else 100
+        ok = await run_db(set_slow_query_profiling, enabled, slow_ms)
+        if ok:
+            await update.message.reply_text(
+                f"✅ تم {'تفعيل' if enabled else 'إيقاف'} تسجيل الاستعلامات البطيئة (>{slow_ms}ms)"
+            )
+        else:
+            await update.message.reply_text("❌ فشل تغيير إعدادات profiler (قد لا تسمح الاستضافة بذلك)")
+        return
+
+    health = get_db_health()
+    state_icon = "🟢" if health['available'] else "🔴"
+    health_text = (
+        f"{state_icon} **الاتصال:** {health['state']}"
+        f" | الانقطاعات: {health['outages']}\n"
+    )
+    if health['latency_ms'] is not None:
+        health_text += (
+            f"📶 ping: {health['latency_ms']:.1f}ms"
+            f" (متوسط {health['avg_latency_ms']:.1f}ms)\n"
+        )
+    health_text += (
+        f"🔗 المجمع: {health['pool_in_use']} مستخدم / {health['pool_open']} مفتوح"
+        f"{' / ' + str(health['pool_max']) if health['pool_max'] else ''}\n"
+    )
+    if not health['available']:
+        # لا نحاول جلب باقي التقرير أثناء الانقطاع
+        await update.message.reply_text(
+            f"🗄️ **إحصائيات قاعدة البيانات**\n\n{health_text}"
+            f"⚠️ `{(health['last_error'] or 'غير متصلة').replace('`', '')}`",
+            parse_mode='Markdown'
+        )
+        return
+
+    version = await run_db(get_schema_version)
+    index_stats = await run_db(get_index_usage_stats)
+    slow = await run_db(get_slow_query_stats)
+
+    report = (
+        f"🗄️ **إحصائيات قاعدة البيانات**\n\n"
+        f"{health_text}"
+        f"📐 **إصدار المخطط:** {version}/{SCHEMA_VERSION}"
+        f"{' ✅' if version >= SCHEMA_VERSION else ' ⚠️'}\n\n"
+    )
+
+    # تكلفة الأوامر (من command monitoring داخل العملية)
+    report += "⏱️ **أعلى الأوامر تكلفة:**\n"
+    commands = get_db_command_stats(limit=8)
+    if not commands:
+        report += "• لا توجد بيانات\n"
+    for c in commands:
+        report += (
+            f"• `{c['command']} {c['collection']}`: {c['count']:,} × "
+            f"{c['avg_ms']:.1f}ms (max {c['max_ms']:.0f}ms)\n"
+        )
+    report += "\n"
+
+    # ذاكرة استخراج الروابط (extract_info)
+    cache = get_extraction_cache_stats()
+    report += (
+        f"🧠 **ذاكرة الاستخراج:** {cache['hit_rate']:.0%} إصابة"
+        f" ({cache['memory_hits']:,} ذاكرة + {cache['persistent_hits']:,} دائمة / {cache['misses']:,} إخفاق)\n"
+        f"• المدخلات: {cache['size']:,} | الإخراج: {cache['evictions']:,}"
+        f" | الطبقة الدائمة: {'مفعلة' if cache['persistent'] else 'معطلة'}"
+        f" | طلبات مدمجة: {cache['coalesced']:,}\n\n"
+    )
+
+    # ذاكرة التسليم (file_id)
+    delivery = get_delivery_cache_stats()
+    report += (
+        f"📨 **ذاكرة التسليم:** {delivery['hit_rate']:.0%} إصابة"
+        f" ({delivery['memory_hits'] + delivery['persistent_hits']:,} / {delivery['misses']:,} إخفاق)\n"
+        f"• المدخلات: {delivery['size']:,} | محفوظ: {delivery['stores']:,}"
+        f" | مرفوض: {delivery['invalid']:,}\n"
+        f"• تحميلات جارية: {delivery['in_flight']:,} | طلبات انتظرت تحميلاً جارياً: {delivery['coalesced']:,}\n\n"
+    )
+
+    # مجدول التحميل
+    jobs = download_scheduler.stats()
+    platforms = ', '.join(f"{p}: {n}" for p, n in jobs['running_by_platform'].items()) or '-'
+    report += (
+        f"🚦 **مجدول التحميل:** {jobs['running']}/{jobs['workers']} يعمل"
+        f" | {jobs['waiting']:,} ينتظر ({jobs['waiting_priority']:,} أولوية)\n"
+        f"• المنصات: {platforms}\n"
+        f"• الانتظار: متوسط {jobs['avg_wait']:.1f}s | أقصى {jobs['max_wait']:.1f}s"
+        f" | انتظر: {jobs['queued']:,} من {jobs['started']:,}\n\n"
+    )
+
+    # عمال yt-dlp (وضع العمليات)
+    pool = get_ytdlp_pool_stats()
+    if pool is not None:
+        report += (
+            f"⚙️ **عمال yt-dlp:** {pool['busy']} يعمل / {pool['idle']} خامل (الحد {pool['size']})\n"
+            f"• المهام: {pool['jobs']:,} | أُنشئ: {pool['spawned']:,}"
+            f" | استُبدل: {pool['recycled_jobs']:,} عدد + {pool['recycled_memory']:,} ذاكرة"
+            f" | قُتل: {pool['killed']:,}\n\n"
+        )
+
+    # استخدام الفهارس
+    report += "📇 **استخدام الفهارس:**\n"
+    for collection, indexes in index_stats.items():
+        if not indexes:
+            continue
+        report += f"\n🔹 `{collection}`\n"
+        for idx in sorted(indexes, key=lambda i: i['ops'], reverse=True):
+            unused = " 💤" if idx['ops'] == 0 and idx['name'] != '_id_' else ""
+            report += f"• `{idx['name']}`: {idx['ops']:,}{unused}\n"
+
+    # الاستعلامات البطيئة
+    report += "\n🐢 **الاستعلامات البطيئة:**\n"
+    if slow['level'] is None:
+        report += "• غير متاح\n"
+    elif not slow['level']:
+        report += "• profiler معطل - استخدم `/dbstats on 100` للتفعيل\n"
+    elif not slow['queries']:
+        report += f"• لا توجد استعلامات أبطأ من {slow['slow_ms']}ms ✅\n"
+    else:
+        for q in slow['queries']:
+            plan = (q['plan'] or '-').replace('`', '')
+            report += f"• `{q['ns']}` {q['op']} - {q['millis']}ms (`{plan}`)\n"
+
+    await update.message.reply_text(report, parse_mode='Markdown')
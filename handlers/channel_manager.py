@@ -668,8 +668,8 @@ class ChannelManager:
 
         # محاولة جلب إجمالي الأعضاء
         try:
-            from database import get_all_users
-            total_users = len(get_all_users())
+            from database import get_users_count
+            total_users = get_users_count()['total']
             stats_info = f"\n\n━━━━━━━━━━━━━━━━━━━━━\n\n📊 **إحصائيات:**\n💎 إجمالي الأعضاء: **{total_users:,}**"
         except Exception:
             stats_info = ""
@@ -286,6 +286,24 @@ class CookieManager:
             logger.error(f"❌ Failed to parse cookies: {e}")
             return (False, None, None, 0)
 
+    def invalidate_extractions(self, cookie_file: str):
+        """
+        Drop cached extract_info results for every platform using this cookie file,
+        so results extracted with missing/expired cookies are not served until TTL
+        """
+        try:
+            from core.utils.extraction_cache import clear_extraction_cache
+
+            if cookie_file == 'general':
+                # General cookies may be used by any platform
+                removed = clear_extraction_cache()
+            else:
+                platforms = [p for p, f in PLATFORM_COOKIE_LINKS.items() if f == cookie_file] or [cookie_file]
+                removed = sum(clear_extraction_cache(p) for p in platforms)
+            logger.info(f"🧹 Cleared {removed} cached extractions after {cookie_file} cookies changed")
+        except Exception as e:
+            logger.error(f"❌ Failed to clear extraction cache for {cookie_file}: {e}")
+
     def encrypt_cookie_file(self, platform: str, cookie_data: bytes) -> bool:
         """Encrypt cookie file and save to encrypted directory"""
         try:
@@ -308,6 +326,7 @@ class CookieManager:
 
             self._log_event(f"🔒 Encrypted cookies for {platform}")
             logger.info(f"✅ Successfully encrypted cookies for {platform}")
+            self.invalidate_extractions(platform)
             return True
 
         except Exception as e:
@@ -845,6 +864,7 @@ class CookieManager:
 
             self._log_event(f"🗑️ Deleted cookies for {platform}")
             logger.info(f"✅ Deleted cookies for {platform}")
+            self.invalidate_extractions(platform)
             return True
         except Exception as e:
             logger.error(f"❌ Failed to delete cookies for {platform}: {e}")
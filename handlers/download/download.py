@@ -5,6 +5,8 @@ import requests
 import subprocess
 import re
 import random
+import shutil
+import tempfile
 from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -25,8 +27,7 @@ executor = ThreadPoolExecutor(max_workers=20)
 
 # ===== Per-user cancel download support =====
 ACTIVE_DOWNLOADS = {}  # user_id -> asyncio.Task
-# Performance optimization: increased from 2 to 5 concurrent downloads per user
-USER_SEMAPHORE = defaultdict(lambda: asyncio.Semaphore(5))  # max 5 concurrent per user
+# التزامن العام ولكل مستخدم يديره مجدول التحميل (handlers/download/scheduler.py)
 PLAYLISTS = {}  # user_id -> {entries: list, quality: str, progress_msg: Message}
 CANCEL_MESSAGES = {}  # user_id -> Message (for updating progress)
 SELECTED_VIDEOS = defaultdict(set)  # user_id -> set of selected video indices
@@ -45,14 +46,16 @@ LOAD_ALERT_WINDOW = 600  # Within 10 minutes (600 seconds)
 LAST_LOAD_ALERT = 0  # Timestamp of last alert to avoid spam
 
 from database import (
-    is_subscribed,
-    get_user,
-    increment_download_count,
-    get_user_language,
-    is_admin,
-    get_daily_download_count,
-    get_no_logo_credits,
-    use_no_logo_credit
+    # نسخ async - لا توقف event loop أثناء انتظار MongoDB
+    async_increment_download_count,
+    async_reserve_daily_download,
+    async_release_daily_download,
+    async_get_user_language,
+    async_use_no_logo_credit,
+    async_record_download_attempt,
+    async_create_error_report,
+    async_load_user_context,
+    UserRequestContext,
 )
 
 # نظام تتبع الأخطاء المتقدم
@@ -60,9 +63,21 @@ from core.utils.error_tracker import ErrorTracker, track_download_error
 from utils import (
     get_message, clean_filename, get_config, format_file_size, format_duration,
     send_video_report, rate_limit, validate_url, log_warning,
-    get_cached_user_data, clear_user_cache
+    clear_user_cache
 )
 from core.utils.helpers import safe_edit_message
+from core.utils.extraction_cache import extract_info_cached
+from core.utils.single_flight import SharedFlightError
+from core.utils.delivery_cache import (
+    delivery_cache_key, logo_variant, get_delivery, send_cached_media, remember_delivery, delivery_tag, download_flights
+)
+from handlers.download.scheduler import download_scheduler
+from core.utils.ytdlp_runner import ytdlp_download
+from core.media.streaming import STREAM_WATERMARK, stream_watermark
+from core.media.format_planner import PLAN_MAX_HEIGHT, plan_format, plan_limit_mb
+from core.utils.cancellation import (
+    CancelToken, DownloadCancelled, register_cancel_token, unregister_cancel_token, cancel_user_downloads
+)
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -74,6 +89,20 @@ VIDEO_PATH = 'videos'
 if not os.path.exists(VIDEO_PATH):
     os.makedirs(VIDEO_PATH)
 
+# امتدادات منشورات الصور
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+def create_job_dir(user_id: int) -> str:
+    """
+    مجلد عمل خاص بمهمة تحميل واحدة داخل VIDEO_PATH
+
+    كل مهمة تكتب ملفاتها (التحميل، اللوجو، الضغط) في مجلدها فقط، لذلك المهام
+    المتزامنة لا تلتقط ملفات بعضها ولا تستبدل ملفاً بنفس العنوان، ويُحذف المجلد
+    كاملاً عند انتهاء المهمة.
+    """
+    return tempfile.mkdtemp(prefix=f"job_{user_id}_", dir=VIDEO_PATH)
+
 
 # ═══════════════════════════════════════════════════════════════
 #  Server Load Monitoring System (V5.0.1)
@@ -227,8 +256,13 @@ def safe_filename(title: str, max_length: int = 60) -> str:
         safe_name = safe_name[:max_length].rsplit(' ', 1)[0]  # قطع عند آخر مسافة
     return safe_name.strip()
 
-async def send_log_to_channel(context: ContextTypes.DEFAULT_TYPE, update: Update, user, video_info: dict, file_path: str, sent_message, is_audio: bool = False):
-    """إرسال سجل التحميل الناجح إلى قناة الفيديوهات مع رسالة نصية قابلة للنسخ (فيديو أو صوت)"""
+async def send_log_to_channel(context: ContextTypes.DEFAULT_TYPE, update: Update, user, video_info: dict, file_path: str, sent_message, is_audio: bool = False, delivery_key: str = None):
+    """
+    إرسال سجل التحميل الناجح إلى قناة الفيديوهات مع رسالة نصية قابلة للنسخ (فيديو أو صوت)
+
+    delivery_key: إذا حُدد يُضاف وسم التسليم (المفتاح + file_id) لرسالة التفاصيل،
+    لإعادة بناء ذاكرة التسليم من القناة
+    """
     if not VIDEOS_CHANNEL_ID:
         logger.warning("⚠️ VIDEOS_CHANNEL_ID غير محدد، لن يتم إرسال سجلات النجاح")
         logger.warning("💡 أضف VIDEOS_CHANNEL_ID إلى ملف .env لتفعيل إرسال الفيديوهات للقناة")
@@ -335,6 +369,10 @@ async def send_log_to_channel(context: ContextTypes.DEFAULT_TYPE, update: Update
             f"✅ <b>تم المعالجة بنجاح</b>"
         )
 
+        tag = delivery_tag(delivery_key, forwarded)
+        if tag:
+            info_text += f"\n<code>{html.escape(tag)}</code>"
+
         await context.bot.send_message(
             chat_id=log_channel_id,
             text=info_text,
@@ -347,10 +385,27 @@ async def send_log_to_channel(context: ContextTypes.DEFAULT_TYPE, update: Update
     except Exception as e:
         log_warning(f"❌ فشل إرسال {media_text} إلى قناة الفيديوهات: {e}", module="handlers/download.py")
 
-async def show_quality_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, url: str, info_dict: dict):
-    """عرض قائمة اختيار الجودة - مبسطة"""
+def quality_size_label(label: str, plan: dict) -> str:
+    """إضافة الدقة والحجم المتوقع لزر الجودة"""
+    if not plan:
+        return label
+    details = f"{plan['height']}p · " if plan['height'] else ""
+    details += f"~{plan['size'] / (1024 * 1024):.0f}MB"
+    if not plan['fits']:
+        details += " 🗜️"
+    return f"{label} ({details})"
+
+async def show_quality_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, url: str, info_dict: dict, user_ctx: UserRequestContext = None, format_spec: str = None):
+    """عرض قائمة اختيار الجودة - مبسطة (مع الحجم المتوقع إذا عُرفت صيغة المنصة)"""
     user_id = update.effective_user.id
-    lang = get_user_language(user_id)
+    lang = user_ctx.lang if user_ctx else await async_get_user_language(user_id)
+
+    # الحجم المتوقع لكل جودة حسب حد المستخدم (نفس الخطة التي يستخدمها perform_download)
+    limit_mb = plan_limit_mb(user_ctx.is_privileged if user_ctx else False)
+    plans = {
+        quality: plan_format(info_dict, quality, format_spec, limit_mb)
+        for quality in PLAN_MAX_HEIGHT
+    }
 
     title = info_dict.get('title', get_message(lang, 'title_not_found', 'فيديو'))[:50]
     duration = format_duration(info_dict.get('duration', 0))
@@ -361,8 +416,8 @@ async def show_quality_menu(update: Update, context: ContextTypes.DEFAULT_TYPE,
     }
 
     keyboard = [
-        [InlineKeyboardButton(get_message(lang, 'video_quality_best', '🌟 أفضل جودة'), callback_data="quality_best")],
-        [InlineKeyboardButton(get_message(lang, 'video_quality_medium', '📱 جودة متوسطة (أسرع)'), callback_data="quality_medium")],
+        [InlineKeyboardButton(quality_size_label(get_message(lang, 'video_quality_best', '🌟 أفضل جودة'), plans['best']), callback_data="quality_best")],
+        [InlineKeyboardButton(quality_size_label(get_message(lang, 'video_quality_medium', '📱 جودة متوسطة (أسرع)'), plans['medium']), callback_data="quality_medium")],
         [InlineKeyboardButton(get_message(lang, 'audio_only', '🎵 صوت فقط MP3'), callback_data="quality_audio")],
     ]
 
@@ -395,17 +450,18 @@ async def handle_quality_selection(update: Update, context: ContextTypes.DEFAULT
 
     # === فحص مدة الفيديو لجميع الأنواع (صوت وفيديو) ===
     user_id = query.from_user.id
-    lang = get_user_language(user_id)
-    from database import is_subscribed, is_admin, get_free_time_limit
+    user_ctx = await async_load_user_context(user_id)
+    lang = user_ctx.lang
+    is_privileged = user_ctx.is_privileged
 
     duration_seconds = info_dict.get('duration', 0)
 
     # فحص حد المدة الزمنية (للمستخدمين غير VIP وغير الأدمن)
     # يطبق دائماً بغض النظر عن حالة نظام الاشتراكات
-    if not is_subscribed(user_id) and not is_admin(user_id):
+    if not is_privileged:
         if duration_seconds > 0:
             duration_minutes = duration_seconds / 60
-            time_limit_minutes = get_free_time_limit()
+            time_limit_minutes = user_ctx.free_time_limit
 
             # -1 يعني غير محدود
             if time_limit_minutes != -1 and duration_minutes > time_limit_minutes:
@@ -428,10 +484,8 @@ async def handle_quality_selection(update: Update, context: ContextTypes.DEFAULT
 
     # التحقق من مدة الصوتيات إذا اختار المستخدم "صوت فقط"
     if quality_choice == 'audio':
-        from database import is_audio_enabled
-
         # التحقق من تفعيل الصوتيات
-        if not is_audio_enabled():
+        if not user_ctx.audio_enabled:
             await query.edit_message_text(
                 "🚫 **تحميل الصوتيات معطل حالياً!**\n\n"
                 "يرجى اختيار جودة فيديو بدلاً من ذلك."
@@ -456,14 +510,12 @@ async def handle_quality_selection(update: Update, context: ContextTypes.DEFAULT
             return
 
         # التحقق من حد المدة (فقط إذا كان الاشتراك مفعلاً)
-        subscription_enabled = is_subscription_enabled()
-
-        if subscription_enabled and not is_subscribed(user_id) and not is_admin(user_id):
+        if user_ctx.subscription_enabled and not is_privileged:
             duration_seconds = info_dict.get('duration', 0)
 
             if duration_seconds > 0:
                 duration_minutes = duration_seconds / 60
-                audio_limit_minutes = get_free_time_limit()  # استخدام نفس الحد الزمني العام
+                audio_limit_minutes = user_ctx.free_time_limit  # استخدام نفس الحد الزمني العام
 
                 # -1 يعني غير محدود، فلا نحتاج للتحقق
                 if audio_limit_minutes != -1 and duration_minutes > audio_limit_minutes:
@@ -487,7 +539,7 @@ async def handle_quality_selection(update: Update, context: ContextTypes.DEFAULT
 
     await query.edit_message_text(get_message(lang, 'download_preparing', '⏳ جاري التحضير...'))
 
-    await download_video_with_quality(update, context, url, info_dict, quality_choice)
+    await download_video_with_quality(update, context, url, info_dict, quality_choice, user_ctx=user_ctx)
 
 def get_ydl_opts_for_platform(url: str, quality: str = 'best'):
     """
@@ -526,7 +578,7 @@ def get_ydl_opts_for_platform(url: str, quality: str = 'best'):
 
     # إعدادات أساسية
     ydl_opts = {
-        'outtmpl': os.path.join(VIDEO_PATH, '%(title).60s.%(ext)s'),  # تقصير تلقائي لـ 60 حرف
+        'outtmpl': os.path.join(VIDEO_PATH, '%(id)s.%(ext)s'),  # perform_download يوجهه لمجلد المهمة
         'quiet': False,
         'no_warnings': False,
         'extract_flat': False,
@@ -1126,34 +1178,180 @@ async def send_file_with_retry(context, chat_id, file_path, is_audio, caption, r
     return None, Exception("فشل الرفع بعد جميع المحاولات")
 
 
-async def download_video_with_quality(update: Update, context: ContextTypes.DEFAULT_TYPE, url: str, info_dict: dict, quality: str):
+async def download_video_with_quality(update: Update, context: ContextTypes.DEFAULT_TYPE, url: str, info_dict: dict, quality: str, user_ctx: UserRequestContext = None):
     """تحميل الفيديو بالجودة المحددة"""
-    user = update.effective_user
-    user_id = user.id
-    lang = get_user_language(user_id)
-    
     ydl_opts = get_ydl_opts_for_platform(url, quality)
     
-    await perform_download(update, context, url, info_dict, ydl_opts, is_audio=(quality=='audio'))
+    await perform_download(update, context, url, info_dict, ydl_opts, is_audio=(quality=='audio'), user_ctx=user_ctx, quality=quality)
+
+def build_media_caption(info_dict: dict, file_size: int, is_audio: bool, is_subscribed_user: bool, bot_username: str) -> str:
+    """نص الوصف المرفق بالملف المرسل"""
+    title = info_dict.get('title', 'video')
+    uploader = info_dict.get('uploader', 'Unknown')[:40]
+    duration = info_dict.get('duration', 0)
+    return (
+        f"🎬 {title[:50]}\n\n"
+        f"👤 {uploader}\n"
+        f"⏱️ {format_duration(duration)} | 📦 {format_file_size(file_size)}\n"
+        f"{'🎵' if is_audio else '🎥'} {'💎 VIP' if is_subscribed_user else '🆓 مجاني'}\n\n"
+        f"✨ بواسطة @{bot_username}"
+    )
+
+
+async def spend_no_logo_credit(context: ContextTypes.DEFAULT_TYPE, update: Update, user_ctx: UserRequestContext):
+    """استهلاك نقطة بدون لوجو وإشعار المستخدم بالرصيد المتبقي"""
+    user_id = user_ctx.user_id
+    no_logo_credits = user_ctx.no_logo_credits
+    if await async_use_no_logo_credit(user_id):
+        user_ctx.consume_no_logo_credit()
+        logger.info(f"✅ تم استخدام نقطة بدون لوجو للمستخدم {user_id}، المتبقي: {no_logo_credits - 1}")
+        # إرسال إشعار للمستخدم
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=f"🎨 تم استخدام نقطة بدون لوجو!\n💰 الرصيد المتبقي: {no_logo_credits - 1} فيديو"
+        )
+
+def should_apply_logo_for(user_ctx: UserRequestContext, is_audio: bool, logo_path: str) -> bool:
+    """
+    تحديد تطبيق اللوجو حسب إعدادات اللوجو، الفئة المستهدفة، ورصيد المستخدم
+
+    يُحسب قبل التحميل لأنه جزء من مفتاح ذاكرة التسليم (نسخة مع لوجو / بدون لوجو)
+    """
+    is_user_admin = user_ctx.is_admin
+    is_subscribed_user = user_ctx.is_subscribed
+    logo_enabled = user_ctx.logo_enabled
+    target_group = user_ctx.logo_target
+
+    # التحقق من رصيد نقاط بدون لوجو
+    no_logo_credits = user_ctx.no_logo_credits
+    
+    # تحديد نوع المستخدم
+    is_regular_user = not is_subscribed_user and not is_user_admin  # عادي
+    is_vip_user = is_subscribed_user and not is_user_admin  # VIP
+    is_admin_user = is_user_admin  # Admin
+    has_credits = no_logo_credits > 0  # لديه رصيد
+    
+    # منطق تحديد ما إذا كان المستخدم ضمن الفئة المستهدفة
+    is_target_user = False
+    
+    # ملاحظة: "مع النقاط" = لا نهتم بالنقاط، "بدون النقاط" = يجب ألا يكون لديه نقاط
+    if target_group == 'free_with_points':
+        # العاديون (لا نهتم بالنقاط) - كل العاديين
+        is_target_user = is_regular_user
+    elif target_group == 'free_no_points':
+        # العاديون (بدون نقاط) - العاديون الذين ليس لديهم نقاط
+        is_target_user = is_regular_user and not has_credits
+    elif target_group == 'free_all':
+        # جميع العاديون
+        is_target_user = is_regular_user
+    elif target_group == 'vip_with_points':
+        # VIP (لا نهتم بالنقاط) - كل VIP
+        is_target_user = is_vip_user
+    elif target_group == 'vip_no_points':
+        # VIP (بدون نقاط) - VIP الذين ليس لديهم نقاط
+        is_target_user = is_vip_user and not has_credits
+    elif target_group == 'vip_all':
+        # جميع VIP
+        is_target_user = is_vip_user
+    elif target_group == 'everyone_with_points':
+        # الجميع (لا نهتم بالنقاط) - كل الناس ماعدا Admin
+        is_target_user = not is_admin_user
+    elif target_group == 'everyone_no_points':
+        # الجميع (بدون نقاط) - الجميع الذين ليس لديهم نقاط
+        is_target_user = (is_regular_user or is_vip_user) and not has_credits
+    elif target_group == 'everyone_all':
+        # الجميع
+        is_target_user = not is_admin_user
+    elif target_group == 'no_credits_only':
+        # المستخدمون بدون نقاط فقط (عادي + VIP بدون نقاط)
+        is_target_user = (is_regular_user or is_vip_user) and not has_credits
+    elif target_group == 'everyone_except_no_credits':
+        # الجميع عدا من لديهم نقاط (أي: ضع اللوجو للجميع إلا من لديه نقاط)
+        is_target_user = (is_regular_user or is_vip_user) and not has_credits
+    
+    should_apply_logo = (
+        not is_audio and 
+        logo_enabled and 
+        is_target_user and
+        logo_path and 
+        os.path.exists(logo_path)
+    )
+    
+    # إضافة رسائل تشخيص
+    logger.info(f"🔍 تشخيص اللوجو:")
+    logger.info(f"  - is_audio: {is_audio}")
+    logger.info(f"  - logo_enabled: {logo_enabled}")
+    logger.info(f"  - target_group: {target_group}")
+    logger.info(f"  - is_regular_user: {is_regular_user}")
+    logger.info(f"  - is_vip_user: {is_vip_user}")
+    logger.info(f"  - is_admin_user: {is_admin_user}")
+    logger.info(f"  - has_credits: {has_credits}")
+    logger.info(f"  - is_target_user: {is_target_user}")
+    logger.info(f"  - logo_path: {logo_path}")
+    logger.info(f"  - logo_exists: {os.path.exists(logo_path) if logo_path else False}")
+    logger.info(f"  - should_apply_logo: {should_apply_logo}")
+    
+    if not should_apply_logo:
+        if not logo_enabled:
+            log_warning("⚠️ اللوجو معطل من الإعدادات", module="handlers/download.py")
+        elif is_audio:
+            log_warning("⚠️ الملف صوتي، لا يطبق لوجو", module="handlers/download.py")
+        elif not is_target_user:
+            log_warning(f"⚠️ المستخدم ليس ضمن الفئة المستهدفة: {target_group}", module="handlers/download.py")
+        elif not logo_path:
+            log_warning("⚠️ مسار اللوجو غير معرف", module="handlers/download.py")
+        elif not os.path.exists(logo_path):
+            log_warning(f"⚠️ ملف اللوجو غير موجود: {logo_path}", module="handlers/download.py")
+    
+    if should_apply_logo:
+        logger.info(f"✅ سيتم تطبيق اللوجو على الفيديو")
 
-async def perform_download(update: Update, context: ContextTypes.DEFAULT_TYPE, url: str, info_dict: dict, ydl_opts: dict, is_audio: bool = False):
+    return should_apply_logo
+
+
+async def perform_download(update: Update, context: ContextTypes.DEFAULT_TYPE, url: str, info_dict: dict, ydl_opts: dict, is_audio: bool = False, user_ctx: UserRequestContext = None, quality: str = None):
     """تنفيذ عملية التحميل"""
     user = update.effective_user
     user_id = user.id
-    lang = get_user_language(user_id)
+
+    # سياق المستخدم يُمرر من handle_quality_selection - يُحمّل هنا فقط للمسارات الأخرى (batch/playlist)
+    if user_ctx is None:
+        user_ctx = await async_load_user_context(user_id)
+    lang = user_ctx.lang
     
-    is_user_admin = is_admin(user_id)
-    is_subscribed_user = is_subscribed(user_id)
+    is_user_admin = user_ctx.is_admin
+    is_subscribed_user = user_ctx.is_subscribed
     config = get_config()
 
-    processing_message = await context.bot.send_message(
-        chat_id=update.effective_chat.id,
-        text=get_message(lang, 'download_wait', '📥 جاري التحضير...\n⏳ الرجاء الانتظار...'),
-        parse_mode='Markdown'
-    )
-    
+    # حجز تحميل من الحد اليومي ذرياً (الفحص والزيادة في تحديث واحد)
+    # يمنع الطلبات المتزامنة من تجاوز الحد، ويُرجع الحجز إذا لم يكتمل التحميل
+    daily_reserved = False
+    download_completed = False
+    if not is_user_admin and not is_subscribed_user and user_ctx.subscription_enabled:
+        if not await async_reserve_daily_download(user_id, user_ctx.daily_limit):
+            await context.bot.send_message(
+                chat_id=update.effective_chat.id,
+                text=get_message(lang, 'daily_limit_reached', '🚫 وصلت للحد اليومي ({limit} تحميلات). اشترك للتحميل بلا حدود!').format(limit=user_ctx.daily_limit)
+            )
+            return
+        daily_reserved = True
+        user_ctx.consume_download()
+
+    # تُرسل داخل try حتى يُرجع finally الحجز اليومي ورمز الإلغاء إذا فشل الإرسال
+    processing_message = None
     new_filepath = None
     temp_watermarked_path = None
+    job_dir = None
+
+    # single-flight: هذا الطلب ينفذ التحميل والطلبات المتزامنة لنفس الملف تنتظره
+    delivery_key = None
+    flight = None
+    flight_outcome = None
+    download_job = None
+
+    # رمز الإلغاء: /cancel يوقف yt-dlp و ffmpeg والرفع فعلياً وليس الـ coroutine فقط
+    cancel_token = CancelToken()
+    register_cancel_token(user_id, cancel_token)
     
     # التحقق إذا كان المحتوى صورة وليس فيديو
     is_image_post = False
@@ -1188,12 +1386,39 @@ async def perform_download(update: Update, context: ContextTypes.DEFAULT_TYPE, u
         logger.info("✅ تيك توك بدون مدة - احتمال صور")
     
     try:
+        processing_message = await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=get_message(lang, 'download_wait', '📥 جاري التحضير...\n⏳ الرجاء الانتظار...'),
+            parse_mode='Markdown'
+        )
+
+        # مجلد عمل خاص بهذه المهمة وأسماء ملفات حسب المعرّف (لا تعارض بين المهام المتزامنة)
+        job_dir = create_job_dir(user_id)
+        ydl_opts = {**ydl_opts, 'outtmpl': os.path.join(job_dir, '%(id)s.%(ext)s')}
+
+        # 🚦 مجدول التحميل (حد عام + حد لكل منصة + عدالة بين المستخدمين)
+        # الصور والفيديو يأخذان مكاناً قبل التحميل؛ تسليم الفيديو من الذاكرة وانتظار
+        # تحميل جارٍ لنفس الملف لا يحجزان مكاناً (المنفذ الذي ينتظرونه يحتاجه)
+        async def show_queue_position(position):
+            await processing_message.edit_text(
+                get_message(lang, 'queue_position', '⏳ في قائمة الانتظار — دورك #{position}').format(position=position) + "\n"
+                + (get_message(lang, 'queue_priority_active', '⭐ أولوية المشتركين مفعلة') if is_user_admin or is_subscribed_user
+                   else get_message(lang, 'queue_priority_hint', '💎 المشتركون يحصلون على أولوية في الطابور'))
+            )
+
+        async def acquire_download_slot():
+            return await cancel_token.run(download_scheduler.acquire(
+                user_id,
+                get_platform_from_url(url),
+                priority=is_user_admin or is_subscribed_user,
+                on_wait=show_queue_position
+            ))
+
         # إذا كان منشور صور من تيك توك أو انستقرام
         if is_image_post:
+            download_job = await acquire_download_slot()
             await safe_edit_message(processing_message, "📷 اكتشفت صوراً! جاري التحميل...")
             
-            loop = asyncio.get_event_loop()
-            
             # إعداد خاص للصور - نضيف write_all_thumbnails لتيك توك
             image_ydl_opts = ydl_opts.copy()
             image_ydl_opts.update({
@@ -1204,24 +1429,17 @@ async def perform_download(update: Update, context: ContextTypes.DEFAULT_TYPE, u
             
             # تحميل الصور
             try:
-                with yt_dlp.YoutubeDL(image_ydl_opts) as ydl:
-                    await loop.run_in_executor(None, lambda: ydl.download([url]))
+                downloaded_images = await ytdlp_download(url, image_ydl_opts, cancel_token)
                 logger.info("✅ تم تحميل المحتوى من yt-dlp")
             except Exception as e:
                 log_warning(f"❌ خطأ في تحميل الصور: {e}", module="handlers/download.py")
                 raise
             
-            # البحث عن الصور المحملة
-            image_files = []
-            current_time = time.time()
-            
-            for file in os.listdir(VIDEO_PATH):
-                file_path = os.path.join(VIDEO_PATH, file)
-                # التحقق أنها صورة ومحملة حديثاً (آخر دقيقة)
-                if (file.endswith(('.jpg', '.jpeg', '.png', '.webp')) and 
-                    os.path.isfile(file_path) and 
-                    os.path.getmtime(file_path) > (current_time - 60)):
-                    image_files.append(file_path)
+            # الصور المحملة كما أرجعها yt-dlp (requested_downloads + الصور المصغرة)
+            image_files = [
+                path for path in dict.fromkeys(downloaded_images)
+                if path.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(path)
+            ]
             
             logger.info(f"📸 تم العثور على {len(image_files)} صورة")
             
@@ -1234,7 +1452,7 @@ async def perform_download(update: Update, context: ContextTypes.DEFAULT_TYPE, u
                         import requests
                         response = requests.get(thumbnail_url, timeout=10)
                         if response.status_code == 200:
-                            thumb_path = os.path.join(VIDEO_PATH, f"thumbnail_{int(time.time())}.jpg")
+                            thumb_path = os.path.join(job_dir, "thumbnail.jpg")
                             with open(thumb_path, 'wb') as f:
                                 f.write(response.content)
                             image_files.append(thumb_path)
@@ -1293,41 +1511,135 @@ async def perform_download(update: Update, context: ContextTypes.DEFAULT_TYPE, u
             except:
                 pass
             
-            # تحديث عداد التحميلات
+            # تحديث عداد التحميلات (إذا لم يكن محجوزاً مسبقاً)
+            download_completed = True
             if not is_user_admin and not is_subscribed_user:
-                from database import get_daily_download_limit_setting
-                increment_download_count(user_id)
-                daily_limit = get_daily_download_limit_setting()
-                remaining = daily_limit - get_daily_download_count(user_id)
+                if not daily_reserved:
+                    await async_increment_download_count(user_id)
+                    user_ctx.consume_download()
+                remaining = user_ctx.remaining_downloads
                 if remaining > 0:
                     await context.bot.send_message(
                         chat_id=update.effective_chat.id,
                         text=get_message(lang, 'remaining_downloads_message', 'ℹ️ تبقى لك {remaining} تحميلات مجانية اليوم').format(remaining=remaining)
                     )
-            
-            # حذف الصور المؤقتة
-            for img_file in image_files:
-                try:
-                    os.remove(img_file)
-                    logger.info(f"🗑️ تم حذف: {img_file}")
-                except Exception as e:
-                    log_warning(f"❌ فشل حذف الصورة: {e}", module="handlers/download.py")
-            
+
+            # الصور المؤقتة تُحذف مع مجلد المهمة في finally
             return
         
-        # إذا كان فيديو عادي - الكود القديم
-        loop = asyncio.get_event_loop()
+        # ⚡ ذاكرة التسليم: نفس الملف (بنفس الجودة ونسخة اللوجو) أُرسل سابقاً
+        # إعادة إرساله بالـ file_id بدلاً من التحميل → اللوجو → الرفع
+        logo_path = config.get("LOGO_PATH")
+        should_apply_logo = should_apply_logo_for(user_ctx, is_audio, logo_path)
+
+        # 📐 اختيار الصيغة حسب الحجم المتوقع: أعلى جودة تقع تحت حد المستخدم بدلاً من
+        # التحميل ثم الضغط - الصيغة الصريحة جزء من مفتاح التسليم لأن الحد يختلف حسب الفئة
+        format_plan = None
+        platform_format = ydl_opts.get('format')
+        if not is_audio and quality in PLAN_MAX_HEIGHT:
+            format_plan = plan_format(info_dict, quality, platform_format, plan_limit_mb(user_ctx.is_privileged))
+        if format_plan:
+            ydl_opts = {**ydl_opts, 'format': format_plan['format']}
+            logger.info(
+                f"📐 خطة الصيغة: {format_plan['format']} ({format_plan['height']}p، "
+                f"~{format_plan['size'] / (1024 * 1024):.1f}MB، {'مدمجة' if format_plan['muxed'] else 'دمج'}"
+                f"{'' if format_plan['fits'] else '، تتجاوز الحد وستُضغط بعد التحميل'})"
+            )
+            delivery_quality = f"{quality}:{format_plan['format']}"
+        else:
+            delivery_quality = quality or ydl_opts.get('format')
+        delivery_key = delivery_cache_key(
+            info_dict, url, delivery_quality, is_audio,
+            logo_variant(user_ctx.logo_settings, logo_path) if should_apply_logo else None
+        )
+
+        cached = await get_delivery(delivery_key)
+
+        # ✈️ نفس الملف قيد التحميل لطلب آخر - انتظار نتيجته بدلاً من تحميل ثانٍ
+        # كل طلب يحتفظ برسالة التقدم الخاصة به، وإذا أُلغي المنفذ يكمل أول منتظر بنفسه
+        while not cached:
+            running = download_flights.get(delivery_key)
+            if running is None:
+                break
+            try:
+                await processing_message.edit_text("⏳ نفس الملف قيد التحميل لطلب آخر، سيصلك فور جاهزيته...")
+            except Exception as e:
+                logger.debug(f"فشل تحديث رسالة المعالجة: {e}")
+            outcome = await cancel_token.run(download_flights.wait(running))
+            if outcome is not None:
+                entry, error = outcome
+                if error is not None:
+                    raise SharedFlightError(error) from error
+                cached = entry or await get_delivery(delivery_key)
+
+        if cached:
+            sent_message = await send_cached_media(
+                context.bot,
+                update.effective_chat.id,
+                delivery_key,
+                cached,
+                caption=build_media_caption(info_dict, cached.get('file_size', 0), is_audio, is_subscribed_user, context.bot.username),
+                reply_to_message_id=update.effective_message.message_id
+            )
+            if sent_message:
+                logger.info(f"⚡ تسليم من الذاكرة بدون تحميل — {user_id} — {delivery_key}")
+
+                if not should_apply_logo and user_ctx.no_logo_credits > 0 and not is_subscribed_user and not is_user_admin:
+                    await spend_no_logo_credit(context, update, user_ctx)
+
+                try:
+                    await processing_message.delete()
+                except Exception as e:
+                    logger.debug(f"فشل حذف رسالة المعالجة: {e}")
+
+                download_completed = True
+                if not is_user_admin and not is_subscribed_user:
+                    if not daily_reserved:
+                        await async_increment_download_count(user_id)
+                        user_ctx.consume_download()
+                    remaining = user_ctx.remaining_downloads
+                    if remaining > 0:
+                        await context.bot.send_message(
+                            chat_id=update.effective_chat.id,
+                            text=get_message(lang, 'remaining_downloads_message', 'ℹ️ تبقى لك {remaining} تحميلات مجانية اليوم').format(remaining=remaining)
+                        )
 
+                await send_log_to_channel(context, update, user, info_dict, None, sent_message, is_audio)
+                return
+
+        # لا يوجد تحميل جارٍ لنفس الملف - هذا الطلب هو المنفذ
+        flight = download_flights.begin(delivery_key)
+
+        # 🚦 انتظار دور في مجدول التحميل قبل أي تحميل فعلي
+        download_job = await acquire_download_slot()
+
+        # إذا كان فيديو عادي - الكود القديم
         # تتبع الأخطاء المتقدم - معرفة الصيغة المستخدمة
         format_used = ydl_opts.get('format', 'auto')
         is_pinterest = 'pinterest.com' in url or 'pin.it' in url
         logger.info(f"🎬 بدء التحميل - الرابط: {url[:50]}...")
         logger.info(f"📊 الصيغة المستخدمة: {format_used}")
 
+        # 🌊 وضع التدفق: الصيغة المفردة تُحمَّل مباشرة إلى ffmpeg مع اللوجو
+        # (ملف واحد على القرص بدلاً من الأصلي + نسخة اللوجو) - None يعني المسار العادي
+        streamed_path = None
+        if should_apply_logo and not is_audio and STREAM_WATERMARK:
+            streamed_path = await cancel_token.run_in_executor(
+                executor,
+                stream_watermark,
+                url,
+                info_dict,
+                ydl_opts,
+                os.path.join(job_dir, f"{info_dict.get('id') or 'video'}_stream.mp4"),
+                logo_path,
+                cancel_token
+            )
+
+        downloaded_files = []
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                # تحميل الملف
-                await loop.run_in_executor(None, lambda: ydl.download([url]))
+            # تحميل الملف (خيوط أو عملية عامل حسب YTDLP_PROCESS_POOL)
+            if streamed_path is None:
+                downloaded_files = await ytdlp_download(url, ydl_opts, cancel_token)
         except DownloadError as e:
             error_msg = str(e).lower()
 
@@ -1339,14 +1651,16 @@ async def perform_download(update: Update, context: ContextTypes.DEFAULT_TYPE, u
             if "requested format is not available" in error_msg or "format" in error_msg:
                 logger.warning("⚠️ خطأ format - محاولة التحميل بدون تحديد format")
 
-                # إزالة format والمحاولة مرة أخرى
+                # إزالة format والمحاولة مرة أخرى (صيغة الخطة تُستبدل بصيغة المنصة)
                 if 'format' in ydl_opts:
-                    del ydl_opts['format']
+                    if format_plan and platform_format:
+                        ydl_opts['format'] = platform_format
+                    else:
+                        del ydl_opts['format']
                     logger.info("🔄 إعادة المحاولة بالاختيار التلقائي...")
 
                     try:
-                        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                            await loop.run_in_executor(None, lambda: ydl.download([url]))
+                        downloaded_files = await ytdlp_download(url, ydl_opts, cancel_token)
                         logger.info("✅ نجحت المحاولة الثانية بالاختيار التلقائي!")
                     except Exception as retry_error:
                         logger.error(f"❌ فشلت المحاولة الثانية أيضاً: {str(retry_error)[:200]}")
@@ -1363,122 +1677,43 @@ async def perform_download(update: Update, context: ContextTypes.DEFAULT_TYPE, u
                     "💡 يمكنك إضافة ملف cookies.txt لتحميل المحتوى الخاص\n"
                     "You can add cookies.txt file to download private content"
                 )
+                # فشل ثابت: المنتظرون يتلقون نفس الخطأ بدلاً من إعادة نفس التحميل واحداً تلو الآخر
+                flight_outcome = (None, e)
                 return
             else:
                 # خطأ آخر - إظهاره
                 raise
 
-        # معالجة المسارات بعد التحميل الناجح
-        original_filepath = ydl.prepare_filename(info_dict)
+        # معالجة المسارات بعد التحميل الناجح (المسار الفعلي من requested_downloads)
+        if streamed_path:
+            original_filepath = streamed_path
+        elif downloaded_files:
+            original_filepath = downloaded_files[0]
+        else:
+            original_filepath = yt_dlp.YoutubeDL(ydl_opts).prepare_filename(info_dict)
         title = info_dict.get('title', 'video')
         cleaned_title = clean_filename(title)
 
+        # اسم العنوان للمستخدم فقط - داخل مجلد المهمة فلا يتعارض مع مهمة أخرى بنفس العنوان
         ext = 'mp3' if is_audio else 'mp4'
-        new_filepath = os.path.join(VIDEO_PATH, f"{cleaned_title}.{ext}")
+        new_filepath = os.path.join(job_dir, f"{cleaned_title}.{ext}")
 
-        if os.path.exists(original_filepath):
-            if os.path.exists(new_filepath) and original_filepath != new_filepath:
-                os.remove(new_filepath)
-            os.rename(original_filepath, new_filepath)
+        if os.path.exists(original_filepath) and original_filepath != new_filepath:
+            os.replace(original_filepath, new_filepath)
 
         if not os.path.exists(new_filepath):
             raise FileNotFoundError(f"الملف غير موجود: {new_filepath}")
         
         logger.info(f"✅ تم التحميل: {new_filepath}")
         
-        # التحقق من حالة اللوجو والفئة المستهدفة
-        from database import is_logo_enabled, get_logo_target
-        logo_enabled = is_logo_enabled()
-        target_group, _ = get_logo_target()
-        
-        logo_path = config.get("LOGO_PATH")
         final_video_path = new_filepath
+
+        # التحقق من رصيد نقاط بدون لوجو (should_apply_logo حُسب قبل التحميل)
+        has_credits = user_ctx.no_logo_credits > 0  # لديه رصيد
         
-        # التحقق من رصيد نقاط بدون لوجو
-        no_logo_credits = get_no_logo_credits(user_id)
-        
-        # تحديد نوع المستخدم
-        is_regular_user = not is_subscribed_user and not is_user_admin  # عادي
-        is_vip_user = is_subscribed_user and not is_user_admin  # VIP
-        is_admin_user = is_user_admin  # Admin
-        has_credits = no_logo_credits > 0  # لديه رصيد
-        
-        # منطق تحديد ما إذا كان المستخدم ضمن الفئة المستهدفة
-        is_target_user = False
-        
-        # ملاحظة: "مع النقاط" = لا نهتم بالنقاط، "بدون النقاط" = يجب ألا يكون لديه نقاط
-        if target_group == 'free_with_points':
-            # العاديون (لا نهتم بالنقاط) - كل العاديين
-            is_target_user = is_regular_user
-        elif target_group == 'free_no_points':
-            # العاديون (بدون نقاط) - العاديون الذين ليس لديهم نقاط
-            is_target_user = is_regular_user and not has_credits
-        elif target_group == 'free_all':
-            # جميع العاديون
-            is_target_user = is_regular_user
-        elif target_group == 'vip_with_points':
-            # VIP (لا نهتم بالنقاط) - كل VIP
-            is_target_user = is_vip_user
-        elif target_group == 'vip_no_points':
-            # VIP (بدون نقاط) - VIP الذين ليس لديهم نقاط
-            is_target_user = is_vip_user and not has_credits
-        elif target_group == 'vip_all':
-            # جميع VIP
-            is_target_user = is_vip_user
-        elif target_group == 'everyone_with_points':
-            # الجميع (لا نهتم بالنقاط) - كل الناس ماعدا Admin
-            is_target_user = not is_admin_user
-        elif target_group == 'everyone_no_points':
-            # الجميع (بدون نقاط) - الجميع الذين ليس لديهم نقاط
-            is_target_user = (is_regular_user or is_vip_user) and not has_credits
-        elif target_group == 'everyone_all':
-            # الجميع
-            is_target_user = not is_admin_user
-        elif target_group == 'no_credits_only':
-            # المستخدمون بدون نقاط فقط (عادي + VIP بدون نقاط)
-            is_target_user = (is_regular_user or is_vip_user) and not has_credits
-        elif target_group == 'everyone_except_no_credits':
-            # الجميع عدا من لديهم نقاط (أي: ضع اللوجو للجميع إلا من لديه نقاط)
-            is_target_user = (is_regular_user or is_vip_user) and not has_credits
-        
-        should_apply_logo = (
-            not is_audio and 
-            logo_enabled and 
-            is_target_user and
-            logo_path and 
-            os.path.exists(logo_path)
-        )
-        
-        # إضافة رسائل تشخيص
-        logger.info(f"🔍 تشخيص اللوجو:")
-        logger.info(f"  - is_audio: {is_audio}")
-        logger.info(f"  - logo_enabled: {logo_enabled}")
-        logger.info(f"  - target_group: {target_group}")
-        logger.info(f"  - is_regular_user: {is_regular_user}")
-        logger.info(f"  - is_vip_user: {is_vip_user}")
-        logger.info(f"  - is_admin_user: {is_admin_user}")
-        logger.info(f"  - has_credits: {has_credits}")
-        logger.info(f"  - is_target_user: {is_target_user}")
-        logger.info(f"  - logo_path: {logo_path}")
-        logger.info(f"  - logo_exists: {os.path.exists(logo_path) if logo_path else False}")
-        logger.info(f"  - should_apply_logo: {should_apply_logo}")
-        
-        if not should_apply_logo:
-            if not logo_enabled:
-                log_warning("⚠️ اللوجو معطل من الإعدادات", module="handlers/download.py")
-            elif is_audio:
-                log_warning("⚠️ الملف صوتي، لا يطبق لوجو", module="handlers/download.py")
-            elif not is_target_user:
-                log_warning(f"⚠️ المستخدم ليس ضمن الفئة المستهدفة: {target_group}", module="handlers/download.py")
-            elif not logo_path:
-                log_warning("⚠️ مسار اللوجو غير معرف", module="handlers/download.py")
-            elif not os.path.exists(logo_path):
-                log_warning(f"⚠️ ملف اللوجو غير موجود: {logo_path}", module="handlers/download.py")
-        
-        if should_apply_logo:
-            logger.info(f"✅ سيتم تطبيق اللوجو على الفيديو")
-        
-        if should_apply_logo:
+        if streamed_path:
+            logger.info(f"✨ تم تطبيق اللوجو المتحرك أثناء التحميل (تدفق)")
+        elif should_apply_logo:
             from utils import apply_animated_watermark
 
             temp_watermarked_path = new_filepath.replace(f".{ext}", f"_watermarked.{ext}")
@@ -1492,14 +1727,15 @@ async def perform_download(update: Update, context: ContextTypes.DEFAULT_TYPE, u
             logger.info(f"  - temp_watermarked_path: {temp_watermarked_path}")
             logger.info(f"  - logo_path: {logo_path}")
 
-            # استخدام ThreadPoolExecutor لتجنب التجميد أثناء FFmpeg
-            loop = asyncio.get_event_loop()
-            result_path = await loop.run_in_executor(
+            # استخدام ThreadPoolExecutor لتجنب التجميد أثناء FFmpeg (يُقتل عند الإلغاء)
+            result_path = await cancel_token.run_in_executor(
                 executor,
                 apply_animated_watermark,
                 new_filepath,
                 temp_watermarked_path,
-                logo_path
+                logo_path,
+                None,
+                cancel_token
             )
 
             # تتبع حالة الملف بعد تطبيق اللوجو
@@ -1518,13 +1754,7 @@ async def perform_download(update: Update, context: ContextTypes.DEFAULT_TYPE, u
                 final_video_path = new_filepath
         elif has_credits and not is_subscribed_user and not is_user_admin:
             # المستخدم لديه نقاط ولم يتم وضع اللوجو، فنستهلك نقطة
-            if use_no_logo_credit(user_id):
-                logger.info(f"✅ تم استخدام نقطة بدون لوجو للمستخدم {user_id}، المتبقي: {no_logo_credits - 1}")
-                # إرسال إشعار للمستخدم
-                await context.bot.send_message(
-                    chat_id=update.effective_chat.id,
-                    text=f"🎨 تم استخدام نقطة بدون لوجو!\n💰 الرصيد المتبقي: {no_logo_credits - 1} فيديو"
-                )
+            await spend_no_logo_credit(context, update, user_ctx)
 
         # Safety check: ensure final_video_path is never None and points to existing file
         if final_video_path is None:
@@ -1557,21 +1787,14 @@ async def perform_download(update: Update, context: ContextTypes.DEFAULT_TYPE, u
         
         if file_size > 2 * 1024 * 1024 * 1024:
             await safe_edit_message(processing_message, "❌ الملف كبير جداً! (أكثر من 2GB)")
+            flight_outcome = (None, ValueError("الملف كبير جداً! (أكثر من 2GB)"))
             return
         
         duration = info_dict.get('duration', 0)
-        uploader = info_dict.get('uploader', 'Unknown')[:40]
-        
-        caption_text = (
-            f"🎬 {title[:50]}\n\n"
-            f"👤 {uploader}\n"
-            f"⏱️ {format_duration(duration)} | 📦 {format_file_size(file_size)}\n"
-            f"{'🎵' if is_audio else '🎥'} {'💎 VIP' if is_subscribed_user else '🆓 مجاني'}\n\n"
-            f"✨ بواسطة @{context.bot.username}"
-        )
+        caption_text = build_media_caption(info_dict, file_size, is_audio, is_subscribed_user, context.bot.username)
 
         # محاولة إرسال الملف مع إعادة المحاولة في حالة TimedOut
-        sent_message, upload_error = await send_file_with_retry(
+        sent_message, upload_error = await cancel_token.run(send_file_with_retry(
             context=context,
             chat_id=update.effective_chat.id,
             file_path=final_video_path,
@@ -1582,10 +1805,11 @@ async def perform_download(update: Update, context: ContextTypes.DEFAULT_TYPE, u
             info_dict=info_dict,
             max_retries=3,
             progress_message=processing_message  # إضافة progress tracking للرفع
-        )
+        ))
 
         if sent_message:
-            # نجح الرفع
+            # نجح الرفع - حفظ file_id للطلبات المتكررة وإيقاظ الطلبات المنتظرة
+            download_flights.end(delivery_key, flight, (remember_delivery(delivery_key, sent_message), None))
             if is_audio:
                 logger.info(f"✅ تم تحميل الصوت بنجاح — {user_id} — {title[:30]} — {format_duration(duration)}")
             else:
@@ -1595,6 +1819,7 @@ async def perform_download(update: Update, context: ContextTypes.DEFAULT_TYPE, u
         else:
             # فشل الرفع بعد جميع المحاولات - استخدام البديل
             logger.error(f"❌ فشل رفع الملف بعد {3} محاولات: {upload_error}")
+            flight_outcome = (None, Exception(f"فشل رفع الملف: {upload_error}"))
 
             # محاولة رفع الملف إلى سيرفر خارجي (placeholder)
             alternative_url = await upload_to_server(final_video_path, user_id)
@@ -1671,11 +1896,12 @@ async def perform_download(update: Update, context: ContextTypes.DEFAULT_TYPE, u
         except Exception as e:
             logger.debug(f"فشل حذف رسالة المعالجة: {e}")
         
+        download_completed = True
         if not is_user_admin and not is_subscribed_user:
-            from database import get_daily_download_limit_setting
-            increment_download_count(user_id)
-            daily_limit = get_daily_download_limit_setting()
-            remaining = daily_limit - get_daily_download_count(user_id)
+            if not daily_reserved:
+                await async_increment_download_count(user_id)
+                user_ctx.consume_download()
+            remaining = user_ctx.remaining_downloads
             if remaining > 0:
                 await context.bot.send_message(
                     chat_id=update.effective_chat.id,
@@ -1684,97 +1910,112 @@ async def perform_download(update: Update, context: ContextTypes.DEFAULT_TYPE, u
 
         # إرسال سجل للقناة فقط إذا نجح الرفع
         if sent_message:
-            await send_log_to_channel(context, update, user, info_dict, final_video_path, sent_message, is_audio)
+            await send_log_to_channel(context, update, user, info_dict, final_video_path, sent_message, is_audio, delivery_key=delivery_key)
         
         # تسجيل الإحصائيات - تحميل ناجح
-        from database import record_download_attempt
         speed_mbps = 0  # يمكن حسابها من بيانات التقدم
-        record_download_attempt(success=True, speed=speed_mbps)
+        await async_record_download_attempt(success=True, speed=speed_mbps)
         
+    except DownloadCancelled:
+        # أُلغي بطلب المستخدم - لا تقرير خطأ، والطلبات المنتظرة تعيد التحميل بنفسها
+        logger.info(f"⛔ تم إلغاء التحميل — {user_id} — {url[:50]}")
+        try:
+            await processing_message.edit_text("❌ تم إلغاء التحميل.")
+        except Exception as e:
+            logger.debug(f"فشل تحديث رسالة المعالجة: {e}")
+
+    except asyncio.CancelledError:
+        # إلغاء المهمة نفسها (دفعة/قائمة تشغيل) - إيقاف العمل الجاري في الخيوط
+        cancel_token.cancel()
+        raise
+
     except Exception as e:
         logger.error(f"❌ خطأ: {e}", exc_info=True)
+        flight_outcome = (None, e)
+
+        # انتظر هذا الطلب تحميلاً فشل لطلب آخر: المنفذ سجل الخطأ وأبلغ عنه
+        # فقط رسالة المستخدم هنا (بدون بلاغ مكرر لكل طلب متزامن)
+        shared_failure = isinstance(e, SharedFlightError)
 
         # تحديد نوع الخطأ
-        error_type = type(e).__name__
+        error_type = type(e.error if shared_failure else e).__name__
         error_message = str(e)
 
-        # تسجيل خطأ التحميل محلياً (ليس خطأ جسيم)
-        error_details = f"فشل تحميل فيديو للمستخدم {user_id}\nالرابط: {url}\nالخطأ: {error_message}"
-        log_warning(error_details, module="handlers/download.py")
-
-        # تسجيل الإحصائيات - تحميل فاشل
-        from database import record_download_attempt
-        record_download_attempt(success=False, speed=0)
-
-        # === نظام البلاغات التلقائي ===
-        # 1. إنشاء بلاغ في قاعدة البيانات
-        from database import create_error_report
-
-        username = user.username if user.username else user.full_name
-        report_id = create_error_report(
-            user_id=user_id,
-            username=username,
-            url=url,
-            error_type=error_type,
-            error_message=error_message[:500]  # حد 500 حرف
-        )
+        if not shared_failure:
+            # تسجيل خطأ التحميل محلياً (ليس خطأ جسيم)
+            error_details = f"فشل تحميل فيديو للمستخدم {user_id}\nالرابط: {url}\nالخطأ: {error_message}"
+            log_warning(error_details, module="handlers/download.py")
 
-        # 2. إرسال تقرير إلى قناة السجلات مع تفاصيل المنصة
-        platform_name = "Unknown"
-        if 'tiktok.com' in url:
-            platform_name = "TikTok"
-        elif 'instagram.com' in url:
-            platform_name = "Instagram"
-        elif 'facebook.com' in url or 'fb.watch' in url or 'fb.com' in url:
-            platform_name = "Facebook"
-        elif 'youtube.com' in url or 'youtu.be' in url:
-            platform_name = "YouTube"
-        elif 'twitter.com' in url or 'x.com' in url:
-            platform_name = "Twitter/X"
-        elif 'pinterest.com' in url or 'pin.it' in url:
-            platform_name = "Pinterest"
-        elif 'reddit.com' in url or 'redd.it' in url:
-            platform_name = "Reddit"
-        elif 'vimeo.com' in url:
-            platform_name = "Vimeo"
-        elif 'dailymotion.com' in url or 'dai.ly' in url:
-            platform_name = "Dailymotion"
-        elif 'twitch.tv' in url:
-            platform_name = "Twitch"
-
-        if LOG_CHANNEL_ID:
-            try:
-                log_channel_id = int(LOG_CHANNEL_ID)
-
-                # تحضير معلومات العضو الكاملة
-                user_name = user.full_name
-                username_display = f"@{user.username}" if user.username else "لا يوجد"
-
-                error_report_text = (
-                    f"⚠️ <b>فشل تحميل من {platform_name}</b>\n"
-                    f"{'━' * 30}\n\n"
-                    f"👤 <b>معلومات العضو:</b>\n"
-                    f"   • الاسم: {user_name}\n"
-                    f"   • اليوزر: {username_display}\n"
-                    f"   • ID: <code>{user_id}</code>\n\n"
-                    f"📱 <b>المنصة:</b> {platform_name}\n\n"
-                    f"🔗 <b>الرابط:</b>\n{url[:150]}\n\n"
-                    f"⚠️ <b>نوع الخطأ:</b> <code>{error_type}</code>\n\n"
-                    f"💬 <b>تفاصيل الخطأ:</b>\n<code>{error_message[:300]}</code>\n\n"
-                    f"📅 <b>الوقت:</b> {datetime.now().strftime('%d-%m-%Y — %H:%M UTC')}\n"
-                    f"{'━' * 30}"
-                )
+            # تسجيل الإحصائيات - تحميل فاشل
+            await async_record_download_attempt(success=False, speed=0)
 
-                await context.bot.send_message(
-                    chat_id=log_channel_id,
-                    text=error_report_text,
-                    parse_mode='HTML',
-                    disable_web_page_preview=True
-                )
+            # === نظام البلاغات التلقائي ===
+            # 1. إنشاء بلاغ في قاعدة البيانات
+            username = user.username if user.username else user.full_name
+            report_id = await async_create_error_report(
+                user_id=user_id,
+                username=username,
+                url=url,
+                error_type=error_type,
+                error_message=error_message[:500]  # حد 500 حرف
+            )
 
-                logger.info(f"✅ تم إرسال تقرير الخطأ لقناة السجلات")
-            except Exception as log_error:
-                log_warning(f"❌ فشل إرسال تقرير الخطأ لقناة السجلات: {log_error}", module="handlers/download.py")
+            # 2. إرسال تقرير إلى قناة السجلات مع تفاصيل المنصة
+            platform_name = "Unknown"
+            if 'tiktok.com' in url:
+                platform_name = "TikTok"
+            elif 'instagram.com' in url:
+                platform_name = "Instagram"
+            elif 'facebook.com' in url or 'fb.watch' in url or 'fb.com' in url:
+                platform_name = "Facebook"
+            elif 'youtube.com' in url or 'youtu.be' in url:
+                platform_name = "YouTube"
+            elif 'twitter.com' in url or 'x.com' in url:
+                platform_name = "Twitter/X"
+            elif 'pinterest.com' in url or 'pin.it' in url:
+                platform_name = "Pinterest"
+            elif 'reddit.com' in url or 'redd.it' in url:
+                platform_name = "Reddit"
+            elif 'vimeo.com' in url:
+                platform_name = "Vimeo"
+            elif 'dailymotion.com' in url or 'dai.ly' in url:
+                platform_name = "Dailymotion"
+            elif 'twitch.tv' in url:
+                platform_name = "Twitch"
+
+            if LOG_CHANNEL_ID:
+                try:
+                    log_channel_id = int(LOG_CHANNEL_ID)
+
+                    # تحضير معلومات العضو الكاملة
+                    user_name = user.full_name
+                    username_display = f"@{user.username}" if user.username else "لا يوجد"
+
+                    error_report_text = (
+                        f"⚠️ <b>فشل تحميل من {platform_name}</b>\n"
+                        f"{'━' * 30}\n\n"
+                        f"👤 <b>معلومات العضو:</b>\n"
+                        f"   • الاسم: {user_name}\n"
+                        f"   • اليوزر: {username_display}\n"
+                        f"   • ID: <code>{user_id}</code>\n\n"
+                        f"📱 <b>المنصة:</b> {platform_name}\n\n"
+                        f"🔗 <b>الرابط:</b>\n{url[:150]}\n\n"
+                        f"⚠️ <b>نوع الخطأ:</b> <code>{error_type}</code>\n\n"
+                        f"💬 <b>تفاصيل الخطأ:</b>\n<code>{error_message[:300]}</code>\n\n"
+                        f"📅 <b>الوقت:</b> {datetime.now().strftime('%d-%m-%Y — %H:%M UTC')}\n"
+                        f"{'━' * 30}"
+                    )
+
+                    await context.bot.send_message(
+                        chat_id=log_channel_id,
+                        text=error_report_text,
+                        parse_mode='HTML',
+                        disable_web_page_preview=True
+                    )
+
+                    logger.info(f"✅ تم إرسال تقرير الخطأ لقناة السجلات")
+                except Exception as log_error:
+                    log_warning(f"❌ فشل إرسال تقرير الخطأ لقناة السجلات: {log_error}", module="handlers/download.py")
 
         # 3. إشعار المستخدم بالفشل مع رسالة مخصصة حسب المنصة
         error_text = "❌ **حدث خطأ أثناء تحميل المقطع!**\n\n"
@@ -1836,13 +2077,24 @@ async def perform_download(update: Update, context: ContextTypes.DEFAULT_TYPE, u
                 log_warning(f"فشل إرسال رسالة الخطأ: {send_error}", module="handlers/download.py")
     
     finally:
-        for filepath in [new_filepath, temp_watermarked_path]:
-            if filepath and os.path.exists(filepath):
-                try:
-                    os.remove(filepath)
-                    logger.info(f"🗑️ تم حذف: {filepath}")
-                except Exception as e:
-                    logger.error(f"❌ فشل الحذف: {e}")
+        # إيقاظ الطلبات المنتظرة (None عند الإلغاء - أول منتظر يعيد التحميل بنفسه)
+        if flight is not None:
+            download_flights.end(delivery_key, flight, flight_outcome)
+        if download_job is not None:
+            download_scheduler.release(download_job)
+
+        unregister_cancel_token(user_id, cancel_token)
+        if cancel_token.cancelled:
+            cancel_token.cleanup_partial_files()
+
+        # إرجاع التحميل المحجوز إذا فشل أو أُلغي
+        if daily_reserved and not download_completed:
+            await async_release_daily_download(user_id)
+
+        # حذف مجلد المهمة بكل ما فيه (الأصلي، اللوجو، الضغط، الأجزاء)
+        if job_dir:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            logger.info(f"🗑️ تم حذف مجلد المهمة: {job_dir}")
 
 @rate_limit(seconds=10)
 async def handle_download(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1851,17 +2103,15 @@ async def handle_download(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = user.id
     url = update.message.text.strip()
 
-    # استخدام الذاكرة المؤقتة للحصول على لغة المستخدم
-    lang = get_cached_user_data(user_id, get_user_language)
+    # سياق الطلب: استعلام users واحد + لقطة الإعدادات (بدلاً من ~10 استعلامات منفصلة)
+    user_ctx = await async_load_user_context(user_id)
+    lang = user_ctx.lang
 
     # رد سريع للمستخدم - تحسين الإحساس بالاستجابة
     processing_msg = await update.message.reply_text(get_message(lang, 'download_processing', '⏳ جاري المعالجة...'))
 
-    # جلب بيانات المستخدم مع التخزين المؤقت
-    user_data = get_cached_user_data(user_id, get_user)
-
     # التحقق من بيانات المستخدم
-    if not user_data:
+    if not user_ctx.exists:
         await processing_msg.edit_text("❌ لم يتم العثور على بياناتك. الرجاء إرسال /start")
         return
 
@@ -1878,16 +2128,15 @@ async def handle_download(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception:
         pass
 
-    is_user_admin = is_admin(user_id)
-    is_subscribed_user = is_subscribed(user_id)
+    is_user_admin = user_ctx.is_admin
+    is_subscribed_user = user_ctx.is_subscribed
     config = get_config()
     
     # التحقق من المنصة المسموحة
-    from database import is_platform_allowed
     platform = get_platform_from_url(url)
     
     # ⭐ إذا كانت المنصة "unknown"، نسمح بالمحاولة لأن yt-dlp يدعم 1000+ موقع
-    if platform != 'unknown' and not is_platform_allowed(platform):
+    if platform != 'unknown' and not user_ctx.is_platform_allowed(platform):
         platform_names = {
             'youtube': 'YouTube',
             'facebook': 'Facebook', 
@@ -1913,13 +2162,11 @@ async def handle_download(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # التحقق من الحد اليومي (فقط إذا كان الاشتراك مفعلاً)
-    from database import is_subscription_enabled, get_daily_download_limit_setting
-    subscription_enabled = is_subscription_enabled()
+    subscription_enabled = user_ctx.subscription_enabled
 
     if subscription_enabled and not is_user_admin and not is_subscribed_user:
-        daily_count = get_daily_download_count(user_id)
-        daily_limit = get_daily_download_limit_setting()  # جلب الحد من قاعدة البيانات
-        if daily_count >= daily_limit:
+        daily_limit = user_ctx.daily_limit
+        if user_ctx.reached_daily_limit:
             keyboard = [[InlineKeyboardButton(
                 "⭐ اشترك الآن",
                 url="https://instagram.com/7kmmy"
@@ -1940,11 +2187,8 @@ async def handle_download(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ydl_opts['skip_download'] = True  # فقط للتحليل
 
         # إزالة format في مرحلة التحليل لتجنب مشاكل التوافق
-        # سنحدد format فقط عند التحميل الفعلي
-        if 'format' in ydl_opts:
-            del ydl_opts['format']
-
-        loop = asyncio.get_event_loop()
+        # سنحدد format فقط عند التحميل الفعلي (صيغة المنصة تُستخدم لتقدير الأحجام في القائمة)
+        format_spec = ydl_opts.pop('format', None)
 
         # 📊 Logging محسّن لتتبع الأخطاء
         platform = get_platform_from_url(url)
@@ -1955,14 +2199,14 @@ async def handle_download(update: Update, context: ContextTypes.DEFAULT_TYPE):
             logger.info(f"🔍 [STORY_DEBUG] Cookies loaded: {ydl_opts.get('cookiefile') is not None}")
             logger.info(f"🔍 [STORY_DEBUG] YDL opts keys: {list(ydl_opts.keys())}")
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            if is_story:
-                logger.info(f"🔍 [STORY_DEBUG] Attempting extract_info for {platform} story...")
+        if is_story:
+            logger.info(f"🔍 [STORY_DEBUG] Attempting extract_info for {platform} story...")
 
-            info_dict = await loop.run_in_executor(None, lambda: ydl.extract_info(url, download=False))
+        # نتيجة التحليل من الذاكرة المؤقتة إذا حلل أحد نفس الرابط مؤخراً
+        info_dict = await extract_info_cached(url, ydl_opts)
 
-            if is_story:
-                logger.info(f"✅ [STORY_DEBUG] Successfully extracted! Extractor: {info_dict.get('extractor', 'unknown')}")
+        if is_story:
+            logger.info(f"✅ [STORY_DEBUG] Successfully extracted! Extractor: {info_dict.get('extractor', 'unknown')}")
         
         title = info_dict.get('title', 'فيديو')
         duration = info_dict.get('duration', 0)
@@ -1972,12 +2216,9 @@ async def handle_download(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         # التحقق من القيود الزمنية (فقط إذا كان الاشتراك مفعلاً)
-        from database import is_subscription_enabled, get_free_time_limit
-        subscription_enabled = is_subscription_enabled()
-
         if subscription_enabled:
             # الاشتراك مفعل - تطبيق القيود على غير المشتركين
-            free_time_limit = get_free_time_limit()  # جلب الحد من قاعدة البيانات (بالدقائق)
+            free_time_limit = user_ctx.free_time_limit  # الحد بالدقائق
             max_free_duration = free_time_limit * 60  # تحويل إلى ثواني
             if not is_user_admin and not is_subscribed_user and duration and duration > max_free_duration:
                 # Track rejection for server load monitoring (V5.0.1)
@@ -2006,53 +2247,54 @@ async def handle_download(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         await processing_message.delete()
         
-        await show_quality_menu(update, context, url, info_dict)
+        await show_quality_menu(update, context, url, info_dict, user_ctx=user_ctx, format_spec=format_spec)
         
     except Exception as e:
         logger.error(f"❌ خطأ في التحليل: {e}", exc_info=True)
         error_msg = str(e)
 
-        # 🔴 تتبع الخطأ بنظام متقدم
-        platform = get_platform_from_url(url)
-        ErrorTracker.track_download_error(
-            platform=platform,
-            url=url,
-            error_message=error_msg,
-            user_id=user_id,
-            cookies_used=platform_cookies is not None if 'platform_cookies' in locals() else False,
-            extractor_used="unknown"
-        )
-
-        # 📢 إرسال الخطأ لقناة السجلات (NEW: Channel Error Tracking)
-        try:
-            from handlers.channel_manager import channel_manager
-            await channel_manager.log_error(
-                bot=context.bot,
-                error_type=f"Download Error - {platform.title()}",
-                error_message=f"{error_msg[:200]}",  # أول 200 حرف فقط
-                user_id=user_id
+        # خطأ استخراج مشترك مع طلب متزامن: المنفذ أبلغ عنه، هنا رسالة المستخدم فقط
+        if not isinstance(e, SharedFlightError):
+            # 🔴 تتبع الخطأ بنظام متقدم
+            platform = get_platform_from_url(url)
+            ErrorTracker.track_download_error(
+                platform=platform,
+                url=url,
+                error_message=error_msg,
+                user_id=user_id,
+                cookies_used=platform_cookies is not None if 'platform_cookies' in locals() else False,
+                extractor_used="unknown"
             )
-        except Exception as log_error:
-            logger.error(f"❌ فشل إرسال الخطأ للقناة: {log_error}")
 
-        # 💾 حفظ البلاغ في قاعدة البيانات (لوحة الأدمن)
-        try:
-            from database import create_error_report
-            # الحصول على username
-            username = user.username if hasattr(user, 'username') else None
-            if not username:
-                username = f"user_{user_id}"
+            # 📢 إرسال الخطأ لقناة السجلات (NEW: Channel Error Tracking)
+            try:
+                from handlers.channel_manager import channel_manager
+                await channel_manager.log_error(
+                    bot=context.bot,
+                    error_type=f"Download Error - {platform.title()}",
+                    error_message=f"{error_msg[:200]}",  # أول 200 حرف فقط
+                    user_id=user_id
+                )
+            except Exception as log_error:
+                logger.error(f"❌ فشل إرسال الخطأ للقناة: {log_error}")
 
-            create_error_report(
-                user_id=user_id,
-                username=username,
-                url=url,
-                error_type=f"Download Error - {platform.title()}",
-                error_message=error_msg[:500]  # حفظ أول 500 حرف
-            )
-            logger.info(f"✅ تم حفظ البلاغ في قاعدة البيانات للمستخدم {user_id}")
-        except Exception as db_error:
-            logger.error(f"❌ فشل حفظ البلاغ في قاعدة البيانات: {db_error}")
+            # 💾 حفظ البلاغ في قاعدة البيانات (لوحة الأدمن)
+            try:
+                # الحصول على username
+                username = user.username if hasattr(user, 'username') else None
+                if not username:
+                    username = f"user_{user_id}"
+
+                await async_create_error_report(
+                    user_id=user_id,
+                    username=username,
+                    url=url,
+                    error_type=f"Download Error - {platform.title()}",
+                    error_message=error_msg[:500]  # حفظ أول 500 حرف
+                )
+                logger.info(f"✅ تم حفظ البلاغ في قاعدة البيانات للمستخدم {user_id}")
+            except Exception as db_error:
+                logger.error(f"❌ فشل حفظ البلاغ في قاعدة البيانات: {db_error}")
 
         # ⭐ معالج خاص لأخطاء cookies database
         if 'could not find' in error_msg.lower() and 'cookies database' in error_msg.lower():
@@ -2662,11 +2904,16 @@ async def handle_download(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def cancel_download(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """إلغاء التحميل الجاري للمستخدم"""
     user_id = update.effective_user.id
-    lang = get_user_language(user_id)
+    lang = await async_get_user_language(user_id)
     task = ACTIVE_DOWNLOADS.get(user_id)
 
+    # إيقاف yt-dlp و ffmpeg والرفع الجاري فعلياً (وليس الـ coroutine فقط)
+    cancelled = cancel_user_downloads(user_id)
     if task and not task.done():
         task.cancel()
+        cancelled += 1
+
+    if cancelled:
         await update.effective_message.reply_text("🛑 طلب الإلغاء تم إرساله. سيتم إيقاف التحميل.")
         logger.info(f"⛔ المستخدم {user_id} ألغى التحميل")
     else:
@@ -2678,11 +2925,15 @@ async def cancel_download_callback(update: Update, context: ContextTypes.DEFAULT
     await query.answer()
 
     user_id = query.from_user.id
-    lang = get_user_language(user_id)
+    lang = await async_get_user_language(user_id)
     task = ACTIVE_DOWNLOADS.get(user_id)
 
+    cancelled = cancel_user_downloads(user_id)
     if task and not task.done():
         task.cancel()
+        cancelled += 1
+
+    if cancelled:
         await query.edit_message_text("❌ تم إلغاء التحميل بنجاح.")
         logger.info(f"⛔ المستخدم {user_id} ألغى التحميل عبر زر inline")
 
@@ -2706,10 +2957,7 @@ async def extract_playlist_info(url: str, progress_msg, user_id: int):
     }
 
     try:
-        loop = asyncio.get_event_loop()
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            playlist_info = await loop.run_in_executor(None, lambda: ydl.extract_info(url, download=False))
+        playlist_info = await extract_info_cached(url, ydl_opts)
 
         if not playlist_info:
             return None
@@ -2776,14 +3024,13 @@ async def handle_batch_download(update: Update, context: ContextTypes.DEFAULT_TY
     urls = urls[:BATCH_MAX_URLS]
     user_id = update.effective_user.id
     user = update.effective_user
-    lang = get_user_language(user_id)
+    lang = await async_get_user_language(user_id)
 
     # Check if user has an active download
     if ACTIVE_DOWNLOADS.get(user_id) and not ACTIVE_DOWNLOADS[user_id].done():
         await update.message.reply_text(get_message(lang, 'download_active', '⚠️ لديك تحميل جارٍ بالفعل. انتظر حتى ينتهي أو استخدم /cancel لإلغائه.'))
         return
 
-    sem_user = USER_SEMAPHORE[user_id]
     sem_batch = asyncio.Semaphore(PER_USER_BATCH_CONCURRENCY)
 
     await update.message.reply_text(
@@ -2793,61 +3040,57 @@ async def handle_batch_download(update: Update, context: ContextTypes.DEFAULT_TY
 
     # Track batch download task
     async def _batch_download_flow():
-        async with sem_user:
-            try:
-                async def process_one(url_to_download, idx):
-                    async with sem_batch:
-                        if ACTIVE_DOWNLOADS.get(user_id) and ACTIVE_DOWNLOADS[user_id].cancelled():
-                            logger.info(f"⛔ الدفعة ملغاة للمستخدم {user_id}")
-                            return
-
-                        try:
-                            logger.info(f"📥 معالجة رابط {idx+1}/{len(urls)}: {url_to_download}")
-
-                            # Reuse existing download logic
-                            processing_message = await update.message.reply_text(f"🔍 جاري التحليل ({idx+1}/{len(urls)})...")
-
-                            ydl_opts = get_ydl_opts_for_platform(url_to_download)
-                            ydl_opts['skip_download'] = True
+        try:
+            async def process_one(url_to_download, idx):
+                async with sem_batch:
+                    if ACTIVE_DOWNLOADS.get(user_id) and ACTIVE_DOWNLOADS[user_id].cancelled():
+                        logger.info(f"⛔ الدفعة ملغاة للمستخدم {user_id}")
+                        return
 
-                            loop = asyncio.get_event_loop()
+                    try:
+                        logger.info(f"📥 معالجة رابط {idx+1}/{len(urls)}: {url_to_download}")
 
-                            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                                info_dict = await loop.run_in_executor(None, lambda: ydl.extract_info(url_to_download, download=False))
+                        # Reuse existing download logic
+                        processing_message = await update.message.reply_text(f"🔍 جاري التحليل ({idx+1}/{len(urls)})...")
 
-                            await processing_message.delete()
+                        ydl_opts = get_ydl_opts_for_platform(url_to_download)
+                        ydl_opts['skip_download'] = True
 
-                            # Use show_quality_menu or download directly with best quality
-                            await show_quality_menu(update, context, url_to_download, info_dict)
+                        info_dict = await extract_info_cached(url_to_download, ydl_opts)
 
-                        except asyncio.CancelledError:
-                            logger.info(f"⛔ تم إلغاء التحميل {idx+1}")
-                            raise
-                        except Exception as e:
-                            logger.error(f"❌ خطأ في تحميل الرابط {idx+1}: {e}")
-                            await update.message.reply_text(f"❌ فشل تحميل الرابط {idx+1}: {url_to_download[:50]}")
+                        await processing_message.delete()
 
-                tasks = [asyncio.create_task(process_one(u, i)) for i, u in enumerate(urls)]
+                        # Use show_quality_menu or download directly with best quality
+                        await show_quality_menu(update, context, url_to_download, info_dict)
 
-                try:
-                    await asyncio.gather(*tasks, return_exceptions=False)
-                except asyncio.CancelledError:
-                    for t in tasks:
-                        if not t.done():
-                            t.cancel()
-                    raise
+                    except asyncio.CancelledError:
+                        logger.info(f"⛔ تم إلغاء التحميل {idx+1}")
+                        raise
+                    except Exception as e:
+                        logger.error(f"❌ خطأ في تحميل الرابط {idx+1}: {e}")
+                        await update.message.reply_text(f"❌ فشل تحميل الرابط {idx+1}: {url_to_download[:50]}")
 
-                await update.message.reply_text("✅ اكتملت الدفعة.")
+            tasks = [asyncio.create_task(process_one(u, i)) for i, u in enumerate(urls)]
 
+            try:
+                await asyncio.gather(*tasks, return_exceptions=False)
             except asyncio.CancelledError:
-                try:
-                    await update.message.reply_text("⛔ تم إلغاء الدفعة بناءً على طلبك.")
-                except Exception:
-                    pass
+                for t in tasks:
+                    if not t.done():
+                        t.cancel()
                 raise
-            finally:
-                if ACTIVE_DOWNLOADS.get(user_id) is task:
-                    ACTIVE_DOWNLOADS.pop(user_id, None)
+
+            await update.message.reply_text("✅ اكتملت الدفعة.")
+
+        except asyncio.CancelledError:
+            try:
+                await update.message.reply_text("⛔ تم إلغاء الدفعة بناءً على طلبك.")
+            except Exception:
+                pass
+            raise
+        finally:
+            if ACTIVE_DOWNLOADS.get(user_id) is task:
+                ACTIVE_DOWNLOADS.pop(user_id, None)
 
     task = asyncio.create_task(_batch_download_flow(), name=f"batch_download:{user_id}")
     ACTIVE_DOWNLOADS[user_id] = task
@@ -2856,7 +3099,7 @@ async def handle_batch_download(update: Update, context: ContextTypes.DEFAULT_TY
 async def handle_playlist_download(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """معالج تحميل playlist YouTube بشكل تفاعلي"""
     user_id = update.effective_user.id
-    lang = get_user_language(user_id)
+    lang = await async_get_user_language(user_id)
     url = update.message.text.strip()
 
     # Check if it's a playlist URL
@@ -2935,7 +3178,7 @@ async def handle_batch_quality_choice(update: Update, context: ContextTypes.DEFA
     await query.answer()
 
     user_id = query.from_user.id
-    lang = get_user_language(user_id)
+    lang = await async_get_user_language(user_id)
     data_parts = query.data.split(":")
     quality = data_parts[1]
 
@@ -3038,9 +3281,7 @@ async def handle_batch_quality_choice(update: Update, context: ContextTypes.DEFA
                         ydl_opts = get_ydl_opts_for_platform(video_url, quality)
                         ydl_opts['skip_download'] = True
 
-                        loop = asyncio.get_event_loop()
-                        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                            info_dict = await loop.run_in_executor(None, lambda: ydl.extract_info(video_url, download=False))
+                        info_dict = await extract_info_cached(video_url, ydl_opts)
 
                         # Download the video
                         await download_video_with_quality(fake_update, context, video_url, info_dict, quality)
@@ -3144,7 +3385,7 @@ async def proceed_to_quality_selection(update: Update, context: ContextTypes.DEF
     await query.answer()
 
     user_id = int(query.data.split(":")[1])
-    lang = get_user_language(user_id)
+    lang = await async_get_user_language(user_id)
 
     if query.from_user.id != user_id:
         await query.answer(get_message(lang, 'batch_not_your_request', '⚠️ هذا ليس طلبك!'), show_alert=True)
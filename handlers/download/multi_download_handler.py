@@ -5,9 +5,12 @@
 
 import os
 import re
+import time
 import asyncio
 import logging
-import subprocess
+import shutil
+import tempfile
+import threading
 from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -15,8 +18,22 @@ from telegram.ext import ContextTypes
 
 import yt_dlp
 
-from database import get_user_language, record_download_attempt, track_download
-from utils import log_warning, send_critical_log, log_error_to_file
+from database import (
+    get_user_language,
+    record_download_attempt,
+    async_track_download,
+    async_get_user_language,
+    async_is_admin,
+    async_is_subscribed,
+)
+from utils import log_warning, send_critical_log, log_error_to_file, clean_filename
+from core.media.watermark import run_ffmpeg
+from core.utils.ytdlp_runner import ytdlp_download
+from core.utils.cancellation import (
+    CancelToken, DownloadCancelled, register_cancel_token, unregister_cancel_token
+)
+from handlers.download.scheduler import download_scheduler
+from handlers.download.download import get_platform_from_url
 
 logger = logging.getLogger(__name__)
 
@@ -171,80 +188,92 @@ async def show_audio_format_selection(update: Update, context: ContextTypes.DEFA
 # ═══════════════════════════════════════════════════════════════
 
 class MultiDownloadProgress:
-    """تتبع تقدم التحميل المتعدد"""
+    """
+    تتبع تقدم التحميل المتعدد
+
+    progress_hook يُستدعى من خيوط yt-dlp (عدة ملفات بالتوازي)، لذلك الحالة
+    محمية بقفل وتحديث الرسالة يُرسل إلى event loop عبر run_coroutine_threadsafe.
+    """
 
     def __init__(self, message, total_files: int, mode: str, lang: str):
         self.message = message
         self.total_files = total_files
         self.mode = mode
         self.lang = lang
-        self.current_file = 0
-        self.current_progress = 0
+        self.loop = asyncio.get_running_loop()
+        self.files = {}  # رقم الملف -> نسبة التحميل أو 'uploading'
+        self.finished = 0
         self.last_update_time = 0
-        self.is_uploading = False
-
-    def progress_hook(self, d):
-        """معالج التقدم من yt-dlp"""
-        import time
-
-        if d['status'] == 'downloading':
-            current_time = time.time()
-
-            # تحديث كل ثانيتين فقط
-            if current_time - self.last_update_time < 2:
-                return
+        self.closed = False
+        self._lock = threading.Lock()
+        self._edit_lock = asyncio.Lock()
+        self._last_text = None
+
+    def hook_for(self, file_index: int):
+        """progress hook خاص بملف واحد"""
+        return lambda d: self.progress_hook(d, file_index)
+
+    def progress_hook(self, d, file_index: int = 0):
+        """معالج التقدم من yt-dlp (من أي خيط)"""
+        if d['status'] != 'downloading':
+            return
 
-            self.last_update_time = current_time
+        try:
+            # حساب النسبة المئوية
+            total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+            downloaded = d.get('downloaded_bytes') or 0
 
-            try:
-                # حساب النسبة المئوية
-                if 'total_bytes' in d:
-                    total = d['total_bytes']
-                elif 'total_bytes_estimate' in d:
-                    total = d['total_bytes_estimate']
+            with self._lock:
+                if total > 0:
+                    self.files[file_index] = min(int((downloaded / total) * 100), 100)
                 else:
-                    total = 0
+                    self.files.setdefault(file_index, 0)
 
-                downloaded = d.get('downloaded_bytes', 0)
+                # تحديث كل ثانيتين فقط (لكل الملفات معاً)
+                current_time = time.time()
+                if current_time - self.last_update_time < 2:
+                    return
+                self.last_update_time = current_time
+                update_text = self._render()
 
-                if total > 0:
-                    self.current_progress = int((downloaded / total) * 100)
+            # تحديث الرسالة بشكل آمن من خيط yt-dlp
+            asyncio.run_coroutine_threadsafe(self._safe_update(update_text), self.loop)
 
-                # عرض التقدم
-                progress_bar = self._create_progress_bar(self.current_progress)
+        except Exception as e:
+            logger.debug(f"Progress update error: {e}")
 
-                mode_text = "🎵 Audio" if self.mode == 'audio' else "🎥 Video"
+    def _render(self) -> str:
+        """نص التقدم لكل الملفات الجارية (يُستدعى داخل القفل)"""
+        mode_text = "🎵 Audio" if self.mode == 'audio' else "🎥 Video"
+        lines = [f"{mode_text} ({self.finished}/{self.total_files})\n"]
 
-                update_text = (
-                    f"{mode_text} ({self.current_file + 1}/{self.total_files})\n\n"
-                    f"⬇️ {'جاري التحميل' if self.lang == 'ar' else 'Downloading'}: {self.current_progress}%\n"
-                    f"{progress_bar}\n"
-                )
+        for file_index in sorted(self.files):
+            state = self.files[file_index]
+            if state == 'uploading':
+                lines.append(f"#{file_index + 1} 📤 {'جاري الرفع' if self.lang == 'ar' else 'Uploading'}...")
+            else:
+                lines.append(f"#{file_index + 1} ⬇️ {self._create_progress_bar(state)}")
 
-                # تحديث الرسالة بشكل آمن
-                loop = asyncio.get_event_loop()
-                loop.create_task(self._safe_update(update_text))
-
-            except Exception as e:
-                logger.debug(f"Progress update error: {e}")
+        return "\n".join(lines)
 
     async def _safe_update(self, text: str):
         """تحديث آمن للرسالة مع زر الإلغاء"""
-        try:
-            # إضافة زر الإلغاء
-            from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-
-            keyboard = [[
-                InlineKeyboardButton(
-                    "❌ إلغاء التحميل / Cancel Download",
-                    callback_data="download_cancel"
-                )
-            ]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            await self.message.edit_text(text, reply_markup=reply_markup)
-        except Exception:
-            pass
+        async with self._edit_lock:
+            if self.closed or text == self._last_text:
+                return
+            try:
+                keyboard = [[
+                    InlineKeyboardButton(
+                        "❌ إلغاء التحميل / Cancel Download",
+                        callback_data="download_cancel"
+                    )
+                ]]
+                reply_markup = InlineKeyboardMarkup(keyboard)
+
+                await self.message.edit_text(text, reply_markup=reply_markup)
+                self._last_text = text
+            except Exception:
+                pass
 
     def _create_progress_bar(self, percentage: int) -> str:
         """إنشاء شريط تقدم بتصميم محسّن"""
@@ -254,37 +283,138 @@ class MultiDownloadProgress:
         return f"{'▓' * filled}{'░' * empty} {percentage}%"
 
     async def set_uploading(self, file_num: int):
-        """تعيين حالة الرفع"""
-        self.is_uploading = True
-        self.current_file = file_num
+        """تعيين حالة الرفع لملف"""
+        with self._lock:
+            self.files[file_num] = 'uploading'
+            text = self._render()
+
+        await self._safe_update(text)
+
+    def finish(self, file_num: int):
+        """إزالة ملف انتهى (نجح أو فشل) من قائمة الجاري"""
+        with self._lock:
+            self.files.pop(file_num, None)
+            self.finished += 1
+
+    async def close(self, text: str, **kwargs):
+        """الرسالة النهائية - لا تحديثات تقدم بعدها"""
+        async with self._edit_lock:
+            self.closed = True
+            try:
+                await self.message.edit_text(text, **kwargs)
+            except Exception as e:
+                logger.debug(f"Final progress update error: {e}")
 
-        mode_text = "🎵 Audio" if self.mode == 'audio' else "🎥 Video"
 
-        text = (
-            f"{mode_text} ({file_num + 1}/{self.total_files})\n\n"
-            f"📤 {'جاري الرفع إلى Telegram' if self.lang == 'ar' else 'Uploading to Telegram'}...\n"
-            "⏳ Please wait..."
+# ═══════════════════════════════════════════════════════════════
+#  Parallel Runner
+# ═══════════════════════════════════════════════════════════════
+
+async def _run_multi_download(query, context, urls: List[str], progress_tracker: MultiDownloadProgress,
+                              track_fields: dict, process_url) -> Dict[str, int]:
+    """
+    تحميل كل الروابط بالتوازي عبر مجدول التحميل
+
+    كل رابط يحجز مكاناً من download_scheduler (نفس حدود التحميل الفردي: عام،
+    لكل منصة، ولكل مستخدم)، لذلك المهمة المتعددة لا تحجب المستخدمين الآخرين.
+
+    Args:
+        track_fields: حقول track_download الخاصة بالوضع (mode + quality/format)
+        process_url: async callable(file_index, url, cancel_token) -> حجم الملف المرفوع
+
+    Returns:
+        dict: {'completed': n, 'failed': n, 'canceled': n}
+    """
+    user_id = query.from_user.id
+    mode = track_fields['mode']
+    priority = await async_is_admin(user_id) or await async_is_subscribed(user_id)
+
+    # رمز إلغاء واحد لكل الروابط - يُلغى من زر الرسالة أو /cancel
+    cancel_token = CancelToken()
+    register_cancel_token(user_id, cancel_token)
+    tokens = context.user_data.setdefault('multi_download_tokens', {})
+    tokens[progress_tracker.message.message_id] = cancel_token
+
+    async def run_one(file_index: int, url: str) -> str:
+        platform = detect_platform(url)
+        job = None
+        try:
+            job = await cancel_token.run(download_scheduler.acquire(
+                user_id, get_platform_from_url(url), priority=priority
+            ))
+            file_size_bytes = await process_url(file_index, url, cancel_token)
+
+        except DownloadCancelled:
+            await async_track_download(user_id=user_id, platform=platform, status='canceled', url=url, **track_fields)
+            return 'canceled'
+
+        except Exception as e:
+            logger.error(f"{mode.title()} download error for {url}: {e}")
+            log_warning(
+                f"فشل تحميل {'صوت' if mode == 'audio' else 'فيديو'}: {url} - {str(e)}",
+                module="multi_download_handler"
+            )
+
+            # Mission 11: Enhanced error logging
+            log_error_to_file(f"{mode}_download", user_id, url, e)
+
+            # تسجيل الفشل
+            await async_track_download(
+                user_id=user_id, platform=platform, status='failed', url=url, error_msg=str(e), **track_fields
+            )
+            record_download_attempt(success=False, speed=0)
+            return 'failed'
+
+        finally:
+            if job is not None:
+                download_scheduler.release(job)
+            progress_tracker.finish(file_index)
+
+        # تسجيل مفصل في قاعدة البيانات (Mission 10)
+        await async_track_download(
+            user_id=user_id, platform=platform, status='completed', url=url, file_size=file_size_bytes, **track_fields
         )
+        record_download_attempt(success=True, speed=0)
+        return 'completed'
 
-        await self._safe_update(text)
+    try:
+        results = await asyncio.gather(*(run_one(idx, url) for idx, url in enumerate(urls)))
+    except asyncio.CancelledError:
+        cancel_token.cancel()
+        raise
+    finally:
+        unregister_cancel_token(user_id, cancel_token)
+        tokens.pop(progress_tracker.message.message_id, None)
+        if cancel_token.cancelled:
+            cancel_token.cleanup_partial_files()
+
+    return {status: results.count(status) for status in ('completed', 'failed', 'canceled')}
+
+
+def _job_options(ydl_opts: dict, job_dir: str, progress_hook=None) -> dict:
+    """خيارات yt-dlp لمهمة واحدة: مجلد خاص وأسماء ملفات حسب المعرّف"""
+    opts = {**ydl_opts, 'outtmpl': os.path.join(job_dir, '%(id)s.%(ext)s')}
+    if progress_hook is not None:
+        opts['progress_hooks'] = [progress_hook]
+    return opts
 
 
 # ═══════════════════════════════════════════════════════════════
 #  Video Download
 # ═══════════════════════════════════════════════════════════════
 
-async def download_videos(update: Update, context: ContextTypes.DEFAULT_TYPE, quality: str):
-    """تحميل الفيديوهات"""
+async def download_videos(update: Update, context: ContextTypes.DEFAULT_TYPE, quality: str = None):
+    """تحميل الفيديوهات (الجودة من callback_data: quality_720)"""
     query = update.callback_query
     user_id = query.from_user.id
-    lang = get_user_language(user_id)
+    lang = await async_get_user_language(user_id)
 
     urls = context.user_data.get('pending_urls', [])
     if not urls:
         await query.answer("❌ No URLs found", show_alert=True)
         return
 
-    quality_height = quality.replace('quality_', '')
+    quality_height = (quality or query.data).replace('quality_', '')
 
     # رسالة التقدم
     progress_message = await query.edit_message_text(
@@ -299,9 +429,7 @@ async def download_videos(update: Update, context: ContextTypes.DEFAULT_TYPE, qu
         'quiet': True,
         'no_warnings': True,
         'format': f'best[height<={quality_height}]',
-        'outtmpl': os.path.join(DOWNLOAD_DIR, '%(title)s.%(ext)s'),
         'continuedl': True,
-        'progress_hooks': [progress_tracker.progress_hook],
         # تحسينات السرعة - مطابقة للإعدادات الرئيسية
         'concurrent_fragment_downloads': 16,
         'http_chunk_size': 16777216,  # 16MB
@@ -311,130 +439,75 @@ async def download_videos(update: Update, context: ContextTypes.DEFAULT_TYPE, qu
         'socket_timeout': 30,
     }
 
-    successful = 0
-    failed = 0
-
-    for idx, url in enumerate(urls):
-        # التحقق من الإلغاء
-        if context.user_data.get('cancel_download'):
-            # تسجيل الروابط المتبقية كملغاة
-            for remaining_url in urls[idx:]:
-                platform = detect_platform(remaining_url)
-                track_download(
-                    user_id=query.from_user.id,
-                    platform=platform,
-                    mode='video',
-                    quality=quality_height,
-                    status='canceled',
-                    url=remaining_url
-                )
-
-            await progress_message.edit_text(
-                "❌ تم إلغاء التحميل / Download canceled"
-            )
-            return
-
-        progress_tracker.current_file = idx
-
+    async def process_url(idx: int, url: str, cancel_token: CancelToken) -> int:
+        # مجلد خاص بكل رابط - الروابط المتوازية لا تتشارك الملفات
+        job_dir = tempfile.mkdtemp(prefix='multi_', dir=DOWNLOAD_DIR)
         try:
-            # تحميل الفيديو
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
+            # تحميل الفيديو (خيوط أو عملية عامل حسب YTDLP_PROCESS_POOL)
+            files, info = await ytdlp_download(
+                url, _job_options(ydl_opts, job_dir, progress_tracker.hook_for(idx)), cancel_token, summary=True
+            )
+            filename = files[0]
+            title = info.get('title') or 'Video'
 
             # التحقق من الحجم والضغط إذا لزم الأمر
-            file_size = os.path.getsize(filename)
-
-            if file_size > TELEGRAM_MAX_SIZE:
-                # ضغط الفيديو
-                await progress_message.edit_text(
-                    f"⚙️ {'جاري الضغط' if lang == 'ar' else 'Compressing'}...\n"
-                    f"File {idx + 1}/{len(urls)}"
-                )
-
-                compressed_file = await compress_video(filename)
+            if os.path.getsize(filename) > TELEGRAM_MAX_SIZE:
+                compressed_file = await compress_video(filename, cancel_token)
                 if compressed_file:
-                    os.remove(filename)
                     filename = compressed_file
 
             # رفع إلى Telegram
             await progress_tracker.set_uploading(idx)
 
             with open(filename, 'rb') as video:
-                await context.bot.send_video(
+                await cancel_token.run(context.bot.send_video(
                     chat_id=query.message.chat_id,
                     video=video,
-                    caption=f"🎥 {info.get('title', 'Video')}\n📊 Quality: {quality_height}p",
+                    caption=f"🎥 {title}\n📊 Quality: {quality_height}p",
+                    filename=f"{clean_filename(title)}.mp4",
                     supports_streaming=True
-                )
-
-            # حذف الملف
-            file_size_bytes = os.path.getsize(filename) if os.path.exists(filename) else 0
-            os.remove(filename)
-            successful += 1
-
-            # تسجيل مفصل في قاعدة البيانات (Mission 10)
-            platform = detect_platform(url)
-            track_download(
-                user_id=query.from_user.id,
-                platform=platform,
-                mode='video',
-                quality=quality_height,
-                status='completed',
-                url=url,
-                file_size=file_size_bytes
-            )
-            record_download_attempt(success=True, speed=0)
+                ))
 
-        except Exception as e:
-            logger.error(f"Download error for {url}: {e}")
-            log_warning(f"فشل تحميل فيديو: {url} - {str(e)}", module="multi_download_handler")
+            return os.path.getsize(filename)
+        finally:
+            shutil.rmtree(job_dir, ignore_errors=True)
 
-            # Mission 11: Enhanced error logging
-            log_error_to_file("video_download", query.from_user.id, url, e)
-
-            failed += 1
-
-            # تسجيل الفشل
-            platform = detect_platform(url)
-            track_download(
-                user_id=query.from_user.id,
-                platform=platform,
-                mode='video',
-                quality=quality_height,
-                status='failed',
-                url=url,
-                error_msg=str(e)
-            )
-            record_download_attempt(success=False, speed=0)
+    results = await _run_multi_download(
+        query, context, urls, progress_tracker, {'mode': 'video', 'quality': quality_height}, process_url
+    )
 
     # رسالة النهاية
+    if results['canceled']:
+        title_text = "❌ تم إلغاء التحميل / Download canceled"
+    else:
+        title_text = f"✅ **{'اكتمل التحميل' if lang == 'ar' else 'Download Complete'}!**"
+
     final_text = (
-        f"✅ **{'اكتمل التحميل' if lang == 'ar' else 'Download Complete'}!**\n\n"
-        f"✔️ {'ناجح' if lang == 'ar' else 'Successful'}: {successful}\n"
-        f"❌ {'فاشل' if lang == 'ar' else 'Failed'}: {failed}\n"
+        f"{title_text}\n\n"
+        f"✔️ {'ناجح' if lang == 'ar' else 'Successful'}: {results['completed']}\n"
+        f"❌ {'فاشل' if lang == 'ar' else 'Failed'}: {results['failed']}\n"
         f"📊 {'الإجمالي' if lang == 'ar' else 'Total'}: {len(urls)}"
     )
 
-    await progress_message.edit_text(final_text, parse_mode='Markdown')
+    await progress_tracker.close(final_text, parse_mode='Markdown')
 
 
 # ═══════════════════════════════════════════════════════════════
 #  Audio Download
 # ═══════════════════════════════════════════════════════════════
 
-async def download_audio(update: Update, context: ContextTypes.DEFAULT_TYPE, audio_format: str):
-    """تحميل الصوتيات"""
+async def download_audio(update: Update, context: ContextTypes.DEFAULT_TYPE, audio_format: str = None):
+    """تحميل الصوتيات (الصيغة من callback_data: audio_mp3)"""
     query = update.callback_query
     user_id = query.from_user.id
-    lang = get_user_language(user_id)
+    lang = await async_get_user_language(user_id)
 
     urls = context.user_data.get('pending_urls', [])
     if not urls:
         await query.answer("❌ No URLs found", show_alert=True)
         return
 
-    format_codec = audio_format.replace('audio_', '')
+    format_codec = (audio_format or query.data).replace('audio_', '')
 
     # رسالة التقدم
     progress_message = await query.edit_message_text(
@@ -449,126 +522,67 @@ async def download_audio(update: Update, context: ContextTypes.DEFAULT_TYPE, aud
         'quiet': True,
         'no_warnings': True,
         'format': 'bestaudio/best',
-        'outtmpl': os.path.join(DOWNLOAD_DIR, '%(title)s.%(ext)s'),
         'postprocessors': [{
             'key': 'FFmpegExtractAudio',
             'preferredcodec': format_codec,
             'preferredquality': '192',
         }],
         'continuedl': True,
-        'progress_hooks': [progress_tracker.progress_hook],
     }
 
-    successful = 0
-    failed = 0
-
-    for idx, url in enumerate(urls):
-        # التحقق من الإلغاء
-        if context.user_data.get('cancel_download'):
-            # تسجيل الروابط المتبقية كملغاة
-            for remaining_url in urls[idx:]:
-                platform = detect_platform(remaining_url)
-                track_download(
-                    user_id=query.from_user.id,
-                    platform=platform,
-                    mode='audio',
-                    format=format_codec,
-                    status='canceled',
-                    url=remaining_url
-                )
-
-            await progress_message.edit_text(
-                "❌ تم إلغاء التحميل / Download canceled"
-            )
-            return
-
-        progress_tracker.current_file = idx
-
+    async def process_url(idx: int, url: str, cancel_token: CancelToken) -> int:
+        job_dir = tempfile.mkdtemp(prefix='multi_', dir=DOWNLOAD_DIR)
         try:
-            # تحميل الصوت
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                # الاسم النهائي بعد التحويل
-                base_filename = ydl.prepare_filename(info)
-                filename = os.path.splitext(base_filename)[0] + f'.{format_codec}'
+            # تحميل الصوت - requested_downloads يحمل الاسم النهائي بعد التحويل
+            files, info = await ytdlp_download(
+                url, _job_options(ydl_opts, job_dir, progress_tracker.hook_for(idx)), cancel_token, summary=True
+            )
+            filename = files[0]
+            title = info.get('title') or 'Audio'
 
             # رفع إلى Telegram
             await progress_tracker.set_uploading(idx)
 
             with open(filename, 'rb') as audio:
-                await context.bot.send_audio(
+                await cancel_token.run(context.bot.send_audio(
                     chat_id=query.message.chat_id,
                     audio=audio,
-                    caption=f"🎵 {info.get('title', 'Audio')}\n📊 Format: {format_codec.upper()}",
-                    title=info.get('title', 'Audio')
-                )
-
-            # حذف الملف - التحقق من وجوده أولاً
-            file_size_bytes = os.path.getsize(filename) if os.path.exists(filename) else 0
-
-            # حذف الملف المحول فقط إذا كان موجوداً
-            if os.path.exists(filename):
-                os.remove(filename)
-
-            # حذف الملف الأصلي (.webm أو غيره) إذا كان مختلفاً
-            if os.path.exists(base_filename) and base_filename != filename:
-                os.remove(base_filename)
-
-            successful += 1
-
-            # تسجيل مفصل في قاعدة البيانات (Mission 10)
-            platform = detect_platform(url)
-            track_download(
-                user_id=query.from_user.id,
-                platform=platform,
-                mode='audio',
-                format=format_codec,
-                status='completed',
-                url=url,
-                file_size=file_size_bytes
-            )
-            record_download_attempt(success=True, speed=0)
+                    caption=f"🎵 {title}\n📊 Format: {format_codec.upper()}",
+                    title=title,
+                    filename=f"{clean_filename(title)}.{format_codec}"
+                ))
 
-        except Exception as e:
-            logger.error(f"Audio download error for {url}: {e}")
-            log_warning(f"فشل تحميل صوت: {url} - {str(e)}", module="multi_download_handler")
+            return os.path.getsize(filename)
+        finally:
+            shutil.rmtree(job_dir, ignore_errors=True)
 
-            # Mission 11: Enhanced error logging
-            log_error_to_file("audio_download", query.from_user.id, url, e)
-
-            failed += 1
-
-            # تسجيل الفشل
-            platform = detect_platform(url)
-            track_download(
-                user_id=query.from_user.id,
-                platform=platform,
-                mode='audio',
-                format=format_codec,
-                status='failed',
-                url=url,
-                error_msg=str(e)
-            )
-            record_download_attempt(success=False, speed=0)
+    results = await _run_multi_download(
+        query, context, urls, progress_tracker, {'mode': 'audio', 'format': format_codec}, process_url
+    )
 
     # رسالة النهاية
+    if results['canceled']:
+        title_text = "❌ تم إلغاء التحميل / Download canceled"
+    else:
+        title_text = f"🎉 **{'اكتمل التحميل' if lang == 'ar' else 'Download Complete'}!**"
+
     final_text = (
-        f"🎉 **{'اكتمل التحميل' if lang == 'ar' else 'Download Complete'}!**\n\n"
-        f"✔️ {'ناجح' if lang == 'ar' else 'Successful'}: {successful}\n"
-        f"❌ {'فاشل' if lang == 'ar' else 'Failed'}: {failed}\n"
+        f"{title_text}\n\n"
+        f"✔️ {'ناجح' if lang == 'ar' else 'Successful'}: {results['completed']}\n"
+        f"❌ {'فاشل' if lang == 'ar' else 'Failed'}: {results['failed']}\n"
         f"📊 {'الإجمالي' if lang == 'ar' else 'Total'}: {len(urls)}\n\n"
         f"🎵 Format: {format_codec.upper()}"
     )
 
-    await progress_message.edit_text(final_text, parse_mode='Markdown')
+    await progress_tracker.close(final_text, parse_mode='Markdown')
 
 
 # ═══════════════════════════════════════════════════════════════
 #  Compression (FFmpeg)
 # ═══════════════════════════════════════════════════════════════
 
-async def compress_video(input_file: str) -> Optional[str]:
-    """ضغط الفيديو باستخدام FFmpeg"""
+async def compress_video(input_file: str, cancel_token: CancelToken = None) -> Optional[str]:
+    """ضغط الفيديو باستخدام FFmpeg (يُقتل فوراً إذا أُلغي cancel_token)"""
     try:
         output_file = input_file.replace('.mp4', '_compressed.mp4')
 
@@ -583,16 +597,11 @@ async def compress_video(input_file: str) -> Optional[str]:
         ]
 
         # استخدام ThreadPoolExecutor لتجنب التجميد أثناء FFmpeg
-        loop = asyncio.get_event_loop()
-        process = await loop.run_in_executor(
-            executor,
-            lambda: subprocess.run(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                timeout=600
-            )
-        )
+        if cancel_token is not None:
+            process = await cancel_token.run_in_executor(executor, run_ffmpeg, cmd, 600, cancel_token)
+        else:
+            loop = asyncio.get_running_loop()
+            process = await loop.run_in_executor(executor, run_ffmpeg, cmd, 600)
 
         if process.returncode == 0 and os.path.exists(output_file):
             logger.info(f"Video compressed: {input_file} -> {output_file}")
@@ -601,6 +610,8 @@ async def compress_video(input_file: str) -> Optional[str]:
             logger.error(f"FFmpeg compression failed: {process.stderr}")
             return None
 
+    except DownloadCancelled:
+        raise
     except Exception as e:
         logger.error(f"Compression error: {e}")
         return None
@@ -613,7 +624,7 @@ async def compress_video(input_file: str) -> Optional[str]:
 async def download_story(update: Update, context: ContextTypes.DEFAULT_TYPE, url: str):
     """تحميل قصة Instagram أو Facebook (عامة فقط، بدون cookies)"""
     user_id = update.effective_user.id
-    lang = get_user_language(user_id)
+    lang = await async_get_user_language(user_id)
 
     platform = detect_platform(url)
 
@@ -623,19 +634,27 @@ async def download_story(update: Update, context: ContextTypes.DEFAULT_TYPE, url
         f"Platform: {platform.replace('_', ' ').title()}"
     )
 
+    # خيارات yt-dlp للقصص (عامة فقط)
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'format': 'best',
+        # لا نستخدم cookies - فقط القصص العامة
+    }
+
+    cancel_token = CancelToken()
+    register_cancel_token(user_id, cancel_token)
+    job = None
+    job_dir = tempfile.mkdtemp(prefix='story_', dir=DOWNLOAD_DIR)
+
     try:
-        # خيارات yt-dlp للقصص (عامة فقط)
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'format': 'best',
-            'outtmpl': os.path.join(DOWNLOAD_DIR, '%(title)s.%(ext)s'),
-            # لا نستخدم cookies - فقط القصص العامة
-        }
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
+        priority = await async_is_admin(user_id) or await async_is_subscribed(user_id)
+        job = await cancel_token.run(download_scheduler.acquire(
+            user_id, get_platform_from_url(url), priority=priority
+        ))
+
+        files = await ytdlp_download(url, _job_options(ydl_opts, job_dir), cancel_token)
+        filename = files[0]
 
         # إرسال الملف
         await progress_msg.edit_text(
@@ -646,26 +665,26 @@ async def download_story(update: Update, context: ContextTypes.DEFAULT_TYPE, url
 
         with open(filename, 'rb') as media:
             if file_ext in ['.mp4', '.mov', '.avi']:
-                await context.bot.send_video(
+                await cancel_token.run(context.bot.send_video(
                     chat_id=update.effective_chat.id,
                     video=media,
                     caption=f"📸 Story from {platform.replace('_', ' ').title()}"
-                )
+                ))
             else:
-                await context.bot.send_document(
+                await cancel_token.run(context.bot.send_document(
                     chat_id=update.effective_chat.id,
                     document=media,
                     caption=f"📸 Story from {platform.replace('_', ' ').title()}"
-                )
-
-        # حذف الملف
-        os.remove(filename)
+                ))
 
         await progress_msg.delete()
 
         # تسجيل نجاح
         record_download_attempt(success=True, speed=0)
 
+    except DownloadCancelled:
+        await progress_msg.edit_text("❌ تم إلغاء التحميل / Download canceled")
+
     except yt_dlp.utils.DownloadError as e:
         error_msg = str(e)
 
@@ -686,6 +705,10 @@ async def download_story(update: Update, context: ContextTypes.DEFAULT_TYPE, url
         log_warning(f"فشل تحميل قصة: {url} - {str(e)}", module="multi_download_handler")
         record_download_attempt(success=False, speed=0)
 
+    except asyncio.CancelledError:
+        cancel_token.cancel()
+        raise
+
     except Exception as e:
         await progress_msg.edit_text(
             f"❌ حدث خطأ / Error occurred\n\n"
@@ -696,19 +719,31 @@ async def download_story(update: Update, context: ContextTypes.DEFAULT_TYPE, url
         log_warning(f"خطأ في تحميل قصة: {url} - {str(e)}", module="multi_download_handler")
         record_download_attempt(success=False, speed=0)
 
+    finally:
+        if job is not None:
+            download_scheduler.release(job)
+        unregister_cancel_token(user_id, cancel_token)
+        # حذف مجلد المهمة (الملف والأجزاء غير المكتملة)
+        shutil.rmtree(job_dir, ignore_errors=True)
+
 
 # ═══════════════════════════════════════════════════════════════
 #  Cancel Handler
 # ═══════════════════════════════════════════════════════════════
 
 async def handle_download_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """إلغاء التحميل"""
+    """إلغاء التحميل (زر القوائم أو زر رسالة التقدم)"""
     query = update.callback_query
     await query.answer()
 
-    context.user_data['cancel_download'] = True
     context.user_data['pending_urls'] = []
 
+    # إيقاف التحميل المتعدد المرتبط بهذه الرسالة (yt-dlp و ffmpeg والرفع)
+    cancel_token = context.user_data.get('multi_download_tokens', {}).get(query.message.message_id)
+    if cancel_token is not None:
+        cancel_token.cancel()
+        return
+
     await query.edit_message_text(
         "❌ تم إلغاء العملية / Operation canceled"
     )
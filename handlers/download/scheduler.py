@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+مجدول مهام التحميل العام
+Global download job scheduler
+
+بدلاً من Semaphore لكل مستخدم (مستخدمون قليلون يشبعون الخادم)، كل تحميل ثقيل
+(yt-dlp → ffmpeg → رفع) يحجز مكاناً من المجدول:
+
+    - عدد عمال عام محدود (DOWNLOAD_WORKERS)
+    - حد لكل منصة (DOWNLOAD_PLATFORM_CAPS) حتى لا تستهلك منصة بطيئة كل العمال
+    - حد لكل مستخدم (DOWNLOAD_PER_USER)
+    - عدالة: دور دائري (round-robin) بين المستخدمين، وطابور FIFO لكل مستخدم
+    - مسار أولوية للمشتركين والمدراء يُخدم قبل المسار العادي
+
+المنتظر يحصل على ترتيبه في الطابور ("دورك #4") ويُحدَّث كل QUEUE_REFRESH ثانية.
+"""
+
+import os
+import asyncio
+from time import monotonic
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager
+
+from config.logger import get_logger
+
+logger = get_logger(__name__)
+
+# عدد التحميلات المتزامنة على مستوى البوت
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "8"))
+
+# عدد التحميلات المتزامنة لكل مستخدم
+DOWNLOAD_PER_USER = int(os.getenv("DOWNLOAD_PER_USER", "2"))
+
+# حد كل منصة - يمكن تعديله بـ DOWNLOAD_PLATFORM_CAPS="youtube=4,tiktok=6"
+DEFAULT_PLATFORM_CAP = int(os.getenv("DOWNLOAD_PLATFORM_CAP", "4"))
+PLATFORM_CAPS = {
+    'youtube': 4,
+    'tiktok': 4,
+    'instagram': 3,
+    'facebook': 3,
+    'twitter': 3,
+}
+
+# الفاصل (بالثواني) بين تحديثات ترتيب الانتظار
+QUEUE_REFRESH = 3.0
+
+# المسارات بترتيب الخدمة
+PRIORITY_LANE = 0
+NORMAL_LANE = 1
+
+
+def _parse_platform_caps(raw: str) -> dict:
+    """قراءة DOWNLOAD_PLATFORM_CAPS بصيغة platform=cap,platform=cap"""
+    caps = {}
+    for item in (raw or '').split(','):
+        name, _, value = item.partition('=')
+        if name.strip() and value.strip().isdigit():
+            caps[name.strip().lower()] = int(value)
+    return caps
+
+
+PLATFORM_CAPS.update(_parse_platform_caps(os.getenv("DOWNLOAD_PLATFORM_CAPS", "")))
+
+
+class DownloadJob:
+    """مكان محجوز (أو منتظر) في المجدول"""
+
+    __slots__ = ('user_id', 'platform', 'lane', 'future', 'enqueued_at', 'started')
+
+    def __init__(self, user_id: int, platform: str, lane: int):
+        self.user_id = user_id
+        self.platform = platform
+        self.lane = lane
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = monotonic()
+        self.started = False
+
+
+class DownloadScheduler:
+    """مجدول عادل بمسارين وحدود عامة/للمنصة/للمستخدم (داخل event loop واحد)"""
+
+    def __init__(self, workers: int, per_user: int, platform_caps: dict, default_platform_cap: int):
+        self.workers = workers
+        self.per_user = per_user
+        self.platform_caps = platform_caps
+        self.default_platform_cap = default_platform_cap
+
+        # لكل مسار: user_id -> deque[DownloadJob] - ترتيب المفاتيح هو الدور الدائري
+        self._lanes = (OrderedDict(), OrderedDict())
+        self._running = 0
+        self._running_platform = defaultdict(int)
+        self._running_user = defaultdict(int)
+
+        self._stats = {'started': 0, 'queued': 0, 'cancelled': 0, 'total_wait': 0.0, 'max_wait': 0.0}
+
+    # ==================== التوزيع ====================
+
+    def _platform_cap(self, platform: str) -> int:
+        return self.platform_caps.get(platform, self.default_platform_cap)
+
+    def _can_start(self, job: DownloadJob) -> bool:
+        return (
+            self._running_platform[job.platform] < self._platform_cap(job.platform)
+            and self._running_user[job.user_id] < self.per_user
+        )
+
+    def _pick(self):
+        """أول مهمة قابلة للتشغيل: مسار الأولوية أولاً، ثم الدور الدائري بين المستخدمين"""
+        for lane in self._lanes:
+            for user_id, queue in lane.items():
+                job = queue[0]
+                if not self._can_start(job):
+                    continue
+                queue.popleft()
+                # المستخدم الذي خُدم ينتقل لآخر الدور
+                del lane[user_id]
+                if queue:
+                    lane[user_id] = queue
+                return job
+        return None
+
+    def _start(self, job: DownloadJob):
+        job.started = True
+        self._running += 1
+        self._running_platform[job.platform] += 1
+        self._running_user[job.user_id] += 1
+
+        waited = monotonic() - job.enqueued_at
+        self._stats['started'] += 1
+        self._stats['total_wait'] += waited
+        self._stats['max_wait'] = max(self._stats['max_wait'], waited)
+        if not job.future.done():
+            job.future.set_result(True)
+
+    def _dispatch(self):
+        while self._running < self.workers:
+            job = self._pick()
+            if job is None:
+                return
+            self._start(job)
+
+    def _remove(self, job: DownloadJob):
+        lane = self._lanes[job.lane]
+        queue = lane.get(job.user_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(job)
+        except ValueError:
+            return
+        if not queue:
+            del lane[job.user_id]
+
+    # ==================== ترتيب الانتظار ====================
+
+    def position(self, job: DownloadJob) -> int:
+        """
+        الترتيب المتوقع للمهمة (1 = التالية) بافتراض الدور الدائري بدون حدود المنصات
+        """
+        ahead = sum(len(queue) for lane in self._lanes[:job.lane] for queue in lane.values())
+
+        lane = self._lanes[job.lane]
+        queue = lane.get(job.user_id)
+        if queue is None or job not in queue:
+            return 0
+        rank = queue.index(job)
+
+        # في كل دورة تُخدم مهمة واحدة من كل مستخدم بالترتيب: المستخدمون قبله
+        # يسبقونه بـ rank + 1 مهمة، والذين بعده بـ rank مهمة
+        before = True
+        for user_id, other in lane.items():
+            if user_id == job.user_id:
+                before = False
+                continue
+            ahead += min(len(other), rank + 1 if before else rank)
+        return ahead + rank + 1
+
+    # ==================== الواجهة ====================
+
+    async def acquire(self, user_id: int, platform: str, priority: bool = False, on_wait=None) -> DownloadJob:
+        """
+        حجز مكان تحميل (يجب استدعاء release في finally)
+
+        Args:
+            user_id: صاحب الطلب
+            platform: المنصة (get_platform_from_url)
+            priority: مسار الأولوية (مشترك/مدير)
+            on_wait: async callable(position) يُستدعى عند تغير ترتيب الانتظار
+
+        Returns:
+            DownloadJob
+        """
+        lane = PRIORITY_LANE if priority else NORMAL_LANE
+        job = DownloadJob(user_id, platform, lane)
+        self._lanes[lane].setdefault(user_id, deque()).append(job)
+        self._dispatch()
+
+        if not job.started:
+            self._stats['queued'] += 1
+
+        last_position = None
+        try:
+            while not job.started:
+                position = self.position(job)
+                if on_wait is not None and position != last_position:
+                    last_position = position
+                    try:
+                        await on_wait(position)
+                    except Exception as e:
+                        logger.debug(f"فشل عرض ترتيب الانتظار: {e}")
+                try:
+                    await asyncio.wait_for(asyncio.shield(job.future), QUEUE_REFRESH)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            # أُلغي المنتظر - إخراجه من الطابور أو إرجاع المكان إذا حُجز للتو
+            self._stats['cancelled'] += 1
+            self.release(job)
+            raise
+
+        return job
+
+    def release(self, job: DownloadJob):
+        """إرجاع المكان وتشغيل المنتظر التالي"""
+        if not job.started:
+            self._remove(job)
+            return
+
+        job.started = False
+        self._running -= 1
+        self._running_platform[job.platform] -= 1
+        self._running_user[job.user_id] -= 1
+        if not self._running_user[job.user_id]:
+            del self._running_user[job.user_id]
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, platform: str, priority: bool = False, on_wait=None):
+        """async with download_scheduler.slot(...): ..."""
+        job = await self.acquire(user_id, platform, priority, on_wait)
+        try:
+            yield job
+        finally:
+            self.release(job)
+
+    def stats(self) -> dict:
+        started = self._stats['started']
+        return {
+            'workers': self.workers,
+            'running': self._running,
+            'waiting': sum(len(q) for lane in self._lanes for q in lane.values()),
+            'waiting_priority': sum(len(q) for q in self._lanes[PRIORITY_LANE].values()),
+            'running_by_platform': {p: n for p, n in self._running_platform.items() if n},
+            'started': started,
+            'queued': self._stats['queued'],
+            'cancelled': self._stats['cancelled'],
+            'avg_wait': self._stats['total_wait'] / started if started else 0.0,
+            'max_wait': self._stats['max_wait'],
+        }
+
+
+download_scheduler = DownloadScheduler(
+    workers=DOWNLOAD_WORKERS,
+    per_user=DOWNLOAD_PER_USER,
+    platform_caps=PLATFORM_CAPS,
+    default_platform_cap=DEFAULT_PLATFORM_CAP,
+)
@@ -4,12 +4,12 @@ from telegram.ext import ContextTypes
 from datetime import datetime
 
 from database import (
-    get_user,
-    is_subscribed,
-    get_user_language,
-    update_user_interaction,
-    get_daily_download_count,
-    get_no_logo_credits
+    async_get_user,
+    async_is_subscribed,
+    async_get_user_language,
+    async_update_user_interaction,
+    async_get_daily_download_count,
+    async_get_no_logo_credits
 )
 from utils import get_message
 
@@ -25,13 +25,13 @@ async def account_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = user.id
     
     # جلب لغة المستخدم
-    lang = get_user_language(user_id)
+    lang = await async_get_user_language(user_id)
     
     # تحديث آخر تفاعل
-    update_user_interaction(user_id)
+    await async_update_user_interaction(user_id, user.username)
     
     # جلب بيانات المستخدم
-    user_data = get_user(user_id)
+    user_data = await async_get_user(user_id)
     
     if not user_data:
         error_message = (
@@ -45,10 +45,10 @@ async def account_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # التحقق من الاشتراك
-    is_vip = is_subscribed(user_id)
+    is_vip = await async_is_subscribed(user_id)
     subscription_end = user_data.get('subscription_end')
-    daily_downloads = get_daily_download_count(user_id)
-    no_logo_credits = get_no_logo_credits(user_id)
+    daily_downloads = await async_get_daily_download_count(user_id)
+    no_logo_credits = await async_get_no_logo_credits(user_id)
     
     # حساب الوقت المتبقي
     if is_vip and subscription_end:
@@ -195,8 +195,8 @@ async def test_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """اختبار حالة الاشتراك (للتطوير فقط)"""
     user_id = update.message.from_user.id
     
-    is_vip = is_subscribed(user_id)
-    user_data = get_user(user_id)
+    is_vip = await async_is_subscribed(user_id)
+    user_data = await async_get_user(user_id)
     
     if not user_data:
         await update.message.reply_text("❌ لم يتم العثور على بياناتك")
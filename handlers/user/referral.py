@@ -40,7 +40,7 @@ async def referral_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # تحديث آخر تفاعل
         try:
-            update_user_interaction(user_id)
+            update_user_interaction(user_id, user.username)
         except Exception as e:
             logger.warning(f"⚠️ [{function_name}] فشل تحديث التفاعل للمستخدم {user_id}: {e}")
 
@@ -6,7 +6,15 @@ import os
 import traceback
 from datetime import datetime
 
-from database import add_user, update_user_language, update_user_interaction, get_user_language, track_referral, generate_referral_code, is_subscription_enabled, is_referral_enabled
+from database import track_referral, is_subscription_enabled, is_referral_enabled
+from database import (
+    run_db,
+    async_add_user,
+    async_update_user_language,
+    async_update_user_interaction,
+    async_get_user_language,
+    async_generate_referral_code,
+)
 from utils import get_message
 from handlers.channel_manager import channel_manager
 
@@ -54,7 +62,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             referral_code = potential_code
     
     # إضافة المستخدم إلى قاعدة البيانات وتحديد إذا كان جديد
-    is_new_user = add_user(user_id, user.username, user.full_name)
+    is_new_user = await async_add_user(user_id, user.username, user.full_name)
 
     # إرسال إشعار لقناة السجلات عند اشتراك عضو جديد
     if is_new_user:
@@ -78,9 +86,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             logger.error(f"📍 [START] Stack trace:\n{traceback.format_exc()}")
     
     # توليد كود إحالة للمستخدم الجديد
-    generate_referral_code(user_id)
+    await async_generate_referral_code(user_id)
     
-    update_user_interaction(user_id)
+    await async_update_user_interaction(user_id)
 
     keyboard = [["العربية 🇸🇦", "English 🇬🇧"]]
     reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
@@ -118,7 +126,7 @@ async def select_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     logger.info(f"✅ [SELECT_LANGUAGE] اللغة المحددة: {lang_code}")
 
-    update_user_language(user_id, lang_code)
+    await async_update_user_language(user_id, lang_code)
 
     # الرسالة الترحيبية مع قناة التحديثات
     if lang_code == "ar":
@@ -135,7 +143,7 @@ async def select_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
     # إنشاء لوحة المفاتيح الرئيسية
-    keyboard = create_main_keyboard(lang_code)
+    keyboard = await run_db(create_main_keyboard, lang_code)
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
     logger.info(f"🔘 [SELECT_LANGUAGE] أزرار القائمة الرئيسية: {keyboard}")
@@ -229,7 +237,7 @@ async def handle_menu_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE
     """
     user_id = update.message.from_user.id
     text = update.message.text
-    lang = get_user_language(user_id)
+    lang = await async_get_user_language(user_id)
     
     # استيراد محلي لتجنب الاستيراد الدائري
     from handlers.user.account import account_info
@@ -237,7 +245,7 @@ async def handle_menu_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE
     from handlers.user.support_handler import show_support_message
     
     # تحديث آخر تفاعل
-    update_user_interaction(user_id)
+    await async_update_user_interaction(user_id, update.message.from_user.username)
     
     if text in ["📥 تحميل فيديو", "📥 Download Video"]:
         message = (
@@ -325,7 +333,7 @@ async def handle_menu_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE
     elif text in ["⭐ الاشتراك VIP", "⭐ Subscribe VIP"]:
         # جلب السعر من قاعدة البيانات
         from database import get_subscription_price
-        price = get_subscription_price()
+        price = await run_db(get_subscription_price)
 
         subscribe_message = (
             "👑 <b>باقة VIP المميزة!</b>\n\n"
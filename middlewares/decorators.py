@@ -66,7 +66,7 @@ def with_language(func):
         context.user_data['user_id'] = user_id
 
         # تحديث آخر تفاعل
-        update_user_interaction(user_id)
+        update_user_interaction(user_id, update.effective_user.username)
 
         return await func(update, context, *args, **kwargs)
 
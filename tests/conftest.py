@@ -0,0 +1,25 @@
+"""
+إعداد الاختبارات: قاعدة بيانات داخل الذاكرة (mongomock) وجذر المشروع في sys.path
+
+pip install -r requirements-dev.txt
+python -m pytest -q
+"""
+
+import os
+import sys
+
+# قبل أي استيراد لـ core.database: الواجهة المحلية بدلاً من MongoDB
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pytest_sessionfinish(session, exitstatus):
+    """
+    استيراد core.utils.helpers يسجل cleanup_temp_files عند الخروج، وهي تحذف
+    videos/* و cookies/*.txt من مجلد العمل - لا نريد ذلك بعد تشغيل الاختبارات
+    """
+    import atexit
+    helpers = sys.modules.get("core.utils.helpers")
+    if helpers is not None:
+        atexit.unregister(helpers.cleanup_temp_files)
@@ -0,0 +1,113 @@
+"""اختبارات CancelToken وسجل الرموز النشطة"""
+
+import asyncio
+import threading
+
+import pytest
+from yt_dlp.utils import DownloadCancelled
+
+from core.utils.cancellation import (
+    CancelToken,
+    register_cancel_token,
+    unregister_cancel_token,
+    cancel_user_downloads,
+)
+
+
+def test_check_and_hooks_raise_after_cancel():
+    token = CancelToken()
+    token.check()
+    token.progress_hook({'status': 'downloading', 'tmpfilename': '/tmp/x.part'})
+    token.postprocessor_hook({'status': 'started'})
+
+    token.cancel()
+    assert token.cancelled
+    with pytest.raises(DownloadCancelled):
+        token.check()
+    with pytest.raises(DownloadCancelled):
+        token.progress_hook({'status': 'downloading'})
+    with pytest.raises(DownloadCancelled):
+        token.postprocessor_hook({'status': 'started', 'postprocessor': 'Merger'})
+
+
+def test_run_returns_result_when_not_cancelled():
+    async def scenario():
+        async def work():
+            await asyncio.sleep(0)
+            return 42
+        return await CancelToken().run(work())
+
+    assert asyncio.run(scenario()) == 42
+
+
+def test_run_interrupts_awaitable_on_cancel():
+    async def scenario():
+        token = CancelToken()
+        stopped = asyncio.Event()
+
+        async def slow():
+            try:
+                await asyncio.sleep(60)
+            finally:
+                stopped.set()
+
+        task = asyncio.ensure_future(token.run(slow()))
+        await asyncio.sleep(0)
+        token.cancel()
+        with pytest.raises(DownloadCancelled):
+            await asyncio.wait_for(task, 1)
+        assert stopped.is_set()
+
+    asyncio.run(scenario())
+
+
+def test_run_in_executor_waits_for_thread_to_stop():
+    async def scenario():
+        token = CancelToken()
+        stopped = threading.Event()
+
+        def blocking():
+            # حلقة متزامنة تفحص الرمز مثل progress hook في خيط yt-dlp
+            try:
+                while True:
+                    token.check()
+                    threading.Event().wait(0.01)
+            finally:
+                stopped.set()
+
+        task = asyncio.ensure_future(token.run_in_executor(None, blocking))
+        await asyncio.sleep(0.05)
+        token.cancel()
+        with pytest.raises(DownloadCancelled):
+            await asyncio.wait_for(task, 2)
+        # يعود بعد توقف الخيط (ضمن CANCEL_GRACE) وليس قبله
+        assert stopped.is_set()
+
+    asyncio.run(scenario())
+
+
+def test_cleanup_partial_files(tmp_path):
+    token = CancelToken()
+    target = tmp_path / 'video.mp4'
+    for name in ('video.mp4.part', 'video.mp4.ytdl', 'video.mp4.part-Frag3'):
+        (tmp_path / name).write_bytes(b'x')
+    unrelated = tmp_path / 'other.mp4'
+    unrelated.write_bytes(b'x')
+
+    token.progress_hook({'filename': str(target), 'tmpfilename': str(target) + '.part'})
+    assert token.cleanup_partial_files() == 3
+    assert unrelated.exists()
+
+
+def test_cancel_user_downloads_cancels_registered_tokens():
+    first, second, other = CancelToken(), CancelToken(), CancelToken()
+    register_cancel_token(1001, first)
+    register_cancel_token(1001, second)
+    register_cancel_token(1002, other)
+    unregister_cancel_token(1001, second)
+
+    assert cancel_user_downloads(1001) == 1
+    assert first.cancelled and not second.cancelled and not other.cancelled
+    assert cancel_user_downloads(1001) == 0
+
+    unregister_cancel_token(1002, other)
@@ -0,0 +1,63 @@
+"""اختبارات توحيد الروابط وقراءة انتهاء الروابط الموقعة في ذاكرة الاستخراج"""
+
+from datetime import datetime
+
+import pytest
+
+from core.utils.extraction_cache import canonical_url, extraction_cache_key, signed_url_expiry
+
+
+@pytest.mark.parametrize('url', [
+    'https://youtu.be/dQw4w9WgXcQ?si=abc123',
+    'https://www.youtube.com/watch?v=dQw4w9WgXcQ&feature=share',
+    'https://m.youtube.com/watch?v=dQw4w9WgXcQ&t=42#comments',
+    'https://youtube.com/shorts/dQw4w9WgXcQ/',
+])
+def test_youtube_links_share_one_canonical_form(url):
+    assert canonical_url(url) == 'https://youtube.com/watch?v=dQw4w9WgXcQ'
+
+
+def test_tracking_params_dropped_and_query_sorted():
+    url = 'https://www.instagram.com/reel/Cx1/?utm_source=ig_web&igsh=zz&b=2&a=1'
+    assert canonical_url(url) == 'https://instagram.com/reel/Cx1?a=1&b=2'
+
+
+def test_x_links_map_to_twitter():
+    assert canonical_url('https://x.com/user/status/1?s=20&t=abc') == 'https://twitter.com/user/status/1'
+
+
+def test_platform_specific_params_kept_elsewhere():
+    # t هو معامل تتبع في يوتيوب وتويتر فقط
+    assert canonical_url('https://vimeo.com/123?t=5') == 'https://vimeo.com/123?t=5'
+
+
+def test_cache_key_depends_on_relevant_options():
+    url = 'https://youtu.be/dQw4w9WgXcQ'
+    same = extraction_cache_key(url, {'format': 'best'})
+    assert extraction_cache_key('https://www.youtube.com/watch?v=dQw4w9WgXcQ', {'format': 'best'}) == same
+    assert extraction_cache_key(url, {'format': 'best', 'extract_flat': True}) != same
+
+
+def test_signed_url_expiry_takes_earliest_expire_param():
+    info = {
+        'url': 'https://rr1.googlevideo.com/videoplayback?expire=2000000000&id=1',
+        'formats': [
+            {'url': 'https://rr1.googlevideo.com/videoplayback?expire=1900000000'},
+            {'url': 'https://cdn.example.com/v.mp4?X-Expires=1950000000'},
+        ],
+    }
+    assert signed_url_expiry(info) == datetime.fromtimestamp(1900000000)
+
+
+def test_signed_url_expiry_reads_hex_oe_and_entries():
+    info = {'entries': [
+        {'url': 'https://scontent.cdninstagram.com/v/t.mp4?oe=6553F100&_nc_ht=x'},
+        None,
+    ]}
+    assert signed_url_expiry(info) == datetime.fromtimestamp(int('6553F100', 16))
+
+
+def test_signed_url_expiry_none_without_expiry():
+    assert signed_url_expiry({'url': 'https://example.com/v.mp4?token=abc'}) is None
+    assert signed_url_expiry({'formats': [{'format_id': '18'}]}) is None
+    assert signed_url_expiry({'url': 'https://example.com/v.mp4?oe=nothex'}) is None
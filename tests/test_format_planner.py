@@ -0,0 +1,84 @@
+"""اختبارات اختيار الصيغة حسب الحجم المتوقع"""
+
+from core.media.format_planner import plan_format, estimate_size
+
+MB = 1024 * 1024
+
+
+def video(format_id, height, tbr, acodec='none'):
+    return {'format_id': format_id, 'height': height, 'vcodec': 'avc1', 'acodec': acodec, 'tbr': tbr, 'ext': 'mp4'}
+
+
+def audio(format_id, abr):
+    return {'format_id': format_id, 'vcodec': 'none', 'acodec': 'mp4a', 'abr': abr, 'tbr': abr, 'ext': 'm4a'}
+
+
+FORMATS = [
+    video('160', 144, 100),
+    video('134', 360, 600),
+    video('136', 720, 2500),
+    video('137', 1080, 5000),
+    audio('140', 128),
+]
+
+
+def test_estimate_size_prefers_filesize_then_tbr():
+    assert estimate_size({'filesize': 10, 'filesize_approx': 20, 'tbr': 1}, 60) == 10
+    assert estimate_size({'filesize_approx': 20, 'tbr': 1}, 60) == 20
+    assert estimate_size({'tbr': 800}, 10) == 1_000_000
+    assert estimate_size({'tbr': 800}, None) is None
+
+
+def test_picks_highest_height_that_fits():
+    # 120 ثانية: 720p + صوت ≈ 39MB، و 1080p ≈ 77MB
+    plan = plan_format({'duration': 120, 'formats': FORMATS}, 'best', 'bv*+ba/b', 45)
+    assert plan['format'] == '136+140'
+    assert plan['height'] == 720
+    assert plan['fits'] and not plan['muxed']
+
+
+def test_medium_quality_caps_height():
+    plan = plan_format({'duration': 60, 'formats': FORMATS}, 'medium', 'bv*+ba/b', 45)
+    assert plan['height'] == 720
+
+
+def test_prefers_muxed_format_at_same_height():
+    formats = FORMATS + [video('22', 720, 2400, acodec='mp4a')]
+    plan = plan_format({'duration': 120, 'formats': formats}, 'best', 'bv*+ba/b', 45)
+    assert plan['format'] == '22'
+    assert plan['muxed']
+
+
+def test_compress_fallback_takes_highest_compressible_option():
+    # 900 ثانية: لا شيء يتسع لـ 45MB، و 360p + صوت ≈ 78MB (أقل من 4 × الحد)
+    plan = plan_format({'duration': 900, 'formats': FORMATS[1:]}, 'best', 'bv*+ba/b', 45)
+    assert plan['format'] == '134+140'
+    assert not plan['fits']
+    assert plan['size'] > 45 * MB
+
+
+def test_no_low_resolution_fallback_for_long_videos():
+    # 40 دقيقة: 144p فقط يقترب من الحد - أقل من أدنى ارتفاع للضغط → صيغة المنصة
+    assert plan_format({'duration': 2400, 'formats': FORMATS}, 'best', 'bv*+ba/b', 45) is None
+
+
+def test_merge_disallowed_uses_muxed_formats_only():
+    formats = FORMATS + [video('18', 360, 500, acodec='mp4a')]
+    plan = plan_format({'duration': 120, 'formats': formats}, 'best', 'best', 45)
+    assert plan['format'] == '18'
+    assert plan['muxed']
+
+    # بدون صيغ مدمجة لا توجد خطة
+    assert plan_format({'duration': 120, 'formats': FORMATS}, 'best', 'best', 45) is None
+
+
+def test_missing_sizes_keep_platform_format():
+    formats = [{'format_id': '137', 'height': 1080, 'vcodec': 'avc1', 'acodec': 'none', 'ext': 'mp4'}]
+    assert plan_format({'duration': None, 'formats': formats}, 'best', 'bv*+ba/b', 45) is None
+    assert plan_format({'formats': []}, 'best', 'bv*+ba/b', 45) is None
+
+
+def test_audio_and_missing_spec_are_not_planned():
+    info = {'duration': 120, 'formats': FORMATS}
+    assert plan_format(info, 'audio', 'bestaudio', 45) is None
+    assert plan_format(info, 'best', None, 45) is None
@@ -0,0 +1,78 @@
+"""
+اختبارات ترحيلات المخطط على قاعدة البيانات داخل الذاكرة (MemoryBackend)
+
+تحويلات البيانات القديمة في v2 و v4 و v6 تستخدم update بـ pipeline
+($unset و $ltrim و $type) وهي غير مدعومة في mongomock - تُختبر على MongoDB فقط.
+"""
+
+import pytest
+
+from core.database.backends import MemoryBackend, DB_NAME
+from core.database.migrations import (
+    SCHEMA_VERSION,
+    get_schema_version,
+    run_migrations,
+    apply_retention_policy,
+)
+
+
+@pytest.fixture
+def database():
+    """قاعدة بيانات فارغة لكل اختبار (الـ client مشترك طوال العملية)"""
+    backend = MemoryBackend()
+    client = backend.create_client()
+    client.drop_database(DB_NAME)
+    yield backend.get_database(client)
+    client.drop_database(DB_NAME)
+
+
+def test_fresh_database_reaches_latest_version(database):
+    assert get_schema_version(database) == 0
+    assert run_migrations(database)
+    assert get_schema_version(database) == SCHEMA_VERSION
+
+    doc = database.settings.find_one({'_id': 'schema_version'})
+    assert [h['version'] for h in doc['history']] == list(range(1, SCHEMA_VERSION + 1))
+
+    assert 'user_id_unique' in database.users.index_information()
+    assert 'u_ts' in database.downloads.index_information()
+    assert 'expires_at_ttl' in database.extraction_cache.index_information()
+
+
+def test_run_migrations_is_idempotent(database):
+    assert run_migrations(database)
+    assert run_migrations(database)
+
+    doc = database.settings.find_one({'_id': 'schema_version'})
+    assert len(doc['history']) == SCHEMA_VERSION
+
+
+def test_duplicate_users_deduped_before_unique_index(database):
+    for n in range(3):
+        database.users.insert_one({'user_id': 7, 'n': n})
+    database.users.insert_one({'user_id': 8, 'n': 0})
+
+    assert run_migrations(database)
+
+    # يبقى الأقدم فقط، والفهرس الفريد أُنشئ
+    assert [u['n'] for u in database.users.find({'user_id': 7})] == [0]
+    assert database.users.count_documents({}) == 2
+    assert database.users.index_information()['user_id_unique']['unique']
+
+
+def test_users_without_referral_code_share_partial_unique_index(database):
+    database.users.insert_many([{'user_id': 1}, {'user_id': 2}, {'user_id': 3, 'referral_code': 'abc'}])
+    assert run_migrations(database)
+    assert database.users.count_documents({}) == 3
+
+
+def test_retention_policy_creates_ttl_index(database):
+    assert run_migrations(database)
+    assert apply_retention_policy(database)
+
+    from core.database.downloads import DOWNLOADS_RETENTION_DAYS
+    ttl = database.downloads.index_information().get('ts_ttl')
+    if DOWNLOADS_RETENTION_DAYS > 0:
+        assert ttl['expireAfterSeconds'] == DOWNLOADS_RETENTION_DAYS * 86400
+    else:
+        assert ttl is None
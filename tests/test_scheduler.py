@@ -0,0 +1,146 @@
+"""اختبارات مجدول التحميل: الحدود، العدالة بين المستخدمين، الترتيب، والإلغاء"""
+
+import asyncio
+
+from handlers.download.scheduler import DownloadScheduler, NORMAL_LANE
+
+
+def make_scheduler(workers=2, per_user=1, caps=None, default_cap=10):
+    return DownloadScheduler(workers=workers, per_user=per_user, platform_caps=caps or {}, default_platform_cap=default_cap)
+
+
+async def start_waiting(scheduler, user_id, platform='youtube', priority=False):
+    """acquire في مهمة منفصلة، ثم إعطاء event loop فرصة لتسجيلها في الطابور"""
+    task = asyncio.ensure_future(scheduler.acquire(user_id, platform, priority=priority))
+    await asyncio.sleep(0)
+    return task
+
+
+def test_global_worker_cap():
+    async def scenario():
+        scheduler = make_scheduler(workers=2, per_user=5)
+        first = await scheduler.acquire(1, 'youtube')
+        second = await scheduler.acquire(2, 'youtube')
+        third = await start_waiting(scheduler, 3)
+
+        assert not third.done()
+        assert scheduler.stats()['running'] == 2
+
+        scheduler.release(first)
+        job = await asyncio.wait_for(third, 1)
+        assert job.user_id == 3
+        scheduler.release(second)
+        scheduler.release(job)
+        assert scheduler.stats()['running'] == 0
+
+    asyncio.run(scenario())
+
+
+def test_per_user_and_platform_caps():
+    async def scenario():
+        scheduler = make_scheduler(workers=10, per_user=1, caps={'tiktok': 1})
+        running = await scheduler.acquire(1, 'youtube')
+
+        # نفس المستخدم تجاوز حده، ومستخدم آخر يبدأ فوراً
+        same_user = await start_waiting(scheduler, 1)
+        other_user = await scheduler.acquire(2, 'youtube')
+        assert not same_user.done()
+
+        # حد المنصة
+        tiktok = await scheduler.acquire(3, 'tiktok')
+        tiktok_waiting = await start_waiting(scheduler, 4, 'tiktok')
+        assert not tiktok_waiting.done()
+
+        scheduler.release(running)
+        assert (await asyncio.wait_for(same_user, 1)).user_id == 1
+        scheduler.release(tiktok)
+        assert (await asyncio.wait_for(tiktok_waiting, 1)).user_id == 4
+        scheduler.release(other_user)
+
+    asyncio.run(scenario())
+
+
+def test_round_robin_between_users_and_priority_lane():
+    async def scenario():
+        scheduler = make_scheduler(workers=1, per_user=5)
+        blocker = await scheduler.acquire(0, 'youtube')
+
+        # المستخدم 1 يرسل 3 طلبات قبل المستخدم 2، ثم يصل مشترك
+        tasks = [await start_waiting(scheduler, 1) for _ in range(3)]
+        tasks += [await start_waiting(scheduler, 2) for _ in range(2)]
+        vip = await start_waiting(scheduler, 3, priority=True)
+
+        pending = set(tasks) | {vip}
+        order = []
+        job = blocker
+        for _ in range(6):
+            scheduler.release(job)
+            done, pending = await asyncio.wait(pending, timeout=1, return_when=asyncio.FIRST_COMPLETED)
+            assert len(done) == 1
+            job = done.pop().result()
+            order.append(job.user_id)
+
+        scheduler.release(job)
+        # مسار الأولوية أولاً، ثم دور دائري: 1، 2، 1، 2، 1
+        assert order == [3, 1, 2, 1, 2, 1]
+
+    asyncio.run(scenario())
+
+
+def test_position_reflects_round_robin():
+    async def scenario():
+        scheduler = make_scheduler(workers=1, per_user=5)
+        blocker = await scheduler.acquire(0, 'youtube')
+        a1 = await start_waiting(scheduler, 1)
+        a2 = await start_waiting(scheduler, 1)
+        b1 = await start_waiting(scheduler, 2)
+
+        queue_a = scheduler._lanes[NORMAL_LANE][1]
+        queue_b = scheduler._lanes[NORMAL_LANE][2]
+        assert scheduler.position(queue_a[0]) == 1
+        assert scheduler.position(queue_b[0]) == 2
+        # الطلب الثاني للمستخدم 1 يأتي بعد دور المستخدم 2
+        assert scheduler.position(queue_a[1]) == 3
+
+        for task in (a1, a2, b1):
+            task.cancel()
+        await asyncio.gather(a1, a2, b1, return_exceptions=True)
+        scheduler.release(blocker)
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_queue_and_frees_slot():
+    async def scenario():
+        scheduler = make_scheduler(workers=1, per_user=5)
+        running = await scheduler.acquire(1, 'youtube')
+        waiting = await start_waiting(scheduler, 2)
+        assert scheduler.stats()['waiting'] == 1
+
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        stats = scheduler.stats()
+        assert stats['waiting'] == 0
+        assert stats['cancelled'] == 1
+
+        # بعد الإرجاع لا يبقى أي مكان محجوز للمنتظر الملغى
+        scheduler.release(running)
+        assert scheduler.stats()['running'] == 0
+        again = await asyncio.wait_for(scheduler.acquire(3, 'youtube'), 1)
+        scheduler.release(again)
+
+    asyncio.run(scenario())
+
+
+def test_slot_context_manager_releases_on_error():
+    async def scenario():
+        scheduler = make_scheduler(workers=1)
+        try:
+            async with scheduler.slot(1, 'youtube'):
+                assert scheduler.stats()['running'] == 1
+                raise RuntimeError('boom')
+        except RuntimeError:
+            pass
+        assert scheduler.stats()['running'] == 0
+
+    asyncio.run(scenario())
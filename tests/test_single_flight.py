@@ -0,0 +1,113 @@
+"""اختبارات تجميع الطلبات المتزامنة (single-flight)"""
+
+import asyncio
+
+import pytest
+
+from core.utils.single_flight import SingleFlight, SharedFlightError
+
+
+def test_leader_success_is_shared_with_waiters():
+    async def scenario():
+        flights = SingleFlight('test')
+        calls = 0
+        release = asyncio.Event()
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return {'id': 'abc'}
+
+        tasks = [asyncio.ensure_future(flights.run('key', work)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*tasks)
+
+        assert calls == 1
+        assert all(result is results[0] for result in results)
+        assert flights.stats() == {'in_flight': 0, 'leaders': 1, 'followers': 2}
+
+    asyncio.run(scenario())
+
+
+def test_leader_failure_reaches_waiters_as_shared_error():
+    async def scenario():
+        flights = SingleFlight('test')
+        release = asyncio.Event()
+        error = ValueError('Video unavailable')
+
+        async def work():
+            await release.wait()
+            raise error
+
+        leader = asyncio.ensure_future(flights.run('key', work))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flights.run('key', work))
+        await asyncio.sleep(0)
+        release.set()
+
+        # المنفذ يرى الخطأ الأصلي (ويبلغ عنه)، والمنتظر يرى نفس النص مغلفاً
+        with pytest.raises(ValueError):
+            await leader
+        with pytest.raises(SharedFlightError) as shared:
+            await waiter
+        assert shared.value.error is error
+        assert str(shared.value) == 'Video unavailable'
+        assert flights.get('key') is None
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_leader_lets_a_waiter_retry():
+    async def scenario():
+        flights = SingleFlight('test')
+        calls = 0
+        started = asyncio.Event()
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                started.set()
+                await asyncio.Event().wait()  # ينتظر حتى يُلغى
+            return calls
+
+        leader = asyncio.ensure_future(flights.run('key', work))
+        await started.wait()
+        waiter = asyncio.ensure_future(flights.run('key', work))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+        # الرحلة انتهت بـ None - المنتظر يصبح المنفذ ويعيد العمل
+        assert await asyncio.wait_for(waiter, 1) == 2
+        assert flights.leaders == 2
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_does_not_cancel_leader():
+    async def scenario():
+        flights = SingleFlight('test')
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return 'done'
+
+        leader = asyncio.ensure_future(flights.run('key', work))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flights.run('key', work))
+        await asyncio.sleep(0)
+
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+        release.set()
+        assert await leader == 'done'
+
+    asyncio.run(scenario())
@@ -69,6 +69,8 @@ from core.utils import (
     # Cleanup
     cleanup_temp_files,
     cleanup_old_files,
+    cleanup_job_dirs,
+    setup_temp_cleanup_job,
 )
 
 # ==================== Import from core.media ====================
@@ -145,6 +147,8 @@ __all__ = [
     # Cleanup
     'cleanup_temp_files',
     'cleanup_old_files',
+    'cleanup_job_dirs',
+    'setup_temp_cleanup_job',
 
     # Watermark
     'get_logo_overlay_position',